@@ -27,7 +27,6 @@ then
         coreutils
 else
     apt-get install -y \
-        pgloader \
         libgeos-dev \
         libgdal-dev \
         libproj-dev \
@@ -379,6 +379,13 @@ class FlannConfig(ConfigBase):
         # General Params
         flann_cfg.algorithm = 'kdtree'  # linear
         flann_cfg.flann_cores = 0  # doesnt change config, just speed
+        # Search engine (see wbia.algo.hots.neighbor_backends)
+        flann_cfg.nn_backend = 'flann'
+        # Product quantization params (pq and ivfpq backends)
+        flann_cfg.pq_m = 16
+        flann_cfg.pq_nlist = 256
+        flann_cfg.pq_nprobe = 8
+        flann_cfg.pq_rerank = 4
         # KDTree params
         flann_cfg.trees = 8
         # KMeansTree params
@@ -397,11 +404,26 @@ class FlannConfig(ConfigBase):
             algorithm=flann_cfg.algorithm,
             trees=flann_cfg.trees,
             cores=flann_cfg.flann_cores,
+            backend=flann_cfg.nn_backend,
         )
+        if flann_cfg.nn_backend in ['pq', 'ivfpq']:
+            flann_params['pq_m'] = flann_cfg.pq_m
+            flann_params['pq_rerank'] = flann_cfg.pq_rerank
+        if flann_cfg.nn_backend == 'ivfpq':
+            flann_params['pq_nlist'] = flann_cfg.pq_nlist
+            flann_params['pq_nprobe'] = flann_cfg.pq_nprobe
         return flann_params
 
     def get_cfgstr_list(flann_cfg, **kwargs):
         flann_cfgstrs = ['_FLANN(']
+        if flann_cfg.nn_backend != 'flann':
+            flann_cfgstrs += ['%s_' % flann_cfg.nn_backend]
+        if flann_cfg.nn_backend in ['pq', 'ivfpq']:
+            flann_cfgstrs += ['m=%d_rerank=%d_' % (flann_cfg.pq_m, flann_cfg.pq_rerank)]
+        if flann_cfg.nn_backend == 'ivfpq':
+            flann_cfgstrs += [
+                'nlist=%d_nprobe=%d_' % (flann_cfg.pq_nlist, flann_cfg.pq_nprobe)
+            ]
         if flann_cfg.algorithm == 'kdtree':
             flann_cfgstrs += ['%d_kdtrees' % flann_cfg.trees]
         elif flann_cfg.algorithm == 'kdtree':
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Batched spatial verification of feature matches.
+
+``vt.spatially_verify_kpts`` verifies one annotation pair at a time: every
+feature match of the pair gives one affine hypothesis (the transform that
+maps the query keypoint onto the database keypoint) and every hypothesis is
+scored against all matches of the pair.
+
+Here the matches of many pairs are padded into ``(num_pairs, num_matches)``
+arrays, so the hypotheses of all pairs of a batch are built and scored with
+a few broadcasted numpy operations instead of a python loop per pair. The
+errors of a batch form ``(num_pairs, num_hypotheses, num_matches)`` arrays.
+Pairs are sorted by their number of matches before they are batched to keep
+the padding small, and the size of a batch is bounded by
+``BATCH_SVER_MAX_CELLS``. Pairs with more matches than fit in a batch are
+scored in slices of hypotheses.
+
+Only the winning affine hypothesis of each pair (the one with the largest
+sum of inlier match weights) is refined into a homography, with the same
+``vt.refine_inliers`` that the per pair verification uses. The results have
+the ``(homog_inliers, homog_errors, H, aff_inliers, aff_errors, Aff)``
+contract of ``vt.spatially_verify_kpts(..., returnAff=True)``, or are None
+if the pair failed verification.
+
+The affine errors are computed in closed form (the determinant of a mapped
+keypoint is ``det(A) * det(invV)`` instead of the determinant of a matrix
+product), so they agree with the per pair errors up to floating point
+rounding.
+"""
+import logging
+import numpy as np
+import vtool as vt
+import utool as ut
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia')
+
+TAU = 2 * np.pi  # References: tauday.com
+
+#: Maximum number of (pair, hypothesis, match) error cells in one batch
+BATCH_SVER_MAX_CELLS = ut.get_argval('--batch-sver-cells', type_=int, default=2 ** 17)
+
+#: The affine matrix is kept without homography refinement at this many inliers
+MAX_NINLIERS = 5000
+
+
+class PaddedMatches(ut.NiceRepr):
+    """
+    Keypoint geometry of the feature matches of several annotation pairs
+    padded to the largest number of matches.
+
+    Attributes:
+        num_matches (ndarray): (P,) number of matches of each pair
+        valid (ndarray): (P, M) False for padding
+        xy1, xy2 (ndarray): (P, M, 2) keypoint locations
+        invVR1, invVR2 (ndarray): (P, M, 2, 2) keypoint shapes (with rotation)
+        det1, det2 (ndarray): (P, M) squared keypoint scales
+        ori2 (ndarray): (P, M) orientations of the database keypoints
+        weights (ndarray): (P, M) match weights (0 for padding)
+        xy_thresh_sqrd (ndarray): (P,) location error threshold of each pair
+    """
+
+    def __init__(pad, kpts1_list, kpts2_list, fm_list, weights_list, xy_thresh_sqrd):
+        num_pairs = len(fm_list)
+        pad.num_matches = np.array([len(fm) for fm in fm_list], dtype=np.int64)
+        num_padded = pad.num_matches.max() if num_pairs else 0
+        pad.valid = np.arange(num_padded)[None, :] < pad.num_matches[:, None]
+        # Padded matches use a unit circle keypoint at the origin
+        kpts1_m = np.zeros((num_pairs, num_padded, 6), dtype=np.float64)
+        kpts2_m = np.zeros((num_pairs, num_padded, 6), dtype=np.float64)
+        kpts1_m[:, :, 2] = kpts1_m[:, :, 4] = 1
+        kpts2_m[:, :, 2] = kpts2_m[:, :, 4] = 1
+        pad.weights = np.zeros((num_pairs, num_padded), dtype=np.float64)
+        for px, (kpts1, kpts2, fm, weights) in enumerate(
+            zip(kpts1_list, kpts2_list, fm_list, weights_list)
+        ):
+            num = len(fm)
+            kpts1_m[px, :num] = kpts1.take(fm.T[0], axis=0)
+            kpts2_m[px, :num] = kpts2.take(fm.T[1], axis=0)
+            pad.weights[px, :num] = weights
+        pad.xy1, pad.invVR1, pad.det1 = _kpts_geometry(kpts1_m)
+        pad.xy2, pad.invVR2, pad.det2 = _kpts_geometry(kpts2_m)
+        pad.ori2 = kpts2_m[:, :, 5]
+        pad.xy_thresh_sqrd = np.asarray(xy_thresh_sqrd, dtype=np.float64)
+
+    def __nice__(pad):
+        return 'pairs=%d, padded=%d' % pad.valid.shape
+
+    def __len__(pad):
+        return len(pad.num_matches)
+
+
+def _kpts_geometry(kpts):
+    """
+    Returns the locations, the 2x2 invVR shapes and their determinants of a
+    (..., 6) array of keypoints (the same shapes as vt.get_invVR_mats3x3)
+    """
+    xy = kpts[..., 0:2]
+    a, c, d, ori = kpts[..., 2], kpts[..., 3], kpts[..., 4], kpts[..., 5]
+    cos_ = np.cos(ori)
+    sin_ = np.sin(ori)
+    # invV = [[a, 0], [c, d]] times the rotation [[cos, -sin], [sin, cos]]
+    invVR = np.empty(kpts.shape[:-1] + (2, 2), dtype=np.float64)
+    invVR[..., 0, 0] = a * cos_
+    invVR[..., 0, 1] = -a * sin_
+    invVR[..., 1, 0] = c * cos_ + d * sin_
+    invVR[..., 1, 1] = d * cos_ - c * sin_
+    det = a * d
+    return xy, invVR, det
+
+
+def build_affine_hypotheses(pad):
+    """
+    Builds the affine hypothesis of every match of every pair. The
+    hypothesis of a match maps the query keypoint onto the database
+    keypoint: ``Aff = invVR2 @ inv(invVR1)``.
+
+    Returns:
+        tuple: (A, t) the (P, M, 2, 2) linear parts and the (P, M, 2)
+            translations
+    """
+    invVR1 = pad.invVR1
+    inv_invVR1 = np.empty_like(invVR1)
+    inv_invVR1[..., 0, 0] = invVR1[..., 1, 1]
+    inv_invVR1[..., 0, 1] = -invVR1[..., 0, 1]
+    inv_invVR1[..., 1, 0] = -invVR1[..., 1, 0]
+    inv_invVR1[..., 1, 1] = invVR1[..., 0, 0]
+    inv_invVR1 /= pad.det1[..., None, None]
+    A = np.matmul(pad.invVR2, inv_invVR1)
+    t = pad.xy2 - np.einsum('pmij,pmj->pmi', A, pad.xy1)
+    return A, t
+
+
+def affine_hypothesis_errors(pad, A, t):
+    """
+    Errors of all matches of each pair under H hypotheses of the pair
+
+    Args:
+        pad (PaddedMatches):
+        A (ndarray): (P, H, 2, 2) linear parts of the hypotheses
+        t (ndarray): (P, H, 2) translations of the hypotheses
+
+    Returns:
+        tuple: (xy_err, ori_err, scale_err) each with shape (P, H, M)
+    """
+    # Map the query keypoints onto the database annotation
+    x1 = pad.xy1[:, None, :, 0]
+    y1 = pad.xy1[:, None, :, 1]
+    x_err = A[..., 0, 0, None] * x1 + A[..., 0, 1, None] * y1
+    x_err += t[..., 0, None]
+    x_err -= pad.xy2[:, None, :, 0]
+    y_err = A[..., 1, 0, None] * x1 + A[..., 1, 1, None] * y1
+    y_err += t[..., 1, None]
+    y_err -= pad.xy2[:, None, :, 1]
+    xy_err = np.multiply(x_err, x_err, out=x_err)
+    xy_err += np.multiply(y_err, y_err, out=y_err)
+    # The determinant of a product is the product of the determinants
+    detA = A[..., 0, 0] * A[..., 1, 1] - A[..., 0, 1] * A[..., 1, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale_err = detA[:, :, None] * (pad.det1 / pad.det2)[:, None, :]
+        # Flip ratios that are less than 1 (like vt.det_distance)
+        flip_flag = scale_err < 1
+        np.reciprocal(scale_err, out=scale_err, where=flip_flag)
+    # Only the first row of the mapped shapes is needed for the orientation
+    invVR1 = pad.invVR1[:, None, :, :, :]
+    iv11 = A[..., 0, 0, None] * invVR1[..., 0, 0] + A[..., 0, 1, None] * invVR1[..., 1, 0]
+    iv12 = A[..., 0, 0, None] * invVR1[..., 0, 1] + A[..., 0, 1, None] * invVR1[..., 1, 1]
+    ori1_mt = np.mod(-np.arctan2(iv12, iv11), TAU)
+    ori_err = vt.ori_distance(ori1_mt, pad.ori2[:, None, :])
+    return xy_err, ori_err, scale_err
+
+
+def affine_hypothesis_inliers(pad, A, t, scale_thresh, ori_thresh):
+    """
+    Returns:
+        tuple: (inlier_flags, errors) where inlier_flags is a (P, H, M)
+            boolean array and errors is (xy_err, ori_err, scale_err)
+    """
+    errors = affine_hypothesis_errors(pad, A, t)
+    xy_err, ori_err, scale_err = errors
+    inlier_flags = xy_err < pad.xy_thresh_sqrd[:, None, None]
+    np.logical_and(inlier_flags, ori_err < ori_thresh, out=inlier_flags)
+    np.logical_and(inlier_flags, scale_err < scale_thresh, out=inlier_flags)
+    np.logical_and(inlier_flags, pad.valid[:, None, :], out=inlier_flags)
+    return inlier_flags, errors
+
+
+def get_best_affine_hypotheses(pad, A, t, scale_thresh, ori_thresh, max_cells=None):
+    """
+    Scores every affine hypothesis of every pair by the sum of the weights of
+    its inliers and returns the best one of each pair.
+
+    Args:
+        pad (PaddedMatches):
+        A, t: the hypotheses from build_affine_hypotheses
+        scale_thresh (float):
+        ori_thresh (float):
+        max_cells (int): bounds the number of hypotheses scored at once
+
+    Returns:
+        tuple: (best_hxs, best_weights) the index of the winning match of each
+            pair and the weight of its inliers
+    """
+    if max_cells is None:
+        max_cells = BATCH_SVER_MAX_CELLS
+    num_pairs, num_padded = pad.valid.shape
+    best_hxs = np.zeros(num_pairs, dtype=np.int64)
+    best_weights = np.full(num_pairs, -np.inf)
+    pxs = np.arange(num_pairs)
+    hypo_chunksize = max(1, max_cells // max(1, num_pairs * num_padded))
+    for hx_sl in ut.ichunk_slices(num_padded, hypo_chunksize):
+        inlier_flags, _ = affine_hypothesis_inliers(
+            pad, A[:, hx_sl], t[:, hx_sl], scale_thresh, ori_thresh
+        )
+        weights = np.matmul(inlier_flags, pad.weights[:, :, None])[..., 0]
+        # Padded matches do not make hypotheses
+        weights[~pad.valid[:, hx_sl]] = -np.inf
+        # argmax keeps the first of equally good hypotheses
+        chunk_hxs = weights.argmax(axis=1)
+        chunk_weights = weights[pxs, chunk_hxs]
+        is_better = chunk_weights > best_weights
+        best_hxs[is_better] = chunk_hxs[is_better] + hx_sl.start
+        best_weights[is_better] = chunk_weights[is_better]
+    return best_hxs, best_weights
+
+
+def get_best_affine_inliers(pad, scale_thresh, ori_thresh, max_cells=None):
+    """
+    Batched version of vt.get_best_affine_inliers
+
+    Returns:
+        list: (aff_inliers, aff_errors, Aff) of each pair
+    """
+    A, t = build_affine_hypotheses(pad)
+    best_hxs, _ = get_best_affine_hypotheses(
+        pad, A, t, scale_thresh, ori_thresh, max_cells
+    )
+    pxs = np.arange(len(pad))
+    best_A = A[pxs, best_hxs][:, None]
+    best_t = t[pxs, best_hxs][:, None]
+    inlier_flags, errors = affine_hypothesis_inliers(
+        pad, best_A, best_t, scale_thresh, ori_thresh
+    )
+    affine_list = []
+    for px, num in enumerate(pad.num_matches):
+        aff_inliers = np.where(inlier_flags[px, 0, :num])[0]
+        aff_errors = tuple(err[px, 0, :num] for err in errors)
+        Aff = np.eye(3)
+        Aff[0:2, 0:2] = best_A[px, 0]
+        Aff[0:2, 2] = best_t[px, 0]
+        affine_list.append((aff_inliers, aff_errors, Aff))
+    return affine_list
+
+
+def refine_affine_inliers(
+    kpts1, kpts2, fm, aff_tup, xy_thresh_sqrd, sver_params, max_nInliers=MAX_NINLIERS
+):
+    """
+    Refines the winning affine hypothesis of a pair with the same checks as
+    vt.spatially_verify_kpts
+
+    Returns:
+        tuple: (homog_inliers, homog_errors, H, aff_inliers, aff_errors, Aff)
+            or None if verification failed
+    """
+    aff_inliers, aff_errors, Aff = aff_tup
+    refine_method = sver_params['refine_method']
+    num_inliers = len(aff_inliers)
+    if num_inliers < sver_params['min_nInliers']:
+        return None
+    # Need at least 4 inliers for an affine and 7 for a homography
+    if (refine_method.endswith('homog') and num_inliers < 7) or num_inliers < 4:
+        return None
+    if num_inliers >= max_nInliers:
+        # The affine matrix is probably good enough
+        return (aff_inliers, aff_errors, Aff, aff_inliers, aff_errors, Aff)
+    try:
+        homog_inliers, homog_errors, H = vt.refine_inliers(
+            kpts1,
+            kpts2,
+            fm,
+            aff_inliers,
+            xy_thresh_sqrd,
+            sver_params['scale_thresh'],
+            sver_params['ori_thresh'],
+            sver_params['full_homog_checks'],
+            refine_method=refine_method,
+        )
+    except Exception as ex:
+        # Same handling as the per pair verification in
+        # wbia.algo.hots.pipeline.sver_single_pair
+        ut.printex(
+            ex,
+            'Unknown error in spatial verification.',
+            keys=['kpts1', 'kpts2', 'fm', 'sver_params', 'xy_thresh_sqrd'],
+        )
+        return None
+    return (homog_inliers, homog_errors, H, aff_inliers, aff_errors, Aff)
+
+
+def make_sver_batches(num_matches, max_cells=None):
+    """
+    Groups pairs into batches of pairs with similar numbers of matches
+
+    Args:
+        num_matches (ndarray): number of matches of each pair
+        max_cells (int): maximum of num_pairs * num_padded ** 2 in a batch.
+            A pair with more matches is put in a batch of its own.
+
+    Returns:
+        list: arrays of pair indices
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.batch_sver import *  # NOQA
+        >>> num_matches = np.array([3, 10, 2, 0, 9, 4, 30])
+        >>> batches = make_sver_batches(num_matches, max_cells=300)
+        >>> result = ut.repr2([batch.tolist() for batch in batches])
+        >>> print(result)
+        [[2, 0, 5], [4, 1], [6]]
+    """
+    if max_cells is None:
+        max_cells = BATCH_SVER_MAX_CELLS
+    num_matches = np.asarray(num_matches)
+    sortx = num_matches.argsort(kind='stable')
+    # Pairs without matches are not verified
+    sortx = sortx[num_matches[sortx] > 0]
+    batches = []
+    start = 0
+    for stop in range(1, len(sortx) + 1):
+        num_padded = num_matches[sortx[stop - 1]]
+        if stop > start + 1 and (stop - start) * num_padded ** 2 > max_cells:
+            batches.append(sortx[start : stop - 1])
+            start = stop - 1
+    if start < len(sortx):
+        batches.append(sortx[start:])
+    return batches
+
+
+@profile
+def batch_spatially_verify(
+    kpts1_list,
+    kpts2_list,
+    fm_list,
+    weights_list,
+    dlen_sqrd_list,
+    sver_params,
+    max_cells=None,
+):
+    r"""
+    Spatially verifies the feature matches of many annotation pairs
+
+    Args:
+        kpts1_list (list): query keypoints of each pair
+        kpts2_list (list): database keypoints of each pair
+        fm_list (list): feature matches of each pair
+        weights_list (list): match weights of each pair
+        dlen_sqrd_list (list): squared diagonal length of the database
+            annotation of each pair (or None to use the extent of the matches)
+        sver_params (dict): see wbia.algo.hots.pipeline.get_sver_params
+        max_cells (int): bounds the size of a batch (see BATCH_SVER_MAX_CELLS)
+
+    Returns:
+        list: an svtup (or None) for every pair with the contract of
+            vt.spatially_verify_kpts(..., returnAff=True)
+
+    CommandLine:
+        python -m wbia.algo.hots.batch_sver batch_spatially_verify
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.batch_sver import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> def random_kpts(num):
+        >>>     xy = rng.rand(num, 2) * 500
+        >>>     scale = 8 + rng.rand(num) * 8
+        >>>     ori = rng.rand(num) * TAU
+        >>>     return np.vstack([xy.T, scale, np.zeros(num), scale, ori]).T
+        >>> # The database annotation is a rotated and scaled query
+        >>> kpts1 = random_kpts(300)
+        >>> theta, scale = .3, 1.5
+        >>> R = scale * np.array([[np.cos(theta), -np.sin(theta)],
+        >>>                       [np.sin(theta), np.cos(theta)]])
+        >>> kpts2 = kpts1.copy()
+        >>> kpts2[:, 0:2] = kpts1[:, 0:2].dot(R.T) + [20, 30]
+        >>> kpts2[:, 2:5] *= scale
+        >>> kpts2[:, 5] = (kpts1[:, 5] + theta) % TAU
+        >>> fm_true = np.vstack([np.arange(40), np.arange(40)]).T
+        >>> fm_rand = rng.randint(0, 300, size=(20, 2))
+        >>> fm_list = [np.vstack([fm_true, fm_rand]), fm_rand, fm_true[0:3]]
+        >>> weights_list = [np.ones(len(fm)) for fm in fm_list]
+        >>> sver_params = dict(xy_thresh=.01, scale_thresh=2.0, ori_thresh=TAU / 4,
+        >>>                    min_nInliers=4, full_homog_checks=True,
+        >>>                    refine_method='homog')
+        >>> pad = PaddedMatches([kpts1] * 3, [kpts2] * 3, fm_list, weights_list,
+        >>>                     [1E4] * 3)
+        >>> aff_inliers, aff_errors, Aff = get_best_affine_inliers(pad, 2.0, TAU / 4)[0]
+        >>> assert set(range(40)).issubset(aff_inliers)
+        >>> expected_Aff = np.array([[R[0, 0], R[0, 1], 20],
+        >>>                          [R[1, 0], R[1, 1], 30], [0, 0, 1]])
+        >>> assert np.allclose(Aff, expected_Aff)
+        >>> # The result of a pair does not depend on the size of the batches
+        >>> svtup_list1 = [
+        >>>     batch_spatially_verify([kpts1], [kpts2], [fm], [weights], [None],
+        >>>                            sver_params)[0]
+        >>>     for fm, weights in zip(fm_list, weights_list)]
+        >>> svtup_list2 = batch_spatially_verify(
+        >>>     [kpts1] * 3, [kpts2] * 3, fm_list, weights_list, [None] * 3,
+        >>>     sver_params, max_cells=1000)
+        >>> assert [tup is None for tup in svtup_list2] == [False, True, True]
+        >>> assert np.all(svtup_list1[0][3] == svtup_list2[0][3])
+        >>> assert np.all(svtup_list1[0][0] == svtup_list2[0][0])
+    """
+    num_pairs = len(fm_list)
+    xy_thresh = sver_params['xy_thresh']
+    scale_thresh = sver_params['scale_thresh']
+    ori_thresh = sver_params['ori_thresh']
+    xy_thresh_sqrd_list = []
+    for kpts2, fm, dlen_sqrd2 in zip(kpts2_list, fm_list, dlen_sqrd_list):
+        if dlen_sqrd2 is None and len(fm) > 0:
+            kpts2_m = kpts2.take(fm.T[1], axis=0)
+            dlen_sqrd2 = vt.get_kpts_dlen_sqrd(kpts2_m)
+        xy_thresh_sqrd_list.append(None if dlen_sqrd2 is None else dlen_sqrd2 * xy_thresh)
+    num_matches = np.array([len(fm) for fm in fm_list], dtype=np.int64)
+    svtup_list = [None] * num_pairs
+    for pxs in make_sver_batches(num_matches, max_cells):
+        pad = PaddedMatches(
+            ut.take(kpts1_list, pxs),
+            ut.take(kpts2_list, pxs),
+            ut.take(fm_list, pxs),
+            ut.take(weights_list, pxs),
+            ut.take(xy_thresh_sqrd_list, pxs),
+        )
+        affine_list = get_best_affine_inliers(pad, scale_thresh, ori_thresh, max_cells)
+        for px, aff_tup in zip(pxs, affine_list):
+            svtup_list[px] = refine_affine_inliers(
+                kpts1_list[px].astype(np.float64, copy=False),
+                kpts2_list[px].astype(np.float64, copy=False),
+                fm_list[px],
+                aff_tup,
+                xy_thresh_sqrd_list[px],
+                sver_params,
+            )
+    return svtup_list
@@ -11,6 +11,8 @@ from os.path import join
 from operator import xor
 from wbia.algo.hots import hstypes
 from wbia.algo.hots import old_chip_match
+from wbia.algo.hots import chip_match_csr
+from wbia.algo.hots.chip_match_csr import CSRList
 from wbia.algo.hots import scoring
 from wbia.algo.hots import name_scoring
 from wbia.algo.hots import _pipeline_helpers as plh  # NOQA
@@ -48,6 +50,8 @@ def extend_scores(vals, num):
 
 
 def extend_nplists_(x_list, num, shape, dtype):
+    if isinstance(x_list, CSRList):
+        return x_list.extend_empty(num)
     return x_list + ([np.empty(shape, dtype=dtype)] * num)
 
 
@@ -73,6 +77,11 @@ def convert_numpy_lists(arr_list, dtype, dims=None):
 def safecast_numpy_lists(arr_list, dtype=None, dims=None):
     if arr_list is None:
         new_arrs = None
+    elif isinstance(arr_list, CSRList):
+        flat = np.array(arr_list.flat, dtype=dtype)
+        if dims is not None:
+            flat = vt.ensure_shape(flat, dims)
+        new_arrs = CSRList(flat, arr_list.offsets)
     else:
         new_arrs = [np.array(arr, dtype=dtype) for arr in arr_list]
         if dims is not None:
@@ -80,6 +89,38 @@ def safecast_numpy_lists(arr_list, dtype=None, dims=None):
     return new_arrs
 
 
+def take_annot_items(x_list, idx_list):
+    """ut.take that keeps the layout of a CSRList"""
+    if isinstance(x_list, CSRList):
+        return x_list.take(idx_list)
+    return ut.take(x_list, idx_list)
+
+
+def take_annot_rows(x_list, indices_list):
+    """vt.ziptake (along the rows) that keeps the layout of a CSRList"""
+    if isinstance(x_list, CSRList):
+        return x_list.take_rows(indices_list)
+    return vt.ziptake(x_list, indices_list, axis=0)
+
+
+def combine_annot_lists(x_lists):
+    """ut.flatten of annot lists that keeps the layout of CSRLists"""
+    if ut.list_all_eq_to(x_lists, None):
+        return None
+    elif all(isinstance(x_list, CSRList) for x_list in x_lists):
+        return chip_match_csr.concat_csrlists(x_lists)
+    return ut.flatten(x_lists)
+
+
+def csr_to_lists(x_list):
+    """Converts CSRLists (also those in the filtnorm lists) to python lists"""
+    if isinstance(x_list, CSRList):
+        return x_list.tolist()
+    elif isinstance(x_list, list) and any(isinstance(x, CSRList) for x in x_list):
+        return [csr_to_lists(x) for x in x_list]
+    return x_list
+
+
 def aslist(arr):
     if isinstance(arr, np.ndarray):
         return arr.tolist()
@@ -94,6 +135,8 @@ def convert_numpy(arr, dtype):
 def check_arrs_eq(arr1, arr2):
     if arr1 is None and arr2 is None:
         return True
+    elif isinstance(arr1, CSRList) and arr1.has_same_layout(arr2):
+        return np.array_equal(arr1.flat, arr2.flat)
     elif isinstance(arr1, np.ndarray) and isinstance(arr2, np.ndarray):
         return np.all(arr1 == arr2)
     elif len(arr1) != len(arr2):
@@ -821,7 +864,10 @@ class _ChipMatchScorers(object):
             >>> assert annot_score_list[gt_flags].max() > 10.0
         """
         fs_list = cm.get_fsv_prod_list()
-        csum_scores = np.array([np.sum(fs) for fs in fs_list])
+        if isinstance(fs_list, CSRList):
+            csum_scores = chip_match_csr.segment_sum(fs_list.flat, fs_list.offsets)
+        else:
+            csum_scores = np.array([np.sum(fs) for fs in fs_list])
         cm.algo_annot_scores['csum'] = csum_scores
 
     @profile
@@ -839,13 +885,27 @@ class _ChipMatchScorers(object):
         cm.algo_name_scores['nsum'] = fmech_scores
 
     def evaluate_maxcsum_name_score(cm, qreq_):
-        grouped_csum = vt.apply_grouping(cm.algo_annot_scores['csum'], cm.name_groupxs)
-        maxcsum_scores = np.array([scores.max() for scores in grouped_csum])
+        if isinstance(cm.fm_list, CSRList):
+            maxcsum_scores = chip_match_csr.grouped_max(
+                cm.algo_annot_scores['csum'], cm.name_groupxs
+            )
+        else:
+            grouped_csum = vt.apply_grouping(
+                cm.algo_annot_scores['csum'], cm.name_groupxs
+            )
+            maxcsum_scores = np.array([scores.max() for scores in grouped_csum])
         cm.algo_name_scores['maxcsum'] = maxcsum_scores
 
     def evaluate_sumamech_name_score(cm, qreq_):
-        grouped_csum = vt.apply_grouping(cm.algo_annot_scores['csum'], cm.name_groupxs)
-        sumamech_score_list = np.array([scores.sum() for scores in grouped_csum])
+        if isinstance(cm.fm_list, CSRList):
+            sumamech_score_list = chip_match_csr.grouped_sum(
+                cm.algo_annot_scores['csum'], cm.name_groupxs
+            )
+        else:
+            grouped_csum = vt.apply_grouping(
+                cm.algo_annot_scores['csum'], cm.name_groupxs
+            )
+            sumamech_score_list = np.array([scores.sum() for scores in grouped_csum])
         cm.algo_name_scores['sumamech'] = sumamech_score_list
 
     # --- Cannonizers
@@ -1359,6 +1419,8 @@ class _AnnotMatchConvenienceGetter(object):
         return cm.get_groundtruth_daids()
 
     def get_num_matches_list(cm):
+        if isinstance(cm.fm_list, CSRList):
+            return cm.fm_list.lens.tolist()
         num_matches_list = list(map(len, cm.fm_list))
         return num_matches_list
 
@@ -1675,6 +1737,8 @@ class _ChipMatchConvenienceGetter(object):
         return len(cm.fsv_col_lbls)
 
     def get_fsv_prod_list(cm):
+        if isinstance(cm.fsv_list, CSRList):
+            return CSRList(cm.fsv_list.flat.prod(axis=1), cm.fsv_list.offsets)
         return [fsv.prod(axis=1) for fsv in cm.fsv_list]
 
     def get_annot_fm(cm, daid):
@@ -1686,6 +1750,8 @@ class _ChipMatchConvenienceGetter(object):
         assert xor(colx is None, col is None)
         if col is not None:
             colx = cm.fsv_col_lbls.index(col)
+        if isinstance(cm.fsv_list, CSRList):
+            return CSRList(cm.fsv_list.flat.T[colx].T, cm.fsv_list.offsets)
         fs_list = [fsv.T[colx].T for fsv in cm.fsv_list]
         return fs_list
 
@@ -2241,6 +2307,10 @@ class ChipMatch(
     completely replace the old structure
     """
 
+    # True if some scores were reused from a query against an older set of
+    # daids (see match_chips4.execute_query_incremental)
+    is_approx = False
+
     # Standard Contstructor
     def __init__(cm, *args, **kwargs):
         """
@@ -2406,7 +2476,10 @@ class ChipMatch(
     # ------------------
 
     def _cast_scores(cm, dtype=np.float64):
-        cm.fsv_list = [fsv.astype(dtype) for fsv in cm.fsv_list]
+        if isinstance(cm.fsv_list, CSRList):
+            cm.fsv_list = cm.fsv_list.astype(dtype)
+        else:
+            cm.fsv_list = [fsv.astype(dtype) for fsv in cm.fsv_list]
 
     def compress_results(cm, inplace=False):
         flags = [len(fm) > 1 for fm in cm.fm_list]
@@ -2528,6 +2601,33 @@ class ChipMatch(
             >>> ut.quit_if_noshow()
             >>> out.ishow_analysis(request)
             >>> ut.show_if_requested()
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.algo.hots.chip_match import *  # NOQA
+            >>> fsv_col_lbls = ['lnbnn', 'fg']
+            >>> cm1 = ChipMatch(
+            >>>     qaid=1, daid_list=np.array([2, 3]), dnid_list=np.array([5, 6]),
+            >>>     fsv_col_lbls=fsv_col_lbls,
+            >>>     fm_list=[np.array([[0, 1]]), np.array([[0, 2], [1, 3]])],
+            >>>     fsv_list=[np.ones((1, 2)), np.ones((2, 2))],
+            >>>     H_list=[np.eye(3), np.eye(3)])
+            >>> cm1.filtnorm_aids = [[np.array([7]), np.array([7, 8])], None]
+            >>> cm2 = ChipMatch(
+            >>>     qaid=1, daid_list=np.array([4]), dnid_list=np.array([5]),
+            >>>     fsv_col_lbls=fsv_col_lbls,
+            >>>     fm_list=[np.array([[2, 4]])], fsv_list=[np.ones((1, 2))])
+            >>> cm2.filtnorm_aids = [None, [np.array([9])]]
+            >>> cm2.is_approx = True
+            >>> out = ChipMatch.combine_cms([cm1, cm2])
+            >>> print(out.daid_list)
+            >>> print(ut.repr2(out.filtnorm_aids, nl=0))
+            >>> print([H is None for H in out.H_list])
+            >>> print(out.filtnorm_fxs, out.is_approx)
+            [2 3 4]
+            [[np.array([7]), np.array([7, 8]), None], [None, None, np.array([9])]]
+            [False, False, True]
+            None True
         """
         new_attrs = {}
         common_attrs = ['qaid', 'qnid', 'fsv_col_lbls']
@@ -2555,11 +2655,33 @@ class ChipMatch(
             values = ut.list_getattr(cm_list, attr)
             if ut.list_all_eq_to(values, None):
                 new_attrs[attr] = None
+            elif attr in ['filtnorm_aids', 'filtnorm_fxs']:
+                # Combine the annot lists of each filter separately
+                num_filts = len(new_attrs['fsv_col_lbls'])
+                values = [[None] * num_filts if val is None else val for val in values]
+                new_attrs[attr] = []
+                for filt_values in zip(*values):
+                    if not ut.list_all_eq_to(filt_values, None):
+                        # Annots without normalizers for this filter
+                        filt_values = [
+                            [None] * len(cm.daid_list) if x_list is None else x_list
+                            for cm, x_list in zip(cm_list, filt_values)
+                        ]
+                    new_attrs[attr].append(combine_annot_lists(filt_values))
+            elif attr == 'H_list':
+                # Annots that were not verified have no homography
+                new_attrs[attr] = ut.flatten(
+                    [
+                        [None] * len(cm.daid_list) if H_list is None else H_list
+                        for cm, H_list in zip(cm_list, values)
+                    ]
+                )
             else:
-                new_attrs[attr] = ut.flatten(values)
+                new_attrs[attr] = combine_annot_lists(values)
         out = ChipMatch(**new_attrs)
         out._update_daid_index()
         out._update_unique_nid_index()
+        out.is_approx = any(cm.is_approx for cm in cm_list)
         return out
 
     def take_annots(cm, idx_list, inplace=False, keepscores=True):
@@ -2608,11 +2730,11 @@ class ChipMatch(
         out.daid_list = vt.take2(cm.daid_list, idx_list)
         out.dnid_list = safeop(vt.take2, cm.dnid_list, idx_list)
         out.H_list = safeop(ut.take, cm.H_list, idx_list)
-        out.fm_list = safeop(ut.take, cm.fm_list, idx_list)
-        out.fsv_list = safeop(ut.take, cm.fsv_list, idx_list)
-        out.fk_list = safeop(ut.take, cm.fk_list, idx_list)
-        out.filtnorm_aids = filtnorm_op(cm.filtnorm_aids, ut.take, idx_list)
-        out.filtnorm_fxs = filtnorm_op(cm.filtnorm_fxs, ut.take, idx_list)
+        out.fm_list = safeop(take_annot_items, cm.fm_list, idx_list)
+        out.fsv_list = safeop(take_annot_items, cm.fsv_list, idx_list)
+        out.fk_list = safeop(take_annot_items, cm.fk_list, idx_list)
+        out.filtnorm_aids = filtnorm_op(cm.filtnorm_aids, take_annot_items, idx_list)
+        out.filtnorm_fxs = filtnorm_op(cm.filtnorm_fxs, take_annot_items, idx_list)
 
         if keepscores:
             # Annot Scores
@@ -2685,17 +2807,15 @@ class ChipMatch(
         out = cm.compress_annots(flags, inplace=inplace, keepscores=keepscores)
         indicies_list2 = ut.compress(indicies_list, flags)
 
-        out.fm_list = safeop(vt.ziptake, out.fm_list, indicies_list2, axis=0)
-        out.fs_list = safeop(vt.ziptake, out.fs_list, indicies_list2, axis=0)
-        out.fsv_list = safeop(vt.ziptake, out.fsv_list, indicies_list2, axis=0)
-        out.fk_list = safeop(vt.ziptake, out.fk_list, indicies_list2, axis=0)
+        out.fm_list = safeop(take_annot_rows, out.fm_list, indicies_list2)
+        out.fs_list = safeop(take_annot_rows, out.fs_list, indicies_list2)
+        out.fsv_list = safeop(take_annot_rows, out.fsv_list, indicies_list2)
+        out.fk_list = safeop(take_annot_rows, out.fk_list, indicies_list2)
 
         out.filtnorm_aids = filtnorm_op(
-            out.filtnorm_aids, vt.ziptake, indicies_list2, axis=0
-        )
-        out.filtnorm_fxs = filtnorm_op(
-            out.filtnorm_fxs, vt.ziptake, indicies_list2, axis=0
+            out.filtnorm_aids, take_annot_rows, indicies_list2
         )
+        out.filtnorm_fxs = filtnorm_op(out.filtnorm_fxs, take_annot_rows, indicies_list2)
 
         # out.assert_self(verbose=False)
         return out
@@ -2717,7 +2837,13 @@ class ChipMatch(
         assert inplace, 'this is always inplace right now'
         assert filtkey not in cm.fsv_col_lbls, 'already have filtkey=%r' % (cm.filtkey,)
         cm.fsv_col_lbls.append(filtkey)
-        cm.fsv_list = vt.zipcat(cm.fsv_list, filtweight_list, axis=1)
+        if isinstance(cm.fsv_list, CSRList):
+            filtweights = CSRList.from_list(filtweight_list)
+            assert cm.fsv_list.has_same_layout(filtweights), 'must correspond to fsv'
+            flat = np.concatenate([cm.fsv_list.flat, filtweights.flat[:, None]], axis=1)
+            cm.fsv_list = CSRList(flat, cm.fsv_list.offsets)
+        else:
+            cm.fsv_list = vt.zipcat(cm.fsv_list, filtweight_list, axis=1)
 
     def compress_top_feature_matches(cm, num=10, rng=np.random, use_random=True):
         """
@@ -2742,11 +2868,11 @@ class ChipMatch(
 
         # cm.take_feature_matches()
 
-        cm.fsv_list = vt.ziptake(cm.fsv_list, score_sortx_filt, axis=0)
-        cm.fm_list = vt.ziptake(cm.fm_list, score_sortx_filt, axis=0)
-        cm.fk_list = vt.ziptake(cm.fk_list, score_sortx_filt, axis=0)
+        cm.fsv_list = take_annot_rows(cm.fsv_list, score_sortx_filt)
+        cm.fm_list = take_annot_rows(cm.fm_list, score_sortx_filt)
+        cm.fk_list = take_annot_rows(cm.fk_list, score_sortx_filt)
         if cm.fs_list is not None:
-            cm.fs_list = vt.ziptake(cm.fs_list, score_sortx_filt, axis=0)
+            cm.fs_list = take_annot_rows(cm.fs_list, score_sortx_filt)
         cm.H_list = None
         cm.fs_list = None
 
@@ -2756,10 +2882,10 @@ class ChipMatch(
         sortx = cm.argsort()
         cm.daid_list = vt.trytake(cm.daid_list, sortx)
         cm.dnid_list = vt.trytake(cm.dnid_list, sortx)
-        cm.fm_list = vt.trytake(cm.fm_list, sortx)
-        cm.fsv_list = vt.trytake(cm.fsv_list, sortx)
-        cm.fs_list = vt.trytake(cm.fs_list, sortx)
-        cm.fk_list = vt.trytake(cm.fk_list, sortx)
+        cm.fm_list = safeop(take_annot_items, cm.fm_list, sortx)
+        cm.fsv_list = safeop(take_annot_items, cm.fsv_list, sortx)
+        cm.fs_list = safeop(take_annot_items, cm.fs_list, sortx)
+        cm.fk_list = safeop(take_annot_items, cm.fk_list, sortx)
         cm.score_list = vt.trytake(cm.score_list, sortx)
         # FIXME: Not all properties covered
         cm.algo_annot_scores['csum'] = vt.trytake(cm.algo_annot_scores['csum'], sortx)
@@ -2880,6 +3006,7 @@ class ChipMatch(
         # can't encode dictionaries with integer keys
         # this means you need to rebuild indexes on reconstruction
         ut.delete_dict_keys(data, ['daid2_idx', 'nid2_nidx'])
+        data = {key: csr_to_lists(val) for key, val in data.items()}
         # logger.info('data = %r' % (list(data.keys()),))
         json_str = ut.to_json(data)
         return json_str
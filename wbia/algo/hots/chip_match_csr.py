@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed sparse row (CSR) layout of the feature matches of a ChipMatch.
+
+A ChipMatch keeps its feature matches as one small array per database
+annotation (``fm_list``, ``fsv_list``, ``fk_list``, ``fs_list``, and the
+per filter lists of ``filtnorm_aids`` / ``filtnorm_fxs``). A :class:`CSRList`
+can be used in place of any of those lists. The arrays of all annotations
+are concatenated into one ``flat`` array, and the rows of the i-th
+annotation are ``flat[offsets[i]:offsets[i + 1]]``.
+
+Indexing and iterating a CSRList give views into the flat array, so code
+that expects a list of arrays keeps working. The ChipMatch operations
+(taking annots and feature matches, score sums, name aggregation) work on
+the flat arrays directly with the kernels in this module, and their results
+are CSRLists again.
+
+The segment kernels give exactly the same result as reducing the segments
+one at a time. Maximums use ``np.maximum.reduceat``. Sums do not use
+``np.add.reduceat``, because it adds sequentially while ``np.sum`` uses
+pairwise summation, and the scores would change in the last bits. Instead,
+segments of the same length are stacked into a 2D array and summed along its
+rows, which is the same reduction as ``np.sum`` of each segment.
+"""
+import logging
+import numpy as np
+import utool as ut
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia')
+
+
+class CSRList(ut.NiceRepr):
+    """
+    A read only list of arrays stored as one flat array and row offsets
+
+    Args:
+        flat (ndarray): the concatenated arrays
+        offsets (ndarray): len(self) + 1 row offsets into flat
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.chip_match_csr import *  # NOQA
+        >>> fm_list = [np.array([[0, 1], [2, 3]]), np.empty((0, 2), dtype=int),
+        >>>            np.array([[4, 5]])]
+        >>> csr = CSRList.from_list(fm_list)
+        >>> print(csr)
+        <CSRList(len=3, rows=3)>
+        >>> assert all(np.all(a == b) for a, b in zip(csr, fm_list))
+        >>> assert np.all(csr[-1] == [[4, 5]]) and csr[0].base is csr.flat
+        >>> print(csr.take([2, 0]).flat.tolist())
+        [[4, 5], [0, 1], [2, 3]]
+        >>> subset = csr.take_rows([[1], [], [0]])
+        >>> print(subset.flat.tolist(), subset.lens.tolist())
+        [[2, 3], [4, 5]] [1, 0, 1]
+        >>> print((subset + csr.take([2])).lens.tolist())
+        [1, 0, 1, 1]
+        >>> import pytest
+        >>> with pytest.raises(TypeError):
+        >>>     csr + fm_list
+    """
+
+    def __init__(self, flat, offsets):
+        self.flat = flat
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_list(cls, arr_list):
+        """Concatenates a list of arrays"""
+        if isinstance(arr_list, CSRList):
+            return arr_list
+        arr_list = [np.asarray(arr) for arr in arr_list]
+        offsets = lens_to_offsets([len(arr) for arr in arr_list])
+        # Empty arrays may not have the trailing shape of the others
+        nonempty_list = [arr for arr in arr_list if len(arr) > 0]
+        if len(nonempty_list) > 0:
+            flat = np.concatenate(nonempty_list, axis=0)
+        elif len(arr_list) > 0:
+            flat = arr_list[0][0:0]
+        else:
+            flat = np.empty(0)
+        return cls(flat, offsets)
+
+    @classmethod
+    def from_grouping(cls, items, groupxs):
+        """
+        The same as ``CSRList.from_list(vt.apply_grouping(items, groupxs))``
+        without making an array for every group
+        """
+        lens = [len(idxs) for idxs in groupxs]
+        if len(groupxs) > 0:
+            sortx = np.concatenate(groupxs)
+        else:
+            sortx = np.empty(0, dtype=np.int64)
+        return cls(items.take(sortx, axis=0), lens_to_offsets(lens))
+
+    def __nice__(self):
+        return 'len=%d, rows=%d' % (len(self), len(self.flat))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('CSRList index out of range')
+        return self.flat[self.offsets[index] : self.offsets[index + 1]]
+
+    def __iter__(self):
+        flat = self.flat
+        offsets = self.offsets.tolist()
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            yield flat[start:stop]
+
+    def __add__(self, other):
+        # Adding a plain list would silently give up the flat layout
+        if not isinstance(other, CSRList):
+            return NotImplemented
+        nonempty_list = [csr.flat for csr in (self, other) if len(csr.flat) > 0]
+        if len(nonempty_list) > 0:
+            flat = np.concatenate(nonempty_list, axis=0)
+        else:
+            flat = self.flat
+        offsets = np.hstack([self.offsets, other.offsets[1:] + self.offsets[-1]])
+        return CSRList(flat, offsets)
+
+    @property
+    def lens(self):
+        """number of rows of each item"""
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.flat.nbytes + self.offsets.nbytes
+
+    def tolist(self):
+        return list(self)
+
+    def astype(self, dtype):
+        return CSRList(self.flat.astype(dtype), self.offsets)
+
+    def take(self, index_list):
+        """The same as ut.take"""
+        rowxs, offsets = segment_take(self.offsets, index_list)
+        return CSRList(self.flat.take(rowxs, axis=0), offsets)
+
+    def take_rows(self, indices_list):
+        """The same as vt.ziptake(self, indices_list, axis=0)"""
+        rowxs, offsets = segment_rowxs(self.offsets, indices_list)
+        return CSRList(self.flat.take(rowxs, axis=0), offsets)
+
+    def extend_empty(self, num):
+        """Appends num empty items"""
+        offsets = np.append(self.offsets, [self.offsets[-1]] * num)
+        return CSRList(self.flat, offsets)
+
+    def has_same_layout(self, other):
+        return isinstance(other, CSRList) and np.array_equal(self.offsets, other.offsets)
+
+
+def lens_to_offsets(lens):
+    offsets = np.zeros(len(lens) + 1, dtype=np.int64)
+    np.cumsum(lens, out=offsets[1:])
+    return offsets
+
+
+def concat_csrlists(csr_list):
+    """The same as ut.flatten for a list of CSRLists"""
+    flat = np.concatenate([csr.flat for csr in csr_list], axis=0)
+    lens = np.concatenate([csr.lens for csr in csr_list])
+    return CSRList(flat, lens_to_offsets(lens))
+
+
+def segment_take(offsets, index_list):
+    """
+    Returns:
+        tuple: (rowxs, new_offsets) the rows of the selected segments in
+            order and the offsets of the selected segments within them
+    """
+    index_list = np.asarray(index_list, dtype=np.int64).ravel()
+    index_list = np.where(index_list < 0, index_list + len(offsets) - 1, index_list)
+    starts = offsets[index_list]
+    lens = offsets[index_list + 1] - starts
+    new_offsets = lens_to_offsets(lens)
+    rowxs = np.arange(new_offsets[-1], dtype=np.int64)
+    rowxs += np.repeat(starts - new_offsets[:-1], lens)
+    return rowxs, new_offsets
+
+
+def segment_rowxs(offsets, indices_list):
+    """
+    Args:
+        offsets (ndarray): offsets of the segments
+        indices_list (list): row indices within each segment
+
+    Returns:
+        tuple: (rowxs, new_offsets) of the selected rows
+    """
+    assert len(indices_list) == len(offsets) - 1, 'must correspond to segments'
+    lens = [len(idxs) for idxs in indices_list]
+    new_offsets = lens_to_offsets(lens)
+    if new_offsets[-1] == 0:
+        return np.empty(0, dtype=np.int64), new_offsets
+    local_rowxs = np.concatenate([np.asarray(idxs) for idxs in indices_list])
+    local_rowxs = local_rowxs.astype(np.int64, copy=False)
+    seglens = np.repeat(np.diff(offsets), lens)
+    if np.any(local_rowxs >= seglens) or np.any(local_rowxs < 0):
+        raise IndexError('row index out of bounds of its segment')
+    rowxs = local_rowxs + np.repeat(offsets[:-1], lens)
+    return rowxs, new_offsets
+
+
+@profile
+def segment_sum(values, offsets):
+    """
+    Sums the segments of values. Each sum is exactly equal to
+    ``np.sum(values[offsets[i]:offsets[i + 1]])``.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.chip_match_csr import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> lens = rng.randint(0, 300, size=500)
+        >>> values = rng.rand(lens.sum())
+        >>> offsets = lens_to_offsets(lens)
+        >>> sums = segment_sum(values, offsets)
+        >>> expected = [np.sum(values[a:b]) for a, b in zip(offsets, offsets[1:])]
+        >>> assert np.all(sums == expected)
+    """
+    values = np.asarray(values)
+    lens = np.diff(offsets)
+    # Same dtype as np.sum of a segment
+    sums = np.zeros(len(lens), dtype=np.add.reduce(values[0:0]).dtype)
+    sortx = lens.argsort(kind='stable')
+    sorted_lens = lens[sortx]
+    # Segments with the same length are summed together
+    bounds = np.flatnonzero(np.diff(sorted_lens)) + 1
+    bounds = np.r_[0, bounds, len(lens)]
+    for lx, rx in zip(bounds[:-1], bounds[1:]):
+        num = sorted_lens[lx] if lx < rx else 0
+        if num == 0:
+            continue
+        segxs = sortx[lx:rx]
+        rowxs = offsets[segxs][:, None] + np.arange(num)
+        sums[segxs] = values.take(rowxs).sum(axis=1)
+    return sums
+
+
+def segment_max(values, offsets, fill=-np.inf):
+    """Maximum of each segment (fill for empty segments)"""
+    values = np.asarray(values)
+    lens = np.diff(offsets)
+    dtype = values.dtype if np.issubdtype(values.dtype, np.inexact) else np.float64
+    maxs = np.full(len(lens), fill, dtype=dtype)
+    nonempty = lens > 0
+    if np.any(nonempty):
+        maxs[nonempty] = np.maximum.reduceat(values, offsets[:-1][nonempty])
+    return maxs
+
+
+def grouped_sum(values, groupxs):
+    """The same as ``np.array([vals.sum() for vals in vt.apply_grouping(values, groupxs)])``"""
+    csr = CSRList.from_grouping(np.asarray(values), groupxs)
+    return segment_sum(csr.flat, csr.offsets)
+
+
+def grouped_max(values, groupxs):
+    """The same as ``np.array([vals.max() for vals in vt.apply_grouping(values, groupxs)])``"""
+    csr = CSRList.from_grouping(np.asarray(values), groupxs)
+    return segment_max(csr.flat, csr.offsets)
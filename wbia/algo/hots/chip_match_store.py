@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+"""
+A consolidated store of the cached chipmatches of one query config.
+
+Instead of one cPkl file per query (see ChipMatch.save_to_fpath), all
+chipmatches of a config live in two files of the query result directory:
+
+    cm_store_<hash>.sqlite3  - index of (qaid, quuid) -> (offset, nbytes)
+    cm_store_<hash>.records  - the appended binary records
+
+A record is a pickle free encoding of ChipMatch.__getstate__. Its header is
+a json tree of the state where every array is a reference into the raw
+array buffers that follow the header. Lists of arrays with the same dtype
+(fm_list, fsv_list, name_groupxs, ...) are stored like a CSRList as one
+flat array plus offsets.
+
+Existence checks and loads are batched through the index, and clearing a
+store (e.g. invalidating the supercache) only deletes index rows.
+Overwritten and cleared records stay in the records file until
+:meth:`ChipMatchStore.compact` is called.
+
+Compacting writes a new generation of the records file. Its name is
+committed to the index together with the new offsets, and readers look up
+the offsets and the name and open the file inside one read transaction, so
+a reader never mixes the offsets of one generation with the file of another.
+"""
+import logging
+import functools
+import json
+import operator
+import sqlite3
+import struct
+import numpy as np
+import utool as ut
+from os.path import join, exists
+from wbia.algo.hots import chip_match
+from wbia.algo.hots.chip_match_csr import CSRList
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia')
+
+# Version of the record encoding
+RECORD_VERSION = 1
+# Raw array buffers start at multiples of this
+RECORD_ALIGN = 16
+# Maximum number of sql variables in one batched statement
+SQL_CHUNKSIZE = 500
+
+
+_PRIMITIVES = (bool, int, float, str)
+
+# Errors of decoding a corrupt record or a record that is not a chipmatch.
+# json.JSONDecodeError and UnicodeDecodeError are ValueErrors.
+_BAD_RECORD_ERRORS = (
+    chip_match.NeedRecomputeError,
+    struct.error,
+    ValueError,
+    TypeError,
+    KeyError,
+    IndexError,
+    AttributeError,
+)
+
+
+class _RecordEncoder(object):
+    """
+    Encodes a state dict as a json tree with array references into a list
+    of raw array buffers
+    """
+
+    def __init__(encoder):
+        encoder.arrays = []
+
+    def add_array(encoder, arr):
+        if arr.dtype.hasobject:
+            raise TypeError('cannot encode object arrays without pickle')
+        # Note: np.ascontiguousarray would make 0-d arrays 1-d
+        encoder.arrays.append(np.require(arr, requirements='C'))
+        return len(encoder.arrays) - 1
+
+    def encode(encoder, val):
+        if val is None or isinstance(val, _PRIMITIVES):
+            return val
+        elif isinstance(val, np.ndarray):
+            return ['nd', encoder.add_array(val)]
+        elif isinstance(val, np.generic):
+            return ['sc', encoder.add_array(np.array(val))]
+        elif isinstance(val, CSRList):
+            return ['csr', encoder.add_array(val.flat), encoder.add_array(val.offsets)]
+        elif isinstance(val, dict):
+            keys = encoder.encode(list(val.keys()))
+            values = encoder.encode(list(val.values()))
+            return ['dict', keys, values]
+        elif isinstance(val, tuple):
+            return ['tuple', [encoder.encode(item) for item in val]]
+        elif isinstance(val, list):
+            if _is_ndlist(val):
+                csr = CSRList.from_list(val)
+                return [
+                    'ndlist',
+                    encoder.add_array(csr.flat),
+                    encoder.add_array(csr.offsets),
+                ]
+            elif _is_scalarlist(val):
+                return ['sclist', encoder.add_array(np.array(val))]
+            elif all(item is None or isinstance(item, _PRIMITIVES) for item in val):
+                return ['pylist', val]
+            return ['list', [encoder.encode(item) for item in val]]
+        else:
+            raise TypeError('cannot encode %r without pickle' % (type(val),))
+
+
+def _is_ndlist(val):
+    """True if val is a list of arrays that can be concatenated"""
+    if len(val) == 0 or not all(isinstance(arr, np.ndarray) for arr in val):
+        return False
+    first = val[0]
+    return first.ndim > 0 and all(
+        arr.dtype == first.dtype and arr.shape[1:] == first.shape[1:] for arr in val
+    )
+
+
+def _is_scalarlist(val):
+    """True if val is a list of numpy scalars of one dtype"""
+    if len(val) == 0 or not isinstance(val[0], np.generic):
+        return False
+    dtype = val[0].dtype
+    return all(isinstance(item, np.generic) and item.dtype == dtype for item in val)
+
+
+def _decode(node, arrays):
+    if not isinstance(node, list):
+        return node
+    tag = node[0]
+    if tag == 'nd':
+        return arrays[node[1]]
+    elif tag == 'sc':
+        return arrays[node[1]][()]
+    elif tag == 'csr':
+        return CSRList(arrays[node[1]], arrays[node[2]])
+    elif tag == 'ndlist':
+        return CSRList(arrays[node[1]], arrays[node[2]]).tolist()
+    elif tag == 'sclist':
+        return list(arrays[node[1]])
+    elif tag == 'dict':
+        keys = _decode(node[1], arrays)
+        values = _decode(node[2], arrays)
+        return dict(zip(keys, values))
+    elif tag == 'tuple':
+        return tuple(_decode(item, arrays) for item in node[1])
+    elif tag == 'pylist':
+        return node[1]
+    elif tag == 'list':
+        return [_decode(item, arrays) for item in node[1]]
+    else:
+        raise ValueError('unknown record node %r' % (tag,))
+
+
+def _aligned(nbytes):
+    return -(-nbytes // RECORD_ALIGN) * RECORD_ALIGN
+
+
+def encode_state(state_dict):
+    """
+    Encodes a state dict of numpy arrays, lists, dicts and scalars without
+    pickle.
+
+    Returns:
+        bytes: record
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.chip_match_store import *  # NOQA
+        >>> state = {
+        >>>     'qaid': 1, 'qnid': np.int32(3), 'lbls': ['a', 'b'],
+        >>>     'fm_list': [np.array([[0, 1]]), np.empty((0, 2), dtype=int)],
+        >>>     'daid2_idx': {np.int64(5): 0, np.int64(7): 1},
+        >>>     'scores': {'csum': np.array([1.5, 2.0]), 'nsum': None},
+        >>> }
+        >>> state2 = decode_state(encode_state(state))
+        >>> assert ut.repr4(state) == ut.repr4(state2)
+        >>> assert state2['qnid'].dtype == np.int32
+        >>> assert state2['fm_list'][1].shape == (0, 2)
+    """
+    encoder = _RecordEncoder()
+    tree = encoder.encode(state_dict)
+    array_infos = []
+    offset = 0
+    for arr in encoder.arrays:
+        array_infos.append((arr.dtype.str, arr.shape, offset))
+        offset += _aligned(arr.nbytes)
+    header = json.dumps(
+        {'version': RECORD_VERSION, 'arrays': array_infos, 'tree': tree}
+    ).encode('utf8')
+    data_start = _aligned(8 + len(header))
+    record = bytearray(data_start + offset)
+    struct.pack_into('<Q', record, 0, len(header))
+    record[8 : 8 + len(header)] = header
+    for arr, (_, _, arr_offset) in zip(encoder.arrays, array_infos):
+        start = data_start + arr_offset
+        record[start : start + arr.nbytes] = arr.tobytes()
+    return bytes(record)
+
+
+def decode_state(record):
+    """
+    Inverse of encode_state. The arrays are views into the record buffer,
+    which is writable if record is a bytearray.
+    """
+    (header_len,) = struct.unpack_from('<Q', record, 0)
+    header = json.loads(bytes(record[8 : 8 + header_len]).decode('utf8'))
+    if header['version'] != RECORD_VERSION:
+        raise chip_match.NeedRecomputeError('old version of chipmatch record')
+    data_start = _aligned(8 + header_len)
+    arrays = []
+    for dtype_str, shape, offset in header['arrays']:
+        dtype = np.dtype(dtype_str)
+        count = functools.reduce(operator.mul, shape, 1)
+        arr = np.frombuffer(record, dtype=dtype, count=count, offset=data_start + offset)
+        arrays.append(arr.reshape(tuple(shape)))
+    return _decode(header['tree'], arrays)
+
+
+def chipmatch_from_record(record):
+    state_dict = decode_state(record)
+    if 'filtnorm_aids' not in state_dict:
+        raise chip_match.NeedRecomputeError('old version of chipmatch')
+    cm = chip_match.ChipMatch()
+    cm.__setstate__(state_dict)
+    return cm
+
+
+class ChipMatchStore(ut.NiceRepr):
+    """
+    The cached chipmatches of one query config
+
+    Args:
+        dpath (str): query result directory
+        cfgstr (str): query config (data and pipeline) of the chipmatches
+
+    CommandLine:
+        python -m wbia.algo.hots.chip_match_store ChipMatchStore
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.chip_match_store import *  # NOQA
+        >>> from wbia.algo.hots import name_scoring
+        >>> import tempfile
+        >>> dpath = tempfile.mkdtemp()
+        >>> cm1 = name_scoring.testdata_chipmatch()
+        >>> cm2 = name_scoring.testdata_chipmatch()
+        >>> cm2.qaid = 2
+        >>> with ChipMatchStore(dpath, 'cfg') as store:
+        >>>     store.save_chipmatches([cm1, cm2], ['uuid1', 'uuid2'])
+        >>>     flags = store.exists([1, 2, 1], ['uuid1', 'uuid2', 'uuid2'])
+        >>>     cm_list = store.load_chipmatches([2, 1, 3], ['uuid2', 'uuid1', 'uuid3'])
+        >>> print(flags)
+        [True, True, False]
+        >>> assert cm_list[0] == cm2 and cm_list[1] == cm1 and cm_list[2] is None
+        >>> with ChipMatchStore(dpath, 'cfg') as store:
+        >>>     print(store)
+        >>>     store.clear()
+        >>>     print(store)
+        <ChipMatchStore(cfg, n=2)>
+        <ChipMatchStore(cfg, n=0)>
+        >>> ut.delete(dpath, verbose=False)
+    """
+
+    def __init__(store, dpath, cfgstr):
+        store.dpath = dpath
+        store.cfgstr = cfgstr
+        store._fname = 'cm_store_' + ut.hashstr27(cfgstr)
+        store.index_fpath = join(dpath, store._fname + '.sqlite3')
+        store._conn = None
+
+    def __nice__(store):
+        return '%s, n=%d' % (ut.truncate_str(store.cfgstr, 40), len(store))
+
+    @property
+    def records_fpath(store):
+        """The current generation of the records file"""
+        return store._get_records_fpath(store.connect())
+
+    def _get_records_fpath(store, conn):
+        (generation,) = conn.execute(
+            'SELECT value FROM metadata WHERE key = ?', ('generation',)
+        ).fetchone()
+        return store._records_fpath(int(generation))
+
+    def _records_fpath(store, generation):
+        if generation == 0:
+            return join(store.dpath, store._fname + '.records')
+        return join(store.dpath, '%s.%d.records' % (store._fname, generation))
+
+    def __len__(store):
+        return store.connect().execute('SELECT COUNT(*) FROM chipmatch').fetchone()[0]
+
+    def __enter__(store):
+        store.connect()
+        return store
+
+    def __exit__(store, type_, value, trace):
+        store.close()
+
+    def connect(store):
+        if store._conn is None:
+            ut.ensuredir(store.dpath)
+            # Transactions are explicit, see _write_transaction
+            conn = sqlite3.connect(store.index_fpath, isolation_level=None)
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                'key TEXT PRIMARY KEY, value TEXT)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS chipmatch ('
+                'qaid INTEGER, quuid TEXT, offset INTEGER, nbytes INTEGER, '
+                'PRIMARY KEY (qaid, quuid))'
+            )
+            conn.execute(
+                'INSERT OR IGNORE INTO metadata VALUES (?, ?)', ('cfgstr', store.cfgstr)
+            )
+            conn.execute(
+                'INSERT OR IGNORE INTO metadata VALUES (?, ?)', ('generation', '0')
+            )
+            (cfgstr,) = conn.execute(
+                'SELECT value FROM metadata WHERE key = ?', ('cfgstr',)
+            ).fetchone()
+            if cfgstr != store.cfgstr:
+                conn.close()
+                raise AssertionError(
+                    'chipmatch store %r belongs to another config' % (store.index_fpath,)
+                )
+            store._conn = conn
+        return store._conn
+
+    def close(store):
+        if store._conn is not None:
+            store._conn.close()
+            store._conn = None
+
+    def _write_transaction(store):
+        """
+        Locks the index before the records file is appended, so concurrent
+        writers do not interleave their records.
+        """
+        conn = store.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    def _open_records(store, qaids, quuids):
+        """
+        Looks up the keys and opens their records file in one read
+        transaction of the index. Until the file is open, the transaction
+        keeps compact from committing and removing the old generation.
+
+        Returns:
+            tuple: (loc_list, file_) - file_ is None if no key is stored or
+                the records file is missing
+        """
+        conn = store.connect()
+        conn.execute('BEGIN')
+        try:
+            loc_list = store._lookup(qaids, quuids)
+            file_ = None
+            if any(loc is not None for loc in loc_list):
+                records_fpath = store._get_records_fpath(conn)
+                try:
+                    file_ = open(records_fpath, 'rb')
+                except FileNotFoundError:
+                    logger.info('chipmatch records %r are missing' % (records_fpath,))
+        finally:
+            conn.execute('COMMIT')
+        return loc_list, file_
+
+    def _lookup(store, qaids, quuids):
+        """
+        Returns:
+            list: (offset, nbytes) of each key or None
+        """
+        conn = store.connect()
+        keys = list(zip(map(int, qaids), map(str, quuids)))
+        key_to_loc = {}
+        for chunk in ut.ichunks(sorted(set(qaid for qaid, _ in keys)), SQL_CHUNKSIZE):
+            rows = conn.execute(
+                'SELECT qaid, quuid, offset, nbytes FROM chipmatch '
+                'WHERE qaid IN (%s)' % (','.join('?' * len(chunk)),),
+                chunk,
+            )
+            for qaid, quuid, offset, nbytes in rows:
+                key_to_loc[(qaid, quuid)] = (offset, nbytes)
+        return [key_to_loc.get(key, None) for key in keys]
+
+    def exists(store, qaids, quuids):
+        """batched existence check"""
+        return [loc is not None for loc in store._lookup(qaids, quuids)]
+
+    @profile
+    def load_chipmatches(store, qaids, quuids):
+        """
+        Batched load. Missing chipmatches and chipmatches that need to be
+        recomputed are None.
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.algo.hots.chip_match_store import *  # NOQA
+            >>> from wbia.algo.hots import name_scoring
+            >>> import tempfile
+            >>> dpath = tempfile.mkdtemp()
+            >>> cm = name_scoring.testdata_chipmatch()
+            >>> store = ChipMatchStore(dpath, 'cfg')
+            >>> store.save_chipmatches([cm], ['uuid1'])
+            >>> conn = store.connect()
+            >>> # Corrupt records are recomputed
+            >>> _ = conn.execute('UPDATE chipmatch SET offset = 16, nbytes = nbytes - 16')
+            >>> assert store.load_chipmatches([cm.qaid], ['uuid1']) == [None]
+            >>> # and so are records of another query
+            >>> _ = conn.execute('UPDATE chipmatch SET offset = 0, nbytes = nbytes + 16')
+            >>> _ = conn.execute('UPDATE chipmatch SET qaid = qaid + 1')
+            >>> assert store.load_chipmatches([cm.qaid + 1], ['uuid1']) == [None]
+            >>> ut.delete(store.records_fpath, verbose=False)
+            >>> assert store.load_chipmatches([cm.qaid + 1], ['uuid1']) == [None]
+            >>> store.close()
+            >>> ut.delete(dpath, verbose=False)
+        """
+        loc_list, file_ = store._open_records(qaids, quuids)
+        cm_list = [None] * len(loc_list)
+        if file_ is None:
+            return cm_list
+        num_bad = 0
+        # Read the records in file order
+        hitxs = [idx for idx, loc in enumerate(loc_list) if loc is not None]
+        hitxs = sorted(hitxs, key=lambda idx: loc_list[idx][0])
+        with file_:
+            for idx in hitxs:
+                offset, nbytes = loc_list[idx]
+                record = bytearray(nbytes)
+                file_.seek(offset)
+                if file_.readinto(record) != nbytes:
+                    num_bad += 1
+                    continue
+                # Defense against corrupt (e.g. truncated) records files
+                try:
+                    cm = chipmatch_from_record(record)
+                except _BAD_RECORD_ERRORS:
+                    num_bad += 1
+                    continue
+                if cm.qaid != qaids[idx]:
+                    num_bad += 1
+                    continue
+                cm_list[idx] = cm
+        if num_bad > 0:
+            logger.info(
+                '%d / %d stored chipmatches need to be recomputed' % (num_bad, len(hitxs))
+            )
+        return cm_list
+
+    @profile
+    def save_chipmatches(store, cm_list, quuids):
+        """Appends the chipmatches and replaces older ones with the same keys"""
+        record_list = [encode_state(cm.__getstate__()) for cm in cm_list]
+        conn = store._write_transaction()
+        try:
+            with open(store._get_records_fpath(conn), 'ab') as file_:
+                offset = file_.tell()
+                rows = []
+                for cm, quuid, record in zip(cm_list, quuids, record_list):
+                    file_.write(record)
+                    rows.append((int(cm.qaid), str(quuid), offset, len(record)))
+                    offset += len(record)
+            conn.executemany('INSERT OR REPLACE INTO chipmatch VALUES (?, ?, ?, ?)', rows)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def remove(store, qaids, quuids):
+        keys = list(zip(map(int, qaids), map(str, quuids)))
+        conn = store._write_transaction()
+        conn.executemany('DELETE FROM chipmatch WHERE qaid = ? AND quuid = ?', keys)
+        conn.execute('COMMIT')
+
+    def clear(store):
+        """Removes all chipmatches. Only the index is changed."""
+        conn = store._write_transaction()
+        conn.execute('DELETE FROM chipmatch')
+        conn.execute('COMMIT')
+
+    def compact(store):
+        """
+        Writes the stored records to a new generation of the records file and
+        removes the old one. Readers are only blocked while the new offsets
+        are committed.
+        """
+        conn = store._write_transaction()
+        new_fpath = None
+        try:
+            rows = conn.execute(
+                'SELECT qaid, quuid, offset, nbytes FROM chipmatch ORDER BY offset'
+            ).fetchall()
+            (generation,) = conn.execute(
+                'SELECT value FROM metadata WHERE key = ?', ('generation',)
+            ).fetchone()
+            old_fpath = store._records_fpath(int(generation))
+            new_generation = int(generation) + 1
+            new_fpath = store._records_fpath(new_generation)
+            new_rows = []
+            new_offset = 0
+            with open(new_fpath, 'wb') as dst:
+                if exists(old_fpath):
+                    with open(old_fpath, 'rb') as src:
+                        for qaid, quuid, offset, nbytes in rows:
+                            src.seek(offset)
+                            dst.write(src.read(nbytes))
+                            new_rows.append((new_offset, qaid, quuid))
+                            new_offset += nbytes
+            conn.executemany(
+                'UPDATE chipmatch SET offset = ? WHERE qaid = ? AND quuid = ?', new_rows
+            )
+            conn.execute(
+                'UPDATE metadata SET value = ? WHERE key = ?',
+                (str(new_generation), 'generation'),
+            )
+        except Exception:
+            conn.execute('ROLLBACK')
+            if new_fpath is not None and exists(new_fpath):
+                ut.delete(new_fpath, verbose=False)
+            raise
+        conn.execute('COMMIT')
+        # Readers that opened the old file before the commit keep reading it
+        if exists(old_fpath):
+            ut.delete(old_fpath, verbose=False)
@@ -3,11 +3,13 @@
 Runs functions in pipeline to get query reuslts and does some caching.
 """
 import logging
+import numpy as np
 import ubelt as ub
 import utool as ut
 from os.path import exists
 from wbia.algo.hots import chip_match
 from wbia.algo.hots import pipeline
+from wbia.algo.hots import scoring
 
 (print, rrr, profile) = ut.inject2(__name__)
 logger = logging.getLogger('wbia')
@@ -26,6 +28,9 @@ USE_SUPERCACHE = ut.USE_CACHE and ut.get_argflag('--supercache')
 SAVE_CACHE = not ut.get_argflag('--nocache-save')
 MIN_BIGCACHE_BUNDLE = 64
 HOTS_BATCH_SIZE = ut.get_argval('--hots-batch-size', type_=int, default=None)
+# Cache chipmatches in one indexed store per query config instead of one
+# cPkl file per query
+USE_CM_STORE = ut.get_argflag('--cm-store')
 
 
 # ----------------------
@@ -235,10 +240,14 @@ def execute_query_and_save_L1(
         cm = qaid2_cm[qaid]
     """
     if invalidate_supercache:
-        dpath = qreq_.get_qresdir()
-        fpath_list = ut.glob('%s/*_cm_supercache_*' % (dpath,))
-        for fpath in fpath_list:
-            ut.delete(fpath)
+        if USE_CM_STORE:
+            with qreq_.get_chipmatch_store(super_qres_cache=True) as store:
+                store.clear()
+        else:
+            dpath = qreq_.get_qresdir()
+            fpath_list = ut.glob('%s/*_cm_supercache_*' % (dpath,))
+            for fpath in fpath_list:
+                ut.delete(fpath)
 
     if use_cache:
         if verbose:
@@ -246,54 +255,8 @@ def execute_query_and_save_L1(
         if use_supercache:
             logger.info('[mc4] supercache-query is on')
         # Try loading as many cached results as possible
-        qaid2_cm_hit = {}
         external_qaids = qreq_.qaids
-        fpath_list = list(
-            qreq_.get_chipmatch_fpaths(external_qaids, super_qres_cache=use_supercache)
-        )
-        exists_flags = [exists(fpath) for fpath in fpath_list]
-        qaids_hit = ut.compress(external_qaids, exists_flags)
-        fpaths_hit = ut.compress(fpath_list, exists_flags)
-        fpath_iter = ut.ProgIter(
-            fpaths_hit,
-            length=len(fpaths_hit),
-            enabled=len(fpaths_hit) > 1,
-            label='loading cache hits',
-            adjust=True,
-            freq=1,
-        )
-        try:
-            cm_hit_list = [
-                chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
-                for fpath in fpath_iter
-            ]
-            assert all(
-                [qaid == cm.qaid for qaid, cm in zip(qaids_hit, cm_hit_list)]
-            ), 'inconsistent qaid and cm.qaid'
-            qaid2_cm_hit = {cm.qaid: cm for cm in cm_hit_list}
-        except chip_match.NeedRecomputeError:
-            logger.info('NeedRecomputeError: Some cached chips need to recompute')
-            fpath_iter = ut.ProgIter(
-                fpaths_hit,
-                length=len(fpaths_hit),
-                enabled=len(fpaths_hit) > 1,
-                label='checking chipmatch cache',
-                adjust=True,
-                freq=1,
-            )
-            # Recompute those that fail loading
-            qaid2_cm_hit = {}
-            for fpath in fpath_iter:
-                try:
-                    cm = chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
-                except chip_match.NeedRecomputeError:
-                    pass
-                else:
-                    qaid2_cm_hit[cm.qaid] = cm
-            logger.info(
-                '%d / %d cached matches need to be recomputed'
-                % (len(qaids_hit) - len(qaid2_cm_hit), len(qaids_hit))
-            )
+        qaid2_cm_hit = _load_cached_chipmatches(qreq_, external_qaids, use_supercache)
         if len(qaid2_cm_hit) == len(external_qaids):
             return qaid2_cm_hit
         else:
@@ -317,6 +280,124 @@ def execute_query_and_save_L1(
     return qaid2_cm
 
 
+def _load_cached_chipmatches(
+    qreq_, external_qaids, use_supercache=False, allow_approx=False
+):
+    """
+    Args:
+        allow_approx (bool): if False, approximate results saved by
+            execute_query_incremental (``cm.is_approx``) are cache misses
+
+    Returns:
+        dict: qaid2_cm_hit - the cached chipmatches of external_qaids
+    """
+    if USE_CM_STORE:
+        qaid2_cm_hit = _load_chipmatch_store(qreq_, external_qaids, use_supercache)
+    else:
+        qaid2_cm_hit = _load_chipmatch_fpaths(qreq_, external_qaids, use_supercache)
+    if not allow_approx:
+        qaid2_cm_hit = {qaid: cm for qaid, cm in qaid2_cm_hit.items() if not cm.is_approx}
+    return qaid2_cm_hit
+
+
+def _save_cached_chipmatches(qreq_, cm_list, use_supercache=False):
+    if USE_CM_STORE:
+        qaid_list = [cm.qaid for cm in cm_list]
+        qauuid_list = list(qreq_.get_qreq_pcc_uuids(qaid_list))
+        with qreq_.get_chipmatch_store(super_qres_cache=use_supercache) as store:
+            store.save_chipmatches(cm_list, qauuid_list)
+    else:
+        fpath_list = list(
+            qreq_.get_chipmatch_fpaths(
+                [cm.qaid for cm in cm_list], super_qres_cache=use_supercache
+            )
+        )
+        _iter = zip(cm_list, fpath_list)
+        _iter = ut.ProgIter(
+            _iter,
+            length=len(cm_list),
+            label='saving chip matches',
+            adjust=True,
+            freq=1,
+        )
+        for cm, fpath in _iter:
+            cm.save_to_fpath(fpath, verbose=False)
+
+
+def _load_chipmatch_fpaths(qreq_, external_qaids, use_supercache):
+    """Loads the cached results stored as one cPkl file per query"""
+    fpath_list = list(
+        qreq_.get_chipmatch_fpaths(external_qaids, super_qres_cache=use_supercache)
+    )
+    exists_flags = [exists(fpath) for fpath in fpath_list]
+    qaids_hit = ut.compress(external_qaids, exists_flags)
+    fpaths_hit = ut.compress(fpath_list, exists_flags)
+    fpath_iter = ut.ProgIter(
+        fpaths_hit,
+        length=len(fpaths_hit),
+        enabled=len(fpaths_hit) > 1,
+        label='loading cache hits',
+        adjust=True,
+        freq=1,
+    )
+    try:
+        cm_hit_list = [
+            chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
+            for fpath in fpath_iter
+        ]
+        assert all(
+            [qaid == cm.qaid for qaid, cm in zip(qaids_hit, cm_hit_list)]
+        ), 'inconsistent qaid and cm.qaid'
+        qaid2_cm_hit = {cm.qaid: cm for cm in cm_hit_list}
+    except chip_match.NeedRecomputeError:
+        logger.info('NeedRecomputeError: Some cached chips need to recompute')
+        fpath_iter = ut.ProgIter(
+            fpaths_hit,
+            length=len(fpaths_hit),
+            enabled=len(fpaths_hit) > 1,
+            label='checking chipmatch cache',
+            adjust=True,
+            freq=1,
+        )
+        # Recompute those that fail loading
+        qaid2_cm_hit = {}
+        for fpath in fpath_iter:
+            try:
+                cm = chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
+            except chip_match.NeedRecomputeError:
+                pass
+            else:
+                qaid2_cm_hit[cm.qaid] = cm
+        logger.info(
+            '%d / %d cached matches need to be recomputed'
+            % (len(qaids_hit) - len(qaid2_cm_hit), len(qaids_hit))
+        )
+    return qaid2_cm_hit
+
+
+def _load_chipmatch_store(qreq_, external_qaids, use_supercache):
+    """Batched load of the cached results from the consolidated store"""
+    qauuid_list = list(qreq_.get_qreq_pcc_uuids(external_qaids))
+    with qreq_.get_chipmatch_store(super_qres_cache=use_supercache) as store:
+        cm_list = store.load_chipmatches(external_qaids, qauuid_list)
+    qaid2_cm_hit = {cm.qaid: cm for cm in cm_list if cm is not None}
+    return qaid2_cm_hit
+
+
+def _get_chunksize(qreq_, batch_size=None):
+    # vsone must have a chunksize of 1
+    if batch_size is None:
+        if HOTS_BATCH_SIZE is None:
+            hots_batch_size = qreq_.ibs.cfg.other_cfg.hots_batch_size
+            # hots_batch_size = 256
+        else:
+            hots_batch_size = HOTS_BATCH_SIZE
+    else:
+        hots_batch_size = batch_size
+    chunksize = 1 if qreq_.qparams.vsone else hots_batch_size
+    return chunksize
+
+
 @profile
 def execute_query2(qreq_, verbose, save_qcache, batch_size=None, use_supercache=False):
     """
@@ -335,16 +416,7 @@ def execute_query2(qreq_, verbose, save_qcache, batch_size=None, use_supercache=
     all_qaids = qreq_.qaids
     logger.info('len(missed_qaids) = %r' % (len(all_qaids),))
     qaid2_cm = {}
-    # vsone must have a chunksize of 1
-    if batch_size is None:
-        if HOTS_BATCH_SIZE is None:
-            hots_batch_size = qreq_.ibs.cfg.other_cfg.hots_batch_size
-            # hots_batch_size = 256
-        else:
-            hots_batch_size = HOTS_BATCH_SIZE
-    else:
-        hots_batch_size = batch_size
-    chunksize = 1 if qreq_.qparams.vsone else hots_batch_size
+    chunksize = _get_chunksize(qreq_, batch_size)
 
     # Iterate over vsone queries in chunks.
     n_total_chunks = ut.get_num_chunks(len(all_qaids), chunksize)
@@ -368,23 +440,177 @@ def execute_query2(qreq_, verbose, save_qcache, batch_size=None, use_supercache=
             [qaid == cm.qaid for qaid, cm in zip(sub_qreq_.qaids, sub_cm_list)]
         ), 'not corresonding'
         if save_qcache:
-            fpath_list = list(
-                qreq_.get_chipmatch_fpaths(
-                    sub_qreq_.qaids, super_qres_cache=use_supercache
-                )
-            )
-            _iter = zip(sub_cm_list, fpath_list)
-            _iter = ut.ProgIter(
-                _iter,
-                length=len(sub_cm_list),
-                label='saving chip matches',
-                adjust=True,
-                freq=1,
-            )
-            for cm, fpath in _iter:
-                cm.save_to_fpath(fpath, verbose=False)
+            _save_cached_chipmatches(qreq_, sub_cm_list, use_supercache)
         else:
             if ut.VERBOSE:
                 logger.info('[mc4] not saving vsmany chunk')
         qaid2_cm.update({cm.qaid: cm for cm in sub_cm_list})
     return qaid2_cm
+
+
+def execute_query_incremental(
+    qreq_,
+    base_daids,
+    use_cache=None,
+    save_qcache=None,
+    allow_approx=True,
+    verbose=True,
+    batch_size=None,
+):
+    """
+    Runs the queries of qreq_ by reusing their cached results against an
+    older set of database annotations (base_daids).
+
+    Only the matches to the daids that are not in base_daids are computed.
+    Their neighbors and normalizers come from all daids, so they are the same
+    as in a full query. The merged result of a query is exact when the new
+    daids are not among its neighbors (see pipeline.delta_neighbor_filter),
+    no daids were removed, and the names of the query and the reused daids did
+    not change. Otherwise the old matches are kept and ``cm.is_approx`` is set.
+    If allow_approx is False, those queries are recomputed instead.
+
+    Queries without a cached base result are run normally.
+
+    Note:
+        With sv_on, the merged result spatially verifies the union of the
+        old and new shortlists, which can contain more annotations than the
+        shortlist of a full query.
+
+    Args:
+        qreq_ (wbia.QueryRequest): query against the current daids
+        base_daids (list): daids of the cached results to reuse
+        allow_approx (bool): if False, only exact results are reused
+
+    Returns:
+        tuple: (qaid2_cm, inc_info)
+
+    CommandLine:
+        python -m wbia.algo.hots.match_chips4 execute_query_incremental
+
+    Example:
+        >>> # SLOW_DOCTEST
+        >>> # xdoctest: +SKIP
+        >>> from wbia.algo.hots.match_chips4 import *  # NOQA
+        >>> import wbia
+        >>> ibs = wbia.opendb('PZ_MTEST')
+        >>> daids = ibs.get_valid_aids()
+        >>> qaids = daids[0:10]
+        >>> base_daids = daids[: int(len(daids) * 0.8)]
+        >>> cfgdict = dict(sv_on=False)
+        >>> qreq_ = ibs.new_query_request(qaids, daids, cfgdict=cfgdict)
+        >>> base_qreq_ = ibs.new_query_request(qaids, base_daids, cfgdict=cfgdict)
+        >>> base_cms = base_qreq_.execute(use_cache=True)
+        >>> qaid2_cm, inc_info = execute_query_incremental(
+        >>>     qreq_, base_daids, use_cache=False, save_qcache=False,
+        >>>     allow_approx=False)
+        >>> qaid2_cm_full = execute_query_and_save_L1(qreq_, False, False)
+        >>> for qaid, cm in qaid2_cm_full.items():
+        >>>     cm_ = qaid2_cm[qaid]
+        >>>     assert set(cm.daid_list) == set(cm_.daid_list)
+        >>>     assert cm.get_top_aids()[0] == cm_.get_top_aids()[0]
+        >>> print(ut.repr4(inc_info))
+    """
+    if use_cache is None:
+        use_cache = USE_CACHE
+    if save_qcache is None:
+        save_qcache = SAVE_CACHE
+    tt = ut.tic()
+    all_qaids = list(qreq_.qaids)
+    delta_daids = np.setdiff1d(qreq_.daids, base_daids)
+    removed_daids = np.setdiff1d(base_daids, qreq_.daids)
+
+    if use_cache:
+        qaid2_cm = _load_cached_chipmatches(qreq_, all_qaids, allow_approx=allow_approx)
+    else:
+        qaid2_cm = {}
+    miss_qaids = [qaid for qaid in all_qaids if qaid not in qaid2_cm]
+    num_cachehit = len(qaid2_cm)
+
+    # Only the vsmany pipeline can restrict the matches to delta_daids
+    can_reuse = qreq_.qparams.pipeline_root == 'vsmany' and len(miss_qaids) > 0
+    if can_reuse:
+        base_qreq_ = type(qreq_).new_query_request(
+            miss_qaids,
+            base_daids,
+            qreq_.qparams,
+            qreq_.qresdir,
+            qreq_.ibs,
+            qreq_.query_config2_,
+            qreq_.data_config2_,
+            qreq_._indexer_request_params,
+            custom_nid_lookup=qreq_.custom_nid_lookup,
+        )
+        qaid2_basecm = _load_cached_chipmatches(
+            base_qreq_, miss_qaids, allow_approx=allow_approx
+        )
+    else:
+        qaid2_basecm = {}
+    reuse_qaids = [qaid for qaid in miss_qaids if qaid in qaid2_basecm]
+
+    qaid2_cm_inc = {}
+    approx_qaids = []
+    if len(reuse_qaids) > 0:
+        qreq_.lazy_preload(verbose=verbose and ut.NOT_QUIET)
+        chunksize = _get_chunksize(qreq_, batch_size)
+        _qreq_iter = (
+            qreq_.shallowcopy(qaids=qaids) for qaids in ut.ichunks(reuse_qaids, chunksize)
+        )
+        sub_qreq_iter = ut.ProgIter(
+            _qreq_iter,
+            length=ut.get_num_chunks(len(reuse_qaids), chunksize),
+            freq=1,
+            label='[mc4] incremental query chunk: ',
+        )
+        for sub_qreq_ in sub_qreq_iter:
+            delta_cm_list, delta_changed_list = pipeline.request_wbia_query_L0(
+                qreq_.ibs, sub_qreq_, verbose=verbose, delta_daids=delta_daids
+            )
+            for delta_cm, changed in zip(delta_cm_list, delta_changed_list):
+                base_cm = qaid2_basecm[delta_cm.qaid]
+                # Keep the matches to the base daids that are still in the database
+                keep_idxs = np.flatnonzero(np.isin(base_cm.daid_list, qreq_.daids))
+                kept_cm = base_cm.take_annots(keep_idxs)
+                old_nids = np.append(kept_cm.dnid_list, kept_cm.qnid)
+                cm = chip_match.ChipMatch.combine_cms([kept_cm, delta_cm])
+                cm.evaluate_dnids(qreq_)
+                new_nids = np.append(cm.dnid_list[: len(keep_idxs)], cm.qnid)
+                is_approx = (
+                    changed
+                    or len(removed_daids) > 0
+                    or base_cm.is_approx
+                    or not np.array_equal(old_nids, new_nids)
+                )
+                if is_approx:
+                    cm.is_approx = True
+                    approx_qaids.append(cm.qaid)
+                qaid2_cm_inc[cm.qaid] = cm
+        if not allow_approx:
+            for qaid in approx_qaids:
+                del qaid2_cm_inc[qaid]
+        cm_list = list(qaid2_cm_inc.values())
+        scoring.score_chipmatch_list(qreq_, cm_list, qreq_.qparams.score_method)
+        if save_qcache and len(cm_list) > 0:
+            _save_cached_chipmatches(qreq_, cm_list)
+        qaid2_cm.update(qaid2_cm_inc)
+
+    full_qaids = [qaid for qaid in miss_qaids if qaid not in qaid2_cm_inc]
+    if len(full_qaids) > 0:
+        # mask queries that have already been answered
+        qreq_.set_external_qaid_mask(ut.setdiff(all_qaids, full_qaids))
+        qaid2_cm.update(execute_query2(qreq_, verbose, save_qcache, batch_size))
+        qreq_.set_external_qaid_mask(None)  # undo state changes
+
+    num_approx = len(approx_qaids) if allow_approx else 0
+    inc_info = ut.odict(
+        [
+            ('num_delta_daids', len(delta_daids)),
+            ('num_removed_daids', len(removed_daids)),
+            ('num_cachehit', num_cachehit),
+            ('num_exact', len(qaid2_cm_inc) - num_approx),
+            ('num_approx', num_approx),
+            ('num_full', len(full_qaids)),
+            ('time', ut.toc(tt)),
+        ]
+    )
+    logger.info('[mc4] incremental query %s' % (ut.repr2(inc_info, precision=2),))
+    return qaid2_cm, inc_info
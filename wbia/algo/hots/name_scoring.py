@@ -5,6 +5,7 @@ import vtool as vt
 import utool as ut
 import itertools
 from wbia.algo.hots import hstypes
+from wbia.algo.hots import chip_match_csr
 from wbia.algo.hots import _pipeline_helpers as plh  # NOQA
 from collections import namedtuple
 
@@ -122,13 +123,19 @@ def compute_fmech_score(cm, qreq_=None, hack_single_ori=False):
     # The query feature index for each feature match
     fm_list = cm.fm_list
     fs_list = cm.get_fsv_prod_list()
-    fx1_list = [fm.T[0] for fm in fm_list]
+    fx1_to_comboid = None
     if hack_single_ori:
         # Group keypoints with the same xy-coordinate.
         # Combine these feature so each only recieves one vote
         kpts1 = qreq_.ibs.get_annot_kpts(cm.qaid, config2_=qreq_.extern_query_config2)
         xys1_ = vt.get_xys(kpts1).T
         fx1_to_comboid = vt.compute_unique_arr_dataids(xys1_)
+
+    if isinstance(fs_list, chip_match_csr.CSRList):
+        return _compute_fmech_score_csr(fm_list, fs_list, cm.name_groupxs, fx1_to_comboid)
+
+    fx1_list = [fm.T[0] for fm in fm_list]
+    if hack_single_ori:
         fcombo_ids = [fx1_to_comboid.take(fx1) for fx1 in fx1_list]
     else:
         # use the feature index itself as a combo id
@@ -172,6 +179,56 @@ def compute_fmech_score(cm, qreq_=None, hack_single_ori=False):
     return nsum_score_list
 
 
+def _compute_fmech_score_csr(fm_list, fs_list, name_groupxs, fx1_to_comboid=None):
+    """
+    compute_fmech_score for CSRList matches. All names are scored at once and
+    the name scores are exactly equal to the ones of the loop over names.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.name_scoring import *  # NOQA
+        >>> from wbia.algo.hots import chip_match_csr
+        >>> cm = testdata_chipmatch()
+        >>> fm_list = chip_match_csr.CSRList.from_list(cm.fm_list)
+        >>> fs_list = chip_match_csr.CSRList.from_list(cm.get_fsv_prod_list())
+        >>> nsum_score_list = _compute_fmech_score_csr(fm_list, fs_list, cm.name_groupxs)
+        >>> assert np.all(nsum_score_list == compute_fmech_score(cm))
+    """
+    # Lay out the matches of the annots of each name one after another
+    name_lens = [len(idxs) for idxs in name_groupxs]
+    annotxs = np.concatenate(name_groupxs) if len(name_groupxs) else []
+    rowxs, annot_offsets = chip_match_csr.segment_take(fs_list.offsets, annotxs)
+    fs = fs_list.flat.take(rowxs)
+    combo_ids = fm_list.flat.T[0].take(rowxs)
+    if fx1_to_comboid is not None:
+        combo_ids = fx1_to_comboid.take(combo_ids)
+    annot_name_offsets = chip_match_csr.lens_to_offsets(name_lens)
+    name_offsets = annot_offsets[annot_name_offsets]
+    nameids = np.repeat(np.arange(len(name_lens)), np.diff(name_offsets))
+    if len(fs) == 0:
+        return np.zeros(len(name_lens), dtype=fs.dtype)
+    # Features (with the same id) can't vote for a name twice. The vote of
+    # a feature is its first best scoring match (same as argmax).
+    combo_ids = combo_ids.astype(np.int64)
+    votekeys = nameids * (combo_ids.max() + 1) + combo_ids
+    sortx = votekeys.argsort(kind='stable')
+    sorted_keys = votekeys.take(sortx)
+    sorted_fs = fs.take(sortx)
+    group_starts = np.flatnonzero(np.r_[True, np.diff(sorted_keys) != 0])
+    group_maxs = np.maximum.reduceat(sorted_fs, group_starts)
+    group_lens = np.diff(np.r_[group_starts, len(sortx)])
+    maxxs = np.flatnonzero(sorted_fs == np.repeat(group_maxs, group_lens))
+    maxkeys = sorted_keys.take(maxxs)
+    first = np.r_[True, np.diff(maxkeys) != 0]
+    # Detail: sorting the idxs preseveres summation order
+    flagged_idxs = np.sort(sortx.take(maxxs[first]))
+    flagged_offsets = chip_match_csr.lens_to_offsets(
+        np.bincount(nameids[flagged_idxs], minlength=len(name_lens))
+    )
+    nsum_score_list = chip_match_csr.segment_sum(fs.take(flagged_idxs), flagged_offsets)
+    return nsum_score_list
+
+
 @profile
 def get_chipmatch_namescore_nonvoting_feature_flags(cm, qreq_=None):
     """
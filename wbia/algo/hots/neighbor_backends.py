@@ -0,0 +1,644 @@
+# -*- coding: utf-8 -*-
+"""
+Search engines used by :class:`wbia.algo.hots.neighbor_index.NeighborIndex`.
+
+Every backend implements the subset of the ``pyflann.FLANN`` interface the
+indexer relies on: ``build_index``, ``nn_index``, ``add_points``,
+``remove_points``, ``save_index``, ``load_index`` and ``get_indexed_data``.
+``nn_index`` returns indices into the indexed data and *squared* euclidean
+distances, with the same K == 1 squeezing that pyflann does, so the indexer's
+``knn`` / ``requery_knn`` code is shared by all backends.
+
+Backends:
+    * ``flann`` - approximate search with FLANN (the default)
+    * ``brute`` - exact brute force search on top of BLAS matrix products.
+      There is nothing to build, so this is faster than FLANN overall for
+      small and medium databases where building the FLANN index dominates.
+    * ``pq`` - product quantization. Each vector is stored as ``pq_m`` one
+      byte codes (16 bytes instead of 128 for SIFT by default) and searched
+      with asymmetric distance computation (ADC). The best
+      ``pq_rerank * K`` candidates are re-ranked with exact distances.
+    * ``ivfpq`` - like ``pq`` but the residuals are encoded in ``pq_nlist``
+      coarse clusters and only the ``pq_nprobe`` clusters closest to each
+      query are searched.
+
+The backend is selected with the ``backend`` key of the flann params, which
+is set from ``IndexerConfig`` (depcache indexers) or from the ``nn_backend``
+query param (``FlannConfig``).
+"""
+import logging
+from concurrent import futures
+
+import numpy as np
+import utool as ut
+from vtool._pyflann_backend import pyflann as pyflann
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia')
+
+
+#: Number of query vectors searched together by the brute force backend
+BRUTE_QUERY_CHUNKSIZE = ut.get_argval('--brute-query-chunksize', type_=int, default=256)
+#: Number of database vectors compared against a chunk of queries at once
+BRUTE_DATA_CHUNKSIZE = ut.get_argval('--brute-data-chunksize', type_=int, default=65536)
+
+
+class FlannBackend(pyflann.FLANN):
+    """
+    Approximate nearest neighbors with FLANN
+    """
+
+    name = 'flann'
+    ext = '.flann'
+    exact = False
+
+    def __init__(backend, **kwargs):
+        # The flann params are given to build_index
+        super(FlannBackend, backend).__init__()
+
+    def nbytes(backend):
+        """Memory held by the search structure (not the indexed data)"""
+        if backend._FLANN__curindex is None:
+            return 0
+        return backend.used_memory()
+
+
+class BruteForceBackend(object):
+    """
+    Exact nearest neighbors by brute force.
+
+    Squared distances are computed as ``|q|^2 - 2 q.x + |x|^2`` with float32
+    matrix products (which run multithreaded in BLAS) over chunks of the
+    queries and of the database, so memory stays bounded for large databases.
+    The squared distances of the K chosen neighbors are then recomputed
+    exactly, and ties are broken by index so the result is deterministic.
+    Chunks of queries are searched in parallel by ``cores`` threads.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_backends import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> data = rng.randint(0, 255, size=(1000, 16)).astype(np.uint8)
+        >>> qvecs = rng.randint(0, 255, size=(20, 16)).astype(np.uint8)
+        >>> backend = BruteForceBackend()
+        >>> backend.build_index(data)
+        >>> idxs, dists = backend.nn_index(qvecs, 3, cores=2)
+        >>> diff = qvecs[:, None, :].astype(np.float64) - data[None, :, :]
+        >>> sqrd_dists = (diff ** 2).sum(axis=2)
+        >>> assert np.all(idxs == sqrd_dists.argsort(axis=1, kind='stable')[:, 0:3])
+        >>> assert np.all(dists == np.sort(sqrd_dists, axis=1)[:, 0:3])
+        >>> backend.remove_points(idxs[:, 0])
+        >>> idxs2, dists2 = backend.nn_index(qvecs, 2)
+        >>> sqrd_dists[:, idxs[:, 0]] = np.inf
+        >>> assert np.all(idxs2 == sqrd_dists.argsort(axis=1, kind='stable')[:, 0:2])
+        >>> assert backend.nn_index(qvecs, 1)[0].shape == (20,)
+    """
+
+    name = 'brute'
+    ext = '.brute'
+    exact = True
+
+    def __init__(backend, **kwargs):
+        backend._data = None
+        backend._sqrd_norms = None
+        backend._removed = None
+        backend._cores = kwargs.get('cores', 0)
+
+    def build_index(backend, pts, **kwargs):
+        backend._data = pts
+        backend._sqrd_norms = _sqrd_norms(pts)
+        backend._removed = np.zeros(len(pts), dtype=bool)
+
+    def add_points(backend, pts, rebuild_threshold=None):
+        backend._data = np.vstack([backend._data, pts])
+        backend._sqrd_norms = np.hstack([backend._sqrd_norms, _sqrd_norms(pts)])
+        backend._removed = np.hstack([backend._removed, np.zeros(len(pts), dtype=bool)])
+
+    def remove_points(backend, idxs):
+        backend._removed[idxs] = True
+
+    def get_indexed_data(backend):
+        return backend._data, []
+
+    def save_index(backend, filename):
+        # There is no search structure, only the removed points are saved
+        with open(filename, 'wb') as file_:
+            np.save(file_, backend._removed)
+
+    def load_index(backend, filename, pts):
+        with open(filename, 'rb') as file_:
+            removed = np.load(file_)
+        if len(removed) != len(pts):
+            raise IOError('brute force index does not match the data')
+        backend.build_index(pts)
+        backend._removed = removed
+
+    @profile
+    def nn_index(backend, qpts, num_neighbors=1, checks=None, cores=None, **kwargs):
+        """
+        Returns the (indices, squared distances) of the nearest neighbors.
+        ``checks`` is accepted for compatibility with FLANN and ignored.
+        """
+        qpts = np.asarray(qpts)
+        if qpts.ndim == 1:
+            qpts = qpts[None, :]
+        num_queries = len(qpts)
+        num_data = len(backend._data)
+        K = num_neighbors
+        if K > num_data:
+            raise ValueError('cannot find %d neighbors in %d points' % (K, num_data))
+        idxs = np.empty((num_queries, K), dtype=np.int32)
+        dists = np.empty((num_queries, K), dtype=np.float32)
+        if cores is None or cores == 0:
+            cores = backend._cores or ut.num_cpus()
+
+        def _search(sl_):
+            idxs[sl_], dists[sl_] = backend._search_chunk(qpts[sl_], K)
+
+        slices = list(ut.ichunk_slices(num_queries, BRUTE_QUERY_CHUNKSIZE))
+        if cores <= 1 or len(slices) <= 1:
+            for sl_ in slices:
+                _search(sl_)
+        else:
+            with futures.ThreadPoolExecutor(min(cores, len(slices))) as executor:
+                for _ in executor.map(_search, slices):
+                    pass
+        if K == 1:
+            # pyflann returns flat arrays for a single neighbor
+            return idxs[:, 0], dists[:, 0]
+        return idxs, dists
+
+    def nbytes(backend):
+        """Memory held by the search structure (not the indexed data)"""
+        if backend._removed is None:
+            return 0
+        return backend._sqrd_norms.nbytes + backend._removed.nbytes
+
+    def _search_chunk(backend, qpts, K):
+        qpts_ = qpts.astype(np.float32)
+        num_data = len(backend._data)
+        # Keep the best K candidates seen so far in each row
+        cand_idxs = np.empty((len(qpts), 0), dtype=np.int64)
+        cand_dists = np.empty((len(qpts), 0), dtype=np.float32)
+        for sl_ in ut.ichunk_slices(num_data, BRUTE_DATA_CHUNKSIZE):
+            block = backend._data[sl_].astype(np.float32)
+            # |q|^2 is the same for every column, so it is left out of the
+            # ranking and added back when the distances are recomputed
+            block_dists = backend._sqrd_norms[sl_] - 2 * qpts_.dot(block.T)
+            block_dists[:, backend._removed[sl_]] = np.inf
+            if block_dists.shape[1] > K:
+                part = np.argpartition(block_dists, K - 1, axis=1)[:, 0:K]
+                block_dists = np.take_along_axis(block_dists, part, axis=1)
+                block_idxs = part + sl_.start
+            else:
+                block_idxs = np.broadcast_to(
+                    np.arange(sl_.start, sl_.start + len(block)), block_dists.shape
+                )
+            cand_idxs = np.hstack([cand_idxs, block_idxs])
+            cand_dists = np.hstack([cand_dists, block_dists])
+            if cand_dists.shape[1] > K:
+                part = np.argpartition(cand_dists, K - 1, axis=1)[:, 0:K]
+                cand_idxs = np.take_along_axis(cand_idxs, part, axis=1)
+                cand_dists = np.take_along_axis(cand_dists, part, axis=1)
+        return _rerank_exact(backend._data, backend._removed, qpts, cand_idxs, K)
+
+
+class PQBackend(BruteForceBackend):
+    """
+    Approximate nearest neighbors with product quantization.
+
+    The vectors are split into ``pq_m`` sub-vectors and every sub-vector is
+    replaced by the index of its nearest centroid in a codebook of 256
+    centroids. The codebooks are trained with k-means on a random sample of
+    ``pq_sample`` of the indexed vectors. Queries are compared to the codes
+    with asymmetric distance computation: a table of the squared distances
+    from each query sub-vector to every centroid is summed over the codes.
+
+    If ``pq_rerank`` is positive the ``pq_rerank * K`` best candidates are
+    re-ranked with exact distances, which reads only those rows of the
+    indexed data (that may be a memory mapped view of the depcache).
+    Otherwise the approximate ADC distances are returned.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_backends import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> centers = rng.randint(0, 255, size=(50, 16))
+        >>> data = centers.repeat(40, axis=0) + rng.randint(-4, 5, size=(2000, 16))
+        >>> data = data.clip(0, 255).astype(np.uint8)
+        >>> qvecs = data[::100]
+        >>> brute = BruteForceBackend()
+        >>> brute.build_index(data)
+        >>> exact_idxs, exact_dists = brute.nn_index(qvecs, 4)
+        >>> backend = PQBackend(pq_rerank=8)
+        >>> backend.build_index(data, pq_m=4, random_seed=0)
+        >>> idxs, dists = backend.nn_index(qvecs, 4)
+        >>> assert np.all(idxs[:, 0] == np.arange(0, 2000, 100))
+        >>> recall = np.mean([len(np.intersect1d(a, b)) / 4 for a, b in zip(idxs, exact_idxs)])
+        >>> assert recall > .9, recall
+        >>> assert backend._codes.nbytes * 4 == data.nbytes
+        >>> # Without re-ranking the ADC distances are returned
+        >>> backend.rerank = 0
+        >>> adc_idxs, adc_dists = backend.nn_index(qvecs, 4)
+        >>> assert np.all(np.diff(adc_dists, axis=1) >= 0)
+    """
+
+    name = 'pq'
+    ext = '.pq'
+    exact = False
+
+    def __init__(backend, **kwargs):
+        super(PQBackend, backend).__init__(**kwargs)
+        # Search params
+        backend.rerank = kwargs.get('pq_rerank', 4)
+        # Build params
+        backend.m = None
+        backend._centroids = None  # (m x 256 x dsub) codebooks
+        backend._codes = None  # (N x m) uint8 codes
+
+    def build_index(backend, pts, **kwargs):
+        backend._data = pts
+        backend._removed = np.zeros(len(pts), dtype=bool)
+        backend.m = kwargs.get('pq_m', 16)
+        if pts.shape[1] % backend.m != 0:
+            raise ValueError(
+                'pq_m=%r must divide the dimension %r' % (backend.m, pts.shape[1])
+            )
+        rng = np.random.RandomState(kwargs.get('random_seed', 42))
+        sample = _sample_rows(pts, kwargs.get('pq_sample', 65536), rng)
+        backend._train(sample, kwargs, rng)
+        for key, arr in backend._encode(pts).items():
+            setattr(backend, '_' + key, arr)
+
+    def _train(backend, sample, params, rng):
+        backend._centroids = _train_codebooks(
+            sample, backend.m, params.get('pq_iters', 20), rng
+        )
+
+    def _encode(backend, pts):
+        """Returns a dict of the per-point arrays that describe pts"""
+        return {'codes': _encode_pq(backend._centroids, pts)}
+
+    def add_points(backend, pts, rebuild_threshold=None):
+        # New points are encoded with the existing codebooks
+        for key, arr in backend._encode(pts).items():
+            old_arr = getattr(backend, '_' + key)
+            stack = np.vstack if old_arr.ndim == 2 else np.hstack
+            setattr(backend, '_' + key, stack([old_arr, arr]))
+        backend._data = np.vstack([backend._data, pts])
+        backend._removed = np.hstack([backend._removed, np.zeros(len(pts), dtype=bool)])
+
+    def _state(backend):
+        return {
+            'centroids': backend._centroids,
+            'codes': backend._codes,
+            'removed': backend._removed,
+            'm': np.array(backend.m),
+        }
+
+    def _set_state(backend, state):
+        backend._centroids = state['centroids']
+        backend._codes = state['codes']
+        backend._removed = state['removed']
+        backend.m = int(state['m'])
+
+    def save_index(backend, filename):
+        with open(filename, 'wb') as file_:
+            np.savez(file_, **backend._state())
+
+    def load_index(backend, filename, pts):
+        with open(filename, 'rb') as file_:
+            state = dict(np.load(file_).items())
+        if len(state['codes']) != len(pts):
+            raise IOError('pq index does not match the data')
+        backend._data = pts
+        backend._set_state(state)
+
+    def nbytes(backend):
+        """Memory held by the codes and codebooks (not the indexed data)"""
+        if backend._removed is None:
+            return 0
+        return sum(arr.nbytes for arr in backend._state().values())
+
+    def _num_candidates(backend, K):
+        return K * backend.rerank if backend.rerank else K
+
+    def _search_chunk(backend, qpts, K):
+        Kc = min(backend._num_candidates(K), len(backend._codes))
+        tables = _adc_tables(backend._centroids, qpts)
+        cand_idxs, cand_dists = _adc_search(
+            tables, backend._codes, backend._removed, np.arange(len(backend._codes)), Kc
+        )
+        return backend._finish(qpts, cand_idxs, cand_dists, K)
+
+    def _finish(backend, qpts, cand_idxs, cand_dists, K):
+        if backend.rerank:
+            return _rerank_exact(
+                backend._data, backend._removed, qpts, cand_idxs, K, cand_dists
+            )
+        sortx = np.lexsort((cand_idxs, cand_dists), axis=1)[:, 0:K]
+        idxs = np.take_along_axis(cand_idxs, sortx, axis=1)
+        dists = np.take_along_axis(cand_dists, sortx, axis=1)
+        return idxs, dists
+
+
+class IVFPQBackend(PQBackend):
+    """
+    Product quantization with an inverted file.
+
+    The vectors are assigned to ``pq_nlist`` coarse k-means clusters and the
+    residuals to their cluster center are product quantized. A query only
+    searches its ``pq_nprobe`` closest clusters (more if they hold fewer
+    than the number of needed candidates).
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_backends import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> centers = rng.randint(0, 255, size=(50, 16))
+        >>> data = centers.repeat(40, axis=0) + rng.randint(-4, 5, size=(2000, 16))
+        >>> data = data.clip(0, 255).astype(np.uint8)
+        >>> qvecs = data[::100]
+        >>> backend = IVFPQBackend(pq_nprobe=2)
+        >>> backend.build_index(data, pq_m=4, pq_nlist=16, random_seed=0)
+        >>> idxs, dists = backend.nn_index(qvecs, 4)
+        >>> assert np.all(idxs[:, 0] == np.arange(0, 2000, 100))
+        >>> assert np.all(dists[:, 0] == 0)
+        >>> # Removed points are never returned
+        >>> backend.remove_points(idxs[:, 0])
+        >>> idxs2, dists2 = backend.nn_index(qvecs, 4)
+        >>> assert not np.any(np.isin(idxs2, idxs[:, 0]))
+        >>> # The per cluster counts follow the removals
+        >>> backend.remove_points(idxs[:, 0:2].ravel())
+        >>> assert backend._list_num_valid.sum() == 2000 - 40
+    """
+
+    name = 'ivfpq'
+    ext = '.ivfpq'
+
+    def __init__(backend, **kwargs):
+        super(IVFPQBackend, backend).__init__(**kwargs)
+        backend.nprobe = kwargs.get('pq_nprobe', 8)
+        backend._coarse = None  # (nlist x D) coarse centers
+        backend._list_ids = None  # (N,) coarse cluster of each vector
+        # Derived from _list_ids, computed once per build / load / add
+        backend._list_order = None  # vectors grouped by coarse cluster
+        backend._list_bounds = None  # (nlist + 1,) group starts in _list_order
+        backend._list_num_valid = None  # (nlist,) unremoved vectors per cluster
+
+    def build_index(backend, pts, **kwargs):
+        super(IVFPQBackend, backend).build_index(pts, **kwargs)
+        backend._index_lists()
+
+    def add_points(backend, pts, rebuild_threshold=None):
+        super(IVFPQBackend, backend).add_points(pts, rebuild_threshold)
+        backend._index_lists()
+
+    def remove_points(backend, idxs):
+        idxs = np.unique(idxs)
+        idxs = idxs[~backend._removed[idxs]]
+        super(IVFPQBackend, backend).remove_points(idxs)
+        backend._list_num_valid -= np.bincount(
+            backend._list_ids[idxs], minlength=len(backend._coarse)
+        )
+
+    def _index_lists(backend):
+        nlist = len(backend._coarse)
+        backend._list_order = np.argsort(backend._list_ids, kind='stable')
+        backend._list_bounds = np.searchsorted(
+            backend._list_ids[backend._list_order], np.arange(nlist + 1)
+        )
+        backend._list_num_valid = np.bincount(
+            backend._list_ids[~backend._removed], minlength=nlist
+        )
+
+    def _train(backend, sample, params, rng):
+        nlist = params.get('pq_nlist', 256)
+        iters = params.get('pq_iters', 20)
+        backend._coarse = _kmeans(sample.astype(np.float32), nlist, iters, rng)
+        residuals = sample - backend._coarse[_assign(sample, backend._coarse)]
+        backend._centroids = _train_codebooks(residuals, backend.m, iters, rng)
+
+    def _encode(backend, pts):
+        list_ids = _assign(pts, backend._coarse)
+        residuals = pts - backend._coarse[list_ids]
+        return {
+            'codes': _encode_pq(backend._centroids, residuals),
+            'list_ids': list_ids,
+        }
+
+    def _state(backend):
+        state = super(IVFPQBackend, backend)._state()
+        state['coarse'] = backend._coarse
+        state['list_ids'] = backend._list_ids
+        return state
+
+    def _set_state(backend, state):
+        super(IVFPQBackend, backend)._set_state(state)
+        backend._coarse = state['coarse']
+        backend._list_ids = state['list_ids']
+        backend._index_lists()
+
+    def _search_chunk(backend, qpts, K):
+        num_queries = len(qpts)
+        Kc = min(backend._num_candidates(K), len(backend._codes))
+        nlist = len(backend._coarse)
+        order = backend._list_order
+        bounds = backend._list_bounds
+        num_valid = backend._list_num_valid
+        # Clusters in the order each query visits them
+        coarse_dists = _sqrd_dists(qpts, backend._coarse)
+        probe_order = np.argsort(coarse_dists, axis=1, kind='stable')
+        cand_idxs = np.zeros((num_queries, Kc), dtype=np.int64)
+        cand_dists = np.full((num_queries, Kc), np.inf, dtype=np.float32)
+        num_found = np.zeros(num_queries, dtype=np.int64)
+        for rank in range(nlist):
+            active = num_found < Kc if rank >= backend.nprobe else None
+            if active is not None and not np.any(active):
+                break
+            qxs = np.arange(num_queries) if active is None else np.nonzero(active)[0]
+            list_of_qx = probe_order[qxs, rank]
+            unique_lists, groupxs = _group_indices(list_of_qx)
+            for listx, groupx in zip(unique_lists, groupxs):
+                members = order[bounds[listx] : bounds[listx + 1]]
+                if len(members) == 0:
+                    continue
+                qxs_ = qxs[groupx]
+                residuals = qpts[qxs_] - backend._coarse[listx]
+                tables = _adc_tables(backend._centroids, residuals)
+                idxs_, dists_ = _adc_search(
+                    tables,
+                    backend._codes[members],
+                    backend._removed[members],
+                    members,
+                    min(Kc, len(members)),
+                )
+                idxs_ = np.hstack([cand_idxs[qxs_], idxs_])
+                dists_ = np.hstack([cand_dists[qxs_], dists_])
+                part = np.argpartition(dists_, Kc - 1, axis=1)[:, 0:Kc]
+                cand_idxs[qxs_] = np.take_along_axis(idxs_, part, axis=1)
+                cand_dists[qxs_] = np.take_along_axis(dists_, part, axis=1)
+                num_found[qxs_] += num_valid[listx]
+        return backend._finish(qpts, cand_idxs, cand_dists, K)
+
+
+def _rerank_exact(data, removed, qpts, cand_idxs, K, cand_dists=None):
+    """
+    Recomputes the squared distances to the candidates exactly and returns
+    the K closest, ties broken by index. Candidates with an infinite
+    approximate distance (unfilled slots) stay infinite.
+    """
+    diff = data[cand_idxs.ravel()].reshape(cand_idxs.shape + (-1,))
+    diff = diff.astype(np.float64) - qpts[:, None, :]
+    exact_dists = (diff ** 2).sum(axis=2)
+    exact_dists[removed[cand_idxs]] = np.inf
+    if cand_dists is not None:
+        exact_dists[np.isinf(cand_dists)] = np.inf
+    sortx = np.lexsort((cand_idxs, exact_dists), axis=1)[:, 0:K]
+    idxs = np.take_along_axis(cand_idxs, sortx, axis=1)
+    dists = np.take_along_axis(exact_dists, sortx, axis=1)
+    return idxs, dists
+
+
+def _sqrd_norms(pts):
+    pts_ = np.asarray(pts, dtype=np.float32)
+    return (pts_ ** 2).sum(axis=1)
+
+
+def _sqrd_dists(pts, centers):
+    pts_ = np.asarray(pts, dtype=np.float32)
+    dists = _sqrd_norms(pts_)[:, None] - 2 * pts_.dot(centers.T)
+    dists += _sqrd_norms(centers)[None, :]
+    return np.maximum(dists, 0)
+
+
+def _assign(pts, centers, chunksize=65536):
+    """Index of the nearest center of each point"""
+    labels = np.empty(len(pts), dtype=np.int64)
+    center_norms = _sqrd_norms(centers)
+    for sl_ in ut.ichunk_slices(len(pts), chunksize):
+        block = np.asarray(pts[sl_], dtype=np.float32)
+        labels[sl_] = (center_norms - 2 * block.dot(centers.T)).argmin(axis=1)
+    return labels
+
+
+def _sample_rows(pts, num, rng):
+    if len(pts) <= num:
+        return np.asarray(pts, dtype=np.float32)
+    rowxs = np.sort(rng.choice(len(pts), num, replace=False))
+    return np.asarray(pts[rowxs], dtype=np.float32)
+
+
+def _kmeans(data, k, iters, rng):
+    """
+    Lloyd's k-means. Returns (k x D) float32 centers. Empty clusters keep
+    their previous center.
+    """
+    k = min(k, len(data))
+    centers = data[rng.choice(len(data), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        labels = _assign(data, centers)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, data)
+        nonempty = counts > 0
+        new_centers = centers.copy()
+        new_centers[nonempty] = sums[nonempty] / counts[nonempty, None]
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    return centers
+
+
+def _train_codebooks(sample, m, iters, rng):
+    """Trains a 256 center codebook for each of the m sub-vectors"""
+    dsub = sample.shape[1] // m
+    centroids = np.zeros((m, 256, dsub), dtype=np.float32)
+    for j in range(m):
+        sub = sample[:, j * dsub : (j + 1) * dsub]
+        centers = _kmeans(sub, 256, iters, rng)
+        centroids[j, 0 : len(centers)] = centers
+        # Unused codes (tiny samples) can never be the nearest centroid
+        centroids[j, len(centers) :] = np.inf
+    return centroids
+
+
+def _encode_pq(centroids, pts):
+    m, _, dsub = centroids.shape
+    codes = np.empty((len(pts), m), dtype=np.uint8)
+    for j in range(m):
+        sub = pts[:, j * dsub : (j + 1) * dsub]
+        codes[:, j] = _assign(sub, _finite(centroids[j]))
+    return codes
+
+
+def _finite(centers):
+    return centers[np.isfinite(centers[:, 0])]
+
+
+def _adc_tables(centroids, qpts):
+    """(N x m x 256) squared distances from query sub-vectors to centroids"""
+    m, ksub, dsub = centroids.shape
+    qsub = np.asarray(qpts, dtype=np.float32).reshape(len(qpts), m, dsub)
+    finite = np.where(np.isfinite(centroids), centroids, 0)
+    tables = (qsub ** 2).sum(axis=2)[:, :, None]
+    tables = tables - 2 * np.einsum('nmd,mkd->nmk', qsub, finite)
+    tables += (finite ** 2).sum(axis=2)[None, :, :]
+    return np.maximum(tables, 0)
+
+
+def _adc_search(tables, codes, removed, idxs, Kc):
+    """
+    Returns the Kc best (idxs, ADC distances) of each query over the given
+    codes, searched in blocks to bound memory.
+    """
+    num_queries, m, _ = tables.shape
+    cand_idxs = np.empty((num_queries, 0), dtype=np.int64)
+    cand_dists = np.empty((num_queries, 0), dtype=np.float32)
+    for sl_ in ut.ichunk_slices(len(codes), BRUTE_DATA_CHUNKSIZE):
+        block_codes = codes[sl_]
+        block_dists = np.zeros((num_queries, len(block_codes)), dtype=np.float32)
+        for j in range(m):
+            block_dists += tables[:, j, :][:, block_codes[:, j]]
+        block_dists[:, removed[sl_]] = np.inf
+        block_idxs = np.broadcast_to(idxs[sl_], block_dists.shape)
+        cand_idxs = np.hstack([cand_idxs, block_idxs])
+        cand_dists = np.hstack([cand_dists, block_dists])
+        if cand_dists.shape[1] > Kc:
+            part = np.argpartition(cand_dists, Kc - 1, axis=1)[:, 0:Kc]
+            cand_idxs = np.take_along_axis(cand_idxs, part, axis=1)
+            cand_dists = np.take_along_axis(cand_dists, part, axis=1)
+    return cand_idxs, cand_dists
+
+
+def _group_indices(labels):
+    sortx = np.argsort(labels, kind='stable')
+    unique_labels, starts = np.unique(labels[sortx], return_index=True)
+    return unique_labels, np.split(sortx, starts[1:])
+
+
+BACKENDS = {
+    FlannBackend.name: FlannBackend,
+    BruteForceBackend.name: BruteForceBackend,
+    PQBackend.name: PQBackend,
+    IVFPQBackend.name: IVFPQBackend,
+}
+
+
+def new_backend(name='flann', **kwargs):
+    """
+    Returns an empty search engine
+
+    Args:
+        name (str): one of the keys of ``BACKENDS``
+        **kwargs: search params of the backend (e.g. cores, pq_rerank,
+            pq_nprobe). Build params are given to ``build_index``.
+    """
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            'Unknown neighbor backend=%r. Valid backends are %r'
+            % (name, sorted(BACKENDS.keys()))
+        )
+    return backend_cls(**kwargs)
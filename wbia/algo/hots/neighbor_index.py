@@ -14,9 +14,12 @@ from vtool._pyflann_backend import pyflann as pyflann
 
 # import itertools as it
 import lockfile
-from os.path import basename
+import os
+from os.path import basename, exists, join
 from wbia.algo.hots import hstypes
+from wbia.algo.hots import neighbor_backends
 from wbia.algo.hots import _pipeline_helpers as plh  # NOQA
+from wbia.dtool.shard_store import stack_arrays
 
 (print, rrr, profile) = ut.inject2(__name__)
 logger = logging.getLogger('wbia')
@@ -25,6 +28,10 @@ USE_HOTSPOTTER_CACHE = not ut.get_argflag('--nocache-hs')
 NOSAVE_FLANN = ut.get_argflag('--nosave-flann')
 NOCACHE_FLANN = ut.get_argflag('--nocache-flann') and USE_HOTSPOTTER_CACHE
 
+#: Support arrays written by NeighborIndex.save_support. ax2_aid is written
+#: last and marks a complete write.
+SUPPORT_KEYS = ['idx2_vec', 'idx2_fgw', 'idx2_ax', 'idx2_fx', 'ax2_aid']
+
 
 def get_support_data(qreq_, daid_list):
     """
@@ -168,11 +175,13 @@ def invert_index(vecs_list, fgws_list, ax_list, fxs_list, verbose=ut.NOT_QUIET):
         nFeats = sum(nFeat_list)
         idx2_ax = np.fromiter(ut.iflatten(axs_list), np.int32, nFeats)
         idx2_fx = np.fromiter(ut.iflatten(fxs_list), np.int32, nFeats)
-        idx2_vec = np.vstack(vecs_list)
+        # Descriptors read in order from memory-mapped shards are stacked
+        # without copying
+        idx2_vec = stack_arrays(vecs_list)
         if fgws_list is None:
             idx2_fgw = None
         else:
-            idx2_fgw = np.hstack(fgws_list)
+            idx2_fgw = stack_arrays(fgws_list)
             try:
                 assert len(idx2_fgw) == len(
                     idx2_vec
@@ -202,7 +211,8 @@ def invert_index(vecs_list, fgws_list, ax_list, fxs_list, verbose=ut.NOT_QUIET):
 @ut.reloadable_class
 class NeighborIndex(object):
     r"""
-    wrapper class around flann
+    wrapper class around flann (or another search backend, see
+    neighbor_backends, selected by the 'backend' key of flann_params)
     stores flann index and data it needs to index into
 
     Example:
@@ -231,6 +241,8 @@ class NeighborIndex(object):
             # Make flann determenistic for the same data
             flann_params['random_seed'] = 42
         nnindexer.flann_params = flann_params
+        nnindexer.backend = flann_params.get('backend', 'flann')
+        nnindexer.ext = neighbor_backends.BACKENDS[nnindexer.backend].ext
 
         # nprocs = ut.util_parallel.__NUM_PROCS__
         # if nprocs is None:
@@ -253,6 +265,8 @@ class NeighborIndex(object):
         assert indexer.flann is None, 'already initalized'
 
         logger.info('[nnindex] Preparing data for indexing / loading index')
+        # NOTE: vecs_list may hold read-only memmap views (see
+        # dtool.shard_store), invert_index avoids copying them when possible
         # Check input
         assert len(aid_list) == len(vecs_list), 'invalid input. bad len'
         assert len(aid_list) > 0, (
@@ -266,8 +280,13 @@ class NeighborIndex(object):
         idx2_vec, idx2_fgw, idx2_ax, idx2_fx = tup
 
         ax2_aid = np.array(aid_list)
+        indexer._set_support(ax2_aid, idx2_vec, idx2_fgw, idx2_ax, idx2_fx)
 
-        indexer.flann = pyflann.FLANN()  # Approximate search structure
+    def _set_support(indexer, ax2_aid, idx2_vec, idx2_fgw, idx2_ax, idx2_fx):
+        # Approximate search structure
+        indexer.flann = neighbor_backends.new_backend(
+            indexer.backend, **indexer.get_backend_params()
+        )
         indexer.ax2_aid = ax2_aid  # (A x 1) Mapping to original annot ids
         indexer.idx2_vec = idx2_vec  # (M x D) Descriptors to index
         indexer.idx2_fgw = idx2_fgw  # (M x 1) Descriptor forground weight
@@ -285,6 +304,10 @@ class NeighborIndex(object):
             # changed')
             indexer.max_distance_sqrd = None
 
+    def get_backend_params(nnindexer):
+        """flann_params without the backend name"""
+        return ut.delete_dict_keys(nnindexer.flann_params.copy(), ['backend'])
+
     def add_wbia_support(nnindexer, qreq_, new_daid_list, verbose=ut.NOT_QUIET):
         r"""
         # TODO: ensure that the memcache changes appropriately
@@ -385,6 +408,13 @@ class NeighborIndex(object):
         # FIXME:
         # nnindexer.ax2_aid
         if True:
+            # Support data may be a read-only view of the depcache
+            if not nnindexer.idx2_vec.flags.writeable:
+                nnindexer.idx2_vec = nnindexer.idx2_vec.copy()
+            if nnindexer.idx2_fgw is not None and not nnindexer.idx2_fgw.flags.writeable:
+                nnindexer.idx2_fgw = nnindexer.idx2_fgw.copy()
+            if not nnindexer.idx2_fx.flags.writeable:
+                nnindexer.idx2_fx = nnindexer.idx2_fx.copy()
             nnindexer.ax2_aid[remove_ax_list] = -1
             nnindexer.idx2_fx[remove_idx_list] = -1
             nnindexer.idx2_vec[remove_idx_list] = 0
@@ -544,7 +574,7 @@ class NeighborIndex(object):
             )
             tt = ut.tic(msg='Building index')
         idx2_vec = nnindexer.idx2_vec
-        flann_params = nnindexer.flann_params
+        flann_params = nnindexer.get_backend_params()
         if num_vecs == 0:
             logger.info(
                 'WARNING: CANNOT BUILD FLANN INDEX OVER 0 POINTS. THIS MAY BE A SIGN OF A DEEPER ISSUE'
@@ -604,6 +634,73 @@ class NeighborIndex(object):
                     load_success = True
         return load_success
 
+    def save_support(nnindexer, dpath, verbose=True):
+        r"""
+        Writes the support data (the inverted index arrays) to dpath as npy
+        files, see :func:`load_support`
+        """
+        if NOSAVE_FLANN:
+            return False
+        if ut.VERYVERBOSE or verbose:
+            logger.info('[nnindex] save_support(%r)' % ut.path_ndir_split(dpath, n=5))
+        ut.ensuredir(dpath)
+        with lockfile.LockFile(dpath):
+            for key in SUPPORT_KEYS:
+                arr = getattr(nnindexer, key)
+                if arr is None:
+                    continue
+                fpath = join(dpath, key + '.npy')
+                # Write to a temporary file so readers never map a partial file
+                np.save(fpath + '.tmp.npy', np.ascontiguousarray(arr))
+                os.replace(fpath + '.tmp.npy', fpath)
+        return True
+
+    def load_support(nnindexer, dpath, verbose=True):
+        r"""
+        Loads support data written by :func:`save_support`.
+
+        The M x 1 and M x D arrays are memory mapped (read-only) instead of
+        read, so every process that loads the same support data shares one
+        physical copy of it in the page cache. Arrays that are modified by
+        :func:`remove_support` are copied on demand.
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.algo.hots.neighbor_index import *  # NOQA
+            >>> rng = np.random.RandomState(0)
+            >>> vecs_list = [rng.randint(0, 255, (n, 8)).astype(np.uint8) for n in [3, 5]]
+            >>> fxs_list = [np.arange(len(vecs)) for vecs in vecs_list]
+            >>> nnindexer1 = NeighborIndex({'backend': 'brute'}, 'test')
+            >>> nnindexer1.init_support([1, 2], vecs_list, None, fxs_list, verbose=False)
+            >>> dpath = ut.ensure_app_resource_dir('wbia', 'testfiles', 'nnsupport')
+            >>> nnindexer1.save_support(dpath, verbose=False)
+            >>> nnindexer2 = NeighborIndex({'backend': 'brute'}, 'test')
+            >>> assert nnindexer2.load_support(dpath, verbose=False)
+            >>> assert isinstance(nnindexer2.idx2_vec, np.memmap)
+            >>> assert np.all(nnindexer2.idx2_vec == nnindexer1.idx2_vec)
+            >>> assert np.all(nnindexer2.idx2_ax == nnindexer1.idx2_ax)
+            >>> assert nnindexer2.idx2_fgw is None
+            >>> usage = nnindexer2.get_memory_usage()
+            >>> keys = ['idx2_vec', 'idx2_ax', 'idx2_fx']
+            >>> assert usage['mapped'] == sum(getattr(nnindexer1, k).nbytes for k in keys)
+            >>> assert usage['private'] == nnindexer1.ax2_aid.nbytes
+            >>> ut.delete(dpath)
+        """
+        fpaths = {key: join(dpath, key + '.npy') for key in SUPPORT_KEYS}
+        if not exists(fpaths['ax2_aid']):
+            return False
+        if ut.VERYVERBOSE or verbose:
+            logger.info('[nnindex] load_support(%r)' % ut.path_ndir_split(dpath, n=5))
+        with lockfile.LockFile(dpath):
+            support = {
+                key: np.load(fpath, mmap_mode='r') if exists(fpath) else None
+                for key, fpath in fpaths.items()
+            }
+        # The annot mapping is small and modified in place
+        support['ax2_aid'] = np.array(support['ax2_aid'])
+        nnindexer._set_support(**support)
+        return True
+
     def get_prefix(nnindexer):
         return nnindexer.prefix1
 
@@ -658,6 +755,22 @@ class NeighborIndex(object):
             # flann_valsig_ = str(list(flann_params.values()))
             # flann_valsig = ut.remove_chars(flann_valsig_, ', \'[]')
             flann_cfgstr_list.append('_FLANN(' + flann_valsig_ + ')')
+            if nnindexer.backend != 'flann':
+                # Product quantization params (pq_nprobe and pq_rerank are
+                # search params like checks)
+                pq_params = ut.odict(
+                    [
+                        (key, val)
+                        for key, val in sorted(nnindexer.flann_params.items())
+                        if key.startswith('pq_')
+                        and not (noquery and key in {'pq_nprobe', 'pq_rerank'})
+                    ]
+                )
+                backend_sig = ','.join(
+                    [nnindexer.backend]
+                    + ['%s=%s' % (key[3:], val) for key, val in pq_params.items()]
+                )
+                flann_cfgstr_list.append('_BACKEND(%s)' % (backend_sig,))
         if use_data_hash:
             vecs_hashstr = ut.hashstr_arr(nnindexer.idx2_vec, '_VECS')
             flann_cfgstr_list.append(vecs_hashstr)
@@ -680,6 +793,32 @@ class NeighborIndex(object):
     def get_dtype(nnindexer):
         return nnindexer.idx2_vec.dtype
 
+    def get_memory_usage(nnindexer):
+        r"""
+        Returns the number of bytes held by the indexer.
+
+        ``mapped`` bytes are memory mapped support data, which is shared with
+        every other process that mapped the same files, ``private`` bytes are
+        the rest of the support data and ``index`` is the search structure.
+        """
+        usage = ut.odict([('private', 0), ('mapped', 0), ('index', 0)])
+        for key in SUPPORT_KEYS:
+            arr = getattr(nnindexer, key, None)
+            if arr is None:
+                continue
+            if isinstance(_root_array(arr), np.memmap):
+                usage['mapped'] += arr.nbytes
+            else:
+                usage['private'] += arr.nbytes
+        if nnindexer.flann is not None and hasattr(nnindexer.flann, 'nbytes'):
+            usage['index'] = nnindexer.flann.nbytes()
+        return usage
+
+    def nbytes(nnindexer):
+        """Bytes of process memory used by the indexer (excludes mapped data)"""
+        usage = nnindexer.get_memory_usage()
+        return usage['private'] + usage['index']
+
     @profile
     def knn(indexer, qfx2_vec, K):
         r"""
@@ -877,6 +1016,170 @@ class NeighborIndex(object):
             idxs[sl_], dists[sl_] = indexer.knn(vecs[sl_], K=K)
         return idxs, dists
 
+    @profile
+    def multi_knn(indexer, qvecs_list, K_list):
+        """
+        Works like calling `indexer.knn` on each item of `qvecs_list`, but the
+        vectors of all queries with the same K are stacked and searched with a
+        single call. The (approximate) results of the search backend depend
+        on K, so queries with different K are searched in separate batches to
+        get the same results as knn.
+
+        Args:
+            qvecs_list (list): the (N_i x D) query vectors of each annotation
+            K_list (list): number of neighbors to return for each annotation
+
+        Returns:
+            list: a (qfx2_idx, qfx2_dist) tuple for each annotation
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.algo.hots.neighbor_index import *  # NOQA
+            >>> indexer, qreq_, ibs = testdata_nnindexer()
+            >>> qvecs_list = qreq_.internal_qannots.vecs[0:3]
+            >>> K_list = [2, 4, 3][0:len(qvecs_list)]
+            >>> idx_dist_list = indexer.multi_knn(qvecs_list, K_list)
+            >>> for qfx2_vec, K, (qfx2_idx, qfx2_dist) in zip(qvecs_list, K_list, idx_dist_list):
+            >>>     assert qfx2_idx.shape == (len(qfx2_vec), K)
+            >>>     assert np.all(np.diff(qfx2_dist, axis=1) >= 0)
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> # Mixed K with the (approximate) flann backend
+            >>> from wbia.algo.hots.neighbor_index import *  # NOQA
+            >>> rng = np.random.RandomState(0)
+            >>> vecs_list = [rng.randint(0, 255, (200, 32)).astype(np.uint8) for _ in range(5)]
+            >>> fxs_list = [np.arange(len(vecs)) for vecs in vecs_list]
+            >>> flann_params = {'algorithm': 'kdtree', 'trees': 2, 'random_seed': 42}
+            >>> indexer = NeighborIndex(flann_params, None)
+            >>> indexer.init_support([1, 2, 3, 4, 5], vecs_list, None, fxs_list, verbose=False)
+            >>> indexer.checks = 4
+            >>> indexer.reindex(verbose=False)
+            >>> qvecs_list = [rng.randint(0, 255, (n, 32)).astype(np.uint8) for n in [20, 0, 30, 10]]
+            >>> K_list = [1, 4, 7, 4]
+            >>> # Truncating the results of the largest K gives other neighbors
+            >>> qfx2_idx7 = indexer.knn(qvecs_list[3], 7)[0]
+            >>> assert np.any(qfx2_idx7[:, 0:4] != indexer.knn(qvecs_list[3], 4)[0])
+            >>> idx_dist_list = indexer.multi_knn(qvecs_list, K_list)
+            >>> for qfx2_vec, K, (qfx2_idx, qfx2_dist) in zip(qvecs_list, K_list, idx_dist_list):
+            >>>     (qfx2_idx1, qfx2_dist1) = indexer.knn(qfx2_vec, K)
+            >>>     assert qfx2_idx.shape == qfx2_idx1.shape
+            >>>     assert np.all(qfx2_idx == qfx2_idx1)
+            >>>     assert np.all(qfx2_dist == qfx2_dist1)
+        """
+        idx_dist_list = [None] * len(qvecs_list)
+        # Queries are only batched with queries of the same K
+        K2_qxs = ut.group_items(range(len(qvecs_list)), K_list)
+        for K, qxs in sorted(K2_qxs.items()):
+            qvecs_list_ = ut.take(qvecs_list, qxs)
+            if K == 0 or K > indexer.num_indexed:
+                # Keep the corner case behavior of knn
+                results = [indexer.knn(qfx2_vec, K) for qfx2_vec in qvecs_list_]
+            else:
+                qfx2_vec, offset_list = stack_query_vecs(qvecs_list_)
+                (qfx2_idx, qfx2_dist) = indexer.knn(qfx2_vec, K)
+                results = split_query_results(qfx2_idx, qfx2_dist, offset_list)
+            for qx, result in zip(qxs, results):
+                idx_dist_list[qx] = result
+        return idx_dist_list
+
+    @profile
+    def multi_requery_knn(
+        indexer, qvecs_list, K, pad_list, impossible_aids_list, recover=True
+    ):
+        """
+        Works like calling `indexer.requery_knn` on each item of `qvecs_list`,
+        but the vectors of all queries are stacked and searched (and
+        requeried) together. Each row is only checked against the impossible
+        aids of its own annotation. Queries with different pads are searched
+        in separate batches, so the results are the same as requery_knn's.
+
+        CommandLine:
+            python -m wbia.algo.hots.neighbor_index multi_requery_knn
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.algo.hots.neighbor_index import *  # NOQA
+            >>> import wbia
+            >>> qreq_ = wbia.testdata_qreq_(defaultdb='testdb1', a='default')
+            >>> qreq_.load_indexer()
+            >>> indexer = qreq_.indexer
+            >>> qannots = qreq_.internal_qannots[0:3]
+            >>> qvecs_list = qannots.vecs
+            >>> impossible_aids_list = [
+            >>>     qreq_.ibs.get_annot_groundtruth(qaid, noself=False)
+            >>>     for qaid in qannots.aid]
+            >>> K, pad_list = 3, [1, 0, 1]
+            >>> idx_dist_list = indexer.multi_requery_knn(
+            >>>     qvecs_list, K, pad_list, impossible_aids_list)
+            >>> for (qfx2_idx, qfx2_dist), impossible_aids in zip(idx_dist_list, impossible_aids_list):
+            >>>     assert np.all(np.diff(qfx2_dist, axis=1) >= 0)
+            >>>     assert not np.any(np.isin(indexer.get_nn_aids(qfx2_idx), impossible_aids))
+            >>> # Same results as requerying each annotation with its own pad
+            >>> for qfx2_vec, pad, impossible_aids, (qfx2_idx, qfx2_dist) in zip(
+            >>>         qvecs_list, pad_list, impossible_aids_list, idx_dist_list):
+            >>>     qfx2_idx1, qfx2_dist1 = indexer.requery_knn(
+            >>>         qfx2_vec, K, pad, impossible_aids)
+            >>>     assert np.all(qfx2_idx1 == qfx2_idx)
+            >>>     assert np.allclose(qfx2_dist1, qfx2_dist)
+        """
+        from wbia.algo.hots import requery_knn
+
+        if K == 0 or K > indexer.num_indexed or len(qvecs_list) == 0:
+            # Keep the corner case behavior of requery_knn
+            return [
+                indexer.requery_knn(qfx2_vec, K, pad, impossible_aids, recover=recover)
+                for qfx2_vec, pad, impossible_aids in zip(
+                    qvecs_list, pad_list, impossible_aids_list
+                )
+            ]
+
+        def get_neighbors(vecs, temp_K):
+            return indexer.flann.nn_index(
+                vecs, temp_K, checks=indexer.checks, cores=indexer.cores
+            )
+
+        results = [None] * len(qvecs_list)
+        # Queries are only batched with queries of the same pad
+        pad2_qxs = ut.group_items(range(len(qvecs_list)), pad_list)
+        for pad, qxs in sorted(pad2_qxs.items()):
+            qfx2_vec, offset_list = stack_query_vecs(ut.take(qvecs_list, qxs))
+            qfx2_owner = np.repeat(np.arange(len(qxs)), np.diff(offset_list))
+            invalid_axs_list = [
+                np.array(ut.take(indexer.aid2_ax, impossible_aids), dtype=np.int64)
+                for impossible_aids in ut.take(impossible_aids_list, qxs)
+            ]
+            if len(qfx2_vec) == 0:
+                (qfx2_idx, qfx2_dist) = indexer.empty_neighbors(0, K)
+            else:
+                try:
+                    (qfx2_idx, qfx2_raw_dist) = requery_knn.requery_knn_batched(
+                        get_neighbors,
+                        indexer.get_nn_axs,
+                        qfx2_vec,
+                        qfx2_owner,
+                        num_neighbs=K,
+                        invalid_axs_list=invalid_axs_list,
+                        pad=pad,
+                        limit=3,
+                        recover=recover,
+                    )
+                except pyflann.FLANNException as ex:
+                    ut.printex(
+                        ex,
+                        'probably misread the cached flann_fpath=%r'
+                        % (indexer.flann_fpath,),
+                    )
+                    raise
+                if indexer.max_distance_sqrd is not None:
+                    qfx2_dist = np.divide(qfx2_raw_dist, indexer.max_distance_sqrd)
+                else:
+                    qfx2_dist = qfx2_raw_dist
+            group_results = split_query_results(qfx2_idx, qfx2_dist, offset_list)
+            for qx, result in zip(qxs, group_results):
+                results[qx] = result
+        return results
+
     def debug_nnindexer(nnindexer):
         r"""
         Makes sure the indexer has valid SIFT descriptors
@@ -1024,10 +1327,55 @@ class NeighborIndex(object):
         return qfx2_nid
 
 
+def _root_array(arr):
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+    return arr
+
+
 def in1d_shape(arr1, arr2):
     return np.in1d(arr1, arr2).reshape(arr1.shape)
 
 
+def stack_query_vecs(qvecs_list):
+    """
+    Stacks the query vectors of several annotations
+
+    Returns:
+        tuple: (qfx2_vec, offset_list) where the vectors of the i-th
+            annotation are ``qfx2_vec[offset_list[i]:offset_list[i + 1]]``
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_index import *  # NOQA
+        >>> qvecs_list = [np.ones((2, 3)), np.empty((0, 3)), 2 * np.ones((1, 3))]
+        >>> qfx2_vec, offset_list = stack_query_vecs(qvecs_list)
+        >>> print(qfx2_vec.shape, offset_list)
+        (3, 3) [0 2 2 3]
+    """
+    offset_list = np.cumsum([0] + [len(qvecs) for qvecs in qvecs_list])
+    if offset_list[-1] == 0:
+        dim = qvecs_list[0].shape[1] if len(qvecs_list) else 0
+        dtype = qvecs_list[0].dtype if len(qvecs_list) else hstypes.VEC_TYPE
+        qfx2_vec = np.empty((0, dim), dtype=dtype)
+    else:
+        qfx2_vec = stack_arrays(qvecs_list)
+    return qfx2_vec, offset_list
+
+
+def split_query_results(qfx2_idx, qfx2_dist, offset_list):
+    """
+    Inverse of :func:`stack_query_vecs` for the neighbors of the stacked
+    vectors
+    """
+    idx_dist_list = []
+    for start, stop in zip(offset_list[:-1], offset_list[1:]):
+        qfx2_idx_ = np.ascontiguousarray(qfx2_idx[start:stop])
+        qfx2_dist_ = np.ascontiguousarray(qfx2_dist[start:stop])
+        idx_dist_list.append((qfx2_idx_, qfx2_dist_))
+    return idx_dist_list
+
+
 class NeighborIndex2(NeighborIndex, ut.NiceRepr):
     def __init__(nnindexer, flann_params=None, cfgstr=None):
         super(NeighborIndex2, nnindexer).__init__(flann_params, cfgstr)
@@ -1059,7 +1407,7 @@ class NeighborIndex2(NeighborIndex, ut.NiceRepr):
     def on_save(nnindexer, depc, fpath):
         # logger.info('NNINDEX ON SAVE')
         # Save FLANN as well
-        flann_fpath = ut.augpath(fpath, '_flann', newext='.flann')
+        flann_fpath = ut.augpath(fpath, '_flann', newext=nnindexer.ext)
         nnindexer.save(fpath=flann_fpath)
 
     def __getstate__(self):
@@ -1085,6 +1433,9 @@ class NeighborIndex2(NeighborIndex, ut.NiceRepr):
         return state
 
     def __setstate__(self, state_dict):
+        # Indexers pickled before backends were added always used flann
+        state_dict.setdefault('backend', 'flann')
+        state_dict.setdefault('ext', NeighborIndex.ext)
         self.__dict__.update(state_dict)
         # return {}
 
@@ -1105,6 +1456,290 @@ class NeighborIndex2(NeighborIndex, ut.NiceRepr):
     #     return conditional_knn_(nnindexer, qfx2_vec, num_neighbors, invalid_axs)
 
 
+class DeltaNeighborIndex(NeighborIndex):
+    r"""
+    Neighbor index that follows changes to the database annotations without
+    rebuilding its base index.
+
+    Annotations added after the base index was built go to an append log, a
+    small exact (brute force) index that is searched together with the base.
+    Annotations that are no longer requested are tombstoned. Their ax2_aid is
+    -1, so they are returned by get_removed_idxs and filtered out at query
+    time. Their support stays in place and comes back if they are requested
+    again. Instances are not modified after construction. Use
+    :func:`updated` to get the index of a new annotation set.
+
+    The vectors of the base and of the log are not stacked, because the base
+    vectors may be memory mapped (see load_support), so ``idx2_vec`` is None
+    and :func:`get_nn_vecs` looks up both.
+
+    Args:
+        base (NeighborIndex): index built over (a superset of) the annots
+        daid_list (list): annotations that are searched
+        log_support (tuple): (aids, vecs_list, fgws_list, fxs_list) of the
+            annotations appended to the base
+
+    CommandLine:
+        python -m wbia.algo.hots.neighbor_index DeltaNeighborIndex
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_index import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> aid_to_support = {
+        >>>     aid: (rng.randint(0, 255, (10 + aid, 32)).astype(np.uint8),
+        >>>           rng.rand(10 + aid), np.arange(10 + aid))
+        >>>     for aid in range(1, 9)
+        >>> }
+        >>> def build_index(aids):
+        >>>     nnindexer = NeighborIndex({'backend': 'brute'}, None)
+        >>>     nnindexer.init_support(aids, *zip(*ut.take(aid_to_support, aids)), verbose=False)
+        >>>     nnindexer.reindex(verbose=False)
+        >>>     return nnindexer
+        >>> def neighbors(nnindexer, qfx2_idx):
+        >>>     return (nnindexer.get_nn_aids(qfx2_idx), nnindexer.get_nn_featxs(qfx2_idx),
+        >>>             nnindexer.get_nn_fgws(qfx2_idx), nnindexer.get_nn_vecs(qfx2_idx))
+        >>> qfx2_vec = rng.randint(0, 255, (30, 32)).astype(np.uint8)
+        >>> delta = DeltaNeighborIndex(build_index([1, 2, 3, 4, 5]), [1, 2, 3, 4, 5])
+        >>> # Remove two annotations and add three
+        >>> daid_list = [3, 4, 5, 6, 7, 8]
+        >>> new_aids = delta.get_missing_aids(daid_list)
+        >>> delta = delta.updated(daid_list, new_aids, *zip(*ut.take(aid_to_support, new_aids)))
+        >>> assert sorted(delta.tombstone_aids) == [1, 2]
+        >>> assert np.all(delta.get_removed_idxs() == np.arange(11 + 12))
+        >>> expected = build_index(daid_list)
+        >>> for K in [1, 5]:
+        >>>     idx1, dist1 = delta.knn(qfx2_vec, K)
+        >>>     idx2, dist2 = expected.knn(qfx2_vec, K)
+        >>>     assert np.all(dist1 == dist2)
+        >>>     for a, b in zip(neighbors(delta, idx1), neighbors(expected, idx2)):
+        >>>         assert np.all(a == b)
+        >>> idx1, dist1 = delta.requery_knn(qfx2_vec, 3, 1, [7])
+        >>> idx2, dist2 = expected.requery_knn(qfx2_vec, 3, 1, [7])
+        >>> assert np.all(dist1 == dist2)
+        >>> assert np.all(delta.get_nn_aids(idx1) == expected.get_nn_aids(idx2))
+        >>> # Tombstoned annotations come back without touching the support
+        >>> revived = delta.updated([1, 2, 7])
+        >>> assert revived.get_missing_aids([1, 2, 7]) == []
+        >>> assert set(revived.get_nn_aids(revived.knn(qfx2_vec, 4)[0]).ravel()) <= {1, 2, 7}
+        >>> vecs_list = revived.get_support([2, 7])[0]
+        >>> assert np.all(vecs_list[1] == aid_to_support[7][0])
+    """
+
+    def __init__(nnindexer, base, daid_list, log_support=None):
+        super(DeltaNeighborIndex, nnindexer).__init__(base.flann_params, base.cfgstr)
+        if log_support is None:
+            log_support = ([], [], None if base.idx2_fgw is None else [], [])
+        log_aids, log_vecs_list, log_fgws_list, log_fxs_list = log_support
+        nnindexer.base = base
+        nnindexer.log = None  # Exact index over the appended annots
+        nnindexer.log_support = log_support
+        nnindexer.compaction = None  # future of the rebuilt base index
+        nnindexer.num_base = base.num_indexed
+        indexers = [base]
+        if len(log_aids) > 0:
+            log = NeighborIndex({'backend': 'brute', 'cores': base.cores}, None)
+            log.init_support(
+                log_aids, log_vecs_list, log_fgws_list, log_fxs_list, verbose=False
+            )
+            log.reindex(verbose=False)
+            nnindexer.log = log
+            indexers.append(log)
+        # Stack the support (except the vectors) of the base and the log
+        ax_offsets = np.cumsum([0] + [len(indexer.ax2_aid) for indexer in indexers])
+        nnindexer.all_ax2_aid = np.hstack([indexer.ax2_aid for indexer in indexers])
+        nnindexer.idx2_ax = np.hstack(
+            [indexer.idx2_ax + offset for indexer, offset in zip(indexers, ax_offsets)]
+        ).astype(base.idx2_ax.dtype)
+        nnindexer.idx2_fx = np.hstack([indexer.idx2_fx for indexer in indexers])
+        if base.idx2_fgw is not None:
+            nnindexer.idx2_fgw = np.hstack([indexer.idx2_fgw for indexer in indexers])
+        is_active = np.isin(nnindexer.all_ax2_aid, daid_list)
+        nnindexer.ax2_aid = np.where(is_active, nnindexer.all_ax2_aid, -1)
+        nnindexer.tombstone_aids = set(
+            nnindexer.all_ax2_aid[~is_active & (nnindexer.all_ax2_aid != -1)].tolist()
+        )
+        nnindexer.aid2_ax = ut.make_index_lookup(nnindexer.ax2_aid)
+        nnindexer.num_indexed = len(nnindexer.idx2_ax)
+        nnindexer.max_distance_sqrd = base.max_distance_sqrd
+        idx2_removed = nnindexer.ax2_aid[nnindexer.idx2_ax] == -1
+        if nnindexer.log is not None:
+            log_removed = np.nonzero(idx2_removed[nnindexer.num_base :])[0]
+            nnindexer.log.flann.remove_points(log_removed)
+        nnindexer.flann = _DeltaSearch(
+            base.flann,
+            None if nnindexer.log is None else nnindexer.log.flann,
+            idx2_removed,
+        )
+
+    def updated(
+        nnindexer,
+        daid_list,
+        new_aids=None,
+        new_vecs_list=None,
+        new_fgws_list=None,
+        new_fxs_list=None,
+    ):
+        r"""
+        Returns the index of daid_list. The support of the annotations that
+        are not in this index yet (see :func:`get_missing_aids`) is appended
+        to the log.
+        """
+        log_aids, log_vecs_list, log_fgws_list, log_fxs_list = nnindexer.log_support
+        if log_fgws_list is not None:
+            log_fgws_list = list(log_fgws_list) + list(new_fgws_list or [])
+        log_support = (
+            list(log_aids) + list(new_aids or []),
+            list(log_vecs_list) + list(new_vecs_list or []),
+            log_fgws_list,
+            list(log_fxs_list) + list(new_fxs_list or []),
+        )
+        new_nnindexer = DeltaNeighborIndex(nnindexer.base, daid_list, log_support)
+        new_nnindexer.compaction = nnindexer.compaction
+        return new_nnindexer
+
+    def get_missing_aids(nnindexer, daid_list):
+        """annotations without support in the base or the log"""
+        return sorted(set(daid_list) - set(nnindexer.all_ax2_aid.tolist()))
+
+    def get_delta_ratio(nnindexer):
+        """number of appended and tombstoned base vectors per base vector"""
+        num_removed_base = nnindexer.flann.idx2_removed[: nnindexer.num_base].sum()
+        num_appended = nnindexer.num_indexed - nnindexer.num_base
+        return (num_appended + num_removed_base) / max(nnindexer.num_base, 1)
+
+    def get_support(nnindexer, aid_list):
+        r"""
+        Returns:
+            tuple: (vecs_list, fgws_list, fxs_list) of indexed annotations
+        """
+        all_aid2_ax = ut.make_index_lookup(nnindexer.all_ax2_aid)
+        axs = np.array(ut.take(all_aid2_ax, aid_list), dtype=np.int64)
+        sortx = np.argsort(nnindexer.idx2_ax, kind='stable')
+        sorted_axs = nnindexer.idx2_ax[sortx]
+        starts = np.searchsorted(sorted_axs, axs, side='left')
+        stops = np.searchsorted(sorted_axs, axs, side='right')
+        idxs_list = [sortx[start:stop] for start, stop in zip(starts, stops)]
+        vecs_list = [nnindexer.get_nn_vecs(idxs) for idxs in idxs_list]
+        fxs_list = [nnindexer.idx2_fx.take(idxs) for idxs in idxs_list]
+        if nnindexer.idx2_fgw is None:
+            fgws_list = None
+        else:
+            fgws_list = [nnindexer.idx2_fgw.take(idxs) for idxs in idxs_list]
+        return vecs_list, fgws_list, fxs_list
+
+    def get_cfgstr(nnindexer, noquery=False):
+        delta_hashstr = ut.hashstr_arr(nnindexer.ax2_aid, '_DELTA')
+        return nnindexer.base.get_cfgstr(noquery=noquery) + delta_hashstr
+
+    def get_dtype(nnindexer):
+        return nnindexer.base.get_dtype()
+
+    def get_memory_usage(nnindexer):
+        usage = super(DeltaNeighborIndex, nnindexer).get_memory_usage()
+        for indexer in [nnindexer.base, nnindexer.log]:
+            if indexer is not None:
+                for key, nbytes in indexer.get_memory_usage().items():
+                    usage[key] += nbytes
+        return usage
+
+    def num_indexed_vecs(nnindexer):
+        return nnindexer.num_indexed
+
+    def get_indexed_vecs(nnindexer):
+        return nnindexer.get_nn_vecs(np.nonzero(~nnindexer.flann.idx2_removed)[0])
+
+    def get_nn_vecs(nnindexer, qfx2_nnidx):
+        r"""gets matching vectors"""
+        qfx2_nnidx = np.asarray(qfx2_nnidx)
+        base_idx2_vec = nnindexer.base.idx2_vec
+        is_log = qfx2_nnidx >= nnindexer.num_base
+        if not np.any(is_log):
+            return base_idx2_vec.take(qfx2_nnidx, axis=0)
+        qfx2_shape = qfx2_nnidx.shape + base_idx2_vec.shape[1:]
+        qfx2_vec = np.empty(qfx2_shape, dtype=base_idx2_vec.dtype)
+        qfx2_vec[~is_log] = base_idx2_vec.take(qfx2_nnidx[~is_log], axis=0)
+        log_idxs = qfx2_nnidx[is_log] - nnindexer.num_base
+        qfx2_vec[is_log] = nnindexer.log.idx2_vec.take(log_idxs, axis=0)
+        return qfx2_vec
+
+
+class _DeltaSearch(object):
+    """
+    Search backend of a DeltaNeighborIndex. Searches the base and the log and
+    merges the results, ties are broken by index. Neighbors in the base that
+    are tombstoned are filtered out, the base is searched again with a larger
+    K for the rows that have less than K neighbors left.
+    """
+
+    def __init__(search, base_flann, log_flann, idx2_removed):
+        search.base_flann = base_flann
+        search.log_flann = log_flann
+        search.idx2_removed = idx2_removed
+        search.num_base = len(idx2_removed) - (
+            0 if log_flann is None else len(log_flann.get_indexed_data()[0])
+        )
+
+    def nn_index(search, qpts, num_neighbors=1, checks=None, cores=None, **kwargs):
+        K = num_neighbors
+        idxs_list = []
+        dists_list = []
+        if search.num_base > 0:
+            base_removed = search.idx2_removed[: search.num_base]
+            idxs, dists = _filtered_nn_index(
+                search.base_flann, qpts, K, base_removed, checks, cores
+            )
+            idxs_list.append(idxs)
+            dists_list.append(dists)
+        if search.log_flann is not None:
+            num_log = len(search.idx2_removed) - search.num_base
+            K_log = min(K, num_log)
+            idxs, dists = search.log_flann.nn_index(
+                qpts, K_log, checks=checks, cores=cores
+            )
+            idxs_list.append(idxs.reshape(len(qpts), K_log) + search.num_base)
+            dists_list.append(dists.reshape(len(qpts), K_log))
+        idxs = np.hstack(idxs_list)
+        dists = np.hstack(dists_list)
+        sortx = np.lexsort((idxs, dists), axis=1)[:, 0:K]
+        idxs = np.take_along_axis(idxs, sortx, axis=1).astype(np.int32)
+        dists = np.take_along_axis(dists, sortx, axis=1)
+        if K == 1:
+            # pyflann returns flat arrays for a single neighbor
+            return idxs[:, 0], dists[:, 0]
+        return idxs, dists
+
+
+def _filtered_nn_index(flann, qpts, K, idx2_removed, checks, cores):
+    """
+    nn_index that skips removed points (which the backend still returns)
+    """
+    num_data = len(idx2_removed)
+    num_removed = idx2_removed.sum()
+    K = min(K, num_data)
+    # Expect the removed points to be spread evenly
+    pad = int(np.ceil(K * num_removed / max(num_data - num_removed, 1)))
+    temp_K = min(num_data, K + pad)
+    idxs = np.empty((len(qpts), K), dtype=np.int64)
+    dists = np.empty((len(qpts), K), dtype=np.float64)
+    qxs = np.arange(len(qpts))
+    while len(qxs) > 0:
+        temp_idxs, temp_dists = flann.nn_index(
+            qpts[qxs], temp_K, checks=checks, cores=cores
+        )
+        temp_idxs = temp_idxs.reshape(len(qxs), temp_K)
+        temp_dists = temp_dists.reshape(len(qxs), temp_K).astype(np.float64)
+        is_removed = idx2_removed[temp_idxs]
+        temp_dists[is_removed] = np.inf
+        done = ((~is_removed).sum(axis=1) >= K) | (temp_K >= num_data)
+        sortx = np.argsort(temp_dists[done], axis=1, kind='stable')[:, 0:K]
+        idxs[qxs[done]] = np.take_along_axis(temp_idxs[done], sortx, axis=1)
+        dists[qxs[done]] = np.take_along_axis(temp_dists[done], sortx, axis=1)
+        qxs = qxs[~done]
+        temp_K = min(num_data, temp_K * 2)
+    return idxs, dists
+
+
 def testdata_nnindexer(*args, **kwargs):
     from wbia.algo.hots.neighbor_index_cache import testdata_nnindexer
 
@@ -2,11 +2,19 @@
 """
 NEEDS CLEANUP
 """
+import collections
 import logging
+from concurrent import futures
+import os
 from os.path import join
+import numpy as np
 import utool as ut
 from wbia.algo.hots import _pipeline_helpers as plh  # NOQA
-from wbia.algo.hots.neighbor_index import NeighborIndex, get_support_data
+from wbia.algo.hots.neighbor_index import (
+    DeltaNeighborIndex,
+    NeighborIndex,
+    get_support_data,
+)
 
 (print, rrr, profile) = ut.inject2(__name__)
 logger = logging.getLogger('wbia')
@@ -15,14 +23,131 @@ logger = logging.getLogger('wbia')
 USE_HOTSPOTTER_CACHE = not ut.get_argflag('--nocache-hs')
 NOCACHE_UUIDS = ut.get_argflag('--nocache-uuids') and USE_HOTSPOTTER_CACHE
 
-# LRU cache for nn_indexers. Ensures that only a few are ever in memory
-# MAX_NEIGHBOR_CACHE_SIZE = ut.get_argval('--max-neighbor-cachesize', type_=int, default=2)
-MAX_NEIGHBOR_CACHE_SIZE = ut.get_argval('--max-neighbor-cachesize', type_=int, default=1)
+# LRU cache for nn_indexers. Bounded by the number of indexers and optionally
+# by the bytes of process memory the cached indexers use. Unless a byte bound
+# is given, the cache keeps a single indexer as it always has.
+MAX_NEIGHBOR_CACHE_NBYTES = ut.get_argval(
+    '--max-neighbor-cache-nbytes', type_=int, default=None
+)
+MAX_NEIGHBOR_CACHE_SIZE = ut.get_argval(
+    '--max-neighbor-cachesize',
+    type_=int,
+    default=1 if MAX_NEIGHBOR_CACHE_NBYTES is None else None,
+)
+# Memory map the support data of indexers from the flann cachedir, so engine
+# processes serving the same daids share one copy of it
+SHARED_SUPPORT = not ut.get_argflag('--nommap-nnindex')
+# Follow changes to the database annotations with a DeltaNeighborIndex instead
+# of building a new index for every annotation set
+DELTA_NNINDEX = ut.get_argflag('--delta-nnindex')
+# Rebuild the base of a delta index in the background once the appended and
+# tombstoned vectors reach this fraction of the base
+DELTA_COMPACT_RATIO = ut.get_argval('--delta-compact-ratio', type_=float, default=0.1)
+# Start a new delta index when a request changes more than this fraction of
+# the annotations of the base
+DELTA_MAX_RATIO = ut.get_argval('--delta-max-ratio', type_=float, default=0.5)
 # Background process for building indexes
 CURRENT_THREAD = None
+# Background thread for compacting delta indexes
+COMPACTION_EXECUTOR = None
 # Global map to keep track of UUID lists with prebuild indexers.
 UUID_MAP = ut.ddict(dict)
-NEIGHBOR_CACHE = ut.get_lru_cache(MAX_NEIGHBOR_CACHE_SIZE)
+
+
+def _indexer_nbytes(nnindexer):
+    return 0 if nnindexer is None else nnindexer.nbytes()
+
+
+class NeighborCache(object):
+    """
+    LRU cache of neighbor indexers bounded by the bytes of process memory they
+    use and / or by their number (None means unbounded). Support data memory
+    mapped by :func:`NeighborIndex.load_support` is shared with other
+    processes and is not counted. Sizes are measured on every insert because
+    cached indexers may grow. The most recently inserted indexer is always
+    kept, even if it alone is over the limit.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_index_cache import *  # NOQA
+        >>> cache = NeighborCache(max_nbytes=10, get_nbytes=len)
+        >>> cache['a'] = 'aaaa'
+        >>> cache['b'] = 'bbbb'
+        >>> cache['a']
+        'aaaa'
+        >>> cache['c'] = 'cccc'
+        >>> sorted(cache.keys())
+        ['a', 'c']
+        >>> cache['d'] = 'd' * 20
+        >>> sorted(cache.keys()), cache.nbytes()
+        (['d'], 20)
+        >>> cache = NeighborCache(max_nbytes=10, max_size=1, get_nbytes=len)
+        >>> cache['a'] = 'a'
+        >>> cache['b'] = 'b'
+        >>> assert not cache.has_key('a') and len(cache) == 1
+        >>> cache = NeighborCache(max_nbytes=None, max_size=2, get_nbytes=len)
+        >>> for key in 'abc':
+        >>>     cache[key] = key * 20
+        >>> sorted(cache.keys())
+        ['b', 'c']
+    """
+
+    def __init__(cache, max_nbytes, max_size=None, get_nbytes=_indexer_nbytes):
+        cache.max_nbytes = max_nbytes
+        cache.max_size = max_size
+        cache.get_nbytes = get_nbytes
+        cache._items = collections.OrderedDict()
+
+    def has_key(cache, key):
+        return key in cache._items
+
+    def __contains__(cache, key):
+        return key in cache._items
+
+    def __len__(cache):
+        return len(cache._items)
+
+    def __getitem__(cache, key):
+        cache._items.move_to_end(key)
+        return cache._items[key]
+
+    def __setitem__(cache, key, value):
+        cache._items[key] = value
+        cache._items.move_to_end(key)
+        cache._evict()
+
+    def __delitem__(cache, key):
+        del cache._items[key]
+
+    def keys(cache):
+        return list(cache._items.keys())
+
+    def items(cache):
+        return list(cache._items.items())
+
+    def clear(cache):
+        cache._items.clear()
+
+    def nbytes(cache):
+        return sum(cache.get_nbytes(value) for value in cache._items.values())
+
+    def _evict(cache):
+        key_to_nbytes = collections.OrderedDict(
+            [(key, cache.get_nbytes(value)) for key, value in cache._items.items()]
+        )
+        total = sum(key_to_nbytes.values())
+        for key, nbytes in list(key_to_nbytes.items())[:-1]:
+            over_size = cache.max_size is not None and len(cache._items) > cache.max_size
+            over_nbytes = cache.max_nbytes is not None and total > cache.max_nbytes
+            if not over_nbytes and not over_size:
+                break
+            if ut.VERBOSE:
+                logger.info('[nnindex.MEMCACHE] evicting %s (%d bytes)' % (key, nbytes))
+            del cache._items[key]
+            total -= nbytes
+
+
+NEIGHBOR_CACHE = NeighborCache(MAX_NEIGHBOR_CACHE_NBYTES, MAX_NEIGHBOR_CACHE_SIZE)
 
 
 class UUIDMapHyrbridCache(object):
@@ -217,17 +342,37 @@ def build_nnindex_cfgstr(qreq_, daid_list):
 
         _VUUIDS((6)ylydksaqdigdecdd)_FLANN(8_kdtrees)_FEATWEIGHT(OFF)_FEAT(hesaff+sift_)_CHIP(sz450)
     """
+    data_hashid = get_data_cfgstr(qreq_.ibs, daid_list)
+    nnindex_cfgstr = data_hashid + build_nnindex_params_cfgstr(qreq_)
+    return nnindex_cfgstr
+
+
+def build_nnindex_params_cfgstr(qreq_):
+    """
+    the part of the nnindex cfgstr that does not depend on the indexed
+    annotations
+    """
     flann_cfgstr = qreq_.qparams.flann_cfgstr
     featweight_cfgstr = qreq_.qparams.featweight_cfgstr
     feat_cfgstr = qreq_.qparams.feat_cfgstr
     chip_cfgstr = qreq_.qparams.chip_cfgstr
     # FIXME; need to include probchip (or better yet just use depcache)
     # probchip_cfgstr = qreq_.qparams.chip_cfgstr
-    data_hashid = get_data_cfgstr(qreq_.ibs, daid_list)
-    nnindex_cfgstr = ''.join(
-        (data_hashid, flann_cfgstr, featweight_cfgstr, feat_cfgstr, chip_cfgstr)
+    return ''.join((flann_cfgstr, featweight_cfgstr, feat_cfgstr, chip_cfgstr))
+
+
+def build_delta_nnindex_key(qreq_, daid_list):
+    """
+    Memcache key of the delta index that serves daid_list. Requests for
+    annotations of the same database and species share one delta index, so
+    alternating between species does not rebuild it every time.
+    """
+    species_list = sorted(set(qreq_.ibs.get_annot_species_texts(daid_list)))
+    family_cfgstr = '_DB(%s)_SPECIES(%s)' % (
+        qreq_.ibs.get_dbname(),
+        ','.join(map(str, species_list)),
     )
-    return nnindex_cfgstr
+    return '_DELTA' + family_cfgstr + build_nnindex_params_cfgstr(qreq_)
 
 
 def clear_memcache():
@@ -235,6 +380,60 @@ def clear_memcache():
     NEIGHBOR_CACHE.clear()
 
 
+def get_resident_nbytes():
+    r"""
+    Returns:
+        tuple: (resident, shared) bytes of this process or (None, None) if
+            they cannot be read. Shared pages include memory mapped files.
+    """
+    try:
+        with open('/proc/self/statm') as file_:
+            fields = file_.read().split()
+        pagesize = os.sysconf('SC_PAGE_SIZE')
+        return int(fields[1]) * pagesize, int(fields[2]) * pagesize
+    except (IOError, OSError, ValueError, IndexError):
+        return None, None
+
+
+def get_memcache_report():
+    r"""
+    Reports the resident size of this process and the memory used by the
+    neighbor memcache.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_index_cache import *  # NOQA
+        >>> report = get_memcache_report()
+        >>> assert report['pid'] == os.getpid()
+        >>> if report['max_cache_nbytes'] is not None:
+        >>>     assert report['cache_nbytes'] <= report['max_cache_nbytes'] or report['num_indexers'] == 1
+    """
+    resident, shared = get_resident_nbytes()
+    usages = [
+        nnindexer.get_memory_usage()
+        for key, nnindexer in NEIGHBOR_CACHE.items()
+        if nnindexer is not None
+    ]
+    report = ut.odict(
+        [
+            ('pid', os.getpid()),
+            ('resident_nbytes', resident),
+            ('shared_nbytes', shared),
+            ('num_indexers', len(NEIGHBOR_CACHE)),
+            ('cache_nbytes', sum(u['private'] + u['index'] for u in usages)),
+            ('cache_mapped_nbytes', sum(u['mapped'] for u in usages)),
+            ('max_cache_nbytes', NEIGHBOR_CACHE.max_nbytes),
+            ('max_cache_size', NEIGHBOR_CACHE.max_size),
+        ]
+    )
+    return report
+
+
+def get_support_dpath(cachedir, nnindex_cfgstr):
+    """Directory of the memory mappable support data of an indexer"""
+    return ut.util_cache._args2_fpath(cachedir, 'nnsupport_', nnindex_cfgstr, '')
+
+
 def clear_uuid_cache(qreq_):
     """
     CommandLine:
@@ -299,13 +498,172 @@ def request_wbia_nnindexer(qreq_, verbose=True, **kwargs):
     daid_list = qreq_.get_internal_daids()
     if not hasattr(qreq_.qparams, 'use_augmented_indexer'):
         qreq_.qparams.use_augmented_indexer = True
-    if False and qreq_.qparams.use_augmented_indexer:
+    if DELTA_NNINDEX:
+        nnindexer = request_delta_wbia_nnindexer(qreq_, daid_list, **kwargs)
+    elif False and qreq_.qparams.use_augmented_indexer:
         nnindexer = request_augmented_wbia_nnindexer(qreq_, daid_list, **kwargs)
     else:
         nnindexer = request_memcached_wbia_nnindexer(qreq_, daid_list, **kwargs)
     return nnindexer
 
 
+def request_delta_wbia_nnindexer(
+    qreq_,
+    daid_list,
+    use_memcache=True,
+    verbose=ut.NOT_QUIET,
+    veryverbose=False,
+    force_rebuild=False,
+    memtrack=None,
+    prog_hook=None,
+):
+    r"""
+    Returns a :class:`DeltaNeighborIndex` over daid_list.
+
+    One delta index is kept in the memcache per indexer config, database and
+    species (see :func:`build_delta_nnindex_key`). When the requested
+    annotations differ from the last request of that family, only the support of
+    new annotations is loaded and appended, and annotations that are no
+    longer requested are tombstoned. When the appended and tombstoned
+    vectors pass ``--delta-compact-ratio`` of the base, a new base index is
+    built in a background thread. It is swapped in by the first request after
+    it finishes. Until then queries are served by the current delta index. A
+    request that changes more than ``--delta-max-ratio`` of the annotations
+    gets a new base index right away.
+
+    CommandLine:
+        python -m wbia.algo.hots.neighbor_index_cache request_delta_wbia_nnindexer
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.algo.hots.neighbor_index_cache import *  # NOQA
+        >>> import wbia
+        >>> ibs = wbia.opendb('testdb1')
+        >>> daid_list = ibs.get_valid_aids(species=wbia.const.TEST_SPECIES.ZEB_PLAIN)
+        >>> qreq_ = ibs.new_query_request(daid_list, daid_list)
+        >>> nnindexer1 = request_delta_wbia_nnindexer(qreq_, daid_list[:-1])
+        >>> nnindexer2 = request_delta_wbia_nnindexer(qreq_, daid_list[1:])
+        >>> assert nnindexer2.base is nnindexer1.base
+        >>> assert nnindexer2.tombstone_aids == {daid_list[0]}
+        >>> assert sorted(nnindexer2.get_indexed_aids()) == sorted(daid_list[1:])
+        >>> # Another species gets its own delta index
+        >>> other_aids = ibs.get_valid_aids(species=wbia.const.TEST_SPECIES.ZEB_GREVY)
+        >>> nnindexer3 = request_delta_wbia_nnindexer(qreq_, other_aids)
+        >>> nnindexer4 = request_delta_wbia_nnindexer(qreq_, daid_list[1:])
+        >>> assert nnindexer4 is nnindexer2
+    """
+    delta_key = build_delta_nnindex_key(qreq_, daid_list)
+    nnindexer = None
+    if not force_rebuild and use_memcache and NEIGHBOR_CACHE.has_key(delta_key):
+        nnindexer = finish_delta_compaction(NEIGHBOR_CACHE[delta_key], daid_list)
+    if nnindexer is not None:
+        missing_aids = nnindexer.get_missing_aids(daid_list)
+        num_base_aids = max(len(nnindexer.base.ax2_aid), 1)
+        base_aids = nnindexer.base.get_indexed_aids().tolist()
+        num_removed_aids = len(set(base_aids) - set(daid_list))
+        change_ratio = (len(missing_aids) + num_removed_aids) / num_base_aids
+        if change_ratio > DELTA_MAX_RATIO:
+            if verbose:
+                logger.info(
+                    '[nnindex.delta] request changes %.2f of the annots, rebuilding'
+                    % (change_ratio,)
+                )
+            nnindexer = None
+    if nnindexer is None:
+        base = request_diskcached_wbia_nnindexer(
+            qreq_,
+            daid_list,
+            verbose=verbose,
+            force_rebuild=force_rebuild,
+            memtrack=memtrack,
+            prog_hook=prog_hook,
+        )
+        nnindexer = DeltaNeighborIndex(base, daid_list)
+    elif len(missing_aids) > 0 or not ut.list_set_equal(
+        nnindexer.get_indexed_aids().tolist(), list(daid_list)
+    ):
+        vecs_list, fgws_list, fxs_list = get_support_data(qreq_, missing_aids)
+        nnindexer = nnindexer.updated(
+            daid_list, missing_aids, vecs_list, fgws_list, fxs_list
+        )
+        if verbose:
+            logger.info(
+                '[nnindex.delta] appended %d annots, %d annots are tombstoned'
+                % (len(missing_aids), len(nnindexer.tombstone_aids))
+            )
+    delta_ratio = nnindexer.get_delta_ratio()
+    if nnindexer.compaction is None and delta_ratio > DELTA_COMPACT_RATIO:
+        if verbose:
+            logger.info(
+                '[nnindex.delta] delta ratio %.3f > %.3f, compacting in the background'
+                % (delta_ratio, DELTA_COMPACT_RATIO)
+            )
+        cachedir = qreq_.ibs.get_flann_cachedir()
+        cfgstr = build_nnindex_cfgstr(qreq_, daid_list)
+        start_delta_compaction(nnindexer, list(daid_list), cachedir, cfgstr)
+    if use_memcache:
+        NEIGHBOR_CACHE[delta_key] = nnindexer
+    return nnindexer
+
+
+def start_delta_compaction(nnindexer, daid_list, cachedir, cfgstr):
+    r"""
+    Builds a new base index over daid_list from the support data of the
+    delta index in a background thread. The result is stored in
+    ``nnindexer.compaction`` (a future), which is shared with the indexes
+    returned by ``nnindexer.updated``.
+    """
+    global COMPACTION_EXECUTOR
+    if COMPACTION_EXECUTOR is None:
+        COMPACTION_EXECUTOR = futures.ThreadPoolExecutor(1)
+
+    def _compact():
+        logger.info('[BG] Starting delta index compaction')
+        vecs_list, fgws_list, fxs_list = nnindexer.get_support(daid_list)
+        base = build_shared_neighbor_index(
+            daid_list,
+            vecs_list,
+            fgws_list,
+            fxs_list,
+            nnindexer.base.flann_params.copy(),
+            cachedir,
+            cfgstr,
+            verbose=False,
+        )
+        logger.info('[BG] Finished delta index compaction')
+        return base
+
+    nnindexer.compaction = COMPACTION_EXECUTOR.submit(_compact)
+    return nnindexer.compaction
+
+
+def finish_delta_compaction(nnindexer, daid_list):
+    r"""
+    Returns nnindexer on top of its compacted base index if the background
+    compaction finished, otherwise returns nnindexer.
+    """
+    if nnindexer.compaction is None or not nnindexer.compaction.done():
+        return nnindexer
+    try:
+        base = nnindexer.compaction.result()
+    except Exception as ex:
+        ut.printex(ex, 'delta index compaction failed', iswarning=True)
+        nnindexer.compaction = None
+        return nnindexer
+    logger.info('[nnindex.delta] swapping in the compacted base index')
+    new_nnindexer = DeltaNeighborIndex(base, daid_list)
+    # Annots added while the base was compacted are taken from the old log
+    known_aids = set(nnindexer.all_ax2_aid.tolist())
+    log_aids = [
+        aid for aid in new_nnindexer.get_missing_aids(daid_list) if aid in known_aids
+    ]
+    if len(log_aids) > 0:
+        new_nnindexer = new_nnindexer.updated(
+            daid_list, log_aids, *nnindexer.get_support(log_aids)
+        )
+    return new_nnindexer
+
+
 def request_augmented_wbia_nnindexer(
     qreq_, daid_list, verbose=True, use_memcache=True, force_rebuild=False, memtrack=None
 ):
@@ -474,11 +832,7 @@ def request_memcached_wbia_nnindexer(
         logger.info(
             '[nnindex.MEMCACHE] len(NEIGHBOR_CACHE) = %r' % (len(NEIGHBOR_CACHE),)
         )
-        # the lru cache wont be recognized by get_object_size_str, cast to pure python objects
-        logger.info(
-            '[nnindex.MEMCACHE] size(NEIGHBOR_CACHE) = %s'
-            % (ut.get_object_size_str(NEIGHBOR_CACHE.items()),)
-        )
+        logger.info('[nnindex.MEMCACHE] report = %s' % (ut.repr2(get_memcache_report()),))
     # if memtrack is not None:
     #    memtrack.report('IN REQUEST MEMCACHE')
     nnindex_cfgstr = build_nnindex_cfgstr(qreq_, daid_list)
@@ -510,6 +864,10 @@ def request_memcached_wbia_nnindexer(
             if ut.VERBOSE or ut.VERYVERBOSE:
                 logger.info('[disk] Write to memcache=%r' % (nnindex_cfgstr,))
             NEIGHBOR_CACHE[nnindex_cfgstr] = nnindexer
+            if verbose:
+                logger.info(
+                    '[nnindex.MEMCACHE] report = %s' % (ut.repr2(get_memcache_report()),)
+                )
         else:
             if ut.VERBOSE or ut.VERYVERBOSE:
                 logger.info('[disk] Did not write to memcache=%r' % (nnindex_cfgstr,))
@@ -566,31 +924,48 @@ def request_diskcached_wbia_nnindexer(
     # if memtrack is not None:
     #    memtrack.report('[PRE SUPPORT]')
     # Get annot descriptors to index
-    if prog_hook is not None:
-        prog_hook.set_progress(1, 3, 'Loading support data for indexer')
-    logger.info('[nnindex] Loading support data for indexer')
-    vecs_list, fgws_list, fxs_list = get_support_data(qreq_, daid_list)
-    if memtrack is not None:
-        memtrack.report('[AFTER GET SUPPORT DATA]')
-    try:
-        nnindexer = new_neighbor_index(
+    support_dpath = get_support_dpath(cachedir, cfgstr)
+    nnindexer = None
+    if SHARED_SUPPORT and not force_rebuild:
+        nnindexer = load_shared_neighbor_index(
             daid_list,
-            vecs_list,
-            fgws_list,
-            fxs_list,
             flann_params,
+            support_dpath,
             cachedir,
-            cfgstr=cfgstr,
+            cfgstr,
             verbose=verbose,
-            force_rebuild=force_rebuild,
             memtrack=memtrack,
             prog_hook=prog_hook,
         )
-    except Exception as ex:
-        ut.printex(
-            ex, True, msg_='cannot build inverted index', key_list=['ibs.get_infostr()']
-        )
-        raise
+    if nnindexer is None:
+        if prog_hook is not None:
+            prog_hook.set_progress(1, 3, 'Loading support data for indexer')
+        logger.info('[nnindex] Loading support data for indexer')
+        vecs_list, fgws_list, fxs_list = get_support_data(qreq_, daid_list)
+        if memtrack is not None:
+            memtrack.report('[AFTER GET SUPPORT DATA]')
+        try:
+            nnindexer = build_shared_neighbor_index(
+                daid_list,
+                vecs_list,
+                fgws_list,
+                fxs_list,
+                flann_params,
+                cachedir,
+                cfgstr,
+                verbose=verbose,
+                force_rebuild=force_rebuild,
+                memtrack=memtrack,
+                prog_hook=prog_hook,
+            )
+        except Exception as ex:
+            ut.printex(
+                ex,
+                True,
+                msg_='cannot build inverted index',
+                key_list=['ibs.get_infostr()'],
+            )
+            raise
     # Record these uuids in the disk based uuid map so they can be augmented if
     # needed
     min_reindex_thresh = qreq_.qparams.min_reindex_thresh
@@ -670,6 +1045,82 @@ def get_data_cfgstr(ibs, daid_list):
     return daids_hashid
 
 
+def build_shared_neighbor_index(
+    daid_list,
+    vecs_list,
+    fgws_list,
+    fxs_list,
+    flann_params,
+    cachedir,
+    cfgstr,
+    verbose=True,
+    force_rebuild=False,
+    memtrack=None,
+    prog_hook=None,
+):
+    r"""
+    Builds (or loads the disk cached) neighbor index and writes its support
+    data so other processes can memory map it, see
+    :func:`load_shared_neighbor_index`.
+    """
+    nnindexer = new_neighbor_index(
+        daid_list,
+        vecs_list,
+        fgws_list,
+        fxs_list,
+        flann_params,
+        cachedir,
+        cfgstr=cfgstr,
+        verbose=verbose,
+        force_rebuild=force_rebuild,
+        memtrack=memtrack,
+        prog_hook=prog_hook,
+    )
+    support_dpath = get_support_dpath(cachedir, cfgstr)
+    if SHARED_SUPPORT and nnindexer.save_support(support_dpath, verbose=verbose):
+        # Swap the private support data for the shared memory mapped copy
+        shared_nnindexer = load_shared_neighbor_index(
+            daid_list, flann_params, support_dpath, cachedir, cfgstr, verbose=verbose
+        )
+        if shared_nnindexer is not None:
+            nnindexer = shared_nnindexer
+    return nnindexer
+
+
+def load_shared_neighbor_index(
+    daid_list,
+    flann_params,
+    support_dpath,
+    cachedir,
+    cfgstr,
+    verbose=True,
+    memtrack=None,
+    prog_hook=None,
+):
+    r"""
+    Loads a neighbor index whose support data was written to support_dpath
+    by :func:`NeighborIndex.save_support`. The support data is memory mapped
+    so all processes loading the same index share it.
+
+    Returns:
+        NeighborIndex: nnindexer or None if there is no (valid) support data
+    """
+    nnindexer = NeighborIndex(flann_params, cfgstr)
+    try:
+        load_success = nnindexer.load_support(support_dpath, verbose=verbose)
+    except Exception as ex:
+        ut.printex(ex, '... cannot load nnindex support data', iswarning=True)
+        load_success = False
+    if not load_success or not np.array_equal(nnindexer.ax2_aid, daid_list):
+        return None
+    if memtrack is not None:
+        memtrack.report('AFTER LOAD SUPPORT')
+    nnindexer.ensure_indexer(
+        cachedir, verbose=verbose, memtrack=memtrack, prog_hook=prog_hook
+    )
+    return nnindexer
+
+
 def new_neighbor_index(
     daid_list,
     vecs_list,
@@ -42,14 +42,22 @@ TODO:
     been computed?
 """
 import logging
+import multiprocessing
+import shutil
+import tempfile
+import threading
+from concurrent import futures
 import numpy as np
 import vtool as vt
 from wbia.algo.hots import hstypes
+from wbia.algo.hots import batch_sver
 from wbia.algo.hots import chip_match
+from wbia.algo.hots import chip_match_csr
 from wbia.algo.hots import nn_weights
 from wbia.algo.hots import scoring
 from wbia.algo.hots import _pipeline_helpers as plh  # NOQA
 from collections import namedtuple
+from os.path import exists, join
 import utool as ut
 
 print, rrr, profile = ut.inject2(__name__)
@@ -75,6 +83,18 @@ USE_NN_MID_CACHE = (
     and USE_HOTSPOTTER_CACHE
 )
 USE_NN_MID_CACHE = False
+# Search the descriptors of all queries in a chunk with one indexer call
+BATCH_NN = ut.get_argflag('--batch-nn')
+# Number of processes that spatially verify the shortlists of a chunk
+SVER_NPROCS = ut.get_argval('--sver-nprocs', type_=int, default=1)
+# Smaller chunks are verified serially
+SVER_MIN_PARALLEL_TASKS = ut.get_argval('--sver-min-parallel', type_=int, default=64)
+# Where the parallel workers read their inputs from (in memory where possible)
+SVER_TEMP_DPATH = '/dev/shm' if exists('/dev/shm') else None
+# Score the affine hypotheses of all shortlists of a chunk together
+BATCH_SVER = ut.get_argflag('--batch-sver')
+# Store the feature matches of a ChipMatch in flat (CSR) arrays
+CSR_CHIPMATCH = ut.get_argflag('--csr-chipmatch')
 
 
 NN_LBL = 'Assign NN:       '
@@ -131,7 +151,7 @@ class Neighbors(ut.NiceRepr):
 
 
 # @profile
-def request_wbia_query_L0(ibs, qreq_, verbose=VERB_PIPELINE):
+def request_wbia_query_L0(ibs, qreq_, verbose=VERB_PIPELINE, delta_daids=None):
     r"""Driver logic of query pipeline
 
     Note:
@@ -143,9 +163,14 @@ def request_wbia_query_L0(ibs, qreq_, verbose=VERB_PIPELINE):
             technically this object already lives inside of qreq_.
         qreq_ (wbia.QueryRequest): hyper-parameters. use
             ``ibs.new_query_request`` to create one
+        delta_daids (ndarray): if specified, only matches to these daids are
+            kept. The neighbors and normalizers still come from all daids.
+            (used by match_chips4.execute_query_incremental)
 
     Returns:
-        list: cm_list containing ``wbia.ChipMatch`` objects
+        list: cm_list containing ``wbia.ChipMatch`` objects. If delta_daids
+            is specified, returns (cm_list, delta_changed_list), see
+            delta_neighbor_filter.
 
     CommandLine:
         python -m wbia.algo.hots.pipeline --test-request_wbia_query_L0:0 --show
@@ -213,6 +238,10 @@ def request_wbia_query_L0(ibs, qreq_, verbose=VERB_PIPELINE):
         nnvalid0_list = baseline_neighbor_filter(
             qreq_, nns_list, impossible_daids_list, verbose=verbose
         )
+        if delta_daids is not None:
+            nnvalid0_list, delta_changed_list = delta_neighbor_filter(
+                qreq_, nns_list, nnvalid0_list, impossible_daids_list, delta_daids
+            )
 
         # Nearest neighbors weighting / scoring (filtweights_list)
         # filtweights_list maps qaid to filtweights which is a dict
@@ -252,6 +281,8 @@ def request_wbia_query_L0(ibs, qreq_, verbose=VERB_PIPELINE):
     if VERB_PIPELINE:
         logger.info('[hs] L___ FINISHED HOTSPOTTER PIPELINE ___')
 
+    if delta_daids is not None:
+        return cm_list, delta_changed_list
     return cm_list
 
 
@@ -472,11 +503,24 @@ def nearest_neighbor_cacheid2(qreq_, Kpad_list):
 
 @profile
 def cachemiss_nn_compute_fn(
-    flags_list, qreq_, Kpad_list, impossible_daids_list, K, Knorm, requery, verbose
+    flags_list,
+    qreq_,
+    Kpad_list,
+    impossible_daids_list,
+    K,
+    Knorm,
+    requery,
+    verbose,
+    batched=False,
 ):
     """
     Logic for computing neighbors if there is a cache miss
 
+    If batched is True the descriptors of all queries with the same K (or pad)
+    are stacked and searched with a single call to the indexer (see
+    NeighborIndex.multi_knn and NeighborIndex.multi_requery_knn) instead of
+    one call per query.
+
     >>> flags_list = [True] * len(Kpad_list)
     >>> flags_list = [True, False, True]
     """
@@ -492,6 +536,8 @@ def cachemiss_nn_compute_fn(
     internal_qannots = internal_qannots.compress(flags_list)
 
     Kpad_list = ut.compress(Kpad_list, flags_list)
+    if impossible_daids_list is not None:
+        impossible_daids_list = ut.compress(impossible_daids_list, flags_list)
     # do computation
     if not requery:
         num_neighbors_list = [K + Kpad + Knorm for Kpad in Kpad_list]
@@ -533,7 +579,20 @@ def cachemiss_nn_compute_fn(
             logger.info('[hs] depth(qvecs_list) = %r' % (ut.depth_profile(qvecs_list),))
     # Mark progress ane execute nearest indexer nearest neighbor code
     prog_hook = None if qreq_.prog_hook is None else qreq_.prog_hook.next_subhook()
-    if requery:
+    if batched:
+        if verbose:
+            num_vecs = sum(len(qfx2_vec) for qfx2_vec in qvecs_list)
+            logger.info(
+                '[hs] batched nn search of %d vecs from %d queries'
+                % (num_vecs, len(qvecs_list))
+            )
+        if requery:
+            idx_dist_list = qreq_.indexer.multi_requery_knn(
+                qvecs_list, K + Knorm, Kpad_list, impossible_daids_list
+            )
+        else:
+            idx_dist_list = qreq_.indexer.multi_knn(qvecs_list, num_neighbors_list)
+    elif requery:
         # assert False, (
         #     'need to implement part where matches with the same name are not considered'
         # )
@@ -543,7 +602,9 @@ def cachemiss_nn_compute_fn(
         # Maybe some query vector stacking would help here
         qvecs_stack = np.vstack(qvecs_list)
 
-        # Nope, really doesn't help that much
+        # Nope, really doesn't help that much with FLANN alone, but the
+        # batched path (--batch-nn) also shares the requery rounds and avoids
+        # the per-call overhead for small annotations. See benchmark_batched_knn
 
         # For 100 annotations
         %timeit np.vstack(qvecs_list)
@@ -579,12 +640,16 @@ def cachemiss_nn_compute_fn(
 
 @profile
 def nearest_neighbors(
-    qreq_, Kpad_list, impossible_daids_list=None, verbose=VERB_PIPELINE
+    qreq_, Kpad_list, impossible_daids_list=None, verbose=VERB_PIPELINE, batched=None
 ):
     """
     Plain Nearest Neighbors
     Tries to load nearest neighbors from a cache instead of recomputing them.
 
+    Args:
+        batched (bool): if True all queries are searched with a single
+            indexer call. Defaults to the --batch-nn flag.
+
     CommandLine:
         python -m wbia.algo.hots.pipeline --test-nearest_neighbors
         python -m wbia.algo.hots.pipeline --test-nearest_neighbors --db PZ_MTEST --qaids=1:100
@@ -682,10 +747,35 @@ def nearest_neighbors(
         >>> nnvalid0_list1 = baseline_neighbor_filter(qreq1_, nns_list1,
         >>>                                           impossible_daids_list)
         >>> assert np.all(nnvalid0_list1[0]), 'should always be valid'
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.pipeline import *  # NOQA
+        >>> import wbia
+        >>> qreq_ = wbia.testdata_qreq_(
+        >>>     defaultdb='testdb1', t=['default:K=3,requery=True,can_match_samename=False'],
+        >>>     qaid_override=[2, 5, 1])
+        >>> locals_ = plh.testrun_pipeline_upto(qreq_, 'nearest_neighbors')
+        >>> Kpad_list, impossible_daids_list = ut.dict_take(
+        >>>    locals_, ['Kpad_list', 'impossible_daids_list'])
+        >>> nns_list1 = nearest_neighbors(qreq_, Kpad_list, impossible_daids_list,
+        >>>                               batched=False)
+        >>> nns_list2 = nearest_neighbors(qreq_, Kpad_list, impossible_daids_list,
+        >>>                               batched=True)
+        >>> for nn1, nn2 in zip(nns_list1, nns_list2):
+        >>>     assert nn1.qaid == nn2.qaid
+        >>>     assert np.all(nn1.qfx_list == nn2.qfx_list)
+        >>>     assert np.all(nn1.neighb_idxs == nn2.neighb_idxs)
+        >>>     assert np.allclose(nn1.neighb_dists, nn2.neighb_dists)
+        >>> nnvalid0_list = baseline_neighbor_filter(qreq_, nns_list2,
+        >>>                                          impossible_daids_list)
+        >>> assert all(np.all(nnvalid0) for nnvalid0 in nnvalid0_list)
     """
     K = qreq_.qparams.K
     Knorm = qreq_.qparams.Knorm
     requery = qreq_.qparams.requery
+    if batched is None:
+        batched = BATCH_NN
     # checks = qreq_.qparams.checks
     # Get both match neighbors (including padding) and normalizing neighbors
     if verbose:
@@ -720,6 +810,7 @@ def nearest_neighbors(
         Knorm,
         requery,
         verbose,
+        batched,
     )
     return nns_list
 
@@ -784,6 +875,65 @@ def baseline_neighbor_filter(
     return nnvalid0_list
 
 
+def delta_neighbor_filter(
+    qreq_, nns_list, nnvalid0_list, impossible_daids_list, delta_daids
+):
+    """
+    Only keeps the neighbors that belong to delta_daids. The normalizers are
+    not affected, so the matches to delta_daids are the same as in a query
+    against all daids.
+
+    Returns:
+        tuple: (nnvalid0_list, delta_changed_list) - delta_changed_list
+            flags the queries where delta_daids changed the neighbors or the K
+            padding. The matches of the other queries to the remaining daids
+            are the same as in a query without delta_daids.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.pipeline import *  # NOQA
+        >>> ax2_aid = np.array([1, 1, 2, 2, 3, 3])
+        >>> qreq_ = ut.DynStruct()
+        >>> qreq_.qparams = ut.DynStruct()
+        >>> qreq_.qparams.use_k_padding = False
+        >>> qreq_.qparams.Knorm = 1
+        >>> qreq_.indexer = ut.DynStruct()
+        >>> qreq_.indexer.get_nn_aids = lambda idxs: ax2_aid[idxs]
+        >>> nns_list = [
+        >>>     Neighbors(10, np.array([[0, 4, 2], [2, 3, 0]]), None, None),
+        >>>     Neighbors(11, np.array([[0, 2, 3]]), None, None),
+        >>> ]
+        >>> nnvalid0_list = [np.ones((2, 2), dtype=bool), np.ones((1, 2), dtype=bool)]
+        >>> impossible_daids_list = [np.array([10]), np.array([11])]
+        >>> delta_daids = [3]
+        >>> nnvalid0_list_, delta_changed_list = delta_neighbor_filter(
+        >>>     qreq_, nns_list, nnvalid0_list, impossible_daids_list, delta_daids)
+        >>> print([nnvalid0.tolist() for nnvalid0 in nnvalid0_list_])
+        >>> print(delta_changed_list)
+        [[[False, True], [False, False]], [[False, False]]]
+        [True, False]
+    """
+    use_k_padding = qreq_.qparams.use_k_padding
+    Knorm = qreq_.qparams.Knorm
+    delta_daids = np.asarray(delta_daids)
+    nnvalid0_list_ = []
+    delta_changed_list = []
+    for nns, nnvalid0, impossible_daids in zip(
+        nns_list, nnvalid0_list, impossible_daids_list
+    ):
+        neighb_aids = qreq_.indexer.get_nn_aids(nns.neighb_idxs)
+        neighb_isdelta = np.isin(neighb_aids, delta_daids)
+        nnvalid0_list_.append(
+            np.logical_and(nnvalid0, neighb_isdelta.T[: neighb_aids.shape[1] - Knorm].T)
+        )
+        if use_k_padding:
+            kpad_changed = np.any(np.isin(impossible_daids, delta_daids))
+        else:
+            kpad_changed = nns.qaid in delta_daids
+        delta_changed_list.append(bool(kpad_changed or np.any(neighb_isdelta)))
+    return nnvalid0_list_, delta_changed_list
+
+
 # ============================
 # 3) Nearest Neighbor weights
 # ============================
@@ -1223,21 +1373,26 @@ def get_sparse_matchinfo_nonagg(
     # valid_fm = np.ascontiguousarray(valid_fm)
     daid_list, daid_groupxs = vt.group_indices(valid_daid)
 
-    fm_list = vt.apply_grouping(valid_fm, daid_groupxs)
-    fsv_list = vt.apply_grouping(valid_scorevec, daid_groupxs)
-    fk_list = vt.apply_grouping(valid_rank, daid_groupxs)
+    if CSR_CHIPMATCH:
+        apply_grouping = chip_match_csr.CSRList.from_grouping
+    else:
+        apply_grouping = vt.apply_grouping
+
+    fm_list = apply_grouping(valid_fm, daid_groupxs)
+    fsv_list = apply_grouping(valid_scorevec, daid_groupxs)
+    fk_list = apply_grouping(valid_rank, daid_groupxs)
 
     filtnorm_aids = [
         None  # [None] * len(daid_groupxs)
         if aids is None
-        else vt.apply_grouping(aids, daid_groupxs)
+        else apply_grouping(aids, daid_groupxs)
         for aids in valid_norm_aids
     ]
 
     filtnorm_fxs = [
         None  # [None] * len(daid_groupxs)
         if fxs is None
-        else vt.apply_grouping(fxs, daid_groupxs)
+        else apply_grouping(fxs, daid_groupxs)
         for fxs in valid_norm_fxs
     ]
 
@@ -1333,15 +1488,22 @@ def _spatial_verification(qreq_, cm_list, verbose=VERB_PIPELINE):
         qreq_, cm_list, nNameShortList, nAnnotPerName, score_method
     )
     prog_hook = None if qreq_.prog_hook is None else qreq_.prog_hook.next_subhook()
-    cm_progiter = ut.ProgressIter(
-        cm_shortlist,
-        length=len(cm_shortlist),
-        prog_hook=prog_hook,
-        lbl=SVER_LVL,
-        **PROGKW,
-    )
-
-    cm_list_SVER = [sver_single_chipmatch(qreq_, cm) for cm in cm_progiter]
+    num_tasks = sum(len(cm.daid_list) for cm in cm_shortlist)
+    if BATCH_SVER:
+        cm_list_SVER = batch_sver_chipmatches(qreq_, cm_shortlist)
+    elif can_parallel_sver(SVER_NPROCS) and num_tasks >= SVER_MIN_PARALLEL_TASKS:
+        cm_list_SVER = parallel_sver_chipmatches(
+            qreq_, cm_shortlist, SVER_NPROCS, prog_hook=prog_hook
+        )
+    else:
+        cm_progiter = ut.ProgressIter(
+            cm_shortlist,
+            length=len(cm_shortlist),
+            prog_hook=prog_hook,
+            lbl=SVER_LVL,
+            **PROGKW,
+        )
+        cm_list_SVER = [sver_single_chipmatch(qreq_, cm) for cm in cm_progiter]
     # rescore after verification?
     return cm_list_SVER
 
@@ -1451,15 +1613,57 @@ def sver_single_chipmatch(qreq_, cm, verbose=False):
         >>>                    refine_method=refine_method)
         >>> ut.show_if_requested()
     """
+    sver_params = get_sver_params(qreq_)
+    kpts1, kpts2_list, top_dlen_sqrd_list, match_weight_list = get_sver_inputs(qreq_, cm)
+
+    # Make an svtup for every daid in the shortlist
+    _iter1 = zip(
+        cm.daid_list,
+        cm.fm_list,
+        kpts2_list,
+        top_dlen_sqrd_list,
+        match_weight_list,
+    )
+    if verbose:
+        _iter1 = ut.ProgIter(
+            _iter1, length=len(cm.daid_list), lbl='sver shortlist', freq=1
+        )
+    svtup_list = []
+    for daid, fm, kpts2, dlen_sqrd2, match_weights in _iter1:
+        sv_tup = sver_single_pair(
+            kpts1, kpts2, fm, dlen_sqrd2, match_weights, sver_params
+        )
+        svtup_list.append(sv_tup)
+
+    # <SENTINAL>
+
+    cmSV = finish_sver_chipmatch(qreq_, cm, svtup_list, top_dlen_sqrd_list)
+    return cmSV
+
+
+def get_sver_params(qreq_):
+    """parameters of vt.spatially_verify_kpts"""
+    sver_params = dict(
+        xy_thresh=qreq_.qparams.xy_thresh,
+        scale_thresh=qreq_.qparams.scale_thresh,
+        ori_thresh=qreq_.qparams.ori_thresh,
+        min_nInliers=qreq_.qparams.min_nInliers,
+        full_homog_checks=qreq_.qparams.full_homog_checks,
+        refine_method=qreq_.qparams.refine_method,
+    )
+    return sver_params
+
+
+def get_sver_inputs(qreq_, cm):
+    r"""
+    Loads the keypoints, chip extents and match weights needed to verify the
+    shortlist of a chipmatch
+
+    Returns:
+        tuple: (kpts1, kpts2_list, top_dlen_sqrd_list, match_weight_list)
+    """
     qaid = cm.qaid
     use_chip_extent = qreq_.qparams.use_chip_extent
-    xy_thresh = qreq_.qparams.xy_thresh
-    scale_thresh = qreq_.qparams.scale_thresh
-    ori_thresh = qreq_.qparams.ori_thresh
-    min_nInliers = qreq_.qparams.min_nInliers
-    full_homog_checks = qreq_.qparams.full_homog_checks
-    refine_method = qreq_.qparams.refine_method
-    sver_output_weighting = qreq_.qparams.sver_output_weighting
     # Precompute sver cmtup_old
     kpts1 = qreq_.get_qreq_qannot_kpts(qaid).astype(np.float64)
     kpts2_list = qreq_.get_qreq_dannot_kpts(cm.daid_list)
@@ -1483,79 +1687,62 @@ def sver_single_chipmatch(qreq_, cm, verbose=False):
         match_weight_list = [qweights.take(fm.T[0]) for fm in cm.fm_list]
     else:
         match_weight_list = [np.ones(len(fm), dtype=np.float64) for fm in cm.fm_list]
+    return kpts1, kpts2_list, top_dlen_sqrd_list, match_weight_list
 
-    # Make an svtup for every daid in the shortlist
-    _iter1 = zip(
-        cm.daid_list,
-        cm.fm_list,
-        cm.fsv_list,
-        kpts2_list,
-        top_dlen_sqrd_list,
-        match_weight_list,
-    )
-    if verbose:
-        _iter1 = ut.ProgIter(
-            _iter1, length=len(cm.daid_list), lbl='sver shortlist', freq=1
+
+def sver_single_pair(kpts1, kpts2, fm, dlen_sqrd2, match_weights, sver_params):
+    r"""
+    Spatially verifies the feature matches between a query and a database
+    annotation
+
+    Returns:
+        tuple: (homog_inliers, homog_errors, H, aff_inliers, aff_errors, Aff)
+            or None if there are no matches or verification failed
+    """
+    if len(fm) == 0:
+        # skip results without any matches
+        return None
+    try:
+        # Compute homography from chip2 to chip1 returned homography
+        # maps image1 space into image2 space image1 is a query chip
+        # and image2 is a database chip
+        sv_tup = vt.spatially_verify_kpts(
+            kpts1,
+            kpts2,
+            fm,
+            sver_params['xy_thresh'],
+            sver_params['scale_thresh'],
+            sver_params['ori_thresh'],
+            dlen_sqrd2,
+            sver_params['min_nInliers'],
+            match_weights=match_weights,
+            full_homog_checks=sver_params['full_homog_checks'],
+            refine_method=sver_params['refine_method'],
+            returnAff=True,
         )
-    svtup_list = []
-    for daid, fm, fsv, kpts2, dlen_sqrd2, match_weights in _iter1:
-        if len(fm) == 0:
-            # skip results without any matches
-            sv_tup = None
-        else:
+    except Exception as ex:
+        ut.printex(
+            ex,
+            'Unknown error in spatial verification.',
+            keys=[
+                'kpts1',
+                'kpts2',
+                'fm',
+                'sver_params',
+                'dlen_sqrd2',
+            ],
+        )
+        sv_tup = None
+    return sv_tup
 
-            # sver_testdata = dict(
-            #     kpts1=kpts1,
-            #     kpts2=kpts2,
-            #     fm=fm,
-            #     xy_thresh=xy_thresh,
-            #     scale_thresh=scale_thresh,
-            #     ori_thresh=ori_thresh,
-            #     dlen_sqrd2=dlen_sqrd2,
-            #     min_nInliers=min_nInliers,
-            #     match_weights=match_weights,
-            #     full_homog_checks=full_homog_checks,
-            #     refine_method=refine_method
-            # )
-
-            # locals().update(ut.load_data('sver_testdata.pkl'))
-
-            try:
-                # Compute homography from chip2 to chip1 returned homography
-                # maps image1 space into image2 space image1 is a query chip
-                # and image2 is a database chip
-                sv_tup = vt.spatially_verify_kpts(
-                    kpts1,
-                    kpts2,
-                    fm,
-                    xy_thresh,
-                    scale_thresh,
-                    ori_thresh,
-                    dlen_sqrd2,
-                    min_nInliers,
-                    match_weights=match_weights,
-                    full_homog_checks=full_homog_checks,
-                    refine_method=refine_method,
-                    returnAff=True,
-                )
-            except Exception as ex:
-                ut.printex(
-                    ex,
-                    'Unknown error in spatial verification.',
-                    keys=[
-                        'kpts1',
-                        'kpts2',
-                        'fm',
-                        'xy_thresh',
-                        'scale_thresh',
-                        'dlen_sqrd2',
-                        'min_nInliers',
-                    ],
-                )
-                sv_tup = None
-        svtup_list.append(sv_tup)
 
-    # <SENTINAL>
+def finish_sver_chipmatch(qreq_, cm, svtup_list, top_dlen_sqrd_list):
+    r"""
+    Builds the spatially verified chipmatch from the verification results of
+    its shortlist
+    """
+    xy_thresh = qreq_.qparams.xy_thresh
+    sver_output_weighting = qreq_.qparams.sver_output_weighting
 
     # New way
     inliers_list = []
@@ -1578,6 +1765,9 @@ def sver_single_chipmatch(qreq_, cm, verbose=False):
 
     if sver_output_weighting:
         homog_err_weight_list = []
+        # FIXME: this is the extent of the last annot in the shortlist, it
+        # is used for the errors of every annot
+        dlen_sqrd2 = top_dlen_sqrd_list[-1] if len(top_dlen_sqrd_list) else None
         xy_thresh_sqrd = dlen_sqrd2 * xy_thresh
         for sv_tup in svtup_list_:
             (homog_inliers, homog_errors) = sv_tup[0:2]
@@ -1591,6 +1781,331 @@ def sver_single_chipmatch(qreq_, cm, verbose=False):
     return cmSV
 
 
+# Worker processes of parallel_sver_chipmatches. The pool is created on first
+# use and kept for later calls. Its workers are started with forkserver (or
+# spawn), forking a threaded server process is not safe.
+_SVER_POOL = None
+_SVER_POOL_NPROCS = None
+_SVER_POOL_LOCK = threading.Lock()
+
+
+def can_parallel_sver(nprocs):
+    return nprocs > 1
+
+
+def get_sver_pool(nprocs):
+    """
+    Returns the process pool of parallel_sver_chipmatches, which is reused
+    until it is requested with a different number of processes.
+    """
+    global _SVER_POOL, _SVER_POOL_NPROCS
+    with _SVER_POOL_LOCK:
+        if _SVER_POOL is None or _SVER_POOL_NPROCS != nprocs:
+            if _SVER_POOL is not None:
+                _SVER_POOL.shutdown(wait=False)
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context('forkserver')
+            else:
+                mp_context = multiprocessing.get_context('spawn')
+            _SVER_POOL = futures.ProcessPoolExecutor(nprocs, mp_context=mp_context)
+            _SVER_POOL_NPROCS = nprocs
+        return _SVER_POOL
+
+
+def _discard_sver_pool(pool):
+    """Drops a broken pool, the next call creates a new one"""
+    global _SVER_POOL
+    with _SVER_POOL_LOCK:
+        if _SVER_POOL is pool:
+            _SVER_POOL = None
+    pool.shutdown(wait=False)
+
+
+class _SharedArrayPacker(object):
+    """
+    Packs the sver inputs into a few memory mapped files, one per dtype and
+    trailing shape, so the worker processes read them without unpickling.
+    The same array object is only stored once.
+    """
+
+    def __init__(packer):
+        packer._groups = {}
+        packer._refs = {}
+
+    def add(packer, arr):
+        """Returns the (group index, start, stop) reference of arr"""
+        ref = packer._refs.get(id(arr), None)
+        if ref is None:
+            key = (arr.dtype.str, arr.shape[1:])
+            if key not in packer._groups:
+                packer._groups[key] = (len(packer._groups), [], [0])
+            gx, arrs, num = packer._groups[key]
+            ref = (gx, num[0], num[0] + len(arr))
+            arrs.append(arr)
+            num[0] += len(arr)
+            packer._refs[id(arr)] = ref
+        return ref
+
+    def dump(packer, dpath):
+        """Writes the groups to dpath and returns their file paths"""
+        fpath_list = [None] * len(packer._groups)
+        for gx, arrs, _ in packer._groups.values():
+            fpath_list[gx] = join(dpath, 'sver_inputs_%d.npy' % (gx,))
+            np.save(fpath_list[gx], np.concatenate(arrs))
+        return fpath_list
+
+
+def _sver_pairs_worker(task):
+    fpath_list, pair_chunk, sver_params = task
+    # copy-on-write keeps any in place change of an input private
+    blocks = [np.load(fpath, mmap_mode='c') for fpath in fpath_list]
+
+    def _take(ref):
+        gx, start, stop = ref
+        return np.asarray(blocks[gx][start:stop])
+
+    return [
+        sver_single_pair(
+            _take(kpts1_ref),
+            _take(kpts2_ref),
+            _take(fm_ref),
+            dlen_sqrd2,
+            _take(weights_ref),
+            sver_params,
+        )
+        for kpts1_ref, kpts2_ref, fm_ref, weights_ref, dlen_sqrd2 in pair_chunk
+    ]
+
+
+def parallel_spatially_verify(
+    kpts1_list,
+    kpts2_list,
+    fm_list,
+    match_weights_list,
+    dlen_sqrd_list,
+    sver_params,
+    nprocs,
+    prog_hook=None,
+):
+    r"""
+    Runs :func:`sver_single_pair` on every pair with a pool of nprocs worker
+    processes (see :func:`get_sver_pool`).
+
+    The keypoints, feature matches and match weights are written once to
+    memory mapped files (keypoints shared by several pairs are written
+    once). Each task is a chunk of pairs that only refers to its rows of
+    those files, so the chunks are small to pickle and the work of a long
+    shortlist is spread over all workers.
+
+    Returns:
+        list: svtup_list - the same results as sver_single_pair in the same
+            order
+
+    CommandLine:
+        python -m wbia.algo.hots.pipeline parallel_spatially_verify
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.pipeline import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> def random_kpts(num):
+        >>>     xy = rng.rand(num, 2) * 100
+        >>>     shape = np.array([4, 0, 4, 0]) + rng.rand(num, 4) * [4, 1, 4, 6]
+        >>>     return np.hstack([xy, shape])
+        >>> kpts1 = random_kpts(40)
+        >>> kpts2 = random_kpts(40)
+        >>> kpts2[0:20] = kpts1[0:20] + [5, 3, 0, 0, 0, 0]
+        >>> kpts2_list = [kpts2, kpts2[::-1].astype(np.float32), kpts2, random_kpts(40)]
+        >>> fm_list = [
+        >>>     np.array([(x, x) for x in range(25)], dtype=np.int32),
+        >>>     np.array([(x, 39 - x) for x in range(0, 30, 2)], dtype=np.int32),
+        >>>     np.empty((0, 2), dtype=np.int32),
+        >>>     rng.randint(0, 40, (30, 2)).astype(np.int32),
+        >>> ]
+        >>> kpts1_list = [kpts1] * len(fm_list)
+        >>> weights_list = [rng.rand(len(fm)) for fm in fm_list]
+        >>> dlen_sqrd_list = [100.0 ** 2] * len(fm_list)
+        >>> sver_params = dict(
+        >>>     xy_thresh=0.01, scale_thresh=2.0, ori_thresh=np.pi / 4,
+        >>>     min_nInliers=4, full_homog_checks=True, refine_method='homog')
+        >>> svtup_list1 = [
+        >>>     sver_single_pair(kpts1, kpts2, fm, dlen_sqrd2, weights, sver_params)
+        >>>     for kpts1, kpts2, fm, dlen_sqrd2, weights in zip(
+        >>>         kpts1_list, kpts2_list, fm_list, dlen_sqrd_list, weights_list)
+        >>> ]
+        >>> svtup_list2 = parallel_spatially_verify(
+        >>>     kpts1_list, kpts2_list, fm_list, weights_list, dlen_sqrd_list,
+        >>>     sver_params, nprocs=2)
+        >>> assert svtup_list1[0] is not None and svtup_list1[2] is None
+        >>> assert len(svtup_list1[0][0]) >= 20
+        >>> # The errors are tuples of arrays
+        >>> def flat_arrays(sv_tup):
+        >>>     return [arr for item in sv_tup for arr in ut.ensure_iterable(item)]
+        >>> for sv_tup1, sv_tup2 in zip(svtup_list1, svtup_list2):
+        >>>     assert (sv_tup1 is None) == (sv_tup2 is None)
+        >>>     if sv_tup1 is not None:
+        >>>         arrs1, arrs2 = flat_arrays(sv_tup1), flat_arrays(sv_tup2)
+        >>>         assert all(np.array_equal(a, b) for a, b in zip(arrs1, arrs2))
+        >>> # Later calls reuse the worker processes
+        >>> assert get_sver_pool(2) is get_sver_pool(2)
+    """
+    svtup_list = [None] * len(fm_list)
+    # Pairs without matches are not verified
+    pairxs = [pairx for pairx, fm in enumerate(fm_list) if len(fm) > 0]
+    if len(pairxs) == 0:
+        return svtup_list
+    packer = _SharedArrayPacker()
+    pair_list = [
+        (
+            packer.add(kpts1_list[pairx]),
+            packer.add(kpts2_list[pairx]),
+            packer.add(fm_list[pairx]),
+            packer.add(match_weights_list[pairx]),
+            dlen_sqrd_list[pairx],
+        )
+        for pairx in pairxs
+    ]
+    # A few chunks per worker balances shortlists of different lengths
+    chunksize = max(1, -(-len(pair_list) // (nprocs * 8)))
+    dpath = tempfile.mkdtemp(prefix='wbia_sver_', dir=SVER_TEMP_DPATH)
+    try:
+        fpath_list = packer.dump(dpath)
+        tasks = [
+            (fpath_list, pair_chunk, sver_params)
+            for pair_chunk in ut.ichunks(pair_list, chunksize)
+        ]
+        executor = get_sver_pool(nprocs)
+        try:
+            result_iter = executor.map(_sver_pairs_worker, tasks)
+            result_iter = ut.ProgIter(
+                result_iter,
+                length=len(tasks),
+                prog_hook=prog_hook,
+                lbl=SVER_LVL,
+                **PROGKW,
+            )
+            svtup_flat = ut.flatten(result_iter)
+        except futures.BrokenExecutor:
+            _discard_sver_pool(executor)
+            raise
+    finally:
+        shutil.rmtree(dpath, ignore_errors=True)
+    for pairx, sv_tup in zip(pairxs, svtup_flat):
+        svtup_list[pairx] = sv_tup
+    return svtup_list
+
+
+def parallel_sver_chipmatches(qreq_, cm_list, nprocs, prog_hook=None):
+    r"""
+    Spatially verifies the shortlists of all chipmatches with
+    :func:`parallel_spatially_verify`.
+
+    The (chipmatch, shortlist annot) pairs of all chipmatches are verified
+    together and the results go through the same finish_sver_chipmatch as
+    the serial path, so the chipmatches are identical to the ones of
+    sver_single_chipmatch.
+
+    CommandLine:
+        python -m wbia.algo.hots.pipeline parallel_sver_chipmatches
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.algo.hots.pipeline import *  # NOQA
+        >>> ibs, qreq_, cm_list = plh.testdata_pre_sver('PZ_MTEST', qaid_list=[18, 19, 20])
+        >>> scoring.score_chipmatch_list(qreq_, cm_list, qreq_.qparams.prescore_method)
+        >>> cm_list1 = [sver_single_chipmatch(qreq_, cm) for cm in cm_list]
+        >>> cm_list2 = parallel_sver_chipmatches(qreq_, cm_list, nprocs=2)
+        >>> for cm1, cm2 in zip(cm_list1, cm_list2):
+        >>>     assert np.all(cm1.daid_list == cm2.daid_list)
+        >>>     for key in ['fm_list', 'fsv_list', 'H_list']:
+        >>>         for arr1, arr2 in zip(getattr(cm1, key), getattr(cm2, key)):
+        >>>             assert np.array_equal(arr1, arr2)
+    """
+    sver_params = get_sver_params(qreq_)
+    inputs_list = [get_sver_inputs(qreq_, cm) for cm in cm_list]
+    kpts1_list = []
+    kpts2_list = []
+    fm_list = []
+    weights_list = []
+    dlen_sqrd_list = []
+    for cm, (kpts1, kpts2_list_, top_dlen_sqrd_list, match_weight_list) in zip(
+        cm_list, inputs_list
+    ):
+        kpts1_list.extend([kpts1] * len(cm.daid_list))
+        kpts2_list.extend(kpts2_list_)
+        fm_list.extend(cm.fm_list)
+        weights_list.extend(match_weight_list)
+        dlen_sqrd_list.extend(top_dlen_sqrd_list)
+    svtup_flat = parallel_spatially_verify(
+        kpts1_list,
+        kpts2_list,
+        fm_list,
+        weights_list,
+        dlen_sqrd_list,
+        sver_params,
+        nprocs,
+        prog_hook=prog_hook,
+    )
+    cumlen_list = np.cumsum([len(cm.daid_list) for cm in cm_list])
+    svtup_lists = ut.unflatten2(svtup_flat, cumlen_list)
+    cm_list_SVER = [
+        finish_sver_chipmatch(qreq_, cm, svtup_list, inputs[2])
+        for cm, svtup_list, inputs in zip(cm_list, svtup_lists, inputs_list)
+    ]
+    return cm_list_SVER
+
+
+def batch_sver_chipmatches(qreq_, cm_list):
+    r"""
+    Spatially verifies the shortlists of all chipmatches with the batched
+    affine hypothesis scoring of :mod:`wbia.algo.hots.batch_sver`.
+
+    The (chipmatch, shortlist annot) pairs of all chipmatches are verified
+    together and the results go through the same finish_sver_chipmatch as
+    the serial path.
+
+    CommandLine:
+        python -m wbia.algo.hots.pipeline batch_sver_chipmatches
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.algo.hots.pipeline import *  # NOQA
+        >>> ibs, qreq_, cm_list = plh.testdata_pre_sver('PZ_MTEST', qaid_list=[18, 19, 20])
+        >>> scoring.score_chipmatch_list(qreq_, cm_list, qreq_.qparams.prescore_method)
+        >>> cm_list1 = [sver_single_chipmatch(qreq_, cm) for cm in cm_list]
+        >>> cm_list2 = batch_sver_chipmatches(qreq_, cm_list)
+        >>> for cm1, cm2 in zip(cm_list1, cm_list2):
+        >>>     assert np.all(cm1.daid_list == cm2.daid_list)
+        >>>     for fm1, fm2 in zip(cm1.fm_list, cm2.fm_list):
+        >>>         assert np.array_equal(fm1, fm2)
+    """
+    sver_params = get_sver_params(qreq_)
+    inputs_list = [get_sver_inputs(qreq_, cm) for cm in cm_list]
+    kpts1_list = []
+    kpts2_list = []
+    fm_list = []
+    weights_list = []
+    dlen_sqrd_list = []
+    for cm, (kpts1, kpts2_list_, top_dlen_sqrd_list, match_weight_list) in zip(
+        cm_list, inputs_list
+    ):
+        kpts1_list.extend([kpts1] * len(cm.daid_list))
+        kpts2_list.extend(kpts2_list_)
+        fm_list.extend(cm.fm_list)
+        weights_list.extend(match_weight_list)
+        dlen_sqrd_list.extend(top_dlen_sqrd_list)
+    svtup_flat = batch_sver.batch_spatially_verify(
+        kpts1_list, kpts2_list, fm_list, weights_list, dlen_sqrd_list, sver_params
+    )
+    cumlen_list = np.cumsum([len(cm.daid_list) for cm in cm_list])
+    svtup_lists = ut.unflatten2(svtup_flat, cumlen_list)
+    cm_list_SVER = [
+        finish_sver_chipmatch(qreq_, cm, svtup_list, inputs[2])
+        for cm, svtup_list, inputs in zip(cm_list, svtup_lists, inputs_list)
+    ]
+    return cm_list_SVER
+
+
 def compute_matching_dlen_extent(qreq_, fm_list, kpts_list):
     r"""
     helper for spatial verification, computes the squared diagonal length of
@@ -21,6 +21,7 @@ from wbia.algo.hots import neighbor_index_cache
 # from wbia.algo.hots import distinctiveness_normalizer
 from wbia.algo.hots import query_params
 from wbia.algo.hots import chip_match
+from wbia.algo.hots import chip_match_store
 from wbia.algo.hots import _pipeline_helpers as plh  # NOQA
 import wbia.constants as const
 
@@ -359,6 +360,7 @@ class QueryRequest(ut.NiceRepr):
         qreq_.query_config2_ = None
         qreq_.data_config2_ = None
         qreq_._indexer_request_params = None
+        qreq_.custom_nid_lookup = None
         # Set values
         qreq_.unique_species = None  # HACK
         qreq_.qresdir = None
@@ -395,6 +397,8 @@ class QueryRequest(ut.NiceRepr):
             qresdir (str):
             ibs (wbia.IBEISController):  image analysis api
             _indexer_request_params (dict):
+            custom_nid_lookup (dict): overrides the names of the annotations.
+                It is kept on the request so derived requests use it too.
 
         Returns:
             wbia.QueryRequest
@@ -406,6 +410,7 @@ class QueryRequest(ut.NiceRepr):
         qreq_.data_config2_ = data_config2_
         qreq_.qresdir = qresdir
         qreq_._indexer_request_params = _indexer_request_params
+        qreq_.custom_nid_lookup = custom_nid_lookup
         qreq_.set_external_daids(daid_list)
         qreq_.set_external_qaids(qaid_list)
 
@@ -1216,7 +1221,11 @@ class QueryRequest(ut.NiceRepr):
         qreq_.qannots.preload('kpts', 'vecs')
         if prog_hook is not None:
             prog_hook(2, 3, 'ensure database features')
-        qreq_.dannots.preload('kpts')
+        if const.SHARD_FEATURES:
+            # Sharded descriptors are memmap views, holding them is cheap
+            qreq_.dannots.preload('kpts', 'vecs')
+        else:
+            qreq_.dannots.preload('kpts')
         if prog_hook is not None:
             prog_hook(3, 3, 'computed features')
 
@@ -1289,6 +1298,18 @@ class QueryRequest(ut.NiceRepr):
             fpath = join(dpath, fname)
             yield fpath
 
+    def get_chipmatch_store(qreq_, super_qres_cache=False):
+        r"""
+        Consolidated store of the chipmatches of this query config. Used
+        instead of get_chipmatch_fpaths when --cm-store is on.
+        """
+        dpath = qreq_.get_qresdir()
+        if super_qres_cache:
+            cfgstr = 'supercache'
+        else:
+            cfgstr = qreq_.get_cfgstr(with_input=False, with_data=True, with_pipe=True)
+        return chip_match_store.ChipMatchStore(dpath, cfgstr)
+
     def execute(
         qreq_,
         qaids=None,
@@ -1340,6 +1361,30 @@ class QueryRequest(ut.NiceRepr):
             )
         return cm_list
 
+    def execute_incremental(
+        qreq_, base_daids, prog_hook=None, use_cache=None, allow_approx=True
+    ):
+        r"""
+        Like execute, but reuses the cached results of the same queries
+        against base_daids and only matches against the new daids.
+
+        SeeAlso:
+            wbia.algo.hots.match_chips4.execute_query_incremental
+        """
+        from wbia.algo.hots import match_chips4 as mc4
+
+        qreq_.prog_hook = prog_hook
+        qaid2_cm, inc_info = mc4.execute_query_incremental(
+            qreq_,
+            base_daids,
+            use_cache=use_cache,
+            save_qcache=use_cache,
+            allow_approx=allow_approx,
+            verbose=True,
+        )
+        cm_list = [qaid2_cm[qaid] for qaid in qreq_.qaids]
+        return cm_list
+
 
 def cfg_deepcopy_test():
     """
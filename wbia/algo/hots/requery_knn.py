@@ -58,6 +58,59 @@ class TempQuery(ut.NiceRepr):
         query.vecs = query.vecs.compress(flags, axis=0)
 
 
+class TempBatchQuery(TempQuery):
+    """
+    incomplete queries from several annotations that are searched together
+
+    Each row remembers the position of the query annotation it came from
+    (its owner) and is only checked against the invalid axs of that owner.
+    """
+
+    def __init__(query, vecs, owners, invalid_axs_list, get_neighbors, get_axs):
+        invalid_keys = np.hstack(
+            [np.empty(0, dtype=np.int64)]
+            + [
+                owner_keys(owner, invalid_axs)
+                for owner, invalid_axs in enumerate(invalid_axs_list)
+            ]
+        )
+        super(TempBatchQuery, query).__init__(vecs, invalid_keys, get_neighbors, get_axs)
+        query.owners = np.asarray(owners, dtype=np.int64)
+
+    def neighbors(query, temp_K):
+        _idxs, _dists = query.get_neighbors(query.vecs, temp_K)
+        idxs = vt.atleast_nd(_idxs, 2)
+        dists = vt.atleast_nd(_dists, 2)
+        # Flag neighbors that are invalid for the owner of each row
+        keys = owner_keys(query.owners[:, None], query.get_axs(idxs))
+        validflags = ~in1d_shape(keys, query.invalid_axs)
+        cand = TempResults(query.index, idxs, dists, validflags)
+        return cand
+
+    def compress_inplace(query, flags):
+        super(TempBatchQuery, query).compress_inplace(flags)
+        query.owners = query.owners.compress(flags, axis=0)
+
+
+def owner_keys(owners, axs):
+    """
+    Combines owner positions and annotation indices into a single int64 key so
+    per-owner membership tests can be done with one call to np.isin.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.requery_knn import *  # NOQA
+        >>> keys = owner_keys(np.array([[0], [1]]), np.array([[3, 4], [3, 5]]))
+        >>> invalid_keys = np.hstack([owner_keys(0, [4]), owner_keys(1, [3])])
+        >>> print(in1d_shape(keys, invalid_keys))
+        [[False  True]
+         [ True False]]
+    """
+    owners = np.asarray(owners, dtype=np.int64)
+    axs = np.asarray(axs, dtype=np.int64)
+    return (owners << 32) | axs
+
+
 class TempResults(ut.NiceRepr):
     def __init__(cand, index, idxs, dists, validflags):
         cand.index = index
@@ -86,7 +139,7 @@ class TempResults(ut.NiceRepr):
         if DEBUG_REQUERY:
             assert all(ut.issorted(groupx) for groupx in groupxs)
             assert all([len(group) == num_neighbs for group in first_k_groupxs])
-        chosen_xs = np.array(ut.flatten(first_k_groupxs), dtype=np.int)
+        chosen_xs = np.array(ut.flatten(first_k_groupxs), dtype=np.int64)
         # chosen_xs = np.hstack(first_k_groupxs)
         # then convert these to multi-indices
         done_rows = rowxs.take(chosen_xs)
@@ -111,7 +164,7 @@ class TempResults(ut.NiceRepr):
 
 
 def in1d_shape(arr1, arr2):
-    return np.in1d(arr1, arr2).reshape(arr1.shape)
+    return np.isin(arr1, arr2)
 
 
 def requery_knn(
@@ -190,10 +243,67 @@ def requery_knn(
         >>> qfx2_idx, qfx2_dist = res
     """
 
+    query = TempQuery(qfx2_vec, invalid_axs, get_neighbors, get_axs)
+    return _requery_loop(query, num_neighbs, pad, limit, recover)
+
+
+def requery_knn_batched(
+    get_neighbors,
+    get_axs,
+    qfx2_vec,
+    qfx2_owner,
+    num_neighbs,
+    invalid_axs_list,
+    pad=2,
+    limit=4,
+    recover=True,
+):
+    """
+    Works like `requery_knn`, but the query vectors of several annotations are
+    stacked and searched together. ``qfx2_owner[n]`` is the position (in
+    ``invalid_axs_list``) of the annotation that ``qfx2_vec[n]`` belongs to, so
+    every row is only checked against the invalid axs of its own annotation.
+    The requeries are shared too: each round only searches the rows of all
+    annotations that still need more valid neighbors.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.algo.hots.requery_knn import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> max_k, n_pts, num_neighbs = 9, 8, 3
+        >>> tx2_idx_full = np.array([rng.permutation(10)[0:max_k] for _ in range(n_pts)])
+        >>> tx2_dist_full = np.tile(np.arange(max_k) / 10, (n_pts, 1))
+        >>> def get_neighbors(vecs, temp_K):
+        >>>     return tx2_idx_full[vecs.ravel(), 0:temp_K], tx2_dist_full[vecs.ravel(), 0:temp_K]
+        >>> get_axs = ut.identity
+        >>> qfx2_vec = np.arange(n_pts)[:, None]
+        >>> qfx2_owner = np.array([0, 0, 0, 1, 1, 2, 2, 2])
+        >>> invalid_axs_list = [np.array([0, 1]), np.array([], dtype=np.int64), np.array([2, 5, 7])]
+        >>> qfx2_idx, qfx2_dist = requery_knn_batched(
+        >>>     get_neighbors, get_axs, qfx2_vec, qfx2_owner, num_neighbs,
+        >>>     invalid_axs_list, pad=0, limit=2)
+        >>> # Results agree with searching each annotation on its own
+        >>> for owner, invalid_axs in enumerate(invalid_axs_list):
+        >>>     flags = qfx2_owner == owner
+        >>>     idxs, dists = requery_knn(
+        >>>         get_neighbors, get_axs, qfx2_vec[flags], num_neighbs,
+        >>>         invalid_axs, pad=0, limit=2)
+        >>>     assert np.all(idxs == qfx2_idx[flags])
+        >>>     assert np.all(dists == qfx2_dist[flags])
+        >>>     assert not np.any(np.isin(idxs, invalid_axs))
+    """
+    query = TempBatchQuery(qfx2_vec, qfx2_owner, invalid_axs_list, get_neighbors, get_axs)
+    return _requery_loop(query, num_neighbs, pad, limit, recover)
+
+
+def _requery_loop(query, num_neighbs, pad, limit, recover):
+    """
+    Doubles K for the incomplete rows of `query` until they all have
+    `num_neighbs` valid neighbors or the limit is reached.
+    """
     # Alloc space for final results
-    shape = (len(qfx2_vec), num_neighbs)
+    shape = (len(query.vecs), num_neighbs)
     final = FinalResults(shape)  # NOQA
-    query = TempQuery(qfx2_vec, invalid_axs, get_neighbors, get_axs)
 
     temp_K = num_neighbs + pad
     assert limit > 0, 'must have at least one iteration'
@@ -35,3 +35,537 @@ def benchmark_knn():
     nns_list1 = nearest_neighbors(  # NOQA
         qreq_, Kpad_list, impossible_daids_list, verbose=verbose
     )
+
+
+def benchmark_batched_knn():
+    r"""
+    Compares searching the neighbors of each query on its own against
+    searching all queries of a chunk at once for several values of
+    hots_batch_size (the number of queries per chunk).
+
+    CommandLine:
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_batched_knn
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_batched_knn --batch-sizes=1,8,32,128
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_batched_knn()
+        >>> print(result)
+    """
+    import time
+    import numpy as np
+    from wbia.algo.hots import _pipeline_helpers as plh
+    from wbia.algo.hots.pipeline import nearest_neighbors
+    import wbia
+
+    batch_sizes = ut.get_argval('--batch-sizes', type_=list, default=[1, 8, 32, 128])
+    qreq_ = wbia.testdata_qreq_(
+        defaultdb='PZ_PB_RF_TRAIN',
+        t='default:K=3,requery=True,can_match_samename=False',
+        a='default:qsize=128',
+        verbose=1,
+    )
+    locals_ = plh.testrun_pipeline_upto(qreq_, 'nearest_neighbors')
+    Kpad_list, impossible_daids_list = ut.dict_take(
+        locals_, ['Kpad_list', 'impossible_daids_list']
+    )
+
+    def run(batch_size, batched):
+        nns_list = []
+        chunks = ut.ichunk_slices(len(qreq_.qaids), batch_size)
+        start = time.perf_counter()
+        for sl_ in chunks:
+            sub_qreq_ = qreq_.shallowcopy(qaids=qreq_.qaids[sl_])
+            nns_list += nearest_neighbors(
+                sub_qreq_,
+                Kpad_list[sl_],
+                impossible_daids_list[sl_],
+                verbose=False,
+                batched=batched,
+            )
+        return time.perf_counter() - start, nns_list
+
+    result = ut.odict()
+    for batch_size in batch_sizes:
+        serial_time, nns_list1 = run(batch_size, batched=False)
+        batched_time, nns_list2 = run(batch_size, batched=True)
+        num_same = sum(
+            np.all(nn1.neighb_idxs == nn2.neighb_idxs)
+            for nn1, nn2 in zip(nns_list1, nns_list2)
+        )
+        result[batch_size] = ut.odict(
+            [
+                ('serial_time', serial_time),
+                ('batched_time', batched_time),
+                ('speedup', serial_time / batched_time),
+                ('frac_same', num_same / len(nns_list1)),
+            ]
+        )
+    logger.info(ut.repr4(result))
+    return result
+
+
+def _bench_backend(backend, vecs_list, qvecs, K, checks):
+    import time
+    import numpy as np
+    from wbia.algo.hots.neighbor_index import NeighborIndex
+
+    flann_params = {'algorithm': 'kdtree', 'trees': 8, 'backend': backend}
+    flann_params['checks'] = checks
+    indexer = NeighborIndex(flann_params, cfgstr=None)
+    aid_list = list(range(1, len(vecs_list) + 1))
+    fxs_list = [np.arange(len(vecs)) for vecs in vecs_list]
+    indexer.init_support(aid_list, vecs_list, None, fxs_list, verbose=False)
+    start = time.perf_counter()
+    indexer.reindex(verbose=False)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    qfx2_idx, qfx2_dist = indexer.knn(qvecs, K)
+    query_time = time.perf_counter() - start
+    return qfx2_idx, build_time, query_time
+
+
+def benchmark_nn_backends():
+    r"""
+    Recall and latency of the neighbor index backends. The exact brute force
+    backend is the ground truth for the recall of the approximate backends.
+
+    The testdb set indexes the descriptors of testdb1. The synthetic set
+    indexes random SIFT-like descriptors; use --num-vecs=10000000 for the
+    large benchmark.
+
+    CommandLine:
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_nn_backends
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_nn_backends --num-vecs=10000000 --checks=32,128,800
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_nn_backends()
+        >>> print(result)
+    """
+    import numpy as np
+    import wbia
+
+    K = ut.get_argval('--K', type_=int, default=4)
+    checks_list = ut.get_argval('--checks', type_=list, default=[32, 128, 800])
+    num_vecs = ut.get_argval('--num-vecs', type_=int, default=1000000)
+    num_queries = ut.get_argval('--num-queries', type_=int, default=2000)
+    rng = np.random.RandomState(0)
+
+    ibs = wbia.opendb(defaultdb='testdb1')
+    aid_list = ibs.get_valid_aids()
+    testdb_vecs_list = ibs.get_annot_vecs(aid_list)
+    testdb_qvecs = ibs.get_annot_vecs(aid_list[0])
+
+    # SIFT-like descriptors: non-negative with most of the mass in a few bins
+    synth_vecs = np.minimum(rng.exponential(20, size=(num_vecs, 128)), 255)
+    synth_vecs = synth_vecs.astype(np.uint8)
+    synth_vecs_list = np.array_split(synth_vecs, max(1, num_vecs // 1000))
+    noise = rng.randint(-8, 9, size=(num_queries, 128))
+    synth_qvecs = synth_vecs[rng.choice(num_vecs, num_queries)] + noise
+    synth_qvecs = np.clip(synth_qvecs, 0, 255).astype(np.uint8)
+
+    datasets = [
+        ('testdb1', testdb_vecs_list, testdb_qvecs),
+        ('synthetic', synth_vecs_list, synth_qvecs),
+    ]
+    result = ut.odict()
+    for dbname, vecs_list, qvecs in datasets:
+        rows = ut.odict()
+        exact_idx, build_time, query_time = _bench_backend(
+            'brute', vecs_list, qvecs, K, None
+        )
+        rows['brute'] = ut.odict(
+            [('build_time', build_time), ('query_time', query_time), ('recall', 1.0)]
+        )
+        for checks in checks_list:
+            qfx2_idx, build_time, query_time = _bench_backend(
+                'flann', vecs_list, qvecs, K, checks
+            )
+            num_found = sum(
+                len(np.intersect1d(idxs, exact_idxs))
+                for idxs, exact_idxs in zip(qfx2_idx, exact_idx)
+            )
+            rows['flann_checks=%d' % (checks,)] = ut.odict(
+                [
+                    ('build_time', build_time),
+                    ('query_time', query_time),
+                    ('recall', num_found / exact_idx.size),
+                ]
+            )
+        result[dbname] = rows
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_pq_index():
+    r"""
+    Memory and accuracy of the product quantized backends against the
+    current FLANN index.
+
+    Reports the bytes of each search structure and of the indexed vectors,
+    the recall of the K nearest neighbors (the exact brute force backend is
+    the ground truth) and the LNBNN name rank accuracy of full queries.
+
+    CommandLine:
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_pq_index
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_pq_index --db PZ_Master1
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_pq_index()
+        >>> print(result)
+    """
+    import numpy as np
+    import wbia
+
+    dbname = ut.get_argval('--db', type_=str, default='PZ_MTEST')
+    backends = ut.get_argval(
+        '--backends', type_=list, default=['flann', 'brute', 'pq', 'ivfpq']
+    )
+    result = ut.odict()
+    exact_nns = None
+    for backend in backends:
+        qreq_ = wbia.testdata_qreq_(
+            defaultdb=dbname,
+            a='default',
+            p='default:nn_backend=%s' % (backend,),
+            verbose=0,
+        )
+        qreq_.load_indexer()
+        indexer = qreq_.indexer
+        if hasattr(indexer.flann, 'nbytes'):
+            index_nbytes = indexer.flann.nbytes()
+        else:
+            index_nbytes = indexer.flann.used_memory()
+        K = qreq_.qparams.K + qreq_.qparams.Knorm
+        qvecs = np.vstack(qreq_.internal_qannots.vecs)
+        qfx2_idx, qfx2_dist = indexer.knn(qvecs, K)
+        if exact_nns is None:
+            exact_qreq_ = wbia.testdata_qreq_(
+                defaultdb=dbname, a='default', p='default:nn_backend=brute', verbose=0
+            )
+            exact_qreq_.load_indexer()
+            exact_nns = exact_qreq_.indexer.knn(qvecs, K)[0]
+        num_found = sum(
+            len(np.intersect1d(idxs, exact_idxs))
+            for idxs, exact_idxs in zip(qfx2_idx, exact_nns)
+        )
+        cm_list = qreq_.execute()
+        name_ranks = np.array(
+            [cm.get_name_ranks([cm.qnid])[0] for cm in cm_list], dtype=float
+        )
+        result[backend] = ut.odict(
+            [
+                ('index_nbytes', index_nbytes),
+                ('vecs_nbytes', indexer.idx2_vec.nbytes),
+                ('knn_recall', num_found / exact_nns.size),
+                ('top1_name_accuracy', np.mean(name_ranks == 0)),
+                ('top5_name_accuracy', np.mean(name_ranks < 5)),
+            ]
+        )
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_batched_sver():
+    r"""
+    Throughput of spatially verifying PZ_MTEST sized shortlists one pair at a
+    time (vt.spatially_verify_kpts) against the batched affine hypothesis
+    scoring of wbia.algo.hots.batch_sver.
+
+    Reports the verified pairs per second of both and the fraction of pairs
+    with identical homography inliers.
+
+    CommandLine:
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_batched_sver
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_batched_sver --batch-sver-cells=65536
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_batched_sver()
+        >>> print(result)
+    """
+    import time
+    import numpy as np
+    from wbia.algo.hots import _pipeline_helpers as plh
+    from wbia.algo.hots import batch_sver
+    from wbia.algo.hots import pipeline
+    from wbia.algo.hots import scoring
+
+    ibs, qreq_, cm_list = plh.testdata_pre_sver('PZ_MTEST')
+    qparams = qreq_.qparams
+    scoring.score_chipmatch_list(qreq_, cm_list, qparams.prescore_method)
+    cm_shortlist = scoring.make_chipmatch_shortlists(
+        qreq_,
+        cm_list,
+        qparams.nNameShortlistSVER,
+        qparams.nAnnotPerNameSVER,
+        qparams.score_method,
+    )
+    sver_params = pipeline.get_sver_params(qreq_)
+    pair_list = []
+    for cm in cm_shortlist:
+        kpts1, kpts2_list, dlen_sqrd_list, weights_list = pipeline.get_sver_inputs(
+            qreq_, cm
+        )
+        for kpts2, fm, dlen_sqrd2, weights in zip(
+            kpts2_list, cm.fm_list, dlen_sqrd_list, weights_list
+        ):
+            pair_list.append((kpts1, kpts2, fm, dlen_sqrd2, weights))
+    num_pairs = len(pair_list)
+
+    start = time.perf_counter()
+    svtup_list1 = [
+        pipeline.sver_single_pair(kpts1, kpts2, fm, dlen_sqrd2, weights, sver_params)
+        for kpts1, kpts2, fm, dlen_sqrd2, weights in pair_list
+    ]
+    serial_time = time.perf_counter() - start
+
+    kpts1_list, kpts2_list, fm_list, dlen_sqrd_list, weights_list = zip(*pair_list)
+    start = time.perf_counter()
+    svtup_list2 = batch_sver.batch_spatially_verify(
+        kpts1_list, kpts2_list, fm_list, weights_list, dlen_sqrd_list, sver_params
+    )
+    batched_time = time.perf_counter() - start
+
+    num_same = sum(
+        (svtup1 is None and svtup2 is None)
+        or (
+            svtup1 is not None
+            and svtup2 is not None
+            and np.array_equal(svtup1[0], svtup2[0])
+        )
+        for svtup1, svtup2 in zip(svtup_list1, svtup_list2)
+    )
+    result = ut.odict(
+        [
+            ('num_pairs', num_pairs),
+            ('num_matches', sum(len(fm) for fm in fm_list)),
+            ('serial_pairs_per_sec', num_pairs / serial_time),
+            ('batched_pairs_per_sec', num_pairs / batched_time),
+            ('speedup', serial_time / batched_time),
+            ('frac_same', num_same / max(num_pairs, 1)),
+        ]
+    )
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_csr_chipmatch():
+    r"""
+    Time and memory of scoring PZ_MTEST chipmatches stored as lists of small
+    arrays against the same chipmatches stored as CSRLists
+    (wbia.algo.hots.chip_match_csr, --csr-chipmatch in the pipeline).
+
+    CommandLine:
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_csr_chipmatch
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_csr_chipmatch()
+        >>> print(result)
+    """
+    import sys
+    import time
+    import numpy as np
+    from wbia.algo.hots import _pipeline_helpers as plh
+    from wbia.algo.hots.chip_match_csr import CSRList
+
+    ibs, qreq_, cm_list = plh.testdata_pre_sver('PZ_MTEST')
+    attrs = ['fm_list', 'fsv_list', 'fk_list']
+    csr_cm_list = []
+    for cm in cm_list:
+        csr_cm = cm.copy()
+        for attr in attrs:
+            setattr(csr_cm, attr, CSRList.from_list(getattr(cm, attr)))
+        csr_cm.filtnorm_aids = [
+            None if aids is None else CSRList.from_list(aids) for aids in cm.filtnorm_aids
+        ]
+        csr_cm.filtnorm_fxs = [
+            None if fxs is None else CSRList.from_list(fxs) for fxs in cm.filtnorm_fxs
+        ]
+        csr_cm_list.append(csr_cm)
+
+    def list_nbytes(arr_list):
+        return sys.getsizeof(arr_list) + sum(sys.getsizeof(arr) for arr in arr_list)
+
+    def score_all(cm_list_):
+        start = time.perf_counter()
+        for cm in cm_list_:
+            cm.score_name_nsum(qreq_)
+            top = cm.take_annots(cm.argsort()[0:20])
+            top.score_name_nsum(qreq_)
+        return time.perf_counter() - start
+
+    list_time = score_all(cm_list)
+    csr_time = score_all(csr_cm_list)
+    num_same = sum(
+        np.array_equal(cm.name_score_list, csr_cm.name_score_list)
+        and np.array_equal(cm.annot_score_list, csr_cm.annot_score_list)
+        for cm, csr_cm in zip(cm_list, csr_cm_list)
+    )
+    result = ut.odict(
+        [
+            ('num_queries', len(cm_list)),
+            ('num_annots', sum(len(cm.daid_list) for cm in cm_list)),
+            ('list_time', list_time),
+            ('csr_time', csr_time),
+            ('speedup', list_time / csr_time),
+            (
+                'list_nbytes',
+                sum(list_nbytes(getattr(cm, attr)) for cm in cm_list for attr in attrs),
+            ),
+            (
+                'csr_nbytes',
+                sum(getattr(cm, attr).nbytes for cm in csr_cm_list for attr in attrs),
+            ),
+            ('frac_same', num_same / max(len(cm_list), 1)),
+        ]
+    )
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_chipmatch_store():
+    r"""
+    Saving, checking and loading PZ_MTEST chipmatches as one cPkl file per
+    query against the consolidated wbia.algo.hots.chip_match_store
+    (--cm-store in match_chips4).
+
+    CommandLine:
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_chipmatch_store
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_chipmatch_store --num-cms=5000
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_chipmatch_store()
+        >>> print(result)
+    """
+    import tempfile
+    import time
+    from os.path import exists, join
+    from wbia.algo.hots import _pipeline_helpers as plh
+    from wbia.algo.hots import chip_match
+    from wbia.algo.hots import chip_match_store
+
+    num_cms = ut.get_argval('--num-cms', type_=int, default=1000)
+    ibs, qreq_, cm_list = plh.testdata_pre_sver('PZ_MTEST')
+    for cm in cm_list:
+        cm.score_name_nsum(qreq_)
+    # Copies of the real chipmatches stand in for the queries
+    cms = [cm_list[idx % len(cm_list)] for idx in range(num_cms)]
+    keys = list(range(num_cms))
+    dpath = tempfile.mkdtemp()
+    fpath_list = [join(dpath, 'cm_%d.cPkl' % (key,)) for key in keys]
+
+    timings = ut.odict()
+    start = time.perf_counter()
+    for cm, fpath in zip(cms, fpath_list):
+        cm.save_to_fpath(fpath, verbose=False)
+    timings['fpath_save'] = time.perf_counter() - start
+    start = time.perf_counter()
+    flags = [exists(fpath) for fpath in fpath_list]
+    timings['fpath_exists'] = time.perf_counter() - start
+    start = time.perf_counter()
+    loaded1 = [
+        chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
+        for fpath, flag in zip(fpath_list, flags)
+        if flag
+    ]
+    timings['fpath_load'] = time.perf_counter() - start
+
+    # The store is keyed by qaid and query uuid
+    with chip_match_store.ChipMatchStore(dpath, 'bench') as store:
+        qaids = [cm.qaid for cm in cms]
+        start = time.perf_counter()
+        store.save_chipmatches(cms, keys)
+        timings['store_save'] = time.perf_counter() - start
+        start = time.perf_counter()
+        store.exists(qaids, keys)
+        timings['store_exists'] = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded2 = store.load_chipmatches(qaids, keys)
+        timings['store_load'] = time.perf_counter() - start
+        start = time.perf_counter()
+        store.clear()
+        timings['store_clear'] = time.perf_counter() - start
+
+    num_same = sum(cm1 == cm2 for cm1, cm2 in zip(loaded1, loaded2))
+    result = ut.odict(
+        [
+            ('num_cms', num_cms),
+            ('timings', timings),
+            ('load_speedup', timings['fpath_load'] / timings['store_load']),
+            ('frac_same', num_same / max(num_cms, 1)),
+        ]
+    )
+    ut.delete(dpath, verbose=False)
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_incremental_query():
+    r"""
+    Full PZ_MTEST queries against an incremental query that reuses the cached
+    results against the first part of the database
+    (match_chips4.execute_query_incremental).
+
+    CommandLine:
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_incremental_query
+        python ~/code/wbia/wbia/algo/hots/tests/bench.py benchmark_incremental_query --base-frac=0.95
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_incremental_query()
+        >>> print(result)
+    """
+    import time
+    import wbia
+    from wbia.algo.hots import match_chips4 as mc4
+
+    base_frac = ut.get_argval('--base-frac', type_=float, default=0.8)
+    ibs = wbia.opendb('PZ_MTEST')
+    daids = ibs.get_valid_aids()
+    qaids = daids
+    base_daids = daids[: int(len(daids) * base_frac)]
+    cfgdict = dict(sv_on=True)
+    qreq_ = ibs.new_query_request(qaids, daids, cfgdict=cfgdict)
+    base_qreq_ = ibs.new_query_request(qaids, base_daids, cfgdict=cfgdict)
+    # Cache the results against the base daids
+    base_qreq_.execute(use_cache=True)
+
+    start = time.perf_counter()
+    qaid2_cm_full = mc4.execute_query_and_save_L1(qreq_, False, False)
+    time_full = time.perf_counter() - start
+    start = time.perf_counter()
+    qaid2_cm_inc, inc_info = mc4.execute_query_incremental(
+        qreq_, base_daids, use_cache=False, save_qcache=False
+    )
+    time_inc = time.perf_counter() - start
+
+    num_same_top = 0
+    for qaid, cm in qaid2_cm_full.items():
+        cm_ = qaid2_cm_inc[qaid]
+        num_same_top += list(cm.get_top_nids(ntop=1)) == list(cm_.get_top_nids(ntop=1))
+    result = ut.odict(
+        [
+            ('num_qaids', len(qaids)),
+            ('num_base_daids', len(base_daids)),
+            ('inc_info', inc_info),
+            ('time_full', time_full),
+            ('time_inc', time_inc),
+            ('speedup', time_full / time_inc),
+            ('frac_exact', inc_info['num_exact'] / len(qaids)),
+            ('frac_same_top_name', num_same_top / len(qaids)),
+        ]
+    )
+    logger.info(ut.repr4(result))
+    return result
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from wbia.algo.hots import batch_sver
+from wbia.algo.hots.pipeline import sver_single_pair
+
+SVER_PARAMS = dict(
+    xy_thresh=0.01,
+    scale_thresh=2.0,
+    ori_thresh=np.pi / 4,
+    min_nInliers=4,
+    full_homog_checks=True,
+    refine_method='homog',
+)
+
+
+def random_kpts(rng, num):
+    xy = rng.rand(num, 2) * 100
+    shape = np.array([4, 0, 4, 0]) + rng.rand(num, 4) * [4, 1, 4, 6]
+    return np.hstack([xy, shape])
+
+
+@pytest.fixture
+def pairs():
+    rng = np.random.RandomState(0)
+    kpts1 = random_kpts(rng, 40)
+    kpts2 = random_kpts(rng, 40)
+    kpts2[0:20] = kpts1[0:20] + [5, 3, 0, 0, 0, 0]
+    kpts3 = kpts1.copy()
+    kpts3[:, 0:2] = kpts1[:, 0:2] * 1.5 + [10, -4]
+    kpts3[:, 2:5] *= 1.5
+    fm_list = [
+        np.array([(x, x) for x in range(25)], dtype=np.int32),
+        np.array([(x, 39 - x) for x in range(0, 30, 2)], dtype=np.int32),
+        np.empty((0, 2), dtype=np.int32),
+        rng.randint(0, 40, (30, 2)).astype(np.int32),
+        np.array([(x, x) for x in range(0, 40, 3)], dtype=np.int32),
+        np.array([(x, x) for x in range(5)], dtype=np.int32),
+    ]
+    kpts1_list = [kpts1] * len(fm_list)
+    kpts2_list = [kpts2, kpts2, kpts2, random_kpts(rng, 40), kpts3, kpts2]
+    weights_list = [np.ones(len(fm)) for fm in fm_list]
+    dlen_sqrd_list = [100.0 ** 2] * len(fm_list)
+    return kpts1_list, kpts2_list, fm_list, weights_list, dlen_sqrd_list
+
+
+def test_batch_matches_single_pair(pairs):
+    svtup_list1 = [
+        sver_single_pair(kpts1, kpts2, fm, dlen_sqrd2, weights, SVER_PARAMS)
+        for kpts1, kpts2, fm, weights, dlen_sqrd2 in zip(*pairs)
+    ]
+    # A small batch size splits the pairs into several batches
+    svtup_list2 = batch_sver.batch_spatially_verify(*pairs, SVER_PARAMS, max_cells=2000)
+    assert svtup_list1[0] is not None and svtup_list1[4] is not None
+    assert [tup is None for tup in svtup_list2] == [tup is None for tup in svtup_list1]
+    for tup1, tup2 in zip(svtup_list1, svtup_list2):
+        if tup1 is None:
+            continue
+        homog_inliers1, _, H1, aff_inliers1, _, Aff1 = tup1
+        homog_inliers2, _, H2, aff_inliers2, _, Aff2 = tup2
+        assert np.array_equal(aff_inliers1, aff_inliers2)
+        assert np.array_equal(homog_inliers1, homog_inliers2)
+        assert np.allclose(Aff1, Aff2)
+        assert np.allclose(H1, H2)
+
+
+def test_batch_refine_error_is_no_hypothesis(pairs, monkeypatch):
+    def refine_inliers(*args, **kwargs):
+        raise RuntimeError('refinement failed')
+
+    monkeypatch.setattr(batch_sver.vt, 'refine_inliers', refine_inliers)
+    svtup_list = batch_sver.batch_spatially_verify(*pairs, SVER_PARAMS)
+    assert svtup_list == [None] * len(svtup_list)
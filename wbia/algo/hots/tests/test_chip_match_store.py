@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import threading
+from os.path import exists
+
+import pytest
+
+from wbia.algo.hots import name_scoring
+from wbia.algo.hots.chip_match_store import ChipMatchStore
+
+
+@pytest.fixture
+def cm_list():
+    cm_list = []
+    for qaid in [1, 2, 3]:
+        cm = name_scoring.testdata_chipmatch()
+        cm.qaid = qaid
+        cm_list.append(cm)
+    return cm_list
+
+
+def test_compact_generations(tmp_path, cm_list):
+    with ChipMatchStore(str(tmp_path), 'cfg') as store:
+        store.save_chipmatches(cm_list, ['a', 'b', 'c'])
+        store.remove([1], ['a'])
+        old_fpath = store.records_fpath
+        store.compact()
+        assert store.records_fpath != old_fpath
+        assert not exists(old_fpath)
+        assert store.load_chipmatches([1, 2, 3], ['a', 'b', 'c']) == [
+            None,
+            cm_list[1],
+            cm_list[2],
+        ]
+        # New records are appended to the new generation
+        store.save_chipmatches(cm_list[0:1], ['a'])
+    with ChipMatchStore(str(tmp_path), 'cfg') as store:
+        assert store.load_chipmatches([1, 2, 3], ['a', 'b', 'c']) == cm_list
+
+
+def test_compact_during_load(tmp_path, cm_list):
+    dpath = str(tmp_path)
+    with ChipMatchStore(dpath, 'cfg') as store:
+        store.save_chipmatches(cm_list, ['a', 'b', 'c'])
+        store.remove([1], ['a'])
+
+    reader = ChipMatchStore(dpath, 'cfg')
+    lookup = reader._lookup
+    threads = []
+
+    def compact():
+        with ChipMatchStore(dpath, 'cfg') as writer:
+            writer.compact()
+
+    def lookup_then_compact(qaids, quuids):
+        loc_list = lookup(qaids, quuids)
+        # Compact the records after the offsets were read
+        thread = threading.Thread(target=compact)
+        thread.start()
+        thread.join(timeout=0.5)
+        threads.append(thread)
+        return loc_list
+
+    reader._lookup = lookup_then_compact
+    try:
+        loaded = reader.load_chipmatches([2, 3], ['b', 'c'])
+    finally:
+        for thread in threads:
+            thread.join()
+        reader.close()
+    # The reader read the offsets and the file of the same generation
+    assert loaded == cm_list[1:]
+    with ChipMatchStore(dpath, 'cfg') as store:
+        assert store.load_chipmatches([2, 3], ['b', 'c']) == cm_list[1:]
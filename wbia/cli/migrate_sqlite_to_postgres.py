@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import logging
 import re
-import subprocess
 import sys
 from pathlib import Path
 
@@ -10,9 +9,8 @@ import sqlalchemy
 
 from wbia.dtool.copy_sqlite_to_postgres import (
     copy_sqlite_to_postgres,
-    SqliteDatabaseInfo,
-    PostgresDatabaseInfo,
-    compare_databases,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_TABLE_WORKERS,
 )
 
 
@@ -41,7 +39,19 @@ logger = logging.getLogger('wbia')
     default=6,
     help='number of migration processes to concurrently run',
 )
-def main(db_dir, db_uri, verbose, num_procs):
+@click.option(
+    '--table-workers',
+    type=int,
+    default=DEFAULT_TABLE_WORKERS,
+    help='number of tables of a database to concurrently copy',
+)
+@click.option(
+    '--chunk-size',
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help='number of rows per copied and verified chunk',
+)
+def main(db_dir, db_uri, verbose, num_procs, table_workers, chunk_size):
     """"""
     # Set up logging
     if verbose:
@@ -78,6 +88,8 @@ def main(db_dir, db_uri, verbose, num_procs):
             Path(db_dir),
             db_uri,
             num_procs=num_procs,
+            chunk_size=chunk_size,
+            table_workers=table_workers,
         ):
             if exc is not None:
                 logger.info(f'\nfailed while processing {str(path)}\n{exc}')
@@ -95,25 +107,11 @@ def main(db_dir, db_uri, verbose, num_procs):
             # __cause__ is the formated traceback on a multiprocess exception
             logger.info('-' * 30)
             logger.info(exc.__cause__)
-        if isinstance(exc, subprocess.CalledProcessError):
-            logger.info('-' * 30)
-            logger.info(exc.stdout.decode())
-
-    # Verify the migration
-    db_infos = [
-        SqliteDatabaseInfo(Path(db_dir)),
-        PostgresDatabaseInfo(db_uri),
-    ]
-    differences = compare_databases(*db_infos)
 
-    if differences:
-        logger.info(f'Databases {db_infos[0]} and {db_infos[1]} are different:')
-        for line in differences:
-            logger.info(line)
+    # Each table was verified by comparing the checksums of its chunks
+    if problems:
         sys.exit(1)
-    else:
-        logger.info(f'Database {db_infos[0]} successfully migrated to {db_infos[1]}')
-
+    logger.info(f'Databases in {db_dir} successfully migrated to {db_uri}')
     sys.exit(0)
 
 
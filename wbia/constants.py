@@ -19,6 +19,11 @@ logger = logging.getLogger('wbia')
 CONTAINERIZED = ut.get_argflag('--containerized')
 PRODUCTION = ut.get_argflag('--production')
 HTTPS = ut.get_argflag('--https')
+# Store feature depcache arrays in memory-mapped shards (see dtool.shard_store)
+SHARD_FEATURES = ut.get_argflag('--shard-features')
+# Size of the in-memory row cache of each depcache (see dtool.row_cache)
+DEPC_ROW_CACHE_MB = ut.get_argval('--depc-row-cache-mb', type_=int, default=0)
+DEPC_ROW_CACHE_NBYTES = DEPC_ROW_CACHE_MB * 2 ** 20
 
 
 CONTAINER_NAME = ut.get_argval(
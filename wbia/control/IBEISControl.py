@@ -748,6 +748,8 @@ class IBEISController(BASE_CLASS):
             const.IMAGE_TABLE,
             self.get_image_uuids,
             root_getters=image_root_getters,
+            row_cache_nbytes=const.DEPC_ROW_CACHE_NBYTES,
+            get_root_rowids=self._get_all_gids,
         )
         self.depc_image.initialize()
 
@@ -772,6 +774,8 @@ class IBEISController(BASE_CLASS):
             const.ANNOTATION_TABLE,
             self.get_annot_visual_uuids,
             root_getters=annot_root_getters,
+            row_cache_nbytes=const.DEPC_ROW_CACHE_NBYTES,
+            get_root_rowids=self._get_all_aids,
         )
         # backwards compatibility
         self.depc = self.depc_annot
@@ -787,6 +791,8 @@ class IBEISController(BASE_CLASS):
             const.PART_TABLE,
             self.get_part_uuids,
             root_getters=part_root_getters,
+            row_cache_nbytes=const.DEPC_ROW_CACHE_NBYTES,
+            get_root_rowids=self._get_all_part_rowids,
         )
         self.depc_part.initialize()
 
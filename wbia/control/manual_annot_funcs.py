@@ -1266,6 +1266,40 @@ def get_annot_exemplar_flags(ibs, aid_list):
     return annot_exemplar_flag_list
 
 
+@register_ibs_method
+def get_annot_columnar(ibs, aid_list, colnames):
+    r"""
+    Reads columns of the annotation table into numpy masked arrays.
+
+    This is not part of the web API because masked arrays cannot be
+    serialized to JSON.
+
+    Args:
+        ibs (IBEISController):  wbia controller object
+        aid_list (list):  list of annotation ids
+        colnames (tuple): annotation table columns
+
+    Returns:
+        list: one masked array per column, masked where the annotation or its
+            value is missing
+
+    CommandLine:
+        python -m wbia.control.manual_annot_funcs --test-get_annot_columnar
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.control.manual_annot_funcs import *  # NOQA
+        >>> import wbia
+        >>> ibs = wbia.opendb('testdb1')
+        >>> aid_list = ibs.get_valid_aids()
+        >>> flags, gids = get_annot_columnar(
+        >>>     ibs, aid_list, ('annot_exemplar_flag', 'image_rowid'))
+        >>> assert flags.tolist() == ibs.get_annot_exemplar_flags(aid_list)
+        >>> assert gids.tolist() == ibs.get_annot_gids(aid_list)
+    """
+    return ibs.db.get_columnar(const.ANNOTATION_TABLE, colnames, aid_list)
+
+
 @register_ibs_method
 @ut.accepts_numpy
 @accessor_decors.getter_1to1
@@ -1083,14 +1083,24 @@ class FeatConfig(dtool.Config):
 #         pass
 
 
+if const.SHARD_FEATURES:
+    # Feature arrays are appended to memory-mapped shards. The tables live in a
+    # separate database so both storage layouts can coexist in one cache dir.
+    FeatArrayType = dtool.ShardType()
+    FEAT_FNAME = 'featshards'
+else:
+    FeatArrayType = np.ndarray
+    FEAT_FNAME = 'featcache'
+
+
 @derived_attribute(
     tablename='feat',
     parents=['chips'],
     colnames=['num_feats', 'kpts', 'vecs'],
-    coltypes=[int, np.ndarray, np.ndarray],
+    coltypes=[int, FeatArrayType, FeatArrayType],
     configclass=FeatConfig,
     rm_extern_on_delete=True,
-    fname='featcache',
+    fname=FEAT_FNAME,
     chunksize=1024,
 )
 def compute_feats(depc, cid_list, config=None):
@@ -1283,10 +1293,10 @@ class FeatWeightConfig(dtool.Config):
     tablename='featweight',
     parents=['feat', 'probchip'],
     colnames=['fwg'],
-    coltypes=[np.ndarray],
+    coltypes=[FeatArrayType],
     configclass=FeatWeightConfig,
     rm_extern_on_delete=True,
-    fname='featcache',
+    fname=FEAT_FNAME,
     chunksize=64 if const.CONTAINERIZED else 512,
 )
 def compute_fgweights(depc, fid_list, pcid_list, config=None):
@@ -1584,6 +1594,15 @@ class IndexerConfig(dtool.Config):
     """
 
     _param_info_list = [
+        ut.ParamInfo('backend', 'flann', hideif='flann'),
+        ut.ParamInfo(
+            'pq_m', 16, hideif=lambda cfg: cfg['backend'] not in ['pq', 'ivfpq']
+        ),
+        ut.ParamInfo(
+            'pq_rerank', 4, hideif=lambda cfg: cfg['backend'] not in ['pq', 'ivfpq']
+        ),
+        ut.ParamInfo('pq_nlist', 256, hideif=lambda cfg: cfg['backend'] != 'ivfpq'),
+        ut.ParamInfo('pq_nprobe', 8, hideif=lambda cfg: cfg['backend'] != 'ivfpq'),
         ut.ParamInfo('algorithm', 'kdtree', 'alg'),
         ut.ParamInfo('random_seed', 42, 'seed'),
         ut.ParamInfo('trees', 4, hideif=lambda cfg: cfg['algorithm'] != 'kdtree'),
@@ -1598,6 +1617,13 @@ class IndexerConfig(dtool.Config):
     def get_flann_params(self):
         default_params = vt.get_flann_params(self['algorithm'])
         flann_params = ut.update_existing(default_params, self.asdict())
+        flann_params['backend'] = self['backend']
+        if self['backend'] in ['pq', 'ivfpq']:
+            flann_params['pq_m'] = self['pq_m']
+            flann_params['pq_rerank'] = self['pq_rerank']
+        if self['backend'] == 'ivfpq':
+            flann_params['pq_nlist'] = self['pq_nlist']
+            flann_params['pq_nprobe'] = self['pq_nprobe']
         return flann_params
 
 
@@ -1,17 +1,30 @@
 # -*- coding: utf-8 -*-
 """
-Copy sqlite database into a postgresql database using pgloader (from
-apt-get)
+Copy sqlite databases into a postgresql database
+
+The tables are streamed in chunks into ``COPY FROM STDIN`` in the binary
+format and verified by comparing the checksums of the chunks read back from
+postgres.
 """
+import ast
+import collections
+import hashlib
+import io
 import logging
+import math
 import re
-import shutil
-import subprocess
-import tempfile
+import struct
 import traceback
 import typing
-from concurrent.futures import as_completed, ProcessPoolExecutor
-from functools import partial, wraps
+import uuid
+from concurrent.futures import (
+    as_completed,
+    wait,
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from functools import partial
 from pathlib import Path
 
 import numpy as np
@@ -480,32 +493,594 @@ def compare_databases(
 # ##############################
 
 
-def add_rowids(engine):
-    connection = engine.connect()
-    create_table_stmts = connection.execute(
-        """\
-        SELECT name, sql FROM sqlite_master
-        WHERE name NOT LIKE 'sqlite_%' AND type = 'table'
-        """
-    ).fetchall()
-    for table, stmt in create_table_stmts:
-        # Create a new table with suffix "_with_rowid"
-        new_table = f'{table}_with_rowid'
-        stmt = re.sub(
-            r'CREATE TABLE [^ ]* \(',
-            f'CREATE TABLE {new_table} (rowid INTEGER NOT NULL UNIQUE, ',
-            stmt,
+class ChecksumMismatchError(Exception):
+    """Raised when chunks read back from postgres differ from the copied chunks"""
+
+
+#: Information about a chunk of rows copied from a sqlite table. The digest is
+#: the md5 of the chunk's tuples in the postgres binary COPY format.
+ChunkInfo = collections.namedtuple(
+    'ChunkInfo', ('index', 'first_rowid', 'last_rowid', 'num_rows', 'digest')
+)
+
+#: Columns of a sqlite table (``pg_kind`` is a key of ``COPY_ENCODERS``)
+ColumnSpec = collections.namedtuple(
+    'ColumnSpec', ('name', 'sqlite_type', 'pg_type', 'pg_kind', 'notnull', 'default')
+)
+
+
+class TableSpec:
+    """Schema of a sqlite table as it is recreated in postgres"""
+
+    def __init__(self, name, columns, primary_key, unique_constraints, indexes):
+        self.name = name
+        self.columns = columns
+        self.primary_key = primary_key
+        self.unique_constraints = unique_constraints
+        # (index name, is unique, column names)
+        self.indexes = indexes
+        self.dependencies = set()
+
+    def __repr__(self):
+        return f'<TableSpec {self.name} ncols={len(self.columns)}>'
+
+    @property
+    def column_names(self):
+        return ['rowid'] + [column.name for column in self.columns]
+
+    @property
+    def encoders(self):
+        return [COPY_ENCODERS['int8']] + [
+            COPY_ENCODERS[column.pg_kind] for column in self.columns
+        ]
+
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+_NULL_FIELD = struct.pack('!i', -1)
+_INT8_FIELD = struct.Struct('!iq')
+_FLOAT8_FIELD = struct.Struct('!id')
+_NUM_FIELDS = struct.Struct('!h')
+_FIELD_SIZE = struct.Struct('!i')
+
+#: Number of rows per COPY chunk (and per verification checksum)
+DEFAULT_CHUNK_SIZE = 10000
+#: Number of tables of a database loaded concurrently
+DEFAULT_TABLE_WORKERS = 4
+
+# Declared sqlite type to postgres type and COPY encoding. "REAL" in
+# postgresql only can only store 6 digits and so we'd lose precision.
+SQLITE_TO_POSTGRES_TYPES = {
+    'INTEGER': ('BIGINT', 'int8'),
+    'INT': ('BIGINT', 'int8'),
+    'BIGINT': ('BIGINT', 'int8'),
+    'BOOLEAN': ('BIGINT', 'int8'),
+    'REAL': ('DOUBLE PRECISION', 'float8'),
+    'FLOAT': ('DOUBLE PRECISION', 'float8'),
+    'DOUBLE': ('DOUBLE PRECISION', 'float8'),
+    'TEXT': ('TEXT', 'text'),
+    'VARCHAR': ('TEXT', 'text'),
+    'BLOB': ('BYTEA', 'bytea'),
+    'UUID': ('UUID', 'uuid'),
+    # Domains created by ``before_load``
+    'NDARRAY': ('ndarray', 'bytea'),
+    'NUMPY': ('numpy', 'bytea'),
+    'DICT': ('dict', 'json'),
+    'LIST': ('list', 'json'),
+}
+
+_LITERAL_DEFAULT_PATTERN = re.compile(r"^(-?\d+(\.\d+)?|'[^']*'|NULL)$", re.IGNORECASE)
+
+
+def _to_integer(value):
+    """Integer of a value of an INTEGER column (sqlite does not enforce types)"""
+    # We have some float in integer fields in sqlite, for example in
+    # annotmatch, the annotmatch_posixtime_modified field has values
+    # like 1607396181.67946
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return math.floor(value)
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    try:
+        return int(value)
+    except ValueError:
+        return math.floor(float(value))
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return bytes(value)
+
+
+def _encode_int8(value):
+    return _INT8_FIELD.pack(8, _to_integer(value))
+
+
+def _encode_float8(value):
+    return _FLOAT8_FIELD.pack(8, float(value))
+
+
+def _encode_text(value):
+    if isinstance(value, bytes):
+        data = value
+    else:
+        data = str(value).encode('utf-8')
+    return _FIELD_SIZE.pack(len(data)) + data
+
+
+def _encode_bytea(value):
+    data = _to_bytes(value)
+    return _FIELD_SIZE.pack(len(data)) + data
+
+
+def _encode_uuid(value):
+    # sqlite stores uuids as little-endian bytes (see wbia.dtool.types.UUID)
+    if isinstance(value, str):
+        data = uuid.UUID(value).bytes
+    else:
+        data = uuid.UUID(bytes_le=bytes(value)).bytes
+    return _FIELD_SIZE.pack(16) + data
+
+
+#: Functions encoding non-null values as length prefixed binary COPY fields
+COPY_ENCODERS = {
+    'int8': _encode_int8,
+    'float8': _encode_float8,
+    'text': _encode_text,
+    'bytea': _encode_bytea,
+    'uuid': _encode_uuid,
+    # The binary format of json is its text
+    'json': _encode_text,
+}
+
+
+def encode_copy_row(row, encoders):
+    """
+    Encodes a row as a tuple of the postgres binary COPY format
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.copy_sqlite_to_postgres import *  # NOQA
+        >>> encoders = [COPY_ENCODERS[kind] for kind in ['int8', 'text', 'float8']]
+        >>> print(encode_copy_row((1, 'ab', None), encoders).hex())
+        0003000000080000000000000001000000026162ffffffff
+    """
+    parts = [_NUM_FIELDS.pack(len(row))]
+    for value, encode in zip(row, encoders):
+        parts.append(_NULL_FIELD if value is None else encode(value))
+    return b''.join(parts)
+
+
+class CopyStream(io.RawIOBase):
+    """Readable file object over the blocks of bytes of a COPY FROM payload"""
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._block = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._block):
+                self._block = next(self._blocks, None)
+                self._offset = 0
+                if self._block is None:
+                    self._block = b''
+                    break
+                continue
+            if size < 0:
+                end = len(self._block)
+            else:
+                end = min(len(self._block), self._offset + size)
+                size -= end - self._offset
+            parts.append(self._block[self._offset : end])
+            self._offset = end
+        return b''.join(parts)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class CopyDigestSink:
+    """Writable file object hashing the tuples of a binary COPY TO output"""
+
+    def __init__(self):
+        self._hasher = hashlib.md5()
+        self._num_skipped = 0
+        self._tail = b''
+
+    def write(self, data):
+        nbytes = len(data)
+        data = self._tail + bytes(data)
+        if self._num_skipped < len(PGCOPY_HEADER):
+            skip = min(len(PGCOPY_HEADER) - self._num_skipped, len(data))
+            self._num_skipped += skip
+            data = data[skip:]
+        # Hold back what may be the trailer
+        tail_size = min(len(data), len(PGCOPY_TRAILER))
+        self._hasher.update(data[: len(data) - tail_size])
+        self._tail = data[len(data) - tail_size :]
+        return nbytes
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+def _quote(name):
+    """Postgres identifier of a sqlite table or column (folded to lowercase)"""
+    return '"%s"' % (name.lower(),)
+
+
+def _qualified(schema, table_name):
+    return f'{_quote(schema)}.{_quote(table_name)}'
+
+
+def _read_table_dependencies(sl_conn, specs):
+    """Sets the tables each table refers to through a foreign key, a
+    ``dependsmap`` in the metadata table or a ``<table>_rowid`` column"""
+    table_names = {spec.name for spec in specs}
+    dependsmaps = {}
+    if 'metadata' in table_names:
+        cursor = sl_conn.execute(
+            "SELECT metadata_key, metadata_value FROM metadata "
+            "WHERE metadata_key LIKE '%_dependsmap'"
         )
-        # Change "REAL" type to "DOUBLE" because "REAL" in postgresql
-        # only can only store 6 digits and so we'd lose precision
-        stmt = re.sub('REAL', 'DOUBLE', stmt)
-        connection.execute(stmt)
-        connection.execute(f'INSERT INTO {new_table} SELECT rowid, * FROM {table}')
-        connection.execute(f'DROP TABLE {table}')
-        connection.execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+        for key, value in cursor.fetchall():
+            try:
+                dependsmaps[key[: -len('_dependsmap')]] = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                logger.debug(f'Ignoring unreadable metadata {key}={value!r}')
+    for spec in specs:
+        for row in sl_conn.execute(f'PRAGMA foreign_key_list("{spec.name}")'):
+            spec.dependencies.add(row[2])
+        dependsmap = dependsmaps.get(spec.name, None) or {}
+        spec.dependencies.update(value[0] for value in dependsmap.values())
+        spec.dependencies.update(
+            column.name[: -len('_rowid')]
+            for column in spec.columns
+            if column.name.endswith('_rowid')
+        )
+        spec.dependencies &= table_names
+        spec.dependencies.discard(spec.name)
+
+
+def get_sqlite_table_specs(sqlite_uri: str):
+    """Reads the schema of the tables of a sqlite database
 
+    Returns:
+        list: :class:`TableSpec` of each table
+
+    """
+    sl_engine = sqlalchemy.create_engine(sqlite_uri)
+    sl_conn = sl_engine.raw_connection()
+    try:
+        table_names = [
+            row[0]
+            for row in sl_conn.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            )
+        ]
+        specs = []
+        for table_name in table_names:
+            columns = []
+            primary_key = []
+            for _, name, type_, notnull, default, pk in sl_conn.execute(
+                f'PRAGMA table_info("{table_name}")'
+            ):
+                base_type = type_.split('(')[0].strip().upper()
+                pg_type, pg_kind = SQLITE_TO_POSTGRES_TYPES.get(
+                    base_type, ('TEXT', 'text')
+                )
+                if default is not None and not _LITERAL_DEFAULT_PATTERN.match(default):
+                    # Expressions are sqlite specific
+                    default = None
+                columns.append(
+                    ColumnSpec(name, type_, pg_type, pg_kind, bool(notnull), default)
+                )
+                if pk:
+                    primary_key.append((pk, name))
+            primary_key = [name for _, name in sorted(primary_key)]
+            unique_constraints = []
+            indexes = []
+            index_list = sl_conn.execute(f'PRAGMA index_list("{table_name}")').fetchall()
+            for _, index_name, unique, origin, is_partial in index_list:
+                if is_partial or origin == 'pk':
+                    continue
+                index_columns = [
+                    row[2]
+                    for row in sl_conn.execute(f'PRAGMA index_info("{index_name}")')
+                ]
+                if None in index_columns:
+                    # Expression indexes are sqlite specific
+                    continue
+                if origin == 'u':
+                    unique_constraints.append(index_columns)
+                else:
+                    indexes.append((index_name, bool(unique), index_columns))
+            specs.append(
+                TableSpec(table_name, columns, primary_key, unique_constraints, indexes)
+            )
+        _read_table_dependencies(sl_conn, specs)
+    finally:
+        sl_conn.close()
+        sl_engine.dispose()
+    return specs
+
+
+def make_create_table_sql(spec, schema):
+    """CREATE TABLE statement of a sqlite table in postgres. Constraints other
+    than NOT NULL are added after the rows are loaded."""
+    body = ['rowid BIGINT NOT NULL']
+    for column in spec.columns:
+        definition = f'{_quote(column.name)} {column.pg_type}'
+        if column.notnull:
+            definition += ' NOT NULL'
+        if column.default is not None:
+            definition += f' DEFAULT {column.default}'
+        body.append(definition)
+    table_body = ', '.join(body)
+    return f'CREATE TABLE {_qualified(schema, spec.name)} ({table_body})'
+
+
+def make_constraint_sqls(spec, schema):
+    """Statements adding the keys, unique constraints and indexes of a table"""
+    table = _qualified(schema, spec.name)
+    sqls = [f'ALTER TABLE {table} ADD UNIQUE (rowid)']
+    if spec.primary_key:
+        columns = ', '.join(map(_quote, spec.primary_key))
+        sqls.append(f'ALTER TABLE {table} ADD PRIMARY KEY ({columns})')
+    for unique_columns in spec.unique_constraints:
+        name = _quote('_'.join(['unique', spec.name] + unique_columns))
+        columns = ', '.join(map(_quote, unique_columns))
+        sqls.append(f'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE ({columns})')
+    for index_name, unique, index_columns in spec.indexes:
+        unique = 'UNIQUE ' if unique else ''
+        columns = ', '.join(map(_quote, index_columns))
+        sqls.append(
+            f'CREATE {unique}INDEX IF NOT EXISTS {_quote(index_name)} '
+            f'ON {table} ({columns})'
+        )
+    sqls.append(f'ANALYZE {table}')
+    return sqls
+
+
+def iter_copy_chunks(sl_conn, spec, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reads a sqlite table by rowid ranges and encodes the rows in the postgres
+    binary COPY format
+
+    Yields:
+        tuple: (ChunkInfo, bytes)
+    """
+    columns = ', '.join('"%s"' % (name,) for name in spec.column_names[1:])
+    if columns:
+        columns = 'rowid, ' + columns
+    else:
+        columns = 'rowid'
+    sql = f'SELECT {columns} FROM "{spec.name}" WHERE rowid > ? ORDER BY rowid LIMIT ?'
+    encoders = spec.encoders
+    last_rowid = -(2 ** 63)
+    index = 0
+    while True:
+        rows = sl_conn.execute(sql, (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        data = b''.join([encode_copy_row(row, encoders) for row in rows])
+        chunk = ChunkInfo(
+            index, rows[0][0], rows[-1][0], len(rows), hashlib.md5(data).hexdigest()
+        )
+        yield chunk, data
+        last_rowid = rows[-1][0]
+        index += 1
+
+
+def load_table(sqlite_uri, pg_connect, schema, spec, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copies a sqlite table into a new postgres table with COPY FROM STDIN
+
+    Args:
+        sqlite_uri (str): sqlite database
+        pg_connect (callable): returns a new DBAPI connection to postgres
+            (psycopg2 or a compatible object with ``cursor().copy_expert``)
+        schema (str): postgres schema of the table
+        spec (TableSpec): table to copy
+        chunk_size (int): rows per chunk
 
-def before_pgloader(engine, schema):
+    Returns:
+        list: :class:`ChunkInfo` of the copied chunks
+
+    """
+    sl_engine = sqlalchemy.create_engine(sqlite_uri)
+    sl_conn = sl_engine.raw_connection()
+    pg_conn = pg_connect()
+    chunks = []
+
+    def _blocks():
+        yield PGCOPY_HEADER
+        for chunk, data in iter_copy_chunks(sl_conn, spec, chunk_size):
+            chunks.append(chunk)
+            yield data
+        yield PGCOPY_TRAILER
+
+    table = _qualified(schema, spec.name)
+    columns = ', '.join(map(_quote, spec.column_names))
+    try:
+        cursor = pg_conn.cursor()
+        # Creating the table in the loading transaction lets postgres skip
+        # the write-ahead log for its rows (with wal_level=minimal)
+        cursor.execute(f'DROP TABLE IF EXISTS {table} CASCADE')
+        cursor.execute(make_create_table_sql(spec, schema))
+        cursor.copy_expert(
+            f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT binary)',
+            CopyStream(_blocks()),
+            size=2 ** 20,
+        )
+        for sql in make_constraint_sqls(spec, schema):
+            cursor.execute(sql)
+        pg_conn.commit()
+    except Exception:
+        pg_conn.rollback()
+        raise
+    finally:
+        pg_conn.close()
+        sl_conn.close()
+        sl_engine.dispose()
+    return chunks
+
+
+def verify_table(pg_connect, schema, spec, chunks):
+    """Compares the checksums of the copied chunks with the rows in postgres
+
+    Returns:
+        list: the chunks whose rows differ
+
+    """
+    table = _qualified(schema, spec.name)
+    columns = ', '.join(map(_quote, spec.column_names))
+    pg_conn = pg_connect()
+    mismatched = []
+    try:
+        cursor = pg_conn.cursor()
+        for chunk in chunks:
+            sink = CopyDigestSink()
+            cursor.copy_expert(
+                f'COPY (SELECT {columns} FROM {table} '
+                f'WHERE rowid BETWEEN {chunk.first_rowid} AND {chunk.last_rowid} '
+                'ORDER BY rowid) TO STDOUT WITH (FORMAT binary)',
+                sink,
+            )
+            if sink.hexdigest() != chunk.digest:
+                mismatched.append(chunk)
+        cursor.execute(f'SELECT count(*) FROM {table}')
+        total = cursor.fetchone()[0]
+        pg_conn.rollback()
+    finally:
+        pg_conn.close()
+    if total != sum(chunk.num_rows for chunk in chunks):
+        # Rows outside of the copied rowid ranges
+        mismatched.append(ChunkInfo(None, None, None, total, None))
+    return mismatched
+
+
+def run_in_dependency_order(func, specs, num_workers=DEFAULT_TABLE_WORKERS):
+    """
+    Calls ``func(spec)`` for each table on a thread pool. A table is started
+    once the tables it depends on are done and is skipped if one of them
+    failed.
+
+    Yields:
+        tuple: (TableSpec, result, exception) in completion order
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.copy_sqlite_to_postgres import *  # NOQA
+        >>> specs = [TableSpec(name, [], [], [], []) for name in 'abcd']
+        >>> specs[0].dependencies = {'b', 'c'}
+        >>> specs[1].dependencies = {'c'}
+        >>> specs[3].dependencies = {'a'}
+        >>> order = [s.name for s, _, _ in run_in_dependency_order(str, specs, 2)]
+        >>> print(order)
+        ['c', 'b', 'a', 'd']
+    """
+    pending = {spec.name: spec for spec in specs}
+    failed = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        while pending or running:
+            ready = [
+                spec
+                for spec in pending.values()
+                if not (spec.dependencies & (set(pending) | set(running)))
+            ]
+            if not ready and not running:
+                # Break dependency cycles
+                ready = list(pending.values())[:1]
+            for spec in ready:
+                del pending[spec.name]
+                if spec.dependencies & failed:
+                    failed.add(spec.name)
+                    exc = RuntimeError(f'{spec.name} depends on a table that failed')
+                    yield spec, None, exc
+                    continue
+                running[executor.submit(func, spec)] = spec
+            if not running:
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                spec = running.pop(future)
+                exc = future.exception()
+                if exc is None:
+                    yield spec, future.result(), None
+                else:
+                    failed.add(spec.name)
+                    yield spec, None, exc
+
+
+def copy_sqlite_database(
+    sqlite_uri: str,
+    pg_connect,
+    schema: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    num_workers: int = DEFAULT_TABLE_WORKERS,
+    verify: bool = True,
+):
+    """Copies the tables of a sqlite database into a postgres schema
+
+    Tables are streamed in chunks of ``chunk_size`` rows into ``COPY FROM
+    STDIN`` in the binary format, ``num_workers`` tables at a time in
+    dependency order. With ``verify`` each chunk is read back from postgres
+    and its checksum compared with the one of the copied chunk.
+
+    Raises:
+        ChecksumMismatchError: if rows differ after the copy
+
+    Returns:
+        dict: the copied chunks of each table
+
+    """
+    specs = get_sqlite_table_specs(sqlite_uri)
+
+    def _copy(spec):
+        timer = Timer()
+        timer.start()
+        chunks = load_table(sqlite_uri, pg_connect, schema, spec, chunk_size)
+        if verify:
+            mismatched = verify_table(pg_connect, schema, spec, chunks)
+            if mismatched:
+                raise ChecksumMismatchError(
+                    f'({schema}) {len(mismatched)} chunks of {spec.name} differ: '
+                    f'{mismatched[:5]}'
+                )
+        timer.stop()
+        num_rows = sum(chunk.num_rows for chunk in chunks)
+        logger.debug(
+            f'({schema}) copied {num_rows} rows of {spec.name} ... {timer.report()}'
+        )
+        return chunks
+
+    table_chunks = {}
+    errors = []
+    for spec, chunks, exc in run_in_dependency_order(_copy, specs, num_workers):
+        if exc is not None:
+            logger.error(f'({schema}) failed to copy {spec.name}: {exc}')
+            errors.append(exc)
+        else:
+            table_chunks[spec.name] = chunks
+    if errors:
+        raise errors[0]
+    return table_chunks
+
+
+def before_load(engine, schema):
     connection = engine.connect()
     connection.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
     connection.execute(f"SET SCHEMA '{schema}'")
@@ -525,131 +1100,9 @@ def before_pgloader(engine, schema):
             pass
 
 
-PGLOADER_CONFIG_TEMPLATE = """\
-LOAD DATABASE
-    FROM {sqlite_uri}
-    INTO {postgres_uri}
-
-  WITH create tables,
-       create indexes,
-       reset no sequences,
-       workers = 2, concurrency = 2,
-       batch rows = 128,
-       prefetch rows = 512
-
-    SET work_mem to '64MB',
-        maintenance_work_mem to '512MB',
-        search_path to '{schema_name}'
-
-  CAST type uuid to uuid using wbia-uuid-bytes-to-uuid,
-       type integer to bigint using wbia-integer-to-string,
-       type ndarray to ndarray using byte-vector-to-bytea,
-       type numpy to numpy using byte-vector-to-bytea;
-"""
-# Copied from the built-in sql-server-uniqueidentifier-to-uuid
-# transform in pgloader 3.6.2
-# Prior to 3.6.2, the transform was for uuid in big-endian order
-TRANSFORMS_LISP = """\
-(in-package :pgloader.transforms)
-
-(defmacro arr-to-bytes-rev (from to array)
-  `(loop for i from ,to downto ,from
-    with res = 0
-    do (setf (ldb (byte 8 (* 8 (- i,from))) res) (aref ,array i))
-    finally (return res)))
-
-(defun wbia-uuid-bytes-to-uuid (id)
-  (declare (type (or null (array (unsigned-byte 8) (16))) id))
-  (when id
-    (let ((uuid
-        (make-instance 'uuid:uuid
-               :time-low (arr-to-bytes-rev 0 3 id)
-               :time-mid (arr-to-bytes-rev 4 5 id)
-               :time-high (arr-to-bytes-rev 6 7 id)
-               :clock-seq-var (aref id 8)
-               :clock-seq-low (aref id 9)
-               :node (uuid::arr-to-bytes 10 15 id))))
-      (princ-to-string uuid))))
-
-(defun wbia-integer-to-string (integer-string)
-  (declare (type (or null string fixnum float) integer-string))
-  (when integer-string
-    (princ-to-string
-     (typecase integer-string
-       (integer integer-string)
-       (float   (floor integer-string))
-       (string  (let ((with-decimal (position #\\. integer-string)))
-                  (handler-case
-                    (if with-decimal
-                      (parse-integer integer-string :start 0
-                                     :end with-decimal)
-                      (parse-integer integer-string :start 0))
-                    (condition (c)
-                      (declare (ignore c))
-                        (if with-decimal
-                          (parse-integer integer-string :start 1
-                                         :end with-decimal)
-                          (parse-integer integer-string :start 1
-                                         :end (- (length integer-string) 1)))))))))))
-"""
-
-
-def run_pgloader(sqlite_uri: str, postgres_uri: str) -> subprocess.CompletedProcess:
-    """Configure and run ``pgloader``.
-    If there is a problem this will raise a ``CalledProcessError``
-    from ``Process.check_returncode``.
-
-    """
-    schema_name = get_schema_name_from_uri(sqlite_uri)
-
-    # Do all this within a self-cleaning temporary directory
-    with tempfile.TemporaryDirectory() as tempdir:
-        td = Path(tempdir)
-        pgloader_config = td / f'wbia_{schema_name}.load'
-        with pgloader_config.open('w') as fb:
-            fb.write(PGLOADER_CONFIG_TEMPLATE.format(**locals()))
-
-        wbia_transforms = td / 'wbia_transforms.lisp'
-        with wbia_transforms.open('w') as fb:
-            fb.write(TRANSFORMS_LISP)
-
-        try:
-            from subprocess import DEVNULL  # Python 3
-        except ImportError:
-            import os
-
-            DEVNULL = open(os.devnull, 'r+b', 0)
-
-        proc = subprocess.run(
-            [
-                'pgloader',
-                '--verbose',
-                '--load-lisp-file',
-                str(wbia_transforms),
-                str(pgloader_config),
-            ],
-            stdin=DEVNULL,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
-        proc.check_returncode()  # raises subprocess.CalledProcessError
-        logger.debug(proc.stdout.decode())
-        return proc
-
-
-def after_pgloader(sqlite_engine, pg_engine, schema):
-    # Some "NOT NULL" weren't migrated by pgloader for some reason
+def after_load(pg_engine, schema):
     connection = pg_engine.connect()
     connection.execute(f"SET SCHEMA '{schema}'")
-    sqlite_metadata = sqlalchemy.MetaData(bind=sqlite_engine)
-    sqlite_metadata.reflect()
-    for table in sqlite_metadata.tables.values():
-        for column in table.c:
-            if not column.primary_key and not column.nullable:
-                connection.execute(
-                    f'ALTER TABLE {table.name} ALTER COLUMN {column.name} SET NOT NULL'
-                )
-
     table_pkeys = connection.execute(
         f"""\
         SELECT table_name, column_name
@@ -658,13 +1111,11 @@ def after_pgloader(sqlite_engine, pg_engine, schema):
         WHERE table_schema = '{schema}'
         AND constraint_type = 'PRIMARY KEY'"""
     ).fetchall()
-    exclude_sequences = set()
     for (table_name, pkey) in table_pkeys:
         # Create sequences for rowid fields
         for column_name in ('rowid', pkey):
             seq_name = f'{table_name}_{column_name}_seq'
-            exclude_sequences.add(seq_name)
-            connection.execute(f'CREATE SEQUENCE {seq_name}')
+            connection.execute(f'CREATE SEQUENCE IF NOT EXISTS {seq_name}')
             connection.execute(
                 f"SELECT setval('{seq_name}', (SELECT max({column_name}) FROM {table_name}))"
             )
@@ -675,83 +1126,48 @@ def after_pgloader(sqlite_engine, pg_engine, schema):
                 f'ALTER SEQUENCE {seq_name} OWNED BY {table_name}.{column_name}'
             )
 
-    # Reset all sequences except the ones we just created (doing it here
-    # instead of in pgloader because it causes a fatal error in pgloader
-    # when pgloader runs in parallel:
-    #
-    # Asynchronous notification "seqs" (payload: "0") received from
-    # server process with PID 28472.)
-    sequences = connection.execute(
-        f"""\
-        SELECT table_name, column_name, column_default
-        FROM information_schema.columns
-        WHERE table_schema = '{schema}'
-        AND column_default LIKE 'nextval%%'"""
-    ).fetchall()
-    for table_name, column_name, column_default in sequences:
-        seq_name = re.sub(r"nextval\('([^']*)'.*", r'\1', column_default)
-        if seq_name not in exclude_sequences:
-            connection.execute(
-                f"SELECT setval('{seq_name}', (SELECT max({column_name}) FROM {table_name}))"
-            )
-
 
 def drop_schema(engine, schema_name):
     connection = engine.connect()
     connection.execute(f'DROP SCHEMA {schema_name} CASCADE')
 
 
-def _use_copy_of_sqlite_database(f):
-    """Makes a copy of the sqlite database given as the first argument in URI form"""
-
-    @wraps(f)
-    def wrapper(*args):
-        uri = args[0]
-        db = _sqlite_uri_to_path(uri)
-        with tempfile.TemporaryDirectory() as tempdir:
-            temp_db = Path(tempdir) / db.name
-            logger.debug(f'Copying {str(db)} to {str(temp_db)} ({db.stat().st_size} B)')
-            shutil.copy2(db, temp_db)
-            new_uri = _sqlite_path_to_uri(temp_db)
-            return f(new_uri, *args[1:])
-
-    return wrapper
-
-
-@_use_copy_of_sqlite_database
-def migrate(sqlite_uri: str, postgres_uri: str):
+def migrate(
+    sqlite_uri: str,
+    postgres_uri: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    num_workers: int = DEFAULT_TABLE_WORKERS,
+):
     logger.info(f'\nworking on {sqlite_uri} ...')
     schema_name = get_schema_name_from_uri(sqlite_uri)
     sl_info = SqliteDatabaseInfo(sqlite_uri)
     pg_info = PostgresDatabaseInfo(postgres_uri)
-    sl_engine = create_engine(sqlite_uri)
     pg_engine = create_engine(postgres_uri)
     timer = Timer()
 
-    # Add sqlite built-in rowid column to tables
-    logger.debug(f'({schema_name}) adding rowids to database')
+    logger.debug(f'({schema_name}) running pre-load operations')
     timer.start()
-    add_rowids(sl_engine)
+    before_load(pg_engine, schema_name)
     timer.stop()
-    logger.debug(f'({schema_name}) added rowids to database ... {timer.report()}')
+    logger.debug(f'({schema_name}) ran pre-load operations ... {timer.report()}')
 
-    logger.debug(f'({schema_name}) running pre-pgloader operations')
+    logger.debug(f'({schema_name}) copying tables ...')
     timer.start()
-    before_pgloader(pg_engine, schema_name)
-    timer.stop()
-    logger.debug(f'({schema_name}) ran pre-pgloader operations ... {timer.report()}')
-
-    logger.debug(f'({schema_name}) running pgloader ...')
-    timer.start()
-    run_pgloader(sqlite_uri, postgres_uri)
+    copy_sqlite_database(
+        sqlite_uri,
+        pg_engine.raw_connection,
+        schema_name,
+        chunk_size=chunk_size,
+        num_workers=num_workers,
+    )
     timer.stop()
-    logger.debug(f'({schema_name}) ran pgloader ... {timer.report()}')
+    logger.debug(f'({schema_name}) copied and verified tables ... {timer.report()}')
 
-    logger.debug(f'({schema_name}) running post-pgloader operations')
+    logger.debug(f'({schema_name}) running post-load operations')
     timer.start()
-    after_pgloader(sl_engine, pg_engine, schema_name)
+    after_load(pg_engine, schema_name)
     timer.stop()
-    logger.debug(f'({schema_name}) ran post-pgloader operations ... {timer.report()}')
+    logger.debug(f'({schema_name}) ran post-load operations ... {timer.report()}')
 
     # Record in postgres having migrated the sqlite database in its current state
     logger.debug(f'({schema_name}) recorded the migration')
@@ -774,6 +1190,8 @@ def copy_sqlite_to_postgres(
     db_dir: Path,
     postgres_uri: str,
     num_procs: int = 6,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    table_workers: int = DEFAULT_TABLE_WORKERS,
 ) -> typing.Generator[typing.Tuple[Path, Exception, int, int], None, None]:
     """Copies all the sqlite databases into a single postgres database
 
@@ -781,8 +1199,11 @@ def copy_sqlite_to_postgres(
         db_dir: the colloquial dbdir (i.e. directory containing '_ibsdb', 'smart_patrol', etc.)
         postgres_uri: a postgres connection uri without the database name
         num_procs: number of concurrent processes to use
+        chunk_size: number of rows per COPY chunk and checksum
+        table_workers: number of tables of a database copied concurrently
 
     """
+    migrate_ = partial(migrate, chunk_size=chunk_size, num_workers=table_workers)
     executor = ProcessPoolExecutor(max_workers=num_procs)
     mod_date_filter = partial(
         _by_modification_date, pg_info=PostgresDatabaseInfo(postgres_uri)
@@ -796,7 +1217,7 @@ def copy_sqlite_to_postgres(
         # serial migration
         for path in sqlite_dbs:
             try:
-                migrate(_sqlite_path_to_uri(path), postgres_uri)
+                migrate_(_sqlite_path_to_uri(path), postgres_uri)
             except Exception as e:
                 exc = e
                 traceback.print_exc()
@@ -806,7 +1227,7 @@ def copy_sqlite_to_postgres(
             yield (path, exc, db_size, total_size)
     else:
         migration_futures_to_paths = {
-            executor.submit(migrate, _sqlite_path_to_uri(p), postgres_uri): p
+            executor.submit(migrate_, _sqlite_path_to_uri(p), postgres_uri): p
             for p in sqlite_dbs
         }
         for future in as_completed(migration_futures_to_paths):
@@ -9,6 +9,9 @@ import numpy as np
 from wbia.dtool import sql_control
 from wbia.dtool import depcache_table
 from wbia.dtool import base
+from wbia.dtool import depcache_gc
+from wbia.dtool import instrumentation
+from wbia.dtool.row_cache import RowCache
 from collections import defaultdict
 import time
 import random
@@ -35,12 +38,100 @@ Args:
     docstr (str): (default = None)
     fname (str):  file name(default = None)
     asobject (bool): hacky dont use (default = False)
+    vectorized (bool): if False preproc_func is called once per row
+        (default = True)
+    engine (str): None, 'thread' or 'process'. Runs preproc_func in a worker
+        pool and overlaps computing a chunk with storing the previous one.
+        Process workers receive depc=None. (default = None)
+    num_workers (int): size of the process pool (default = None)
 
 SeeAlso:
     depcache_table.DependencyCacheTable
 """
 
 
+#: Maximum number of memoized resolution plans kept by each depcache
+RESOLUTION_PLAN_CACHE_SIZE = 256
+
+
+def _config_plan_key(config):
+    """
+    Hashable key of a requested config or None if it cannot be keyed
+    """
+    try:
+        # assume config is AlgoRequest or TableConfig
+        cfgstr = config.get_cfgstr()
+    except AttributeError:
+        try:
+            cfgstr = ut.to_json(config)
+        except TypeError:
+            return None
+    return (type(config), cfgstr)
+
+
+class ResolutionPlan(ut.NiceRepr):
+    """
+    The part of resolving parent rowids that only depends on the target table
+    and on the requested config: the expanded rootmost inputs, the ordered
+    parent table lookups with their input / signature multi flags, and the
+    ensured config of every table on the way to the target.
+
+    Plans are built by :func:`DependencyCache.get_resolution_plan` and
+    memoized until a table is registered or the depcache is initialized.
+    Building a plan does not touch the database, config rowids are looked up
+    (and memoized) by the tables when rows are requested.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.depcache_control import *  # NOQA
+        >>> from wbia.dtool.example_depcache import testdata_depc
+        >>> depc = testdata_depc()
+        >>> plan = depc.get_resolution_plan('descriptor', {})
+        >>> print(plan)
+        <ResolutionPlan(descriptor: chip -> keypoint)>
+        >>> assert depc.get_resolution_plan('descriptor', {}) is plan
+        >>> assert sorted(plan.configs) == ['chip', 'descriptor', 'keypoint']
+    """
+
+    def __init__(self, depc, target_tablename, config, _hack_rootmost=False):
+        target_table = depc[target_tablename]
+        if _hack_rootmost:
+            # Hack: if true, we are given inputs in rootmost form
+            exi_inputs = target_table.rootmost_inputs
+        else:
+            # otherwise we are given inputs in totalroot form
+            exi_inputs = target_table.rootmost_inputs.total_expand()
+        self.target_tablename = target_tablename
+        self.exi_inputs = exi_inputs
+        self.config_ = depc._ensure_config(target_tablename, config)
+        self.configs = {}
+        # Each step is (input_nodes, output_node, input_multi_flags,
+        # sig_multi_flags, config_). The last step computes the target
+        # parents and has no output config.
+        self.steps = []
+        for input_nodes, output_node in exi_inputs.flat_compute_rmi_edges():
+            tablekey = output_node.tablename
+            table = depc[tablekey]
+            input_multi_flags = [
+                node.ismulti and node in exi_inputs.rmi_list for node in input_nodes
+            ]
+            sig_multi_flags = table.get_parent_col_attr('ismulti')
+            if tablekey == target_tablename:
+                config_ = self.config_
+            else:
+                config_ = depc._ensure_config(tablekey, config)
+            self.configs[tablekey] = config_
+            self.steps.append(
+                (input_nodes, output_node, input_multi_flags, sig_multi_flags, config_)
+            )
+            if tablekey == target_tablename:
+                break
+
+    def __nice__(self):
+        tablenames = [step[1].tablename for step in self.steps[:-1]]
+        return '%s: %s' % (self.target_tablename, ' -> '.join(tablenames))
+
+
 def check_register(args, kwargs):
     assert len(args) < 6, 'too many args'
     assert 'preproc_func' not in kwargs, 'cannot specify func in wrapper'
@@ -93,6 +184,8 @@ class DependencyCache:
         table_name=None,
         root_getters=None,
         use_globals=True,
+        row_cache_nbytes=None,
+        get_root_rowids=None,
     ):
         """
         Args:
@@ -102,6 +195,10 @@ class DependencyCache:
             get_root_uuid: ???
             root_getters: ???
             use_globals (bool): ??? (default: True)
+            row_cache_nbytes (int): if given, enables an in-memory row cache
+                of at most this many bytes (see :func:`enable_row_cache`)
+            get_root_rowids (func): (optional) returns all existing root
+                rowids, which lets :func:`gc` collect the rows of deleted roots
 
         """
         if table_name is None:
@@ -134,9 +231,19 @@ class DependencyCache:
         self.default_fname = f'{table_name}_cache'
 
         self.get_root_uuid = get_root_uuid
+        self.get_root_rowids = get_root_rowids
         self.delete_exclude_tables = {}
         # BBB (25-Sept-12020) `_debug` remains around to be backwards compatible
         self._debug = False
+        #: Optional read-through cache of resolved row data shared by all tables
+        self.row_cache = None
+        if row_cache_nbytes:
+            self.enable_row_cache(row_cache_nbytes)
+        #: Memoize the table lookups of get_parent_rowids per target and config
+        self.use_resolution_plans = True
+        self._resolution_plans = {}
+        # Incremental garbage collection pass in progress (see gc)
+        self._gc = None
 
     def __repr__(self):
         return f'<DependencyCache(controller={self.controller} name={self.name})>'
@@ -219,6 +326,7 @@ class DependencyCache:
         )
         self.cachetable_dict[tablename] = table
         self.configclass_dict[tablename] = configclass
+        self.invalidate_resolution_plans()
         return table
 
     @ut.apply_docstr(REG_PREPROC_DOC)
@@ -280,6 +388,7 @@ class DependencyCache:
 
         for table in self.cachetable_dict.values():
             table.initialize()
+        self.invalidate_resolution_plans()
 
         # HACKS:
         # Define injected functions for autocomplete convinience
@@ -534,18 +643,10 @@ class DependencyCache:
 
         logger.debug('Enter get_parent_rowids')
         logger.debug(' * target_tablename = %r' % (target_tablename,))
-        logger.debug(' * input_tuple=%s' % (ut.trunc_repr(input_tuple),))
         logger.debug(' * config = %r' % (config,))
-        target_table = self[target_tablename]
-
-        # TODO: Expand to the appropriate given inputs
-        if _hack_rootmost:
-            # Hack: if true, we are given inputs in rootmost form
-            exi_inputs = target_table.rootmost_inputs
-        else:
-            # otherwise we are given inputs in totalroot form
-            exi_inputs = target_table.rootmost_inputs.total_expand()
-        logger.debug(' * exi_inputs=%s' % (exi_inputs,))
+        plan = self.get_resolution_plan(target_tablename, config, _hack_rootmost)
+        exi_inputs = plan.exi_inputs
+        logger.debug(' * plan=%s' % (plan,))
 
         rectified_input = self.rectify_input_tuple(exi_inputs, input_tuple)
 
@@ -553,32 +654,18 @@ class DependencyCache:
         for rmi, rowids in zip(exi_inputs.rmi_list, rectified_input):
             rowid_dict[rmi] = rowids
 
-        compute_edges = exi_inputs.flat_compute_rmi_edges()
-        logger.debug(' * rectified_input=%s' % ut.trunc_repr(rectified_input))
-        logger.debug(' * compute_edges=%s' % ut.repr2(compute_edges, nl=2))
-
-        for count, (input_nodes, output_node) in enumerate(compute_edges, start=1):
+        for count, step in enumerate(plan.steps, start=1):
+            (input_nodes_, output_node, input_multi_flags, sig_multi_flags, config_) = step
             logger.debug(
                 ' * COMPUTING %d/%d EDGE %r -- %r'
-                % (count, len(compute_edges), input_nodes, output_node),
+                % (count, len(plan.steps), input_nodes_, output_node),
             )
-            tablekey = output_node.tablename
-            table = self[tablekey]
-            input_nodes_ = input_nodes
-            logger.debug(
-                'table.parent_id_tablenames = %r' % (table.parent_id_tablenames,)
-            )
-            logger.debug('input_nodes_ = %r' % (input_nodes_,))
-            input_multi_flags = [
-                node.ismulti and node in exi_inputs.rmi_list for node in input_nodes_
-            ]
 
             # Args currently go in like this:
             # args  = [..., (pid_{i,1}, pid_{i,2}, ..., pid_{i,M}), ...]
             # They get converted into
             # argsT = [... (pid_{1,j}, ... pid_{N,j}) ...]
             # i = row, j = col
-            sig_multi_flags = table.get_parent_col_attr('ismulti')
             parent_rowidsT = ut.take(rowid_dict, input_nodes_)
             parent_rowids_ = []
             # TODO: will need to figure out which columns to zip and which
@@ -604,40 +691,21 @@ class DependencyCache:
             _parent_rowids = list(zip(*parent_rowids2_))
             # _parent_rowids = list(ut.product(*parent_rowids_))
 
-            logger.debug(
-                'parent_rowids_ = %s'
-                % (
-                    ut.repr4(
-                        [ut.trunc_repr(ids_) for ids_ in parent_rowids_],
-                        strvals=True,
-                    )
-                )
-            )
-            logger.debug(
-                'parent_rowids2_ = %s'
-                % (
-                    ut.repr4(
-                        [ut.trunc_repr(ids_) for ids_ in parent_rowids2_],
-                        strvals=True,
-                    )
-                )
-            )
-            logger.debug(
-                '_parent_rowids = %s'
-                % (
-                    ut.truncate_str(
-                        ut.repr4(
-                            [ut.trunc_repr(ids_) for ids_ in _parent_rowids],
-                            strvals=True,
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    '_parent_rowids = %s'
+                    % (
+                        ut.truncate_str(
+                            ut.repr4(
+                                [ut.trunc_repr(ids_) for ids_ in _parent_rowids],
+                                strvals=True,
+                            )
                         )
                     )
                 )
-            )
 
             if output_node.tablename != target_tablename:
-                # Get table configuration
-                config_ = self._ensure_config(tablekey, config)
-
+                table = self[output_node.tablename]
                 output_rowids = table.get_rowid(
                     _parent_rowids, config=config_, recompute=_recompute, **_kwargs
                 )
@@ -650,6 +718,43 @@ class DependencyCache:
         # rowids = rowid_dict[output_node]
         return parent_rowids
 
+    def get_resolution_plan(self, target_tablename, config=None, _hack_rootmost=False):
+        """
+        Returns the memoized :class:`ResolutionPlan` used by
+        :func:`get_parent_rowids` for a target table and requested config.
+        A new plan is built when plans are disabled or the config cannot be
+        keyed.
+
+        Args:
+            target_tablename (str): table whose parent rowids are resolved
+            config (dict): requested config (default = None)
+            _hack_rootmost (bool): inputs are given in rootmost form
+        """
+        if config is None:
+            config = {}
+        key = None
+        if self.use_resolution_plans:
+            cfgkey = _config_plan_key(config)
+            if cfgkey is not None:
+                key = (target_tablename, bool(_hack_rootmost), cfgkey)
+        plan = None if key is None else self._resolution_plans.get(key, None)
+        if plan is None:
+            plan = ResolutionPlan(self, target_tablename, config, _hack_rootmost)
+            if key is not None:
+                if len(self._resolution_plans) >= RESOLUTION_PLAN_CACHE_SIZE:
+                    # Drop the oldest plan
+                    self._resolution_plans.pop(next(iter(self._resolution_plans)), None)
+                self._resolution_plans[key] = plan
+        return plan
+
+    def invalidate_resolution_plans(self):
+        """
+        Forgets all memoized resolution plans. Called whenever tables or
+        their config classes are registered and when the depcache is
+        initialized.
+        """
+        self._resolution_plans = {}
+
     def check_rowids(self, tablename, input_tuple, config={}):
         """
         Returns a list of flags where True means the row has been computed and
@@ -730,7 +835,11 @@ class DependencyCache:
             **_kwargs,
         )
 
-        config_ = self._ensure_config(target_tablename, config)
+        if self.use_resolution_plans:
+            plan = self.get_resolution_plan(target_tablename, config, _hack_rootmost)
+            config_ = plan.config_
+        else:
+            config_ = self._ensure_config(target_tablename, config)
         rowids = table.get_rowid(
             parent_rowids, config=config_, recompute=recompute, **_kwargs
         )
@@ -1448,8 +1557,20 @@ class DependencyCache:
         r"""
         Deletes all properties of a root object regardless of config
 
+        The descendant rows of every table are collected first (see
+        :func:`get_delete_plan`), then each table is deleted in a single
+        transaction without cascading and its external files are unlinked on
+        a thread pool.
+
         Args:
             root_rowids (list):
+            delete_extern (bool): remove the external files of the deleted
+                rows (defaults to ``rm_extern_on_delete`` of each table)
+            table_config_filter (dict): see :func:`get_delete_plan`
+            prop (str): root property whose table exclusions apply
+
+        Returns:
+            int: number of deleted rows
 
         CommandLine:
             python -m dtool.depcache_control delete_root --show
@@ -1465,31 +1586,127 @@ class DependencyCache:
             >>> depc.get('fgweight', [1])
             >>> depc.delete_root(root_rowids)
         """
-        # graph = self.make_graph(implicit=False)
-        # hack
-        # check to make sure child does not have another parent
-        rowid_dict = self.get_allconfig_descendant_rowids(
-            root_rowids, table_config_filter
-        )
-        # children = [child for child in graph.succ[self.root_tablename]
-        #            if sum([len(e) for e in graph.pred[child].values()]) == 1]
-        # self.delete_property(tablename, root_rowids)
+        plan = self.get_delete_plan(root_rowids, table_config_filter, prop=prop)
         num_deleted = 0
-        for tablename, table_rowids in rowid_dict.items():
-            if tablename == self.root:
-                continue
-            # Specific prop exclusion
-            delete_exclude_table_set_prop = self.delete_exclude_tables.get(prop, [])
-            delete_exclude_table_set_all = self.delete_exclude_tables.get(None, [])
-            if (
-                tablename in delete_exclude_table_set_prop
-                or tablename in delete_exclude_table_set_all
-            ):
+        # Delete the leaves first so an interrupted delete never leaves rows
+        # whose parents are gone
+        tablenames = list(plan.keys())[::-1]
+        prog = ut.ProgIter(
+            tablenames,
+            label='[depc] deleting from %s' % (self.root,),
+            enabled=_debug or sum(map(len, plan.values())) > 1000,
+        )
+        for tablename in prog:
+            table_rowids = plan[tablename]
+            if len(table_rowids) == 0:
                 continue
             table = self[tablename]
-            num_deleted += table.delete_rows(table_rowids, delete_extern=delete_extern)
+            num_deleted += table.delete_rows(
+                table_rowids, delete_extern=delete_extern, cascade=False
+            )
         return num_deleted
 
+    def get_delete_plan(self, root_rowids, table_config_filter=None, prop=None):
+        r"""
+        Collects the rows removed by :func:`delete_root` before anything is
+        deleted.
+
+        Rows are collected a table at a time in topological order with one
+        batched query per parent column. The rows of tables excluded via
+        :func:`register_delete_table_exclusion` are only included when their
+        (non-root) parent rows are deleted, as the cascade of
+        ``delete_rows`` always removed them. ``table_config_filter``
+        restricts the rows reached from the roots to configs matching the
+        filter.
+
+        Args:
+            root_rowids (list):
+            table_config_filter (dict): maps tablenames to dicts of config
+                values the deleted rows must have
+            prop (str): root property whose exclusions apply
+
+        Returns:
+            odict: rowids to delete of each descendant table in topological
+                order
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.dtool.depcache_control import *  # NOQA
+            >>> from wbia.dtool.example_depcache import testdata_depc
+            >>> depc = testdata_depc()
+            >>> depc.get_rowids('fgweight', [1, 2])
+            >>> plan = depc.get_delete_plan([1])
+            >>> assert list(plan.keys()).index('chip') < list(plan.keys()).index('fgweight')
+            >>> assert len(plan['fgweight']) == 1
+        """
+        import networkx as nx
+
+        exclude_tables = set(self.delete_exclude_tables.get(prop, [])) | set(
+            self.delete_exclude_tables.get(None, [])
+        )
+        graph = self.explicit_graph
+        root_rowids = [int(rowid) for rowid in root_rowids if rowid is not None]
+        # Rows that inherit from the root rowids (whether deleted or not)
+        reached = {self.root: set(root_rowids)}
+        plan = ut.odict()
+        descendants = nx.descendants(graph, self.root)
+        tablenames = [node for node in nx.topological_sort(graph) if node in descendants]
+        for tablename in tablenames:
+            table = self[tablename]
+            reached_rowids = set()
+            cascade_rowids = set()
+            for colattr in table.parent_col_attrs:
+                parent = colattr['parent_table']
+                if colattr['ismulti'] or parent not in reached:
+                    # Multi columns hold set uuids instead of parent rowids
+                    continue
+                parent_reached = reached[parent]
+                parent_deleted = set(plan.get(parent, []))
+                parent_ids = sorted(parent_reached | parent_deleted)
+                if len(parent_ids) == 0:
+                    continue
+                unflat_rowids = table.db.get_where_eq(
+                    table.tablename,
+                    (table.rowid_colname,),
+                    [(id_,) for id_ in parent_ids],
+                    (colattr['intern_colname'],),
+                    unpack_scalars=False,
+                    keepwrap=False,
+                )
+                for id_, child_rowids in zip(parent_ids, unflat_rowids):
+                    if id_ in parent_reached:
+                        reached_rowids.update(child_rowids)
+                    if id_ in parent_deleted and not table.ismulti:
+                        cascade_rowids.update(child_rowids)
+            config_filter = (
+                None
+                if table_config_filter is None
+                else table_config_filter.get(tablename, None)
+            )
+            if config_filter is not None:
+                reached_rowids = self._filter_rowids_by_config(
+                    table, reached_rowids, config_filter
+                )
+            reached[tablename] = reached_rowids
+            if tablename in exclude_tables:
+                rowids = cascade_rowids
+            else:
+                rowids = reached_rowids | cascade_rowids
+            plan[tablename] = sorted(rowids)
+        return plan
+
+    def _filter_rowids_by_config(self, table, rowids, config_filter):
+        """Returns the rowids whose config matches all items of config_filter"""
+        rowids = sorted(rowids)
+        cfgid2_rowids = ut.group_items(rowids, table.get_row_cfgid(rowids))
+        unique_cfgids = ut.filter_Nones(cfgid2_rowids.keys())
+        unique_configs = table.get_config_from_rowid(unique_cfgids)
+        passed_rowids = set()
+        for cfgid, config in zip(unique_cfgids, unique_configs):
+            if all(config[key] == val for key, val in config_filter.items()):
+                passed_rowids.update(cfgid2_rowids[cfgid])
+        return passed_rowids
+
     def register_delete_table_exclusion(self, tablename, prop):
         if prop not in self.delete_exclude_tables:
             self.delete_exclude_tables[prop] = set([])
@@ -1497,6 +1714,78 @@ class DependencyCache:
         args = (ut.repr3(self.delete_exclude_tables),)
         logger.info('[depc] Updated delete tables: %s' % args)
 
+    def gc(
+        self,
+        dry_run=False,
+        max_items=None,
+        max_seconds=None,
+        max_deletes_per_sec=None,
+        valid_root_rowids=None,
+        sweeps=depcache_gc.GC_SWEEPS,
+        min_age=depcache_gc.GC_MIN_AGE,
+        restart=False,
+    ):
+        r"""
+        Garbage collects orphaned rows, unreferenced external files and
+        shard stores, and unused config rows (see :mod:`wbia.dtool.depcache_gc`).
+
+        The work is done in bounded increments: a call stops once
+        ``max_items`` rows / files were examined or ``max_seconds`` elapsed
+        and the next call continues the same pass. Call it until the
+        returned report has ``done=True``.
+
+        Args:
+            dry_run (bool): only report what would be removed
+            max_items (int): budget of rows and files examined by this call
+            max_seconds (float): time budget of this call
+            max_deletes_per_sec (float): rate limit of the removals
+            valid_root_rowids (list): existing root rowids. Rows of tables
+                that depend on other root rowids are collected. Defaults to
+                the rowids returned by ``get_root_rowids``; root dependent
+                rows are kept if neither is given.
+            sweeps (tuple): subset of 'rows', 'extern', 'shards', 'configs'
+            min_age (float): never remove files modified more recently
+            restart (bool): abandon the current pass and start a new one
+
+        Returns:
+            dict: report with counts of what was (or would be) removed and
+                bytes_freed
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.dtool.depcache_control import *  # NOQA
+            >>> from wbia.dtool.example_depcache import testdata_depc
+            >>> depc = testdata_depc()
+            >>> depc.get('chip', [1, 2, 3], 'chip')
+            >>> report = depc.gc(dry_run=True, valid_root_rowids=[1, 2], min_age=0)
+            >>> assert report['done'] and report['rows_deleted'] >= 1
+        """
+        gc_ = self._gc
+        if (
+            gc_ is None
+            or gc_.done
+            or restart
+            or gc_.dry_run != dry_run
+            or gc_.sweeps != tuple(sweeps)
+        ):
+            gc_ = depcache_gc.DepcacheGC(
+                self,
+                dry_run=dry_run,
+                valid_root_rowids=valid_root_rowids,
+                get_root_rowids=self.get_root_rowids,
+                sweeps=sweeps,
+                min_age=min_age,
+            )
+            self._gc = gc_
+        report = gc_.run(
+            max_items=max_items,
+            max_seconds=max_seconds,
+            max_deletes_per_sec=max_deletes_per_sec,
+        )
+        if gc_.done:
+            logger.info('[depc.gc] finished pass: %s' % (ut.repr2(report),))
+        return report
+
     def get_allconfig_descendant_rowids(self, root_rowids, table_config_filter=None):
         import networkx as nx
 
@@ -1580,6 +1869,77 @@ class DependencyCache:
         # TODO; remove invalidated properties
         if force_delete:
             self.delete_root(root_rowids, prop=prop)
+        elif self.row_cache is not None:
+            # Stored rows are kept, but must be read again
+            rowid_dict = self.get_allconfig_descendant_rowids(root_rowids)
+            for tablename, table_rowids in rowid_dict.items():
+                if tablename != self.root:
+                    self.row_cache.invalidate_rows(tablename, table_rowids)
+
+    def enable_row_cache(self, max_nbytes):
+        """
+        Keeps up to ``max_nbytes`` of recently read row data in memory so
+        repeated ``depc.get`` calls for the same rows skip SQL and external
+        file reads. Cached ndarrays are shared and read-only. Passing None
+        disables the cache.
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.dtool.depcache_control import *  # NOQA
+            >>> from wbia.dtool.example_depcache import testdata_depc
+            >>> depc = testdata_depc()
+            >>> depc.enable_row_cache(2 ** 20)
+            >>> sizes1 = depc.get('chip', [1, 2], 'size')
+            >>> sizes2 = depc.get('chip', [1, 2], 'size')
+            >>> assert sizes1 == sizes2
+            >>> info = depc.get_row_cache_info()
+            >>> print(ut.repr2(ut.dict_subset(info, ['hits', 'misses', 'num_entries'])))
+            {'hits': 2, 'misses': 2, 'num_entries': 2}
+        """
+        if max_nbytes is None:
+            self.row_cache = None
+        else:
+            self.row_cache = RowCache(max_nbytes)
+
+    def get_row_cache_info(self):
+        """Returns hit rate and memory use of the row cache or None if disabled"""
+        if self.row_cache is None:
+            return None
+        return self.row_cache.get_info()
+
+    def get_instrumentation_snapshot(self):
+        """
+        Returns the instrumented operations of this depcache and of its SQL
+        databases (see :mod:`wbia.dtool.instrumentation`) together with the
+        compute stats of each table and the row cache info.
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.dtool.depcache_control import *  # NOQA
+            >>> from wbia.dtool import instrumentation
+            >>> from wbia.dtool.example_depcache import testdata_depc
+            >>> depc = testdata_depc()
+            >>> instrumentation.enable()
+            >>> depc.get('chip', [1, 2], 'size')
+            >>> snapshot = depc.get_instrumentation_snapshot()
+            >>> instrumentation.enable(False)
+            >>> ops = {(op['kind'], op['table'], op['op']) for op in snapshot['ops']}
+            >>> assert ('depc', 'chip', 'get_row_data') in ops
+            >>> assert ('sql', 'chip', 'select') in ops
+        """
+        snapshot = instrumentation.get_snapshot(kind='depc', source=self.name)
+        db_names = {db.name for db in self._db_by_name.values() if db is not None}
+        sql_ops = instrumentation.get_snapshot(kind='sql')['ops']
+        snapshot['ops'].extend(op for op in sql_ops if op['source'] in db_names)
+        snapshot['ops'].sort(key=lambda op: op['total_sec'], reverse=True)
+        snapshot['compute_stats'] = ut.odict(
+            [
+                (tablename, table.get_compute_stats())
+                for tablename, table in self.cachetable_dict.items()
+            ]
+        )
+        snapshot['row_cache'] = self.get_row_cache_info()
+        return snapshot
 
     def clear_all(self):
         logger.info('Clearning all cached data in %r' % (self,))
@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental garbage collection of dependency cache artifacts.
+
+Over time a depcache accumulates data that nothing references any more:
+rows whose parents were deleted, external files left behind by deleted rows
+(``rm_extern_on_delete`` is off by default) or interrupted computes, shard
+stores of configs without rows and config rows that no table row uses.
+
+A :class:`DepcacheGC` pass walks the tables in dependency order. Each table is
+scanned in rowid batches and rows with a missing parent are deleted, which
+orphans their children further down the pass. Then the unreferenced files in
+the table's ``extern_<tablename>`` directory and its unreferenced shard stores
+are removed. The config tables are swept once all tables were scanned.
+
+A pass is a generator of small steps, so it can be driven in bounded
+increments (``max_items`` / ``max_seconds``) and rate limited
+(``max_deletes_per_sec``) while the server keeps running. Files younger than
+``min_age`` seconds are never removed so that in-flight computes, which write
+their files before inserting their rows, are left alone. With ``dry_run`` the
+report counts what would be removed.
+
+Example:
+    >>> # DISABLE_DOCTEST
+    >>> from wbia.dtool.example_depcache import testdata_depc
+    >>> depc = testdata_depc()
+    >>> report = depc.gc(dry_run=True)
+    >>> while not report['done']:
+    >>>     report = depc.gc(dry_run=True, max_seconds=1.0)
+    >>> print(ut.repr4(report))
+"""
+import logging
+import os
+import re
+import time
+from os.path import exists, join
+
+import networkx as nx
+import utool as ut
+from sqlalchemy.sql import text
+
+from wbia.dtool.depcache_table import CONFIG_ROWID, CONFIG_TABLE
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia.dtool')
+
+
+#: Rows scanned / files examined per step
+GC_BATCH_SIZE = 1000
+#: Files and shard stores modified within this many seconds are kept
+GC_MIN_AGE = ut.get_argval('--depc-gc-min-age', type_=float, default=3600.0)
+#: Everything a pass can collect
+GC_SWEEPS = ('rows', 'extern', 'shards', 'configs')
+
+_SHARD_DNAME_PATTERN = re.compile(r'^(?P<colname>.+)_cfg(?P<config_rowid>\d+)$')
+
+
+def _nbytes_on_disk(fpaths):
+    nbytes = 0
+    for fpath in fpaths:
+        try:
+            nbytes += os.path.getsize(fpath)
+        except OSError:
+            pass
+    return nbytes
+
+
+def _unlink_files(fpaths):
+    """Returns the number of files and bytes that were actually removed"""
+    num_removed = 0
+    nbytes = 0
+    for fpath in fpaths:
+        try:
+            size = os.path.getsize(fpath)
+            os.unlink(fpath)
+        except FileNotFoundError:
+            continue
+        num_removed += 1
+        nbytes += size
+    return num_removed, nbytes
+
+
+def _iter_uris(value):
+    if value is None:
+        return
+    if isinstance(value, (tuple, list)):
+        for uri in value:
+            yield uri
+    else:
+        yield value
+
+
+class DepcacheGC(object):
+    """
+    One garbage collection pass over a dependency cache
+
+    Args:
+        depc (DependencyCache): cache to collect
+        dry_run (bool): only report what would be removed
+        valid_root_rowids (list): if given, rows whose root parent is not in
+            this list are orphans (the root table lives in the controller)
+        get_root_rowids (func): returns all existing root rowids. Used when
+            ``valid_root_rowids`` is None and to refresh the roots before
+            rows of an unknown root are collected (the root may be new).
+        sweeps (tuple): subset of ``GC_SWEEPS`` to run
+        batch_size (int): rows / files handled per step
+        min_age (float): seconds before an unreferenced file can be removed
+    """
+
+    def __init__(
+        self,
+        depc,
+        dry_run=False,
+        valid_root_rowids=None,
+        get_root_rowids=None,
+        sweeps=GC_SWEEPS,
+        batch_size=GC_BATCH_SIZE,
+        min_age=GC_MIN_AGE,
+    ):
+        unknown = set(sweeps) - set(GC_SWEEPS)
+        if unknown:
+            raise ValueError('Unknown gc sweeps=%r, expected %r' % (unknown, GC_SWEEPS))
+        self.depc = depc
+        self.dry_run = dry_run
+        if valid_root_rowids is None and get_root_rowids is not None:
+            valid_root_rowids = get_root_rowids()
+        else:
+            # Explicitly given roots are never refreshed
+            get_root_rowids = None
+        self.valid_root_rowids = (
+            None if valid_root_rowids is None else set(valid_root_rowids)
+        )
+        self.get_root_rowids = get_root_rowids
+        self.sweeps = tuple(sweeps)
+        self.batch_size = batch_size
+        self.min_age = min_age
+        self.start_time = time.time()
+        self.done = False
+        # Rowids deleted by this pass (needed to cascade in dry runs)
+        self._dead_rowids = {}
+        # Config rowids used by the rows of each database
+        self._live_configs = {}
+        self._max_config_rowids = {}
+        self._throttle_start = None
+        self._num_throttled = 0
+        self.max_deletes_per_sec = None
+        self.report = ut.odict(
+            [
+                ('dry_run', dry_run),
+                ('done', False),
+                ('tables_scanned', 0),
+                ('rows_scanned', 0),
+                ('rows_deleted', 0),
+                ('files_deleted', 0),
+                ('shard_dirs_deleted', 0),
+                ('shard_records_dead', 0),
+                ('configs_deleted', 0),
+                ('bytes_freed', 0),
+                ('seconds', 0.0),
+            ]
+        )
+        self._steps = self._iter_steps()
+
+    def run(self, max_items=None, max_seconds=None, max_deletes_per_sec=None):
+        """
+        Advances the pass until it is done or a budget is used up
+
+        Args:
+            max_items (int): stop after scanning this many rows and files
+            max_seconds (float): stop after (about) this many seconds
+            max_deletes_per_sec (float): sleep to remove at most this many
+                rows / files / stores per second
+
+        Returns:
+            dict: cumulative report of the pass, ``done`` is True once the
+                whole cache was swept
+        """
+        start = time.time()
+        self.max_deletes_per_sec = max_deletes_per_sec
+        self._throttle_start = start
+        self._num_throttled = 0
+        num_items = 0
+        if not self.done:
+            for num in self._steps:
+                num_items += num
+                if max_items is not None and num_items >= max_items:
+                    break
+                if max_seconds is not None and time.time() - start >= max_seconds:
+                    break
+            else:
+                self.done = True
+        self.report['done'] = self.done
+        self.report['seconds'] += time.time() - start
+        return ut.odict(self.report)
+
+    def _throttle(self, num_deleted):
+        if not num_deleted or self.dry_run or self.max_deletes_per_sec is None:
+            return
+        self._num_throttled += num_deleted
+        min_elapsed = self._num_throttled / self.max_deletes_per_sec
+        elapsed = time.time() - self._throttle_start
+        if elapsed < min_elapsed:
+            time.sleep(min_elapsed - elapsed)
+
+    def _is_old(self, fpath):
+        try:
+            mtime = os.path.getmtime(fpath)
+        except OSError:
+            return False
+        return mtime < self.start_time - self.min_age
+
+    def _iter_steps(self):
+        depc = self.depc
+        cache_tablenames = set(depc.tablenames)
+        tablenames = [
+            node
+            for node in nx.topological_sort(depc.explicit_graph)
+            if node in cache_tablenames
+        ]
+        for tablename in tablenames:
+            table = depc[tablename]
+            if 'configs' in self.sweeps and table.db.name not in self._max_config_rowids:
+                # Only configs that existed before the pass can be removed
+                self._max_config_rowids[table.db.name] = self._get_max_config_rowid(
+                    table.db
+                )
+            referenced_fnames = set()
+            live_records = ut.ddict(int)
+            for num in self._scan_table(table, referenced_fnames, live_records):
+                yield num
+            self.report['tables_scanned'] += 1
+            if 'extern' in self.sweeps:
+                for num in self._sweep_extern(table, referenced_fnames):
+                    yield num
+            if 'shards' in self.sweeps:
+                for num in self._sweep_shards(table, live_records):
+                    yield num
+        if 'configs' in self.sweeps:
+            for tablename in tablenames:
+                db = depc[tablename].db
+                if db.name in self._max_config_rowids:
+                    yield self._sweep_configs(db)
+                    del self._max_config_rowids[db.name]
+
+    def _scan_table(self, table, referenced_fnames, live_records):
+        """
+        Scans the rows of a table in rowid order. Yields after each batch.
+        """
+        parent_colattrs = [
+            colattr for colattr in table.parent_col_attrs if not colattr['ismulti']
+        ]
+        parent_colnames = [colattr['intern_colname'] for colattr in parent_colattrs]
+        parent_tablenames = [colattr['parent_table'] for colattr in parent_colattrs]
+        intern_colnames = table.get_intern_data_col_attr('intern_colname')
+        extern_colnames = ut.compress(
+            intern_colnames, table.get_intern_data_col_attr('is_external_pointer')
+        )
+        shard_colattrs = [
+            colattr
+            for colattr in table.internal_data_col_attrs
+            if colattr.get('is_shard_pointer', False)
+        ]
+        shard_colnames = [colattr['intern_colname'] for colattr in shard_colattrs]
+        select_colnames = (
+            [table.rowid_colname, CONFIG_ROWID]
+            + parent_colnames
+            + extern_colnames
+            + shard_colnames
+        )
+        stmt = text(
+            'SELECT {colnames} FROM {tablename} WHERE {rowid_colname} > :cursor '
+            'ORDER BY {rowid_colname} LIMIT :limit'.format(
+                colnames=', '.join(select_colnames),
+                tablename=table.tablename,
+                rowid_colname=table.rowid_colname,
+            )
+        )
+        live_configs = self._live_configs.setdefault(table.db.name, set())
+        nparents = len(parent_colnames)
+        nextern = len(extern_colnames)
+        cursor = 0
+        while True:
+            rows = table.db.executeone(
+                stmt, {'cursor': cursor, 'limit': self.batch_size}, keepwrap=True
+            )
+            if not rows:
+                break
+            cursor = rows[-1][0]
+            self.report['rows_scanned'] += len(rows)
+
+            orphan_flags = [False] * len(rows)
+            if 'rows' in self.sweeps:
+                for parentx, parent_tablename in enumerate(parent_tablenames):
+                    parent_ids = [row[2 + parentx] for row in rows]
+                    missing = self._get_missing_parents(parent_tablename, parent_ids)
+                    if missing:
+                        for rowx, parent_id in enumerate(parent_ids):
+                            if parent_id in missing:
+                                orphan_flags[rowx] = True
+
+            orphan_rows = ut.compress(rows, orphan_flags)
+            if orphan_rows:
+                self._delete_orphans(table, orphan_rows, nparents, nextern)
+            for row, is_orphan in zip(rows, orphan_flags):
+                if is_orphan:
+                    continue
+                live_configs.add(row[1])
+                externs = row[2 + nparents : 2 + nparents + nextern]
+                for value in externs:
+                    referenced_fnames.update(_iter_uris(value))
+                shard_idxs = row[2 + nparents + nextern :]
+                for colattr, shard_idx in zip(shard_colattrs, shard_idxs):
+                    if shard_idx is not None:
+                        live_records[(colattr['colname'], row[1])] += 1
+            yield len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+    def _get_missing_parents(self, parent_tablename, parent_ids):
+        """Returns the parent rowids that do not exist (or were collected)"""
+        depc = self.depc
+        unique_ids = set(parent_ids) - {None}
+        dead = self._dead_rowids.get(parent_tablename, set())
+        if parent_tablename == depc.root:
+            if self.valid_root_rowids is None:
+                return set()
+            missing = {id_ for id_ in unique_ids if id_ not in self.valid_root_rowids}
+            if missing and self.get_root_rowids is not None:
+                # Roots added since the pass started are not orphans
+                self.valid_root_rowids = set(self.get_root_rowids())
+                missing = {id_ for id_ in unique_ids if id_ not in self.valid_root_rowids}
+            return missing
+        parent_table = depc[parent_tablename]
+        unique_ids = sorted(unique_ids)
+        existing = parent_table.db.get(
+            parent_tablename,
+            (parent_table.rowid_colname,),
+            unique_ids,
+            id_colname=parent_table.rowid_colname,
+        )
+        return {
+            id_
+            for id_, exists_id in zip(unique_ids, existing)
+            if exists_id is None or id_ in dead
+        }
+
+    def _delete_orphans(self, table, orphan_rows, nparents, nextern):
+        """
+        Deletes rows without cascading into children, which become orphans
+        themselves and are collected when the pass reaches their table.
+        """
+        rowids = [row[0] for row in orphan_rows]
+        fpaths = []
+        for row in orphan_rows:
+            for value in row[2 + nparents : 2 + nparents + nextern]:
+                fpaths.extend(join(table.extern_dpath, uri) for uri in _iter_uris(value))
+        self._dead_rowids.setdefault(table.tablename, set()).update(rowids)
+        self.report['rows_deleted'] += len(rowids)
+        if not self.dry_run and table.on_delete is not None:
+            table.on_delete()
+        num_files = self._remove_files(fpaths)
+        logger.info(
+            '[depc.gc] %s %d orphaned rows of %s with %d files'
+            % (
+                'found' if self.dry_run else 'deleted',
+                len(rowids),
+                table.tablename,
+                num_files,
+            )
+        )
+        if not self.dry_run:
+            table.db.delete_rowids(table.tablename, rowids)
+            table._invalidate_cached_rows(rowids)
+        self._throttle(len(rowids))
+
+    def _sweep_extern(self, table, referenced_fnames):
+        """Removes files of the extern directory that no row points to"""
+        extern_dpath = table.extern_dpath
+        if not exists(extern_dpath):
+            return
+        batch = []
+        with os.scandir(extern_dpath) as entries:
+            for entry in entries:
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    self._remove_unreferenced(batch, referenced_fnames)
+                    yield len(batch)
+                    batch = []
+        if batch:
+            self._remove_unreferenced(batch, referenced_fnames)
+            yield len(batch)
+
+    def _remove_unreferenced(self, entries, referenced_fnames):
+        fpaths = [
+            entry.path
+            for entry in entries
+            if entry.name not in referenced_fnames
+            and entry.is_file()
+            and self._is_old(entry.path)
+        ]
+        if not fpaths:
+            return
+        self._remove_files(fpaths)
+        self._throttle(len(fpaths))
+
+    def _remove_files(self, fpaths):
+        """
+        Unlinks the files and reports the ones that were removed. Files that
+        are already gone, e.g. URIs of rows whose file was never written, are
+        not counted.
+        """
+        if self.dry_run:
+            fpaths = [fpath for fpath in fpaths if exists(fpath)]
+            num_files, nbytes = len(fpaths), _nbytes_on_disk(fpaths)
+        else:
+            num_files, nbytes = _unlink_files(fpaths)
+        self.report['files_deleted'] += num_files
+        self.report['bytes_freed'] += nbytes
+        return num_files
+
+    def _sweep_shards(self, table, live_records):
+        """
+        Removes the shard stores of configs without rows and counts the dead
+        records of the others, which are only reclaimed by clear_table.
+        """
+        shard_dpath = table.shard_dpath
+        if not exists(shard_dpath):
+            return
+        dnames = sorted(os.listdir(shard_dpath))
+        for dname in dnames:
+            match = _SHARD_DNAME_PATTERN.match(dname)
+            if match is None:
+                continue
+            key = (match.group('colname'), int(match.group('config_rowid')))
+            store_dpath = join(shard_dpath, dname)
+            if key in live_records:
+                store = table.get_shard_store(*key)
+                num_dead = len(store) - live_records[key]
+                self.report['shard_records_dead'] += max(0, num_dead)
+            else:
+                index_fpath = join(store_dpath, 'index.bin')
+                recent_fpath = index_fpath if exists(index_fpath) else store_dpath
+                if self._is_old(recent_fpath):
+                    fpaths = [
+                        join(store_dpath, fname) for fname in os.listdir(store_dpath)
+                    ]
+                    self.report['shard_dirs_deleted'] += 1
+                    self.report['bytes_freed'] += _nbytes_on_disk(fpaths)
+                    if not self.dry_run:
+                        store = table._shard_stores.pop(key, None)
+                        if store is not None:
+                            store.close()
+                        ut.delete(store_dpath, verbose=False)
+                    self._throttle(1)
+            yield 1
+
+    def _get_max_config_rowid(self, db):
+        stmt = text('SELECT MAX({}) FROM {}'.format(CONFIG_ROWID, CONFIG_TABLE))
+        return db.executeone(stmt)[0]
+
+    def _sweep_configs(self, db):
+        """
+        Removes config rows that no table row of the database uses. The
+        newest config is kept so that SQLite does not reuse its rowid.
+        """
+        max_config_rowid = self._max_config_rowids[db.name]
+        if max_config_rowid is None:
+            return 0
+        stmt = text(
+            'SELECT {rowid} FROM {config} WHERE {rowid} < :max_rowid'.format(
+                rowid=CONFIG_ROWID, config=CONFIG_TABLE
+            )
+        )
+        config_rowids = db.executeone(stmt, {'max_rowid': max_config_rowid})
+        candidates = set(config_rowids) - self._live_configs.get(db.name, set())
+        tables = [table for table in self.depc.tables if table.db is db]
+        for table in tables:
+            if not candidates:
+                break
+            # Rows may have been added since the table was scanned
+            stmt = text(
+                'SELECT DISTINCT {rowid} FROM {tablename}'.format(
+                    rowid=CONFIG_ROWID, tablename=table.tablename
+                )
+            )
+            candidates -= set(db.executeone(stmt))
+        num_configs = len(config_rowids)
+        if candidates:
+            self.report['configs_deleted'] += len(candidates)
+            logger.info(
+                '[depc.gc] %s %d unused configs in %s'
+                % ('found' if self.dry_run else 'deleting', len(candidates), db.name)
+            )
+            if not self.dry_run:
+                db.delete(CONFIG_TABLE, sorted(candidates), id_colname=CONFIG_ROWID)
+                # Memoized config rowids and resolution plans may be stale
+                for table in tables:
+                    table._config_rowid_cache = {}
+                self.depc.invalidate_resolution_plans()
+            self._throttle(len(candidates))
+        return num_configs
@@ -20,8 +20,14 @@ FIXME:
 
 
 """
+import atexit
+import collections
+import concurrent.futures
 import logging
+import os
+import pickle
 import re
+import threading
 import itertools as it
 from os.path import join, exists
 
@@ -29,7 +35,9 @@ import networkx as nx
 import utool as ut
 import ubelt as ub
 
+from wbia.dtool import instrumentation
 from wbia.dtool import sqlite3 as lite
+from wbia.dtool.shard_store import ShardStore
 from wbia.dtool.sql_control import SQLDatabaseController, compare_coldef_lists
 from wbia.dtool.types import TYPE_TO_SQLTYPE
 
@@ -43,6 +51,7 @@ logger = logging.getLogger('wbia.dtool')
 
 
 EXTERN_SUFFIX = '_extern_uri'
+SHARD_SUFFIX = '_shard_idx'
 
 CONFIG_TABLE = 'config'
 CONFIG_ROWID = 'config_rowid'
@@ -52,6 +61,19 @@ CONFIG_STRID = 'config_strid'
 CONFIG_DICT = 'config_dict'
 
 
+#: Execution engines that can be given to ``register_preproc(engine=...)``
+COMPUTE_ENGINES = (None, 'thread', 'process')
+# Persistent worker pools keyed by (pid, engine, num_workers)
+_ENGINE_POOLS = {}
+# Sentinel for values that are not in a row cache
+_MISSING = object()
+#: Number of threads that read external files ahead of the consumer
+EXTERN_READ_WORKERS = ut.get_argval('--extern-read-workers', type_=int, default=8)
+_PREFETCH_THREAD_PREFIX = 'depc_prefetch'
+#: Number of threads that unlink external files of deleted rows
+EXTERN_DELETE_WORKERS = ut.get_argval('--extern-delete-workers', type_=int, default=8)
+
+
 # if ut.is_developer():
 #     GRACE_PERIOD = 10
 # else:
@@ -100,6 +122,16 @@ class ExternType(ub.NiceRepr):
         )
 
 
+class ShardType(ub.NiceRepr):
+    """
+    Type to denote an ndarray column stored in memory-mapped shards instead of
+    as a blob in the SQL table. See :mod:`wbia.dtool.shard_store`.
+    """
+
+    def __nice__(self):
+        return 'shard'
+
+
 class ExternalStorageException(Exception):
     """Indicates a missing external file"""
 
@@ -152,6 +184,125 @@ def make_extern_io_funcs(table, cls):
     return _read_func, _write_func
 
 
+def _get_engine_pool(engine, num_workers):
+    """Returns a persistent executor, pools from a parent process are dropped"""
+    key = (os.getpid(), engine, num_workers)
+    pool = _ENGINE_POOLS.get(key, None)
+    if pool is None:
+        if engine == 'thread':
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+        elif engine == 'process':
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers)
+        else:
+            raise ValueError('unknown engine=%r' % (engine,))
+        _ENGINE_POOLS[key] = pool
+    return pool
+
+
+def _get_prefetch_pool(num_workers):
+    """Returns a persistent thread pool used to read external files"""
+    key = (os.getpid(), 'prefetch', num_workers)
+    pool = _ENGINE_POOLS.get(key, None)
+    if pool is None:
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix=_PREFETCH_THREAD_PREFIX
+        )
+        _ENGINE_POOLS[key] = pool
+    return pool
+
+
+def prefetch_imap(func, items, num_workers, window=None):
+    """
+    Lazy ``map(func, items)`` that evaluates up to ``window`` items ahead of
+    the consumer on a thread pool. Results are yielded in input order and
+    exceptions are raised when their item is reached. ``items`` is only
+    advanced by the consuming thread.
+
+    Calls made from inside a prefetch worker run serially so nested reads
+    cannot exhaust the pool.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.depcache_table import *  # NOQA
+        >>> import time
+        >>> def slow_square(x):
+        >>>     time.sleep(0.01 * (x % 3))
+        >>>     return x * x
+        >>> print(list(prefetch_imap(slow_square, range(8), num_workers=4)))
+        [0, 1, 4, 9, 16, 25, 36, 49]
+    """
+    in_worker = threading.current_thread().name.startswith(_PREFETCH_THREAD_PREFIX)
+    if num_workers <= 1 or in_worker:
+        for item in items:
+            yield func(item)
+        return
+    if window is None:
+        window = 2 * num_workers
+    pool = _get_prefetch_pool(num_workers)
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _unlink_quiet(fpath):
+    try:
+        os.remove(fpath)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def remove_fpaths_parallel(fpaths, num_workers=EXTERN_DELETE_WORKERS, label=None):
+    """
+    Unlinks files on the prefetch thread pool, which hides the per-file
+    latency of network mounted cache directories. Files that are already
+    gone are skipped.
+
+    Returns:
+        int: number of files removed
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.depcache_table import *  # NOQA
+        >>> dpath = ut.ensure_app_resource_dir('dtool', 'test_remove_fpaths')
+        >>> fpaths = [join(dpath, 'f%d.txt' % x) for x in range(10)]
+        >>> _ = [ut.touch(fpath, verbose=False) for fpath in fpaths]
+        >>> print(remove_fpaths_parallel(fpaths + fpaths[:2], num_workers=4))
+        10
+    """
+    if label is None:
+        label = 'unlinking files'
+    num_removed = 0
+    results = prefetch_imap(_unlink_quiet, fpaths, num_workers)
+    for flag in ut.ProgIter(
+        results, length=len(fpaths), label=label, enabled=len(fpaths) > 1000
+    ):
+        num_removed += flag
+    return num_removed
+
+
+@atexit.register
+def _shutdown_engine_pools():
+    for pool in _ENGINE_POOLS.values():
+        pool.shutdown(wait=True)
+    _ENGINE_POOLS.clear()
+
+
+def _engine_compute_rows(preproc_func, depc, vectorized, argsT, config):
+    """Calls a preproc function on a slice of a chunk inside an engine worker"""
+    if vectorized:
+        proptup_gen = preproc_func(depc, *argsT, config=config)
+    else:
+        proptup_gen = (
+            preproc_func(depc, *argrow, config=config) for argrow in zip(*argsT)
+        )
+    return list(proptup_gen)
+
+
 @profile
 def ensure_config_table(db):
     """SQL definition of configuration table."""
@@ -408,11 +559,11 @@ class _TableConfigHelper(object):
         )
         return cfgstr_list
 
-    def get_config_rowid(self, config=None, _debug=None):
+    def get_config_rowid(self, config=None, _debug=None, verify=False):
         if isinstance(config, int):
             config_rowid = config
         else:
-            config_rowid = self.add_config(config)
+            config_rowid = self.add_config(config, verify=verify)
         return config_rowid
 
     def get_config_hashid(self, config_rowid_list):
@@ -445,13 +596,25 @@ class _TableConfigHelper(object):
         ]
 
     # @profile
-    def add_config(self, config, _debug=None):
+    def add_config(self, config, _debug=None, verify=False):
+        """
+        Returns the rowid of config and adds it if needed. Rowids are memoized,
+        with verify=True a memoized rowid is checked against the database
+        first (config rows can be deleted by depcache_gc in another process).
+        """
         try:
             # assume config is AlgoRequest or TableConfig
             config_strid = config.get_cfgstr()
         except AttributeError:
             config_strid = ut.to_json(config)
         config_hashid = ut.hashstr27(config_strid)
+        config_rowid = self._config_rowid_cache.get(config_hashid, None)
+        if config_rowid is not None:
+            if not verify:
+                return config_rowid
+            if self.get_config_hashid([config_rowid])[0] == config_hashid:
+                return config_rowid
+            del self._config_rowid_cache[config_hashid]
         logger.debug('config_strid = %r' % (config_strid,))
         logger.debug('config_hashid = %r' % (config_hashid,))
         get_rowid_from_superkey = self.get_config_rowid_from_hashid
@@ -466,6 +629,8 @@ class _TableConfigHelper(object):
         )
         config_rowid = config_rowid_list[0]
         logger.debug('config_rowid_list = %r' % (config_rowid_list,))
+        if config_rowid is not None:
+            self._config_rowid_cache[config_hashid] = config_rowid
         return config_rowid
 
 
@@ -687,8 +852,9 @@ class _TableInternalSetup(ub.NiceRepr):
             is_externtup = is_tuple and coltype[0] == 'extern'
             is_functup = is_tuple and ut.is_func_or_method(coltype[0])
             is_exttype = isinstance(coltype, ExternType)
+            is_shard = isinstance(coltype, ShardType)
             # Check column input main types
-            is_normal = coltype in TYPE_TO_SQLTYPE
+            is_normal = not is_shard and coltype in TYPE_TO_SQLTYPE
             # is_normal   = not (is_tuple or is_func)
             isnested = is_tuple and not (is_func or is_externtup)
             is_external = is_func or is_functup or is_externtup or is_exttype
@@ -696,7 +862,12 @@ class _TableInternalSetup(ub.NiceRepr):
             colattr['colname'] = colname
             colattr['coltype'] = coltype
             colattr['data_colx'] = data_colx
-            if is_normal:
+            if is_shard:
+                # Memory-mapped ndarray column, SQL stores the record number
+                colattr['is_shard'] = True
+                colattr['intern_colname'] = colname + SHARD_SUFFIX
+                colattr['sqltype'] = TYPE_TO_SQLTYPE[int]
+            elif is_normal:
                 # Normal non-nested column
                 sqltype = TYPE_TO_SQLTYPE[coltype]
                 colattr['intern_colname'] = colname
@@ -984,6 +1155,8 @@ class _TableInternalSetup(ub.NiceRepr):
                     colattr['is_external_pointer'] = True
                     colattr['write_func'] = data_colattr['write_func']
                     colattr['read_func'] = data_colattr['read_func']
+                if data_colattr.get('is_shard', False):
+                    colattr['is_shard_pointer'] = True
                 internal_col_attrs.append(colattr)
 
         # Append extra columns
@@ -1023,6 +1196,23 @@ class _TableGeneralHelper(ub.NiceRepr):
         extern_dpath = join(cache_dpath, extern_dname)
         return extern_dpath
 
+    @property
+    def shard_dpath(self):
+        cache_dpath = self.depc.cache_dpath
+        shard_dname = 'shards_' + self.tablename
+        shard_dpath = join(cache_dpath, shard_dname)
+        return shard_dpath
+
+    def get_shard_store(self, colname, config_rowid):
+        """Returns the memory-mapped store of a ShardType column for a config"""
+        key = (colname, config_rowid)
+        store = self._shard_stores.get(key, None)
+        if store is None:
+            dname = '%s_cfg%d' % (colname, config_rowid)
+            store = ShardStore(join(self.shard_dpath, dname))
+            self._shard_stores[key] = store
+        return store
+
     @property
     def dpath(self):
         # assert table.ismulti, 'only valid for models'
@@ -1313,6 +1503,11 @@ class _TableGeneralHelper(ub.NiceRepr):
                 rattr['read_func'] = colattr['read_func']
                 rattr['write_func'] = colattr['write_func']
                 rattr['is_extern'] = True
+            elif colattr.get('is_shard'):
+                intern_attr = requestable_col_attrs[colattr['intern_colname']]
+                rattr['intern_colname'] = intern_attr['intern_colname']
+                rattr['intern_colx'] = intern_attr['intern_colx']
+                rattr['is_shard'] = True
             else:
                 continue
             colname = colattr['colname']
@@ -1381,6 +1576,9 @@ class _TableComputeHelper(object):
             proptup_gen = self._prepare_storage_extern(
                 dirty_parent_ids, config_rowid, config, proptup_gen
             )
+        # Append memory-mapped columns to their shards
+        if any(self.get_data_col_attr('is_shard')):
+            proptup_gen = self._prepare_storage_shard(config_rowid, proptup_gen)
         if self.ismulti:
             manifest_dpath = self.dpath
             ut.ensuredir(manifest_dpath)
@@ -1589,6 +1787,36 @@ class _TableComputeHelper(object):
             data_new = tuple(ut.ungroup(grouped_items, groupxs, nCols - 1))
             yield data_new
 
+    def _prepare_storage_shard(self, config_rowid, proptup_gen):
+        """
+        Appends ShardType columns to their memory-mapped store and replaces
+        the data with the record number that is stored in SQL.
+
+        This is not lazy because the records must be flushed before the rows
+        pointing to them are added.
+        """
+        internal_data_col_attrs = self.internal_data_col_attrs
+        shard_colxs = ut.where(
+            ut.dict_take_column(internal_data_col_attrs, 'is_shard_pointer', False)
+        )
+        shard_stores = [
+            self.get_shard_store(internal_data_col_attrs[colx]['colname'], config_rowid)
+            for colx in shard_colxs
+        ]
+        proptup_list = []
+        for data in proptup_gen:
+            if data is None:
+                proptup_list.append(None)
+                continue
+            data_new = list(data)
+            for colx, store in zip(shard_colxs, shard_stores):
+                if data_new[colx] is not None:
+                    data_new[colx] = store.append(data_new[colx])
+            proptup_list.append(tuple(data_new))
+        for store in shard_stores:
+            store.flush()
+        return proptup_list
+
     def get_extern_fnames(self, parent_rowids, config, extern_col_index=0):
         """
         convinience function around get_extern_fnames
@@ -1674,10 +1902,6 @@ class _TableComputeHelper(object):
         dirty_parent_ids = parent_rowids
         config_ = config
         """
-        nInput = len(dirty_parent_ids)
-        # if verbose:
-        #     logger.info('[deptbl.compute] nInput = %r' % (nInput,))
-
         # Pack arguments into column-wise order to send to the func
         argsT = zip(*dirty_preproc_args)
         argsT = list(argsT)  # TODO: remove
@@ -1698,6 +1922,17 @@ class _TableComputeHelper(object):
                 for argrow in zip(*argsT)
             )
 
+        return self._store_dirty_rows(
+            dirty_parent_ids, dirty_preproc_args, proptup_gen, config_rowid, config_
+        )
+
+    def _store_dirty_rows(
+        self, dirty_parent_ids, dirty_preproc_args, proptup_gen, config_rowid, config_
+    ):
+        """
+        Converts the output of ``preproc_func`` into parameters for SQL
+        """
+        nInput = len(dirty_parent_ids)
         DEBUG_LIST_MODE = True
         if DEBUG_LIST_MODE:
             proptup_gen = list(proptup_gen)
@@ -1718,6 +1953,83 @@ class _TableComputeHelper(object):
         # None data means that there was an error for a specific row
         return dirty_params_iter
 
+    def _resolve_engine(self, config):
+        """
+        Returns the engine used to compute rows for this config. The process
+        engine falls back to serial execution if the work cannot be pickled.
+        """
+        if self.engine != 'process':
+            return self.engine
+        config_ = config.config if hasattr(config, 'config') else config
+        try:
+            pickle.dumps((self.preproc_func, config_))
+        except Exception as ex:
+            logger.warning(
+                '[deptbl.compute] tbl=%s cannot use the process engine, '
+                'computing serially: %s' % (self.tablename, ex)
+            )
+            return None
+        return self.engine
+
+    def _submit_dirty_chunk(self, pool, dirty_chunk, config):
+        """
+        Submits a chunk to an engine pool. The chunk is split into one
+        contiguous slice per worker and the futures are returned in order.
+        """
+        config_ = config.config if hasattr(config, 'config') else config
+        if self.engine == 'process':
+            # Connections and the controller cannot be sent to other processes
+            depc = None
+            num_slices = self.num_workers
+        else:
+            # A single thread overlaps compute with storage, more would race
+            # on the parent tables.
+            depc = self.depc
+            num_slices = 1
+        slice_size = max(1, -(-len(dirty_chunk) // num_slices))
+        futures = []
+        for dirty_slice in ut.ichunks(dirty_chunk, slice_size):
+            _, dirty_preproc_args = zip(*dirty_slice)
+            argsT = list(zip(*dirty_preproc_args))
+            future = pool.submit(
+                _engine_compute_rows,
+                self.preproc_func,
+                depc,
+                self.vectorized,
+                argsT,
+                config_,
+            )
+            futures.append(future)
+        return futures
+
+    def _pipelined_compute_dirty_rows(self, dirty_chunks, config_rowid, config):
+        """
+        Computes chunks with ``self.engine``. Chunk N+1 is computed by the
+        workers while chunk N is stored. Chunks are yielded in input order.
+        """
+        pool = _get_engine_pool(self.engine, self.num_workers)
+        config_ = config.config if hasattr(config, 'config') else config
+        chunk_iter = iter(dirty_chunks)
+        pending = collections.deque()
+
+        def _submit_next_chunk():
+            for dirty_chunk in it.islice(chunk_iter, 1):
+                futures = self._submit_dirty_chunk(pool, dirty_chunk, config)
+                pending.append((dirty_chunk, futures))
+
+        _submit_next_chunk()
+        while pending:
+            dirty_chunk, futures = pending.popleft()
+            # The workers compute the next chunk while this one is stored
+            _submit_next_chunk()
+            proptup_list = list(
+                it.chain.from_iterable(future.result() for future in futures)
+            )
+            dirty_parent_ids, dirty_preproc_args = zip(*dirty_chunk)
+            yield self._store_dirty_rows(
+                dirty_parent_ids, dirty_preproc_args, proptup_list, config_rowid, config_
+            )
+
     def _chunk_compute_dirty_rows(
         self, dirty_parent_ids, dirty_preproc_args, config_rowid, config, verbose=True
     ):
@@ -1757,31 +2069,53 @@ class _TableComputeHelper(object):
         )
         # These are the colnames that we expect to be computed
         colnames = self.computable_colnames()
-        # CALL EXTERNAL PREPROCESSING / GENERATION FUNCTION
-        try:
-            # prog_iter = list(prog_iter)
-            for dirty_chunk in tqdm.tqdm(prog_iter):
-                nChunkInput = len(dirty_chunk)
-                if nChunkInput == 0:
-                    return
-                dirty_parent_ids_chunk, dirty_preproc_args_chunk = zip(*dirty_chunk)
+        if nInput == 0:
+            return
 
-                dirty_params_iter = self._compute_dirty_rows(
+        def _serial_compute_dirty_rows():
+            for dirty_chunk in prog_iter:
+                dirty_parent_ids_chunk, dirty_preproc_args_chunk = zip(*dirty_chunk)
+                yield self._compute_dirty_rows(
                     dirty_parent_ids_chunk,
                     dirty_preproc_args_chunk,
                     config_rowid,
                     config,
                 )
 
-                DEBUG_LIST_MODE = True
-                if DEBUG_LIST_MODE:
-                    dirty_params_iter = list(dirty_params_iter)
-                    assert len(dirty_params_iter) == nChunkInput
+        engine = self._resolve_engine(config)
+        if engine is None:
+            chunk_results = _serial_compute_dirty_rows()
+        else:
+            chunk_results = self._pipelined_compute_dirty_rows(
+                prog_iter, config_rowid, config
+            )
+        stats = self.compute_stats
+        source = None if self.depc is None else self.depc.name
+        num_rows = 0
+        # CALL EXTERNAL PREPROCESSING / GENERATION FUNCTION
+        try:
+            start_time = time.time()
+            tt = start_time
+            for dirty_params_iter in tqdm.tqdm(chunk_results):
+                compute_sec = time.time() - tt
+                stats['compute_sec'] += compute_sec
                 # TODO: Separate into func which can be specified as a callback.
                 # None data means that there was an error for a specific row
                 dirty_params_iter = ut.filter_Nones(dirty_params_iter)
                 nChunkInput = len(dirty_params_iter)
+                tt = time.time()
                 yield colnames, dirty_params_iter, nChunkInput
+                store_sec = time.time() - tt
+                stats['store_sec'] += store_sec
+                stats['num_rows'] += nChunkInput
+                instrumentation.record(
+                    'depc', source, self.tablename, 'compute', nChunkInput, compute_sec
+                )
+                instrumentation.record(
+                    'depc', source, self.tablename, 'store', nChunkInput, store_sec
+                )
+                num_rows += nChunkInput
+                tt = time.time()
         except Exception as ex:
             ut.printex(
                 ex,
@@ -1798,6 +2132,26 @@ class _TableComputeHelper(object):
                 tb=True,
             )
             raise
+        total_sec = time.time() - start_time
+        logger.info(
+            '[deptbl.compute] tbl=%s, engine=%s, added %d rows at %.2f rows/sec'
+            % (self.tablename, engine, num_rows, num_rows / max(total_sec, 1e-9))
+        )
+
+    def get_compute_stats(self):
+        """
+        Returns cumulative throughput of rows computed and stored by this table
+
+        Returns:
+            dict: num_rows, compute_sec (calling ``preproc_func`` and preparing
+                storage or waiting for an engine), store_sec (SQL inserts) and
+                rows_per_sec
+        """
+        stats = ut.odict(self.compute_stats)
+        total_sec = stats['compute_sec'] + stats['store_sec']
+        stats['rows_per_sec'] = stats['num_rows'] / total_sec if total_sec else 0.0
+        stats['engine'] = self.engine
+        return stats
 
 
 @ut.reloadable_class
@@ -1829,6 +2183,13 @@ class DependencyCacheTable(
         preproc_func (func): worker function
         vectorized (bool): by defaults it is assumed registered functions can
             process multiple inputs at once.
+        engine (str): how ``preproc_func`` is executed. None calls it in the
+            calling process. 'thread' computes the next chunk on a background
+            thread while the current chunk is stored. 'process' splits each
+            chunk across a persistent process pool and also overlaps compute
+            with storage. In that case ``preproc_func`` must be picklable and is
+            given ``depc=None``.
+        num_workers (int): size of the 'process' pool (default: number of cpus)
         taggable (bool): specifies if a computed object can be disconected from
             its ancestors and accessed via a tag.
 
@@ -1865,6 +2226,8 @@ class DependencyCacheTable(
         rm_extern_on_delete=False,
         vectorized=True,
         taggable=False,
+        engine=None,
+        num_workers=None,
     ):
         """
         recieves kwargs from depc._register_prop
@@ -1892,6 +2255,8 @@ class DependencyCacheTable(
         self.default_to_unpack = default_to_unpack
         self.vectorized = vectorized
         self.taggable = taggable
+        self._init_engine(engine, num_workers)
+        self.extern_read_workers = EXTERN_READ_WORKERS
 
         # self.store_modification_time = True
         # Use the filesystem to accomplish this
@@ -1912,6 +2277,11 @@ class DependencyCacheTable(
         if ut.SUPER_STRICT:
             self._assert_self()
 
+        # Open memory-mapped stores keyed by (colname, config_rowid)
+        self._shard_stores = {}
+        # Config rows are never deleted, so rowids are memoized by hashid
+        self._config_rowid_cache = {}
+
         # ??? Clearly a hack, but to what end?
         self._hack_chunk_cache = None
 
@@ -1932,6 +2302,8 @@ class DependencyCacheTable(
         rm_extern_on_delete=False,
         vectorized=True,
         taggable=False,
+        engine=None,
+        num_workers=None,
     ):
         """Build the instance based on a database and table name."""
         self = cls.__new__(cls)
@@ -1965,6 +2337,9 @@ class DependencyCacheTable(
         self.default_to_unpack = default_to_unpack
         self.vectorized = vectorized
         self.taggable = taggable
+        self._init_engine(engine, num_workers)
+        #: Number of threads used to read external files (1 reads serially)
+        self.extern_read_workers = EXTERN_READ_WORKERS
         #: Flag to enable the deletion of external files on associated SQL row deletion.
         self.rm_extern_on_delete = rm_extern_on_delete
 
@@ -1981,11 +2356,30 @@ class DependencyCacheTable(
         if ut.SUPER_STRICT:
             self._assert_self()
 
+        # Open memory-mapped stores keyed by (colname, config_rowid)
+        self._shard_stores = {}
+        # Config rows are never deleted, so rowids are memoized by hashid
+        self._config_rowid_cache = {}
+
         # ??? Clearly a hack, but to what end?
         self._hack_chunk_cache = None
 
         return self
 
+    def _init_engine(self, engine, num_workers):
+        if engine not in COMPUTE_ENGINES:
+            raise ValueError(
+                'tablename=%r has unknown engine=%r, expected one of %r'
+                % (self.tablename, engine, COMPUTE_ENGINES)
+            )
+        if num_workers is None:
+            num_workers = ut.num_cpus() if engine == 'process' else 1
+        self.engine = engine
+        self.num_workers = num_workers
+        self.compute_stats = ut.odict(
+            [('num_rows', 0), ('compute_sec', 0.0), ('store_sec', 0.0)]
+        )
+
     @property
     def fname(self):
         """Backwards compatible name of the database this Table belongs to"""
@@ -1997,6 +2391,7 @@ class DependencyCacheTable(
         Ensures the SQL schema for this cache table
         """
         self.db = self.depc.get_db_by_name(self._db_name)
+        self._config_rowid_cache = {}
         # logger.info('Checking sql for table=%r' % (self.tablename,))
         if not self.db.has_table(self.tablename):
             logger.debug('Initializing table=%r' % (self.tablename,))
@@ -2079,6 +2474,7 @@ class DependencyCacheTable(
         return self.db.get_row_count(self.tablename)
 
     # @profile
+    @instrumentation.timed_table_op('ensure_rows')
     def ensure_rows(
         self,
         parent_ids_,
@@ -2118,14 +2514,22 @@ class DependencyCacheTable(
             initial_rowid_list = self._get_rowid(parent_ids_, config=config)
             initial_rowid_list = list(initial_rowid_list)
 
-            logger.debug(
-                '[deptbl.ensure] initial_rowid_list = %s'
-                % (ut.trunc_repr(initial_rowid_list),)
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    '[deptbl.ensure] initial_rowid_list = %s'
+                    % (ut.trunc_repr(initial_rowid_list),)
+                )
             logger.debug('[deptbl.ensure] config_rowid = %r' % (config_rowid,))
 
             # Get corresponding "dirty" parent rowids
             isdirty_list = ut.flag_None_items(initial_rowid_list)
+            if any(isdirty_list):
+                # Check the memoized config rowid before rows are added with it
+                valid_config_rowid = self.get_config_rowid(config, verify=True)
+                if valid_config_rowid != config_rowid:
+                    config_rowid = valid_config_rowid
+                    initial_rowid_list = list(self._get_rowid(parent_ids_, config=config))
+                    isdirty_list = ut.flag_None_items(initial_rowid_list)
             num_dirty = sum(isdirty_list)
             num_total = len(parent_ids_)
 
@@ -2422,7 +2826,8 @@ class DependencyCacheTable(
         config_rowid = self.get_config_rowid(config=config)
         logger.debug('_get_rowid')
         logger.debug('_get_rowid self.tablename = %r ' % (self.tablename,))
-        logger.debug('_get_rowid parent_ids_ = %s' % (ut.trunc_repr(parent_ids_)))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('_get_rowid parent_ids_ = %s' % (ut.trunc_repr(parent_ids_)))
         logger.debug('_get_rowid config = %s' % (config))
         logger.debug('_get_rowid self.rowid_colname = %s' % (self.rowid_colname))
         logger.debug('_get_rowid config_rowid = %s' % (config_rowid))
@@ -2440,9 +2845,19 @@ class DependencyCacheTable(
             eager=eager,
             nInput=nInput,
         )
-        logger.debug('_get_rowid rowid_list = %s' % (ut.trunc_repr(rowid_list)))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('_get_rowid rowid_list = %s' % (ut.trunc_repr(rowid_list)))
         return rowid_list
 
+    def _invalidate_cached_rows(self, rowid_list=None):
+        """Drops rows (or the whole table if None) from the depcache row cache"""
+        row_cache = self.depc.row_cache if self.depc is not None else None
+        if row_cache is not None:
+            if rowid_list is None:
+                row_cache.invalidate_table(self.tablename)
+            else:
+                row_cache.invalidate_rows(self.tablename, rowid_list)
+
     def clear_table(self):
         """
         Deletes all data in this table
@@ -2451,10 +2866,47 @@ class DependencyCacheTable(
         logger.info('Clearing data in %r' % (self,))
         self.db.drop_table(self.tablename)
         self.db.add_table(**self._get_addtable_kw())
+        self._invalidate_cached_rows()
+        if any(self.get_data_col_attr('is_shard')):
+            for store in self._shard_stores.values():
+                store.close()
+            self._shard_stores = {}
+            ut.delete(self.shard_dpath, verbose=False)
+
+    def get_extern_fpaths(self, rowid_list):
+        """
+        Returns the external files of the rows in ``rowid_list``. They are not
+        checked for existence, files that are already gone are skipped by
+        :func:`remove_fpaths_parallel`.
+        """
+        internal_colnames = self.get_intern_data_col_attr('intern_colname')
+        is_extern = self.get_intern_data_col_attr('is_external_pointer')
+        extern_colnames = tuple(ut.compress(internal_colnames, is_extern))
+        if len(extern_colnames) == 0:
+            return []
+        uris = self.get_internal_columns(
+            rowid_list,
+            extern_colnames,
+            unpack_scalars=False,
+            eager=True,
+            keepwrap=False,
+        )
+        absuris = []
+        for uri in it.chain.from_iterable(uris):
+            if not isinstance(uri, tuple):
+                uri = [uri]
+            for uri_ in uri:
+                absuris.append(join(self.extern_dpath, uri_))
+        return absuris
 
     # @profile
-    def delete_rows(self, rowid_list, delete_extern=None, dry=False, verbose=None):
+    def delete_rows(
+        self, rowid_list, delete_extern=None, dry=False, verbose=None, cascade=True
+    ):
         """
+        Deletes rows, their external files (if ``delete_extern``) and, if
+        ``cascade``, the rows of non-multi children that depend on them.
+
         CommandLine:
             python -m dtool.depcache_table --exec-delete_rows
 
@@ -2506,38 +2958,26 @@ class DependencyCacheTable(
             # logger.info('delete_extern = %r' % (delete_extern,))
         depc = self.depc
 
-        # TODO:
         # REMOVE EXTERNAL FILES
-        internal_colnames = self.get_intern_data_col_attr('intern_colname')
-        is_extern = self.get_intern_data_col_attr('is_external_pointer')
-        extern_colnames = tuple(ut.compress(internal_colnames, is_extern))
-        if len(extern_colnames) > 0:
-            uris = self.get_internal_columns(
-                rowid_list,
-                extern_colnames,
-                unpack_scalars=False,
-                eager=True,
-                keepwrap=False,
-            )
-            absuris = []
-            for uri in it.chain.from_iterable(uris):
-                if not isinstance(uri, tuple):
-                    uri = [uri]
-                for uri_ in uri:
-                    absuris.append(join(self.extern_dpath, uri_))
-            fpaths = [fpath for fpath in absuris if exists(fpath)]
-            if delete_extern:
+        fpaths = self.get_extern_fpaths(rowid_list)
+        if delete_extern:
+            if dry:
                 if ut.VERBOSE or len(fpaths) > 0:
-                    logger.info('deleting {} existing internal files'.format(len(fpaths)))
-                if not dry:
-                    ut.remove_fpaths(fpaths, verbose=verbose)
+                    logger.info(
+                        'would delete up to {} internal files'.format(len(fpaths))
+                    )
             else:
-                if ut.VERBOSE or len(fpaths) > 0:
-                    logger.info('Leaving {} dangling filepaths'.format(len(fpaths)))
+                # URIs whose files are already gone are not counted
+                num_removed = remove_fpaths_parallel(fpaths)
+                if ut.VERBOSE or num_removed > 0:
+                    logger.info('deleted {} internal files'.format(num_removed))
+        else:
+            if ut.VERBOSE or len(fpaths) > 0:
+                logger.info('Leaving {} dangling filepaths'.format(len(fpaths)))
 
         # DELETE EXPLICITLY DEFINED CHILDREN
         # (TODO: handle implicit definitions)
-        if True:
+        if cascade:
 
             def get_child_partial_rowids(child_table, rowid_list, parent_colnames):
                 colnames = (child_table.rowid_colname,)
@@ -2586,6 +3026,7 @@ class DependencyCacheTable(
         # Finalize: Delete rows from this table
         if not dry:
             self.db.delete_rowids(self.tablename, rowid_list)
+            self._invalidate_cached_rows(rowid_list)
             num_deleted = len(ut.filter_Nones(rowid_list))
         else:
             num_deleted = 0
@@ -2610,6 +3051,12 @@ class DependencyCacheTable(
         extern_colattrs = ut.compress(requested_colattrs, isextern_flags)
         extern_resolve_colxs = ut.compress(nested_offsets_start, isextern_flags)
         extern_read_funcs = ut.take_column(extern_colattrs, 'read_func')
+        # Mark any columns stored in memory-mapped shards
+        isshard_flags = ut.dict_take_column(requested_colattrs, 'is_shard', False)
+        shard_colnames = ut.take_column(
+            ut.compress(requested_colattrs, isshard_flags), 'colname'
+        )
+        shard_resolve_colxs = ut.compress(nested_offsets_start, isshard_flags)
         intern_colnames_ = ut.take_column(self.internal_col_attrs, 'intern_colname')
         intern_colnames = ut.unflat_take(intern_colnames_, intern_colxs)
 
@@ -2619,10 +3066,12 @@ class DependencyCacheTable(
             for x1, x2 in zip(nested_offsets_start, nested_offsets_end)
         ]
         extern_resolve_tups = list(zip(extern_resolve_colxs, extern_read_funcs))
+        shard_resolve_tups = list(zip(shard_resolve_colxs, shard_colnames))
         flat_intern_colnames = tuple(ut.flatten(intern_colnames))
-        return nesting_xs, extern_resolve_tups, flat_intern_colnames
+        return nesting_xs, extern_resolve_tups, shard_resolve_tups, flat_intern_colnames
 
     # @profile
+    @instrumentation.timed_table_op('get_row_data')
     def get_row_data(
         self,
         tbl_rowids,
@@ -2636,11 +3085,16 @@ class DependencyCacheTable(
         delete_on_fail=True,
         showprog=False,
         unpack_columns=None,
+        use_cache=True,
     ):
         r"""
         FIXME: unpacking is confusing with sql controller
         TODO: Clean up and allow for eager=False
 
+        If the depcache has a row cache (see
+        :func:`DependencyCache.enable_row_cache`), eager reads of external data
+        go through it unless ``use_cache=False``.
+
         colnames = ('mask', 'size')
 
         CommandLine:
@@ -2693,10 +3147,11 @@ class DependencyCacheTable(
             >>> data = table.get_row_data(tbl_rowids, 'chip', read_extern=False, ensure=False)
             >>> data = table.get_row_data(tbl_rowids, 'chip', read_extern=False, ensure=True)
         """
-        logger.debug(
-            ('Get col of tablename=%r, colnames=%r with ' 'tbl_rowids=%s')
-            % (self.tablename, colnames, ut.trunc_repr(tbl_rowids))
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                ('Get col of tablename=%r, colnames=%r with ' 'tbl_rowids=%s')
+                % (self.tablename, colnames, ut.trunc_repr(tbl_rowids))
+            )
         ####
         # Resolve requested column names
         if unpack_columns is None:
@@ -2710,9 +3165,27 @@ class DependencyCacheTable(
         else:
             requested_colnames = colnames
 
+        row_cache = self.depc.row_cache if self.depc is not None else None
+        if use_cache and row_cache is not None and eager and read_extern:
+            return self._get_cached_row_data(
+                row_cache,
+                tbl_rowids,
+                requested_colnames,
+                unpack_columns,
+                _debug=_debug,
+                num_retries=num_retries,
+                ensure=ensure,
+                delete_on_fail=delete_on_fail,
+                showprog=showprog,
+            )
+
         logger.debug('requested_colnames = %r' % (requested_colnames,))
         tup = self._resolve_requested_columns(requested_colnames)
-        nesting_xs, extern_resolve_tups, flat_intern_colnames = tup
+        nesting_xs, extern_resolve_tups, shard_resolve_tups, flat_intern_colnames = tup
+        if shard_resolve_tups:
+            # The config rowid locates the shard store, it is read last so
+            # nesting_xs never refers to it.
+            flat_intern_colnames = flat_intern_colnames + (CONFIG_ROWID,)
 
         logger.debug(
             '[deptbl.get_row_data] flat_intern_colnames = %r' % (flat_intern_colnames,)
@@ -2763,8 +3236,9 @@ class DependencyCacheTable(
         if nInput > 0 and len(nonNone_tbl_rowids) > 0:
             if generator_version:
 
-                def _generator_resolve_all():
-                    extern_dpath = self.extern_dpath
+                extern_dpath = self.extern_dpath
+
+                def _generator_resolve_shards():
                     for rawprop in raw_prop_list:
                         if rawprop is None:
                             raise Exception(
@@ -2773,22 +3247,35 @@ class DependencyCacheTable(
                             )
 
                         exprop = list(rawprop)
-                        # Modify prop with external data
-                        for extern_colx, read_func in extern_resolve_tups:
-                            uri = exprop[extern_colx]
-                            uri_full = join(extern_dpath, uri)
-                            if read_extern:
-                                data = read_func(uri_full)
-                            else:
-                                data = uri_full
-                                if ensure:
-                                    ut.assertpath(uri_full)
-                            exprop[extern_colx] = data
-                        # nestprop = ut.unflat_take(exprop, nesting_xs)
-                        nestprop = tup_unflat_take(exprop, nesting_xs)
-                        yield nestprop
-
-                prop_gen = _generator_resolve_all()
+                        # Modify prop with memory-mapped data
+                        for shard_colx, colname in shard_resolve_tups:
+                            store = self.get_shard_store(colname, exprop[-1])
+                            exprop[shard_colx] = store.take([exprop[shard_colx]])[0]
+                        yield exprop
+
+                def _resolve_extern(exprop):
+                    # Modify prop with external data
+                    for extern_colx, read_func in extern_resolve_tups:
+                        uri = exprop[extern_colx]
+                        uri_full = join(extern_dpath, uri)
+                        if read_extern:
+                            data = read_func(uri_full)
+                        else:
+                            data = uri_full
+                            if ensure:
+                                ut.assertpath(uri_full)
+                        exprop[extern_colx] = data
+                    # nestprop = ut.unflat_take(exprop, nesting_xs)
+                    nestprop = tup_unflat_take(exprop, nesting_xs)
+                    return nestprop
+
+                # Stream rows while external files are read ahead
+                num_workers = self.extern_read_workers if read_extern else 1
+                if not extern_resolve_tups:
+                    num_workers = 1
+                prop_gen = prefetch_imap(
+                    _resolve_extern, _generator_resolve_shards(), num_workers
+                )
                 if unpack_columns:
                     prop_gen = (None if p is None else p[0] for p in prop_gen)
                 assert len(idxs2) == 0, 'noneager mode not fully worked out yet'
@@ -2815,6 +3302,8 @@ class DependencyCacheTable(
                     else:
                         # Things worked, dont need to try again
                         break
+                if shard_resolve_tups:
+                    self._resolve_shard_data(prop_listT, shard_resolve_tups)
                 ####
                 # Unflatten data into any given nested structure
                 if len(prop_listT) > 0:
@@ -2837,6 +3326,50 @@ class DependencyCacheTable(
             )
         return prop_list
 
+    def _get_cached_row_data(
+        self, row_cache, tbl_rowids, requested_colnames, unpack_columns, **kwargs
+    ):
+        """
+        Read-through wrapper around :func:`get_row_data`. Rows with any
+        requested column missing from ``row_cache`` are read in one call and
+        copies of their columns are added to the cache. Cache hits are
+        returned as writable copies, the same as uncached reads.
+        """
+        tablename = self.tablename
+        requested_colnames = tuple(requested_colnames)
+        prop_list = [None] * len(tbl_rowids)
+        miss_idxs = []
+        for idx, rowid in enumerate(tbl_rowids):
+            if rowid is None:
+                continue
+            prop = []
+            for colname in requested_colnames:
+                value = row_cache.get((tablename, rowid, colname), _MISSING)
+                if value is _MISSING:
+                    miss_idxs.append(idx)
+                    break
+                prop.append(value)
+            else:
+                prop_list[idx] = tuple(prop)
+        if miss_idxs:
+            miss_rowids = ut.take(tbl_rowids, miss_idxs)
+            miss_props = self.get_row_data(
+                miss_rowids,
+                requested_colnames,
+                unpack_columns=False,
+                use_cache=False,
+                **kwargs,
+            )
+            for idx, rowid, prop in zip(miss_idxs, miss_rowids, miss_props):
+                prop_list[idx] = prop
+                if prop is None:
+                    continue
+                for colname, value in zip(requested_colnames, prop):
+                    row_cache.put((tablename, rowid, colname), value)
+        if unpack_columns:
+            prop_list = [None if p is None else p[0] for p in prop_list]
+        return prop_list
+
     def _resolve_any_external_data(
         self,
         nonNone_tbl_rowids,
@@ -2856,11 +3389,12 @@ class DependencyCacheTable(
             ut.printex(ex, 'error on prop_list shape', keys=['raw_prop_list'])
             raise
 
+        num_workers = self.extern_read_workers if read_extern else 1
+
         for extern_colx, read_func in extern_resolve_tups:
             logger.debug('[deptbl.get_row_data] read_func = %r' % (read_func,))
-            data_list = []
-            failed_list = []
-            for uri in prop_listT[extern_colx]:
+
+            def _try_read(uri, read_func=read_func):
                 uri_full = join(extern_dpath, uri)
                 try:
                     if read_extern:
@@ -2870,6 +3404,17 @@ class DependencyCacheTable(
                             ut.assertpath(uri_full)
                         data = uri_full
                 except Exception as ex:
+                    return None, ex
+                return data, None
+
+            # Files are read ahead on a thread pool, results keep their order
+            uri_list = prop_listT[extern_colx]
+            read_iter = prefetch_imap(_try_read, uri_list, num_workers)
+            data_list = []
+            failed_list = []
+            for uri, (data, ex) in zip(uri_list, read_iter):
+                uri_full = join(extern_dpath, uri)
+                if ex is not None:
                     ut.printex(
                         ex,
                         'failed to load external data',
@@ -2883,7 +3428,7 @@ class DependencyCacheTable(
                         ],
                     )
                     if tries_left == 0:
-                        raise
+                        raise ex
                     failed_list.append(True)
                     data = None
                 else:
@@ -2909,6 +3454,25 @@ class DependencyCacheTable(
             prop_listT[extern_colx] = data_list
         return prop_listT
 
+    def _resolve_shard_data(self, prop_listT, shard_resolve_tups):
+        """
+        Replaces record numbers of memory-mapped columns with read-only views
+        into their shards. The last column of ``prop_listT`` is the config
+        rowid of each row.
+        """
+        if len(prop_listT) == 0:
+            return
+        config_rowids = prop_listT[-1]
+        unique_cfgids, groupxs = ut.group_indices(config_rowids)
+        for shard_colx, colname in shard_resolve_tups:
+            record_idxs = prop_listT[shard_colx]
+            data_list = [None] * len(record_idxs)
+            for cfgid, xs in zip(unique_cfgids, groupxs):
+                store = self.get_shard_store(colname, cfgid)
+                for x, data in zip(xs, store.take(ut.take(record_idxs, xs))):
+                    data_list[x] = data
+            prop_listT[shard_colx] = data_list
+
     def _recompute_external_storage(self, tbl_rowids):
         """
         Recomputes the external file stored for this row.
@@ -2936,6 +3500,7 @@ class DependencyCacheTable(
             # Evaulate just to ensure storage
             for _ in dirty_params_iter:
                 pass
+        self._invalidate_cached_rows(tbl_rowids)
 
     def _recompute_and_store(self, tbl_rowids, config=None):
         """
@@ -2970,6 +3535,7 @@ class DependencyCacheTable(
             )
             # Evaulate to external and internal storage
             self.db.set(self.tablename, colnames, dirty_params_iter, rowids)
+        self._invalidate_cached_rows(tbl_rowids)
 
     # togroup_args = [parent_rowids]
     # grouped_parent_ids = ut.apply_grouping(parent_rowids, groupxs)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing of SQL statements and dependency cache table operations.
+
+When enabled (``--dtool-instrument`` or :func:`enable`) the SQL controller
+and the depcache tables record, per ``(kind, source, table, op)``, the number
+of calls, the number of rows touched, the total / max wall time and a
+histogram of wall times. ``kind`` is ``'sql'`` for statements executed by a
+SQLDatabaseController (``source`` is the database name) and ``'depc'`` for
+depcache table operations (``source`` is the depcache name). The depcache ops
+are ``get_row_data``, ``ensure_rows`` and, for rows that had to be computed,
+``compute`` (calling ``preproc_func``) and ``store`` (writing the results),
+which gives the compute vs IO split of a table.
+
+Use :func:`get_snapshot` to read the counters, e.g. from
+``wbia.web.prometheus``. Recording is a no-op when disabled.
+"""
+import functools
+import logging
+import re
+import threading
+import time
+
+import utool as ut
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia.dtool')
+
+
+INSTRUMENT = ut.get_argflag('--dtool-instrument')
+
+#: Upper bounds in seconds of the wall time histogram buckets
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, float('inf'))
+
+_TEXT_TABLE_PATTERN = re.compile(
+    r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?["`\[]?(\w+)',
+    re.IGNORECASE,
+)
+
+
+class OpStats(object):
+    """Counters of a single instrumented operation"""
+
+    __slots__ = ('count', 'nrows', 'total_sec', 'max_sec', 'bucket_counts')
+
+    def __init__(self):
+        self.count = 0
+        self.nrows = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+        self.bucket_counts = [0] * len(TIME_BUCKETS)
+
+    def add(self, nrows, seconds):
+        self.count += 1
+        self.nrows += nrows
+        self.total_sec += seconds
+        if seconds > self.max_sec:
+            self.max_sec = seconds
+        for index, upper in enumerate(TIME_BUCKETS):
+            if seconds <= upper:
+                self.bucket_counts[index] += 1
+                break
+
+
+class Instrumentation(object):
+    """
+    Thread safe registry of :class:`OpStats`
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.instrumentation import *  # NOQA
+        >>> instr = Instrumentation(enabled=True)
+        >>> instr.record('sql', 'annot', 'feat', 'select', 10, 0.002)
+        >>> instr.record('sql', 'annot', 'feat', 'select', 5, 0.2)
+        >>> instr.record('depc', 'annot', 'feat', 'compute', 5, 1.5)
+        >>> snapshot = instr.snapshot()
+        >>> ops = snapshot['ops']
+        >>> print(ut.repr2([(op['op'], op['count'], op['nrows']) for op in ops]))
+        [('compute', 1, 5), ('select', 2, 15)]
+        >>> print(ops[1]['bucket_counts'])
+        [0, 1, 0, 0, 0, 1, 0, 0, 0, 0]
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, source, tablename, op, nrows, seconds):
+        key = (kind, source, tablename, op)
+        with self._lock:
+            stats = self._stats.get(key, None)
+            if stats is None:
+                stats = self._stats[key] = OpStats()
+            stats.add(nrows, seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def snapshot(self, kind=None, source=None):
+        """
+        Returns the counters sorted by decreasing total time
+
+        Args:
+            kind (str): only return 'sql' or 'depc' ops (default = None)
+            source (str): only return ops of this database / depcache
+                (default = None)
+        """
+        with self._lock:
+            items = [
+                (key, stats.count, stats.nrows, stats.total_sec, stats.max_sec)
+                + (list(stats.bucket_counts),)
+                for key, stats in self._stats.items()
+                if (kind is None or key[0] == kind)
+                and (source is None or key[1] == source)
+            ]
+        ops = []
+        for key, count, nrows, total_sec, max_sec, bucket_counts in items:
+            ops.append(
+                ut.odict(
+                    [
+                        ('kind', key[0]),
+                        ('source', key[1]),
+                        ('table', key[2]),
+                        ('op', key[3]),
+                        ('count', count),
+                        ('nrows', nrows),
+                        ('total_sec', total_sec),
+                        ('mean_sec', total_sec / count),
+                        ('max_sec', max_sec),
+                        ('bucket_counts', bucket_counts),
+                    ]
+                )
+            )
+        ops.sort(key=lambda op: op['total_sec'], reverse=True)
+        return ut.odict(
+            [('enabled', self.enabled), ('buckets', list(TIME_BUCKETS)), ('ops', ops)]
+        )
+
+
+#: Process wide instrumentation shared by all controllers and depcaches
+INSTRUMENTS = Instrumentation(enabled=INSTRUMENT)
+
+
+def enable(flag=True):
+    """Turns recording on (or off with flag=False)"""
+    INSTRUMENTS.enabled = flag
+
+
+def is_enabled():
+    return INSTRUMENTS.enabled
+
+
+def reset():
+    INSTRUMENTS.reset()
+
+
+def get_snapshot(kind=None, source=None):
+    """See :func:`Instrumentation.snapshot`"""
+    return INSTRUMENTS.snapshot(kind=kind, source=source)
+
+
+def record(kind, source, tablename, op, nrows, seconds):
+    if INSTRUMENTS.enabled:
+        INSTRUMENTS.record(kind, source, tablename, op, nrows, seconds)
+
+
+def _num_items(items):
+    try:
+        return len(items)
+    except TypeError:
+        return 0
+
+
+def sql_operation_info(operation):
+    """
+    Returns the table name and the kind of statement of a sqlalchemy clause
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.instrumentation import *  # NOQA
+        >>> import sqlalchemy
+        >>> from sqlalchemy import text
+        >>> print(sql_operation_info(text('SELECT count(*) FROM "annots" WHERE 1')))
+        ('annots', 'select')
+        >>> print(sql_operation_info(text('INSERT OR IGNORE INTO names (x) VALUES (1)')))
+        ('names', 'insert')
+        >>> table = sqlalchemy.table('chips', sqlalchemy.column('chip_rowid'))
+        >>> print(sql_operation_info(table.select()))
+        ('chips', 'select')
+        >>> print(sql_operation_info(table.delete()))
+        ('chips', 'delete')
+    """
+    table = getattr(operation, 'table', None)
+    if table is not None:
+        # Insert, update or delete
+        return table.name, operation.__visit_name__
+    froms = getattr(operation, 'froms', None)
+    if froms is not None:
+        if not froms:
+            return '?', 'select'
+        clause = froms[0]
+        while getattr(clause, 'left', None) is not None:
+            # Joins are reported under their leftmost table
+            clause = clause.left
+        return getattr(clause, 'name', None) or '?', 'select'
+    text = getattr(operation, 'text', '')
+    words = text.split(None, 1)
+    op = words[0].lower() if words else '?'
+    match = _TEXT_TABLE_PATTERN.search(text)
+    tablename = match.group(1) if match else '?'
+    return tablename, op
+
+
+def record_sql(db, operation, nrows, seconds):
+    """Records the execution of a statement by a SQLDatabaseController"""
+    if INSTRUMENTS.enabled:
+        tablename, op = sql_operation_info(operation)
+        INSTRUMENTS.record('sql', db.name, tablename, op, nrows, seconds)
+
+
+def timed_table_op(op):
+    """
+    Decorates a DependencyCacheTable method that takes a list of rowids (or
+    parent ids) as its first argument so calls are recorded under ``op``.
+    """
+
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(table, items, *args, **kwargs):
+            if not INSTRUMENTS.enabled:
+                return func(table, items, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(table, items, *args, **kwargs)
+            finally:
+                source = None if table.depc is None else table.depc.name
+                INSTRUMENTS.record(
+                    'depc',
+                    source,
+                    table.tablename,
+                    op,
+                    _num_items(items),
+                    time.perf_counter() - start,
+                )
+
+        return _wrapper
+
+    return _decorator
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+A byte-bounded LRU cache for resolved depcache row data.
+
+Entries are keyed by ``(tablename, rowid, colname)``. A table rowid already
+identifies the config it was computed with (the config rowid is part of the
+superkey), so cached values never need to be distinguished by config. The
+cache keeps a secondary index from ``(tablename, rowid)`` to the cached
+column names so that deleted rows can be invalidated without a scan.
+
+The cache holds its own read-only copy of every value and hands out
+writable copies, so callers can modify what they read (as they can without
+the cache) without corrupting the cached entry. All operations take a lock so one cache can be shared by threads that read
+from the same depcache.
+"""
+import copy
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import utool as ut
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia.dtool')
+
+
+def estimate_nbytes(value):
+    """
+    Cheap estimate of the memory held by a depcache value
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.row_cache import *  # NOQA
+        >>> estimate_nbytes(np.zeros((10, 128), dtype=np.uint8))
+        1280
+        >>> estimate_nbytes((np.zeros(4, np.float32), np.zeros(4, np.float32))) > 32
+        True
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_nbytes(key) + estimate_nbytes(item) for key, item in value.items()
+        )
+    return sys.getsizeof(value)
+
+
+def _copy_value(value, writeable):
+    """
+    Copies the ndarrays and containers of a depcache value
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.row_cache import *  # NOQA
+        >>> from wbia.dtool.row_cache import _copy_value
+        >>> value = (np.zeros(2), [np.ones(2)], {'a': np.ones(1)}, 'spam')
+        >>> frozen = _copy_value(value, writeable=False)
+        >>> print(frozen[0] is value[0], frozen[1][0].flags.writeable)
+        False False
+        >>> thawed = _copy_value(frozen, writeable=True)
+        >>> print(thawed[2]['a'].flags.writeable, thawed[2] is frozen[2])
+        True False
+    """
+    if isinstance(value, np.ndarray):
+        arr = value.copy()
+        arr.flags.writeable = writeable
+        return arr
+    elif isinstance(value, tuple):
+        return tuple(_copy_value(item, writeable) for item in value)
+    elif isinstance(value, list):
+        return [_copy_value(item, writeable) for item in value]
+    elif isinstance(value, dict):
+        return {key: _copy_value(item, writeable) for key, item in value.items()}
+    return copy.deepcopy(value)
+
+
+class RowCache(object):
+    """
+    Least recently used cache of depcache column values bounded by the
+    estimated number of bytes it holds rather than by its number of entries.
+
+    Args:
+        max_nbytes (int): evict entries once the cache holds more than this
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.row_cache import *  # NOQA
+        >>> cache = RowCache(max_nbytes=2500)
+        >>> for rowid in [1, 2, 3]:
+        >>>     cache.put(('feat', rowid, 'vecs'), np.zeros((1000,), np.uint8))
+        >>> # The oldest entry was evicted to make room
+        >>> print(cache.get(('feat', 1, 'vecs'), None) is None)
+        True
+        >>> # Readers get their own writable copy
+        >>> print(cache.get(('feat', 3, 'vecs')).flags.writeable)
+        True
+        >>> cache.invalidate_rows('feat', [3])
+        >>> info = cache.get_info()
+        >>> print(ut.repr2(ut.dict_subset(info, ['hits', 'misses', 'num_entries'])))
+        {'hits': 1, 'misses': 1, 'num_entries': 1}
+    """
+
+    def __init__(self, max_nbytes):
+        self.max_nbytes = int(max_nbytes)
+        self._entries = OrderedDict()
+        self._row_colnames = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return _copy_value(value, writeable=True)
+
+    def put(self, key, value):
+        nbytes = estimate_nbytes(value)
+        if nbytes > self.max_nbytes:
+            # Would evict everything else and then itself
+            return
+        value = _copy_value(value, writeable=False)
+        with self._lock:
+            self.pop(key)
+            self._entries[key] = (value, nbytes)
+            self._row_colnames.setdefault(key[0:2], set()).add(key[2])
+            self.nbytes += nbytes
+            while self.nbytes > self.max_nbytes:
+                old_key = next(iter(self._entries))
+                self.pop(old_key)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            try:
+                _, nbytes = self._entries.pop(key)
+            except KeyError:
+                return
+            self.nbytes -= nbytes
+            row_key = key[0:2]
+            colnames = self._row_colnames[row_key]
+            colnames.discard(key[2])
+            if not colnames:
+                del self._row_colnames[row_key]
+
+    def invalidate_rows(self, tablename, rowids):
+        """Drops every cached column of the given table rows"""
+        with self._lock:
+            for rowid in rowids:
+                colnames = self._row_colnames.get((tablename, rowid), None)
+                if colnames is not None:
+                    for colname in list(colnames):
+                        self.pop((tablename, rowid, colname))
+
+    def invalidate_table(self, tablename):
+        """Drops every cached row of a table"""
+        with self._lock:
+            rowids = [rowid for name, rowid in self._row_colnames if name == tablename]
+            self.invalidate_rows(tablename, rowids)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._row_colnames.clear()
+            self.nbytes = 0
+
+    def get_info(self):
+        """Returns hit rate and memory use for monitoring"""
+        num_lookups = self.hits + self.misses
+        with self._lock:
+            num_entries = len(self._entries)
+            nbytes = self.nbytes
+        return ut.odict(
+            [
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('hit_rate', self.hits / num_lookups if num_lookups else 0.0),
+                ('evictions', self.evictions),
+                ('num_entries', num_entries),
+                ('nbytes', nbytes),
+                ('max_nbytes', self.max_nbytes),
+            ]
+        )
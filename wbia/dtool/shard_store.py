@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only memory-mapped storage for ndarray depcache columns.
+
+Each store holds the arrays of one column for one config. Array payloads are
+appended as raw bytes to flat binary shard files and an offsets index maps a
+record number to the ``(shard, start, nrows)`` slice that holds it. The SQL
+table only stores the record number, so rowids and config tracking are
+unchanged. Reads are zero-copy :class:`numpy.memmap` slices.
+
+Layout of a store directory::
+
+    meta.json       dtype and trailing shape of the stored arrays
+    index.bin       fixed width ``INDEX_DTYPE`` records, one per array
+    shard_0000.bin  raw C-ordered array rows
+    shard_0001.bin  ...
+
+Records are never rewritten. Deleting a depcache row leaves its record in
+place until the store is removed (e.g. by ``clear_table``). Like the rest of
+the depcache, a store assumes a single writing process.
+"""
+import json
+import logging
+import os
+from os.path import exists, join
+
+import numpy as np
+import utool as ut
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia.dtool')
+
+
+#: Format version written to ``meta.json``
+SHARD_VERSION = 1
+#: Start a new shard file once the current one would exceed this many bytes
+MAX_SHARD_NBYTES = 2 ** 30
+#: Record layout of the offsets index
+INDEX_DTYPE = np.dtype([('shard', '<i4'), ('start', '<i8'), ('nrows', '<i8')])
+
+
+class ShardStore(object):
+    """
+    An append-only store of ndarrays for a single column and config.
+
+    Args:
+        dpath (str): directory that holds the shards, index and metadata
+        max_shard_nbytes (int): size at which a new shard file is started
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.shard_store import *  # NOQA
+        >>> dpath = ut.ensure_app_resource_dir('wbia', 'test_shard_store')
+        >>> ut.delete(dpath, verbose=False)
+        >>> store = ShardStore(dpath)
+        >>> idxs = store.extend([np.ones((3, 4), np.uint8), np.zeros((2, 4), np.uint8)])
+        >>> store.flush()
+        >>> arrs = store.take(idxs)
+        >>> print([arr.shape for arr in arrs])
+        [(3, 4), (2, 4)]
+        >>> stacked = stack_arrays(arrs)
+        >>> print(stacked.shape, np.shares_memory(stacked, arrs[0]))
+        (5, 4) True
+        >>> ut.delete(dpath, verbose=False)
+    """
+
+    def __init__(self, dpath, max_shard_nbytes=MAX_SHARD_NBYTES):
+        self.dpath = dpath
+        self.max_shard_nbytes = max_shard_nbytes
+        self.meta_fpath = join(dpath, 'meta.json')
+        self.index_fpath = join(dpath, 'index.bin')
+        self.dtype = None
+        self.row_shape = None
+        self._index = np.empty(0, dtype=INDEX_DTYPE)
+        self._maps = {}
+        # Write state
+        self._pending = []
+        self._shard_fp = None
+        self._shard_num = None
+        self._shard_nrows = None
+        self._load_meta()
+
+    def __len__(self):
+        self._refresh_index()
+        return len(self._index) + len(self._pending)
+
+    def _load_meta(self):
+        if exists(self.meta_fpath):
+            with open(self.meta_fpath, 'r') as file_:
+                meta = json.load(file_)
+            if meta['version'] != SHARD_VERSION:
+                raise ValueError(
+                    'Unsupported shard store version=%r in %r'
+                    % (meta['version'], self.dpath)
+                )
+            self.dtype = np.dtype(meta['dtype'])
+            self.row_shape = tuple(meta['row_shape'])
+
+    def _write_meta(self):
+        meta = {
+            'version': SHARD_VERSION,
+            'dtype': self.dtype.str,
+            'row_shape': list(self.row_shape),
+        }
+        with open(self.meta_fpath, 'w') as file_:
+            json.dump(meta, file_)
+
+    def _refresh_index(self):
+        """Picks up records flushed since the index was last read"""
+        if not exists(self.index_fpath):
+            return
+        num_records = os.path.getsize(self.index_fpath) // INDEX_DTYPE.itemsize
+        if num_records > len(self._index):
+            self._index = np.fromfile(self.index_fpath, dtype=INDEX_DTYPE)[:num_records]
+            if self.dtype is None:
+                self._load_meta()
+
+    def shard_fpath(self, shard_num):
+        return join(self.dpath, 'shard_%04d.bin' % (shard_num,))
+
+    @property
+    def row_nbytes(self):
+        return self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+
+    # --- Writing ---
+
+    def _open_shard_for_append(self, nbytes):
+        if self._shard_fp is None:
+            shard_num = 0 if len(self._index) == 0 else int(self._index['shard'].max())
+            fpath = self.shard_fpath(shard_num)
+            self._shard_fp = open(fpath, 'ab')
+            self._shard_num = shard_num
+            self._shard_nrows = os.path.getsize(fpath) // max(self.row_nbytes, 1)
+        shard_nbytes = self._shard_nrows * self.row_nbytes
+        if shard_nbytes > 0 and shard_nbytes + nbytes > self.max_shard_nbytes:
+            self._shard_fp.close()
+            self._shard_num += 1
+            self._shard_fp = open(self.shard_fpath(self._shard_num), 'ab')
+            self._shard_nrows = 0
+
+    def append(self, arr):
+        """
+        Appends an array and returns its record number. The record becomes
+        visible to readers after :func:`flush`, which also closes the shard
+        file that is held open between appends.
+        """
+        arr = np.asarray(arr)
+        if self._shard_fp is None and not self._pending:
+            self._refresh_index()
+        if self.dtype is None:
+            if arr.size == 0 and arr.ndim < 2:
+                # Cannot infer the row shape of an empty array, wait for data
+                rec = (0 if self._shard_num is None else self._shard_num, 0, 0)
+                self._pending.append(rec)
+                return len(self._index) + len(self._pending) - 1
+            ut.ensuredir(self.dpath)
+            self.dtype = arr.dtype
+            self.row_shape = arr.shape[1:]
+            self._write_meta()
+        if arr.size == 0:
+            rec = (0 if self._shard_num is None else self._shard_num, 0, 0)
+            self._pending.append(rec)
+            return len(self._index) + len(self._pending) - 1
+        if arr.dtype != self.dtype or arr.shape[1:] != self.row_shape:
+            raise ValueError(
+                'Cannot append array with dtype=%r, shape=%r to a shard store '
+                'of dtype=%r, row_shape=%r'
+                % (arr.dtype, arr.shape, self.dtype, self.row_shape)
+            )
+        self._open_shard_for_append(arr.nbytes)
+        self._shard_fp.write(np.ascontiguousarray(arr).tobytes())
+        rec = (self._shard_num, self._shard_nrows, len(arr))
+        self._shard_nrows += len(arr)
+        self._pending.append(rec)
+        return len(self._index) + len(self._pending) - 1
+
+    def extend(self, arrs):
+        return [self.append(arr) for arr in arrs]
+
+    def flush(self):
+        """Makes appended records visible by writing them to the offsets index"""
+        if self._shard_fp is not None:
+            self._shard_fp.close()
+            self._shard_fp = None
+            self._shard_num = None
+        if self._pending:
+            ut.ensuredir(self.dpath)
+            records = np.array(self._pending, dtype=INDEX_DTYPE)
+            # Shard data is flushed before the index that points into it
+            with open(self.index_fpath, 'ab') as file_:
+                file_.write(records.tobytes())
+            self._pending = []
+            self._refresh_index()
+
+    def close(self):
+        self.flush()
+        self._maps = {}
+
+    # --- Reading ---
+
+    def _get_map(self, shard_num, min_rows):
+        mmap = self._maps.get(shard_num, None)
+        if mmap is None or len(mmap) < min_rows:
+            fpath = self.shard_fpath(shard_num)
+            nrows = os.path.getsize(fpath) // self.row_nbytes
+            mmap = np.memmap(
+                fpath, dtype=self.dtype, mode='r', shape=(nrows,) + self.row_shape
+            )
+            self._maps[shard_num] = mmap
+        return mmap
+
+    def _empty(self):
+        if self.dtype is None:
+            return np.empty(0)
+        return np.empty((0,) + self.row_shape, dtype=self.dtype)
+
+    def take(self, idxs):
+        """
+        Returns the arrays stored at the given record numbers as read-only
+        memmap views. ``None`` record numbers map to ``None``.
+        """
+        idxs = list(idxs)
+        if any(idx is not None and idx >= len(self._index) for idx in idxs):
+            self._refresh_index()
+        index = self._index
+        arrs = []
+        for idx in idxs:
+            if idx is None:
+                arrs.append(None)
+                continue
+            shard_num, start, nrows = index[idx]
+            if nrows == 0:
+                arrs.append(self._empty())
+                continue
+            stop = start + nrows
+            arrs.append(self._get_map(shard_num, stop)[start:stop])
+        return arrs
+
+    def nbytes(self):
+        """Total number of bytes held by the shard files"""
+        total = 0
+        for fname in os.listdir(self.dpath) if exists(self.dpath) else []:
+            if fname.startswith('shard_'):
+                total += os.path.getsize(join(self.dpath, fname))
+        return total
+
+
+def _root_array(arr):
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+    return arr
+
+
+def stack_arrays(arr_list, template=None):
+    """
+    Equivalent to ``np.vstack`` (or ``np.hstack`` for 1d inputs) but returns a
+    view without copying when the inputs are adjacent slices of the same
+    buffer, which is the case for arrays read in order from a
+    :class:`ShardStore`.
+
+    Args:
+        arr_list (list): arrays with the same dtype and trailing shape
+        template (ndarray): gives the dtype and trailing shape of the result
+            when every input is empty. Defaults to the first input.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.shard_store import *  # NOQA
+        >>> data = np.arange(20).reshape(10, 2).copy()
+        >>> stacked = stack_arrays([data[0:3], data[3:3], data[3:7]])
+        >>> assert np.shares_memory(stacked, data)
+        >>> assert np.all(stacked == data[0:7])
+        >>> stacked = stack_arrays([data[0:3], data[4:7]])
+        >>> assert not np.shares_memory(stacked, data)
+        >>> assert np.all(stacked == np.vstack([data[0:3], data[4:7]]))
+        >>> print(stack_arrays([data[0:0]]).shape)
+        (0, 2)
+        >>> empty = stack_arrays([], template=np.empty((0, 128), np.uint8))
+        >>> print(empty.shape, empty.dtype)
+        (0, 128) uint8
+    """
+    if template is None and len(arr_list) > 0:
+        template = arr_list[0]
+    arr_list = [arr for arr in arr_list if len(arr) > 0]
+    if len(arr_list) == 0:
+        if template is None:
+            raise ValueError('need at least one array or a template to stack')
+        return np.empty((0,) + template.shape[1:], dtype=template.dtype)
+    first = arr_list[0]
+    if first.ndim == 1:
+        concat = np.hstack
+    else:
+        concat = np.vstack
+    if len(arr_list) == 1:
+        return first
+    root = _root_array(first)
+    if (
+        root.ndim != first.ndim
+        or not root.flags.c_contiguous
+        or root.shape[1:] != first.shape[1:]
+    ):
+        return concat(arr_list)
+    root_ptr = root.__array_interface__['data'][0]
+    row_nbytes = root.strides[0]
+    expected_ptr = None
+    start = None
+    for arr in arr_list:
+        if (
+            arr.dtype != root.dtype
+            or arr.shape[1:] != root.shape[1:]
+            or not arr.flags.c_contiguous
+            or _root_array(arr) is not root
+        ):
+            return concat(arr_list)
+        ptr = arr.__array_interface__['data'][0]
+        if expected_ptr is not None and ptr != expected_ptr:
+            return concat(arr_list)
+        if start is None:
+            start = (ptr - root_ptr) // row_nbytes
+        expected_ptr = ptr + arr.shape[0] * row_nbytes
+    stop = (expected_ptr - root_ptr) // row_nbytes
+    return root[start:stop]
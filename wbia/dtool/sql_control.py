@@ -5,17 +5,19 @@ Interface into SQL for the IBEIS Controller
 TODO; need to use some sort of sticky bit so
 sql files are created with reasonable permissions.
 """
-import functools
 import logging
 import collections
 import os
 import parse
 import re
+import threading
+import time
 import uuid
 from collections.abc import Mapping, MutableMapping
 from contextlib import contextmanager
 from os.path import join, exists
 
+import numpy as np
 import sqlalchemy
 import utool as ut
 from deprecated import deprecated
@@ -24,9 +26,11 @@ try:
     from sqlalchemy.engine import LegacyRow
 except ImportError:
     LegacyRow = None
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.schema import Table
 from sqlalchemy.sql import bindparam, text, ClauseElement
 
+from wbia.dtool import instrumentation
 from wbia.dtool import lite
 from wbia.dtool.dump import dumps
 from wbia.dtool.types import Integer, TYPE_TO_SQLTYPE
@@ -50,13 +54,46 @@ VERBOSE = ut.VERBOSE
 VERYVERBOSE = ut.VERYVERBOSE
 
 TIMEOUT = 600  # Wait for up to 600 seconds for the database to return from a locked state
+# SQLite busy timeout in seconds, i.e. how long a connection waits for a lock
+BUSY_TIMEOUT = ut.get_argval('--sqlite-busy-timeout', type_=float, default=TIMEOUT)
+
+# Open SQLite file databases in write-ahead-log mode (see ``create_engine``)
+SQLITE_WAL = ut.get_argflag('--sqlite-wal')
+# Number of idle connections kept open per database in WAL mode
+SQLITE_READ_POOL_SIZE = 8
 
 BATCH_SIZE = int(1e4)
 
+# Maximum number of compiled SQL statements kept per controller
+STMT_CACHE_SIZE = 500
+
+# Getters with at least this many ids load them into a temporary table and
+# join against it instead of running batches of ``IN (...)`` queries
+TEMP_TABLE_THRESHOLD = int(5e4)
+
 SQLColumnRichInfo = collections.namedtuple(
     'SQLColumnRichInfo', ('column_id', 'name', 'type_', 'notnull', 'dflt_value', 'pk')
 )
 
+# SQL column types that can be read into a numeric numpy array
+# (everything else is read into an object array)
+SQLTYPE_TO_DTYPE = {
+    'INTEGER': np.int64,
+    'BIGINT': np.int64,
+    'SMALLINT': np.int64,
+    'REAL': np.float64,
+    'FLOAT': np.float64,
+    'DOUBLE PRECISION': np.float64,
+    'NUMERIC': np.float64,
+    'BOOLEAN': np.bool_,
+}
+
+# A getter statement along with the information needed to coerce the ids
+# passed into a getter into the form that is returned by the database.
+CachedStatement = collections.namedtuple(
+    'CachedStatement', ('table', 'stmt', 'id_columns', 'id_sqltypes', 'id_processors')
+)
+
 
 # FIXME (31-Jul-12020) Duplicate definition of wbia.constants.METADATA_TABLE
 #       Use this definition as the authority because it's within the context of its use.
@@ -79,7 +116,26 @@ METADATA_TABLE_COLUMNS = {
 METADATA_TABLE_COLUMN_NAMES = list(METADATA_TABLE_COLUMNS.keys())
 
 
-def create_engine(uri, POSTGRESQL_POOL_SIZE=20, ENGINES={}, timeout=TIMEOUT):
+def create_engine(
+    uri,
+    POSTGRESQL_POOL_SIZE=20,
+    ENGINES={},
+    timeout=BUSY_TIMEOUT,
+    wal=None,
+    read_pool_size=SQLITE_READ_POOL_SIZE,
+):
+    """
+    Returns the (per-process shared) engine for ``uri``
+
+    Args:
+        uri (str): connection uri
+        timeout (float): seconds to wait for a locked database
+        wal (bool): open SQLite file databases in WAL mode (default:
+            ``--sqlite-wal``), see :func:`_init_sqlite_wal_engine`
+        read_pool_size (int): idle connections kept open in WAL mode
+    """
+    if wal is None:
+        wal = SQLITE_WAL
     pid = os.getpid()
     if ENGINES.get('pid') != pid:
         # ENGINES contains engines from the parent process that the
@@ -96,15 +152,103 @@ def create_engine(uri, POSTGRESQL_POOL_SIZE=20, ENGINES={}, timeout=TIMEOUT):
     if uri.startswith('sqlite:') and ':memory:' in uri:
         # Don't share engines for in memory sqlite databases
         return sqlalchemy.create_engine(uri, **kw)
-    if uri not in ENGINES:
+    wal = wal and uri.startswith('sqlite:')
+    key = (uri, wal)
+    if key not in ENGINES:
         if uri.startswith('postgresql:'):
             # pool_size is not available for sqlite
             kw['pool_size'] = POSTGRESQL_POOL_SIZE
             kw['connect_args'] = {
                 'connect_timeout': timeout,
             }
-        ENGINES[uri] = sqlalchemy.create_engine(uri, **kw)
-    return ENGINES[uri]
+        if wal:
+            # Connections are pooled and handed to one thread at a time
+            kw['connect_args']['check_same_thread'] = False
+            kw['poolclass'] = sqlalchemy.pool.QueuePool
+            kw['pool_size'] = read_pool_size
+            kw['max_overflow'] = -1
+        engine = sqlalchemy.create_engine(uri, **kw)
+        if wal:
+            _init_sqlite_wal_engine(engine, timeout)
+        ENGINES[key] = engine
+    return ENGINES[key]
+
+
+def _init_sqlite_wal_engine(engine, timeout):
+    """
+    Configures an SQLite engine for concurrent readers and one writer.
+
+    * The database uses a write-ahead log, so readers see the last
+      committed state and are never blocked by a writer.
+    * Each connection waits up to ``timeout`` seconds for locks, and its
+      pragmas (cache size etc) are set once when it is opened. The pool
+      keeps it open for the next reader.
+    * Explicit transactions (``conn.begin()``) start with ``BEGIN
+      IMMEDIATE``. They hold the write lock from the start, so writers are
+      serialized instead of failing when a read lock is upgraded. Within a
+      process they also take a writer lock, so threads queue in order
+      instead of polling the busy handler. Statements of a transaction must
+      run on the connection that began it, another connection would wait
+      for the write lock held by the transaction.
+    * Transactions begun on a connection with the ``wbia_read_only``
+      execution option start with a plain ``BEGIN`` and take no locks, so
+      readers never queue behind an open write transaction.
+
+    The transaction handling follows the SQLAlchemy recipe for pysqlite, which
+    disables the driver's implicit ``BEGIN`` and emits it from the ``begin``
+    event instead.
+    """
+    writer_lock = threading.RLock()
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_conn, connection_record):
+        dbapi_conn.isolation_level = None
+        cursor = dbapi_conn.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL;')
+        cursor.execute('PRAGMA busy_timeout = %d;' % (int(timeout * 1000),))
+        cursor.execute('PRAGMA synchronous = NORMAL;')
+        cursor.execute('PRAGMA cache_size = 10000;')
+        cursor.execute('PRAGMA temp_store = MEMORY;')
+        cursor.close()
+
+    @sqlalchemy.event.listens_for(engine, 'begin')
+    def _on_begin(conn):
+        if conn.get_execution_options().get('wbia_read_only', False):
+            conn.execute('BEGIN')
+            return
+        writer_lock.acquire()
+        conn.info['_wbia_writer_lock'] = True
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except Exception:
+            _release_writer(conn.info)
+            raise
+
+    def _release_writer(info):
+        if info.pop('_wbia_writer_lock', False):
+            writer_lock.release()
+
+    @sqlalchemy.event.listens_for(engine, 'commit')
+    def _on_commit(conn):
+        _release_writer(conn.info)
+
+    @sqlalchemy.event.listens_for(engine, 'rollback')
+    def _on_rollback(conn):
+        _release_writer(conn.info)
+
+    @sqlalchemy.event.listens_for(engine, 'reset')
+    def _on_reset(dbapi_conn, connection_record):
+        # A connection returned to the pool in the middle of a transaction
+        _release_writer(connection_record.info)
+
+
+def _is_select(operation):
+    """True if the statement only reads from the database"""
+    if isinstance(operation, sqlalchemy.sql.selectable.Select):
+        return True
+    elif isinstance(operation, sqlalchemy.sql.elements.TextClause):
+        return operation.text.lstrip()[0:6].lower() == 'select'
+    return False
 
 
 def compare_coldef_lists(coldef_list1, coldef_list2):
@@ -499,9 +643,9 @@ class SQLDatabaseController(object):
 
     def __init_engine(self):
         """Create the SQLAlchemy Engine"""
-        self._engine = create_engine(self.uri)
+        self._engine = create_engine(self.uri, timeout=self.timeout, wal=self.wal)
 
-    def __init__(self, uri, name, readonly=READ_ONLY, timeout=TIMEOUT):
+    def __init__(self, uri, name, readonly=READ_ONLY, timeout=BUSY_TIMEOUT, wal=None):
         """Creates a controller instance from a connection URI
 
         The name is primarily used with Postgres. In Postgres the the name
@@ -514,11 +658,15 @@ class SQLDatabaseController(object):
         Args:
             uri (str): connection string or uri
             name (str): name of the database (e.g. chips, _ibeis_database, staging)
+            timeout (float): seconds to wait for a locked database
+            wal (bool): use concurrent reader / serialized writer mode for
+                SQLite files (default: ``--sqlite-wal``), see ``create_engine``
 
         """
         self.uri = uri
         self.name = name
         self.timeout = timeout
+        self.wal = SQLITE_WAL if wal is None else wal
         self.metadata = self.Metadata(self)
         self.readonly = readonly
 
@@ -533,6 +681,17 @@ class SQLDatabaseController(object):
 
         self._tablenames = None
 
+        # Cache of getter statements, see ``_get_cached_stmt``
+        self._stmt_cache = {}
+        self._stmt_cache_hits = 0
+        self._stmt_cache_misses = 0
+        # SQLAlchemy compiled form of the cached statements
+        self._compiled_cache = sqlalchemy.util.LRUCache(STMT_CACHE_SIZE)
+        # Superkeys of tables that ``add_cleanly`` can upsert into
+        self._upsert_superkeys = {}
+        #: Use INSERT ... ON CONFLICT DO NOTHING RETURNING in ``add_cleanly``
+        self.use_upsert = self.supports_upsert
+
         if not self.readonly:
             # Ensure the metadata table is initialized.
             self._ensure_metadata_table()
@@ -550,6 +709,13 @@ class SQLDatabaseController(object):
     def is_using_postgres(self):
         return self._engine.dialect.name == 'postgresql'
 
+    @property
+    def supports_upsert(self):
+        """True if the backend has ``ON CONFLICT DO NOTHING ... RETURNING``"""
+        if self.is_using_sqlite:
+            return lite.sqlite_version_info >= (3, 35, 0)
+        return self.is_using_postgres
+
     @property
     def schema_name(self):
         """The name of the namespace schema (using with Postgres)."""
@@ -721,6 +887,9 @@ class SQLDatabaseController(object):
                 )
         # Start Exclusive transaction, lock out all other writers from making database changes
         with self.connect() as conn:
+            if self.wal:
+                # Move committed pages from the write-ahead log into the file
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
             conn.execute('BEGIN EXCLUSIVE')
             ut.copy(path, backup_filepath)
 
@@ -784,6 +953,86 @@ class SQLDatabaseController(object):
             table_name, self._sa_metadata, autoload=True, autoload_with=self._engine, **kw
         )
 
+    def _make_id_processor(self, column):
+        """Produces a function that converts an id value into the form
+        the database returns for the given ``column``"""
+        dialect = self._engine.dialect
+        bind_processor = column.type.bind_processor(dialect)
+        result_processor = column.type.result_processor(dialect, str(column.type))
+
+        def process(a):
+            if bind_processor:
+                a = bind_processor(a)
+            if result_processor:
+                return result_processor(a)
+            return a
+
+        return process
+
+    def _get_cached_stmt(self, tblname, colnames, id_colnames=(), where_clause=None):
+        """Produces the select statement used by the getters
+
+        The statement, the reflected table and the id column processors are
+        cached by ``(tblname, colnames, id_colnames, where_clause)``,
+        because rebuilding them costs more than the query itself for small
+        getter calls. The cache is cleared by ``invalidate_tables_cache``.
+
+        Args:
+            tblname (str): table name
+            colnames (tuple[str]): columns to select
+            id_colnames (tuple[str]): columns matched against an expanding
+                ``IN`` parameter named ``params`` (or ``value`` when
+                there is a single id column)
+            where_clause (str): textual where clause (used by ``get_where``)
+
+        Returns:
+            CachedStatement: statement and id column information
+        """
+        key = (tblname, tuple(colnames), tuple(id_colnames), where_clause)
+        try:
+            cached = self._stmt_cache[key]
+        except KeyError:
+            self._stmt_cache_misses += 1
+        else:
+            self._stmt_cache_hits += 1
+            return cached
+
+        table = self._reflect_table(tblname)
+        id_columns = [
+            # rowid isn't an actual column in sqlite
+            sqlalchemy.sql.column('rowid', Integer) if c == 'rowid' else table.c[c]
+            for c in id_colnames
+        ]
+        stmt = sqlalchemy.select(id_columns + [table.c[c] for c in colnames])
+        if len(id_columns) == 1:
+            stmt = stmt.where(id_columns[0].in_(bindparam('value', expanding=True)))
+        elif len(id_columns) > 1:
+            stmt = stmt.where(
+                sqlalchemy.tuple_(*id_columns).in_(bindparam('params', expanding=True))
+            )
+        if where_clause is not None:
+            stmt = stmt.where(text(where_clause))
+        cached = CachedStatement(
+            table,
+            stmt,
+            id_columns,
+            [str(c.type) for c in id_columns],
+            [self._make_id_processor(c) for c in id_columns],
+        )
+        if len(self._stmt_cache) >= STMT_CACHE_SIZE:
+            self._stmt_cache.clear()
+        self._stmt_cache[key] = cached
+        return cached
+
+    def get_stmt_cache_info(self):
+        """Returns the hit and miss counts of the getter statement cache"""
+        return {
+            'hits': self._stmt_cache_hits,
+            'misses': self._stmt_cache_misses,
+            'size': len(self._stmt_cache),
+            'compiled_size': len(self._compiled_cache),
+        }
+
     # ==============
     # API INTERFACE
     # ==============
@@ -945,6 +1194,12 @@ class SQLDatabaseController(object):
         # ADD_CLEANLY_1: PREPROCESS INPUT
         # eagerly evaluate for superkeys
         params_list = list(params_iter)
+        if self.use_upsert and kwargs.get('unpack_scalars', True):
+            rowid_list = self._add_cleanly_upsert(
+                tblname, colnames, params_list, get_rowid_from_superkey, superkey_paramx
+            )
+            if rowid_list is not None:
+                return rowid_list
         # Extract superkeys from the params list (requires eager eval)
         superkey_lists = [
             [None if params is None else params[x] for params in params_list]
@@ -999,6 +1254,144 @@ class SQLDatabaseController(object):
         assert len(rowid_list) == len(params_list), 'failed sanity check'
         return rowid_list
 
+    def _get_upsert_superkey(self, tblname, superkey_colnames):
+        """
+        Returns the primary key column if ``superkey_colnames`` has a UNIQUE
+        constraint in ``tblname`` (so conflicts are detected by the database),
+        otherwise None.
+        """
+        key = (tblname, tuple(superkey_colnames))
+        if key not in self._upsert_superkeys:
+            pk_column = None
+            table = self._reflect_table(tblname)
+            # Use the reflected schema, the superkeys metadata may be stale
+            unique_colsets = [
+                {col.name for col in constraint.columns}
+                for constraint in table.constraints
+                if isinstance(constraint, sqlalchemy.UniqueConstraint)
+            ]
+            unique_colsets += [
+                {col.name for col in index.columns}
+                for index in table.indexes
+                if index.unique
+            ]
+            if self.is_using_postgres:
+                target_colset = {name.lower() for name in superkey_colnames}
+            else:
+                target_colset = set(superkey_colnames)
+            pk_columns = list(table.primary_key.columns)
+            if len(pk_columns) == 1 and target_colset in unique_colsets:
+                pk_column = pk_columns[0]
+            self._upsert_superkeys[key] = pk_column
+        return self._upsert_superkeys[key]
+
+    def _add_cleanly_upsert(
+        self, tblname, colnames, params_list, get_rowid_from_superkey, superkey_paramx
+    ):
+        """
+        Implementation of ``add_cleanly`` with ``INSERT ... ON CONFLICT
+        (<superkey>) DO NOTHING RETURNING``. New rows are inserted and their
+        rowids returned in one transaction. Only rows that already existed are
+        looked up afterwards with ``get_rowid_from_superkey``. Rows that
+        violate another UNIQUE constraint raise an IntegrityError.
+
+        Returns None if the table cannot be upserted into, in which case the
+        caller falls back to the get / insert / get path.
+        """
+        superkey_colnames = [colnames[x] for x in superkey_paramx]
+        pk_column = self._get_upsert_superkey(tblname, superkey_colnames)
+        if pk_column is None:
+            return None
+        table = self._reflect_table(tblname)
+        if self.is_using_postgres:
+            columns = [table.c[c.lower()] for c in colnames]
+            key_procs = [self._make_id_processor(columns[x]) for x in superkey_paramx]
+        else:
+            columns = [table.c[c] for c in colnames]
+            dialect = self._engine.dialect
+            bind_procs = [col.type.bind_processor(dialect) for col in columns]
+            key_procs = [bind_procs[x] for x in superkey_paramx]
+        key_procs = [ut.identity if proc is None else proc for proc in key_procs]
+
+        # Insert the first occurrence of every new superkey
+        key_list = []
+        key_to_params = {}
+        try:
+            for params in params_list:
+                if params is None:
+                    key_list.append(None)
+                    continue
+                key = tuple(
+                    proc(params[x]) for proc, x in zip(key_procs, superkey_paramx)
+                )
+                key_to_params.setdefault(key, params)
+                key_list.append(key)
+        except TypeError:
+            # Unhashable superkeys
+            return None
+
+        key_to_rowid = {}
+        dirty_items = list(key_to_params.items())
+        rows_per_batch = max(1, BATCH_SIZE // len(colnames))
+        with self.connect() as conn:
+            with conn.begin():
+                for start in range(0, len(dirty_items), rows_per_batch):
+                    batch = dirty_items[start : start + rows_per_batch]
+                    if self.is_using_postgres:
+                        stmt = (
+                            postgresql.insert(table)
+                            .values(
+                                [
+                                    {col.name: val for col, val in zip(columns, params)}
+                                    for _, params in batch
+                                ]
+                            )
+                            .on_conflict_do_nothing(
+                                index_elements=ut.take(columns, superkey_paramx)
+                            )
+                            .returning(pk_column, *ut.take(columns, superkey_paramx))
+                        )
+                        results = conn.execute(stmt).fetchall()
+                    else:
+                        # The sqlite dialect of SQLAlchemy 1.3 cannot compile
+                        # RETURNING, so values are bound as processed here
+                        values_sql = '(%s)' % (', '.join(['?'] * len(columns)),)
+                        operation = (
+                            'INSERT INTO {tblname} ({colnames}) VALUES {values} '
+                            'ON CONFLICT ({keys}) DO NOTHING RETURNING {pk}, {keys}'
+                        ).format(
+                            tblname=tblname,
+                            colnames=', '.join(col.name for col in columns),
+                            values=', '.join([values_sql] * len(batch)),
+                            pk=pk_column.name,
+                            keys=', '.join(superkey_colnames),
+                        )
+                        flat_params = tuple(
+                            val if proc is None else proc(val)
+                            for _, params in batch
+                            for proc, val in zip(bind_procs, params)
+                        )
+                        results = conn.execute(operation, flat_params).fetchall()
+                    for row in results:
+                        key_to_rowid[tuple(row[1:])] = row[0]
+
+        if ut.VERBOSE:
+            logger.info(
+                '[sql] upserted %r/%r new %s'
+                % (len(key_to_rowid), len(params_list), tblname)
+            )
+        # Rows that conflicted already existed before this call
+        existing_keys = [key for key in key_to_params if key not in key_to_rowid]
+        if existing_keys:
+            existing_params = ut.take(key_to_params, existing_keys)
+            superkey_lists = [
+                [params[x] for params in existing_params] for x in superkey_paramx
+            ]
+            existing_rowids = get_rowid_from_superkey(*superkey_lists)
+            key_to_rowid.update(zip(existing_keys, existing_rowids))
+        rowid_list = [None if key is None else key_to_rowid[key] for key in key_list]
+        return rowid_list
+
     def rows_exist(self, tblname, rowids):
         """
         Checks if rowids exist. Yields True if they do
@@ -1016,6 +1409,7 @@ class SQLDatabaseController(object):
         unpack_scalars=True,
         op='AND',
         batch_size=BATCH_SIZE,
+        temp_table_threshold=TEMP_TABLE_THRESHOLD,
         **kwargs,
     ):
         """Executes a SQL select where the given parameters match/equal
@@ -1032,6 +1426,9 @@ class SQLDatabaseController(object):
             unpack_scalars (bool): [deprecated] use to unpack a single result from each query
                                    only use with operations that return a single result for each query
                                    (default: True)
+            temp_table_threshold (int): number of parameters at which they
+                are joined through a temporary table instead of being queried
+                in batches (None to disable)
 
         """
         if len(where_colnames) == 1:
@@ -1042,11 +1439,12 @@ class SQLDatabaseController(object):
                 id_colname=where_colnames[0],
                 unpack_scalars=unpack_scalars,
                 batch_size=batch_size,
+                temp_table_threshold=temp_table_threshold,
                 **kwargs,
             )
         params_iter = list(params_iter)
-        table = self._reflect_table(tblname)
         if op.lower() != 'and' or not params_iter:
+            table = self._reflect_table(tblname)
             # Build the equality conditions using column type information.
             # This allows us to bind the parameter with the correct type.
             equal_conditions = [
@@ -1065,17 +1463,24 @@ class SQLDatabaseController(object):
                 **kwargs,
             )
 
+        if temp_table_threshold is not None and len(params_iter) >= temp_table_threshold:
+            return self._get_by_temp_table(
+                tblname,
+                colnames,
+                params_iter,
+                where_colnames,
+                unpack_scalars=unpack_scalars,
+                keepwrap=kwargs.get('keepwrap', False),
+            )
         params_per_batch = int(batch_size / len(params_iter[0]))
         result_map = {}
-        stmt = sqlalchemy.select(
-            [table.c[c] for c in tuple(where_colnames) + tuple(colnames)]
-        )
-        stmt = stmt.where(
-            sqlalchemy.tuple_(*[table.c[c] for c in where_colnames]).in_(
-                sqlalchemy.sql.bindparam('params', expanding=True)
-            )
-        )
+        cached = self._get_cached_stmt(tblname, colnames, where_colnames)
+        stmt = cached.stmt
         batch_list = list(range(int(len(params_iter) / params_per_batch) + 1))
+        logger.debug(
+            '[db.get(%s)] using batched tuple IN strategy for %d params in %d batches'
+            % (tblname, len(params_iter), len(batch_list))
+        )
         for batch in tqdm.tqdm(
             batch_list, disable=len(batch_list) <= 1, desc='[db.get(%s)]' % (tblname,)
         ):
@@ -1086,6 +1491,7 @@ class SQLDatabaseController(object):
                         batch * params_per_batch : (batch + 1) * params_per_batch
                     ]
                 },
+                compiled_cache=self._compiled_cache,
             )
             for val in val_list:
                 key = val[: len(params_iter[0])]
@@ -1105,28 +1511,13 @@ class SQLDatabaseController(object):
                     existing.append(values)
 
         results = []
-        processors = []
-        for c in tuple(where_colnames):
-
-            def process(column, a):
-                processor = column.type.bind_processor(self._engine.dialect)
-                if processor:
-                    a = processor(a)
-                result_processor = column.type.result_processor(
-                    self._engine.dialect, str(column.type)
-                )
-                if result_processor:
-                    return result_processor(a)
-                return a
-
-            processors.append(functools.partial(process, table.c[c]))
+        processors = cached.id_processors
 
         if params_iter:
             first_params = params_iter[0]
             if any(
-                not isinstance(a, bool)
-                and TYPE_TO_SQLTYPE.get(type(a)) != str(table.c[c].type)
-                for a, c in zip(first_params, where_colnames)
+                not isinstance(a, bool) and TYPE_TO_SQLTYPE.get(type(a)) != sqltype
+                for a, sqltype in zip(first_params, cached.id_sqltypes)
             ):
                 params_iter = (
                     (processor(raw_id) for raw_id, processor in zip(id_, processors))
@@ -1218,21 +1609,28 @@ class SQLDatabaseController(object):
                     "Statements cannot use '?' parameterization, "
                     "use ':name' parameters instead."
                 )
-            elif isinstance(where_clause, str):
-                where_clause = text(where_clause)
 
-        table = self._reflect_table(tblname)
-        stmt = sqlalchemy.select([table.c[c] for c in colnames])
+        if where_clause is None or isinstance(where_clause, str):
+            # Textual where clauses are part of the cached statement
+            stmt = self._get_cached_stmt(
+                tblname, colnames, where_clause=where_clause
+            ).stmt
+        else:
+            table = self._reflect_table(tblname)
+            stmt = sqlalchemy.select([table.c[c] for c in colnames])
+            stmt = stmt.where(where_clause)
 
         if where_clause is None:
-            val_list = self.executeone(stmt, **kwargs)
+            val_list = self.executeone(
+                stmt, compiled_cache=self._compiled_cache, **kwargs
+            )
         else:
-            stmt = stmt.where(where_clause)
             val_list = self.executemany(
                 stmt,
                 params_iter,
                 unpack_scalars=unpack_scalars,
                 eager=eager,
+                compiled_cache=self._compiled_cache,
                 **kwargs,
             )
 
@@ -1311,6 +1709,7 @@ class SQLDatabaseController(object):
         eager=True,
         assume_unique=False,
         batch_size=BATCH_SIZE,
+        temp_table_threshold=TEMP_TABLE_THRESHOLD,
         **kwargs,
     ):
         """Get rows of data by ID
@@ -1323,6 +1722,9 @@ class SQLDatabaseController(object):
             eager (bool): use eager evaluation
             assume_unique (bool): default False. Experimental feature that could result in a 10x speedup
             unpack_scalars (bool): default True
+            temp_table_threshold (int): number of ids at which the ids are
+                joined through a temporary table instead of being queried in
+                batches (None to disable)
 
         Example:
             >>> # ENABLE_DOCTEST
@@ -1338,11 +1740,13 @@ class SQLDatabaseController(object):
             >>> got_data = db.get('notch', colnames, id_iter=rowids)
             >>> assert got_data == [1, 2, 3]
         """
-        logger.debug(
-            '[sql]'
-            + ut.get_caller_name(list(range(1, 4)))
-            + ' db.get(%r, %r, ...)' % (tblname, colnames)
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            # Looking up the caller name is costly, only do it when logged
+            logger.debug(
+                '[sql]'
+                + ut.get_caller_name(list(range(1, 4)))
+                + ' db.get(%r, %r, ...)' % (tblname, colnames)
+            )
         if not isinstance(colnames, (tuple, list)):
             raise TypeError('colnames must be a sequence type of strings')
 
@@ -1362,7 +1766,6 @@ class SQLDatabaseController(object):
             operation = f'SELECT {columns} FROM {tblname} WHERE rowid in ({ids_listing}) ORDER BY rowid ASC'
             with self.connect() as conn:
                 results = conn.execute(operation).fetchall()
-            import numpy as np
 
             # ??? Why order the results if they are going to be sorted here?
             sortx = np.argsort(np.argsort(id_iter))
@@ -1380,22 +1783,34 @@ class SQLDatabaseController(object):
                 )
 
             id_iter = list(id_iter)  # id_iter could be a set
-            table = self._reflect_table(tblname)
+            if (
+                temp_table_threshold is not None
+                and len(id_iter) >= temp_table_threshold
+            ):
+                return self._get_by_temp_table(
+                    tblname,
+                    colnames,
+                    [(id_,) for id_ in id_iter],
+                    (id_colname,),
+                    unpack_scalars=kwargs.get('unpack_scalars', True),
+                    keepwrap=kwargs.get('keepwrap', False),
+                )
             result_map = {}
-            if id_colname == 'rowid':  # rowid isn't an actual column in sqlite
-                id_column = sqlalchemy.sql.column('rowid', Integer)
-            else:
-                id_column = table.c[id_colname]
-            stmt = sqlalchemy.select([id_column] + [table.c[c] for c in colnames])
-            stmt = stmt.where(id_column.in_(bindparam('value', expanding=True)))
+            cached = self._get_cached_stmt(tblname, colnames, (id_colname,))
+            stmt = cached.stmt
 
             batch_list = list(range(int(len(id_iter) / batch_size) + 1))
+            logger.debug(
+                '[db.get(%s)] using batched IN strategy for %d ids in %d batches'
+                % (tblname, len(id_iter), len(batch_list))
+            )
             for batch in tqdm.tqdm(
                 batch_list, disable=len(batch_list) <= 1, desc='[db.get(%s)]' % (tblname,)
             ):
                 val_list = self.executeone(
                     stmt,
                     {'value': id_iter[batch * batch_size : (batch + 1) * batch_size]},
+                    compiled_cache=self._compiled_cache,
                 )
 
                 for val in val_list:
@@ -1417,23 +1832,12 @@ class SQLDatabaseController(object):
 
             results = []
 
-            def process(a):
-                processor = id_column.type.bind_processor(self._engine.dialect)
-                if processor:
-                    a = processor(a)
-                result_processor = id_column.type.result_processor(
-                    self._engine.dialect, str(id_column.type)
-                )
-                if result_processor:
-                    return result_processor(a)
-                return a
-
             if id_iter:
                 first_id = id_iter[0]
                 if isinstance(first_id, bool) or TYPE_TO_SQLTYPE.get(
                     type(first_id)
-                ) != str(id_column.type):
-                    id_iter = (process(id_) for id_ in id_iter)
+                ) != cached.id_sqltypes[0]:
+                    id_iter = map(cached.id_processors[0], id_iter)
 
             for id_ in id_iter:
                 result = sorted(list(result_map.get(id_, set())))
@@ -1444,6 +1848,236 @@ class SQLDatabaseController(object):
 
             return results
 
+    def _get_by_temp_table(
+        self,
+        tblname,
+        colnames,
+        params_list,
+        id_colnames,
+        unpack_scalars=True,
+        keepwrap=False,
+    ):
+        """Getter strategy for very large id lists
+
+        The ids are bulk inserted into a session temporary table, which is
+        joined against ``tblname`` in a single query ordered by the position
+        of each id. This replaces the many round trips and large bound
+        parameter lists of the batched ``IN (...)`` strategy.
+        Results follow the same conventions as ``get``.
+
+        Args:
+            tblname (str): table name to get from
+            colnames (tuple of str): column names to grab from
+            params_list (list[tuple]): search keys, one tuple per row
+            id_colnames (tuple of str): columns matched against the keys
+
+        """
+        table = self._reflect_table(tblname)
+        key_columns = []
+        for c in id_colnames:
+            if c == 'rowid' and self.is_using_sqlite:
+                # rowid isn't an actual column in sqlite
+                key_columns.append(
+                    sqlalchemy.literal_column(f'{table.name}.rowid', Integer)
+                )
+            else:
+                key_columns.append(table.c[c])
+        temp_keys = Table(
+            f'_wbia_get_keys_{uuid.uuid4().hex[:8]}',
+            sqlalchemy.MetaData(),
+            sqlalchemy.Column('key_order', sqlalchemy.Integer, primary_key=True),
+            *[
+                sqlalchemy.Column(f'key_{x}', col.type)
+                for x, col in enumerate(key_columns)
+            ],
+            prefixes=['TEMPORARY'],
+        )
+        temp_key_columns = [temp_keys.c[f'key_{x}'] for x in range(len(key_columns))]
+        on_clause = sqlalchemy.and_(
+            *[a == b for a, b in zip(temp_key_columns, key_columns)]
+        )
+        stmt = (
+            sqlalchemy.select([temp_keys.c.key_order] + [table.c[c] for c in colnames])
+            .select_from(temp_keys.join(table, on_clause))
+            .order_by(temp_keys.c.key_order)
+        )
+        logger.info(
+            '[db.get(%s)] using temp table join strategy for %d ids'
+            % (tblname, len(params_list))
+        )
+        key_names = [c.name for c in temp_key_columns]
+        with self.connect() as conn:
+            # Only the temporary table is written, so don't take the writer lock
+            conn = conn.execution_options(wbia_read_only=True)
+            with conn.begin():
+                temp_keys.create(conn)
+                try:
+                    conn.execute(
+                        temp_keys.insert(),
+                        [
+                            dict(zip(key_names, params), key_order=key_order)
+                            for key_order, params in enumerate(params_list)
+                        ],
+                    )
+                    rows = conn.execute(stmt).fetchall()
+                finally:
+                    temp_keys.drop(conn)
+
+        # Group the joined rows by the position of their key
+        num_values = len(colnames)
+        result_map = {}
+        for row in rows:
+            if not keepwrap and num_values == 1:
+                values = row[1]
+            else:
+                values = tuple(row[1:])
+            result_map.setdefault(row[0], []).append(values)
+
+        results = []
+        for key_order in range(len(params_list)):
+            result = result_map.get(key_order, [])
+            if len(result) > 1:
+                try:
+                    result = sorted(set(result))
+                except TypeError:
+                    # unhashable type
+                    unique_result = []
+                    for values in result:
+                        if values not in unique_result:
+                            unique_result.append(values)
+                    result = sorted(unique_result)
+            if unpack_scalars:
+                results.append(_unpacker(result))
+            else:
+                results.append(result)
+        return results
+
+    def get_columnar(
+        self,
+        tblname,
+        colnames,
+        id_iter,
+        id_colname='rowid',
+        assume_unique=False,
+        batch_size=BATCH_SIZE,
+    ):
+        """Get columns of data by ID as numpy arrays
+
+        Unlike ``get``, which produces a (possibly unpacked) row per id, this
+        produces one array per column aligned to ``id_iter``. Ids without a
+        row and NULL values are masked out.
+
+        Args:
+            tblname (str): table name to get from
+            colnames (tuple of str): column names to grab from
+            id_iter (iterable): iterable of search keys
+            id_colname (str): column to be used as the search key (default: rowid)
+            assume_unique (bool): the caller asserts each id matches at most
+                one row, which skips the per-id set and sort used by ``get``.
+                This is implied when searching by rowid.
+
+        Returns:
+            list of numpy.ma.MaskedArray: one array per column in ``colnames``
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from wbia.dtool.sql_control import *  # NOQA
+            >>> db = SQLDatabaseController('sqlite:///', 'testing')
+            >>> db.add_table('dummy', [('dummy_rowid', 'INTEGER PRIMARY KEY'),
+            >>>                        ('x', 'INTEGER'), ('y', 'REAL')])
+            >>> db._add('dummy', ('x', 'y'), [(1, 1.5), (2, None), (3, 3.5)])
+            >>> xs, ys = db.get_columnar('dummy', ('x', 'y'), [3, 4, 2])
+            >>> print(xs)
+            >>> print(ys)
+            [3 -- 2]
+            [3.5 -- --]
+        """
+        if not isinstance(colnames, (tuple, list)):
+            raise TypeError('colnames must be a sequence type of strings')
+        id_list = list(id_iter)
+        num = len(id_list)
+        cached = self._get_cached_stmt(tblname, colnames, (id_colname,))
+        dtypes = [
+            SQLTYPE_TO_DTYPE.get(str(cached.table.c[c].type).upper(), object)
+            for c in colnames
+        ]
+        if not (assume_unique or id_colname == 'rowid'):
+            # Rows are not known to be unique, go through the generic getter
+            rows = self.get(tblname, colnames, id_list, id_colname=id_colname)
+            if len(colnames) == 1:
+                rows = [(row,) for row in rows]
+            rows = [(None,) * len(colnames) if row is None else row for row in rows]
+            columns = list(zip(*rows)) if rows else [()] * len(colnames)
+            return [
+                self._make_masked_column(column, dtype)
+                for column, dtype in zip(columns, dtypes)
+            ]
+
+        # Normalize the search keys to the form returned by the database
+        if id_list and (
+            isinstance(id_list[0], bool)
+            or TYPE_TO_SQLTYPE.get(type(id_list[0])) != cached.id_sqltypes[0]
+        ):
+            id_list = [cached.id_processors[0](id_) for id_ in id_list]
+
+        found_ids = []
+        found_columns = [[] for _ in colnames]
+        for start in range(0, num, batch_size):
+            with self.connect() as conn:
+                conn = conn.execution_options(compiled_cache=self._compiled_cache)
+                result = conn.execute(
+                    cached.stmt, {'value': id_list[start : start + batch_size]}
+                )
+                rows = result.fetchall()
+            if rows:
+                # Transpose at C speed instead of indexing each row
+                columns = list(zip(*rows))
+                found_ids.extend(columns[0])
+                for found, column in zip(found_columns, columns[1:]):
+                    found.extend(column)
+
+        # Align the found rows with the input ids
+        if found_ids and cached.id_sqltypes[0] in ('INTEGER', 'BIGINT'):
+            found_arr = np.asarray(found_ids, dtype=np.int64)
+            id_arr = np.array([-1 if id_ is None else id_ for id_ in id_list])
+            sortx = found_arr.argsort()
+            pos = np.searchsorted(found_arr, id_arr, sorter=sortx).clip(0, len(sortx) - 1)
+            take_idx = sortx[pos]
+            missing = found_arr[take_idx] != id_arr
+        else:
+            lookup = {id_: index for index, id_ in enumerate(found_ids)}
+            take_idx = np.array(
+                [lookup.get(id_, -1) for id_ in id_list], dtype=np.int64
+            )
+            missing = take_idx < 0
+            take_idx[missing] = 0
+        results = []
+        for found, dtype in zip(found_columns, dtypes):
+            column = self._make_masked_column(found, dtype)
+            if len(column) == 0:
+                column = np.ma.masked_all(num, dtype=column.dtype)
+            else:
+                column = column[take_idx]
+                column[missing] = np.ma.masked
+            results.append(column)
+        return results
+
+    @staticmethod
+    def _make_masked_column(values, dtype):
+        """Converts a sequence of values (possibly with None) into a masked array"""
+        values = list(values)
+        mask = np.array([value is None for value in values], dtype=bool)
+        if dtype is object:
+            data = np.empty(len(values), dtype=object)
+            data[:] = values
+        elif mask.any():
+            data = np.array(
+                [0 if value is None else value for value in values], dtype=dtype
+            )
+        else:
+            data = np.array(values, dtype=dtype)
+        return np.ma.MaskedArray(data, mask=mask)
+
     def set(
         self,
         tblname,
@@ -1593,30 +2227,34 @@ class SQLDatabaseController(object):
                     params.update({f'e{e}': p for e, p in enumerate(val_list[i])})
                     conn.execute(stmt, **params)
 
-    def delete(self, tblname, id_list, id_colname='rowid', **kwargs):
+    def delete(
+        self, tblname, id_list, id_colname='rowid', batch_size=BATCH_SIZE, **kwargs
+    ):
         """Deletes rows from a SQL table (``tblname``) by ID,
         given a sequence of IDs (``id_list``).
         Optionally a different ID column can be specified via ``id_colname``.
 
+        The ids are deleted in batches of ``DELETE ... WHERE id IN (...)``
+        statements inside a single transaction.
+
         """
-        id_param_name = '_identifier'
         table = self._reflect_table(tblname)
-        stmt = table.delete()
-        where_clause = text(id_colname + f' = :{id_param_name}')
         if id_colname == 'rowid':
             # Cast all item values to in, in case values are numpy.integer*
             # Strangely allow for None values
-            id_list = [id_ if id_ is None else int(id_) for id_ in id_list]
-        else:  # b/c rowid doesn't really exist as a column
+            id_list = [int(id_) for id_ in id_list if id_ is not None]
+            # b/c rowid doesn't really exist as a column
+            id_column = sqlalchemy.sql.column('rowid', Integer)
+        else:
+            id_list = [id_ for id_ in id_list if id_ is not None]
             id_column = table.c[id_colname]
-            where_clause = where_clause.bindparams(
-                bindparam(id_param_name, type_=id_column.type)
-            )
-        stmt = stmt.where(where_clause)
+        if not id_list:
+            return
+        stmt = table.delete().where(id_column.in_(bindparam('ids', expanding=True)))
         with self.connect() as conn:
             with conn.begin():
-                for id in id_list:
-                    conn.execute(stmt, {id_param_name: id})
+                for start in range(0, len(id_list), batch_size):
+                    conn.execute(stmt, {'ids': id_list[start : start + batch_size]})
 
     def delete_rowids(self, tblname, rowid_list, **kwargs):
         """deletes the the rows in rowid_list"""
@@ -1666,6 +2304,7 @@ class SQLDatabaseController(object):
         verbose=VERBOSE_SQL,
         use_fetchone_behavior=False,
         keepwrap=False,
+        compiled_cache=None,
     ):
         """Executes the given ``operation`` once with the given set of ``params``
 
@@ -1675,6 +2314,8 @@ class SQLDatabaseController(object):
             eager: [deprecated] no-op
             verbose: [deprecated] no-op
             use_fetchone_behavior (bool): Use DBAPI ``fetchone`` behavior when outputing no rows (i.e. None)
+            compiled_cache (dict): cache for the compiled form of ``operation``,
+                only use with statements that are reused (e.g. from ``_get_cached_stmt``)
 
         """
         if not isinstance(operation, ClauseElement):
@@ -1683,55 +2324,100 @@ class SQLDatabaseController(object):
                 "see docs on 'sqlalchemy.sql:text' factory function; "
                 f"'operation' is a '{type(operation)}'"
             )
-        # FIXME (12-Sept-12020) Allows passing through '?' (question mark) parameters.
-        with self.connect() as conn:
-            results = conn.execute(operation, params)
+        if not instrumentation.INSTRUMENTS.enabled:
+            return self._executeone(
+                operation, params, use_fetchone_behavior, keepwrap, compiled_cache
+            )
+        start = time.perf_counter()
+        values = self._executeone(
+            operation, params, use_fetchone_behavior, keepwrap, compiled_cache
+        )
+        # Statements without results count as a single row
+        nrows = len(values) if isinstance(values, list) else 1
+        instrumentation.record_sql(self, operation, nrows, time.perf_counter() - start)
+        return values
 
-            # BBB (12-Sept-12020) Retaining insertion rowid result
-            # FIXME postgresql (12-Sept-12020) This won't work in postgres.
-            #       Maybe see if ResultProxy.inserted_primary_key will work
-            if (
-                'insert' in str(operation).lower()
-            ):  # cast in case it's an SQLAlchemy object
-                # BBB (12-Sept-12020) Retaining behavior to unwrap single value rows.
-                return [results.lastrowid]
-            elif not results.returns_rows:
-                return None
-            else:
-                if isinstance(operation, sqlalchemy.sql.selectable.Select):
-                    # This code is specifically for handling duplication in colnames
-                    # because sqlalchemy removes them.
-                    # e.g. select field1, field1, field2 from table;
-                    # becomes
-                    #      select field1, field2 from table;
-                    # so the items in val_list only have 2 values
-                    # but the caller isn't expecting it so it causes problems
-                    returned_columns = tuple([c.name for c in operation.columns])
-                    raw_columns = tuple([c.name for c in operation._raw_columns])
-                    if raw_columns != returned_columns:
-                        results_ = []
-                        for r in results:
-                            results_.append(
-                                tuple(r[returned_columns.index(c)] for c in raw_columns)
-                            )
-                        results = results_
-                values = list(
-                    [
-                        # BBB (12-Sept-12020) Retaining behavior to unwrap single value rows.
-                        row[0] if not keepwrap and len(row) == 1 else row
-                        for row in results
-                    ]
+    def _executeone(
+        self,
+        operation,
+        params=(),
+        use_fetchone_behavior=False,
+        keepwrap=False,
+        compiled_cache=None,
+        conn=None,
+    ):
+        if conn is None:
+            with self.connect() as conn:
+                return self._executeone(
+                    operation,
+                    params,
+                    use_fetchone_behavior,
+                    keepwrap,
+                    compiled_cache,
+                    conn=conn,
                 )
-                # FIXME (28-Sept-12020) No rows results in an empty list. This behavior does not
-                #       match the resulting expectations of `fetchone`'s DBAPI spec.
-                #       If executeone is the shortcut of `execute` and `fetchone`,
-                #       the expectation should be to return according to DBAPI spec.
-                if use_fetchone_behavior and not values:  # empty list
-                    values = None
-                return values
+        # FIXME (12-Sept-12020) Allows passing through '?' (question mark) parameters.
+        if compiled_cache is not None:
+            conn = conn.execution_options(compiled_cache=compiled_cache)
+        results = conn.execute(operation, params)
+
+        # BBB (12-Sept-12020) Retaining insertion rowid result
+        # FIXME postgresql (12-Sept-12020) This won't work in postgres.
+        #       Maybe see if ResultProxy.inserted_primary_key will work
+        if isinstance(operation, sqlalchemy.sql.selectable.Select):
+            # Avoid compiling selects to a string on every call
+            is_insert = False
+        elif isinstance(operation, sqlalchemy.sql.dml.Insert):
+            is_insert = True
+        else:
+            # cast in case it's an SQLAlchemy object
+            is_insert = 'insert' in str(operation).lower()
+        if is_insert:
+            # BBB (12-Sept-12020) Retaining behavior to unwrap single value rows.
+            return [results.lastrowid]
+        elif not results.returns_rows:
+            return None
+        else:
+            if isinstance(operation, sqlalchemy.sql.selectable.Select):
+                # This code is specifically for handling duplication in colnames
+                # because sqlalchemy removes them.
+                # e.g. select field1, field1, field2 from table;
+                # becomes
+                #      select field1, field2 from table;
+                # so the items in val_list only have 2 values
+                # but the caller isn't expecting it so it causes problems
+                returned_columns = tuple([c.name for c in operation.columns])
+                raw_columns = tuple([c.name for c in operation._raw_columns])
+                if raw_columns != returned_columns:
+                    results_ = []
+                    for r in results:
+                        results_.append(
+                            tuple(r[returned_columns.index(c)] for c in raw_columns)
+                        )
+                    results = results_
+            values = list(
+                [
+                    # BBB (12-Sept-12020) Retaining behavior to unwrap single value rows.
+                    row[0] if not keepwrap and len(row) == 1 else row
+                    for row in results
+                ]
+            )
+            # FIXME (28-Sept-12020) No rows results in an empty list. This behavior does not
+            #       match the resulting expectations of `fetchone`'s DBAPI spec.
+            #       If executeone is the shortcut of `execute` and `fetchone`,
+            #       the expectation should be to return according to DBAPI spec.
+            if use_fetchone_behavior and not values:  # empty list
+                values = None
+            return values
 
     def executemany(
-        self, operation, params_iter, unpack_scalars=True, keepwrap=False, **kwargs
+        self,
+        operation,
+        params_iter,
+        unpack_scalars=True,
+        keepwrap=False,
+        compiled_cache=None,
+        **kwargs,
     ):
         """Executes the given ``operation`` once for each item in ``params_iter``
 
@@ -1751,17 +2437,31 @@ class SQLDatabaseController(object):
                 f"'operation' is a '{type(operation)}'"
             )
 
+        start = time.perf_counter()
         results = []
         with self.connect() as conn:
+            if _is_select(operation):
+                # Reads don't take the writer lock (see create_engine)
+                conn = conn.execution_options(wbia_read_only=True)
             with conn.begin():
                 for params in params_iter:
-                    value = self.executeone(operation, params, keepwrap=keepwrap)
+                    # The statements must run in the transaction of conn
+                    value = self._executeone(
+                        operation,
+                        params,
+                        keepwrap=keepwrap,
+                        compiled_cache=compiled_cache,
+                        conn=conn,
+                    )
                     # Should only be used when the user wants back on value.
                     # Let the error bubble up if used wrong.
                     # Deprecated... Do not depend on the unpacking behavior.
                     if unpack_scalars:
                         value = _unpacker(value)
                     results.append(value)
+        instrumentation.record_sql(
+            self, operation, len(results), time.perf_counter() - start
+        )
         return results
 
     def print_dbg_schema(self):
@@ -2501,6 +3201,9 @@ class SQLDatabaseController(object):
         """
         self._tablenames = None
         self._sa_metadata = sqlalchemy.MetaData()
+        self._stmt_cache.clear()
+        self._compiled_cache.clear()
+        self._upsert_superkeys.clear()
         self.get_table_names()
 
     def get_table_names(self, lazy=False):
@@ -3459,6 +4162,15 @@ class SQLTable(ut.NiceRepr):
             table.name, colnames, id_iter=id_iter, id_colname=id_colname, eager=eager
         )
 
+    def get_columnar(table, colnames, id_iter, id_colname='rowid', assume_unique=False):
+        return table.db.get_columnar(
+            table.name,
+            colnames,
+            id_iter,
+            id_colname=id_colname,
+            assume_unique=assume_unique,
+        )
+
     def _setup_column_methods(table):
         def _make_getter(column):
             def _getter(table, rowids):
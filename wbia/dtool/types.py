@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Mapping of Python types to SQL types"""
 import io
+import struct
 import uuid
 
 import numpy as np
@@ -71,6 +72,119 @@ class JSONCodeableType(UserDefinedType):
         return process
 
 
+#: Prefix of blobs written by :func:`encode_ndarray`
+NDARRAY_MAGIC = b'\x93WBA'
+#: Current version of the :func:`encode_ndarray` header
+NDARRAY_CODEC_VERSION = 1
+# magic, version, order ('C' or 'F'), ndim, len(dtype.str)
+_NDARRAY_HEADER = struct.Struct('<4sBcBB')
+# Prefix of blobs written by ``np.save``
+_NPY_MAGIC = b'\x93NUMPY'
+#: Decode ``np.save`` blobs of object arrays, which unpickles them. Only enable
+#: this for trusted databases.
+ALLOW_PICKLED_NDARRAYS = ut.get_argflag('--allow-pickled-ndarrays')
+
+
+def encode_ndarray(arr):
+    r"""
+    Serializes an array (or numpy scalar) to bytes without pickling.
+
+    The blob is a small fixed header (see ``_NDARRAY_HEADER``) followed by the
+    dtype string, the shape as little-endian uint64s and the raw data buffer.
+    Object and structured arrays are not described by ``dtype.str`` and are
+    written with ``np.save`` instead. Object arrays are pickled by ``np.save``
+    and are only decoded if pickles are allowed (see :func:`decode_ndarray`).
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.types import *  # NOQA
+        >>> from wbia.dtool.types import encode_ndarray, decode_ndarray
+        >>> arr = np.arange(12, dtype=np.float32).reshape(3, 4)
+        >>> blob = encode_ndarray(arr)
+        >>> print(len(blob) - arr.nbytes)
+        27
+        >>> arr2 = decode_ndarray(blob)
+        >>> assert arr2.dtype == arr.dtype and np.all(arr2 == arr)
+        >>> assert np.all(decode_ndarray(encode_ndarray(arr.T)) == arr.T)
+    """
+    arr = np.asarray(arr)
+    if arr.dtype.hasobject or arr.dtype.names is not None:
+        out = io.BytesIO()
+        np.save(out, arr)
+        return out.getvalue()
+    if arr.flags.c_contiguous:
+        order = b'C'
+    elif arr.flags.f_contiguous:
+        order = b'F'
+    else:
+        arr = np.ascontiguousarray(arr)
+        order = b'C'
+    dtype_str = arr.dtype.str.encode('ascii')
+    header = _NDARRAY_HEADER.pack(
+        NDARRAY_MAGIC, NDARRAY_CODEC_VERSION, order, arr.ndim, len(dtype_str)
+    )
+    shape = struct.pack('<%dQ' % (arr.ndim,), *arr.shape)
+    return b''.join([header, dtype_str, shape, arr.tobytes(order='A')])
+
+
+def decode_ndarray(blob, allow_pickle=None):
+    """
+    Inverse of :func:`encode_ndarray`. Blobs written by ``np.save`` (the format
+    used before this codec) are still decoded with ``np.load``.
+
+    The data is copied out of ``blob`` once, so like ``np.load`` the array is
+    writable and callers may modify depcache values in place.
+
+    Args:
+        blob (bytes): encoded array
+        allow_pickle (bool): decode ``np.save`` blobs of object arrays, which
+            runs their pickle code. Defaults to ``ALLOW_PICKLED_NDARRAYS``
+            (the ``--allow-pickled-ndarrays`` flag).
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from wbia.dtool.types import *  # NOQA
+        >>> from wbia.dtool.types import encode_ndarray, decode_ndarray
+        >>> blob = encode_ndarray(np.array([np.arange(3), np.arange(2)], dtype=object))
+        >>> import pytest
+        >>> with pytest.raises(ValueError):
+        >>>     decode_ndarray(blob)
+        >>> print(decode_ndarray(blob, allow_pickle=True)[1])
+        [0 1]
+    """
+    if bytes(blob[0:4]) != NDARRAY_MAGIC:
+        if bytes(blob[0:6]) != _NPY_MAGIC:
+            raise ValueError('Unknown ndarray encoding')
+        if allow_pickle is None:
+            allow_pickle = ALLOW_PICKLED_NDARRAYS
+        out = io.BytesIO(blob)
+        try:
+            arr = np.load(out, allow_pickle=allow_pickle)
+        except ValueError as ex:
+            if allow_pickle or 'allow_pickle' not in str(ex):
+                raise
+            raise ValueError(
+                'The ndarray blob is a pickled object array. Only decode it '
+                'from a trusted database with allow_pickle=True (or the '
+                '--allow-pickled-ndarrays flag).'
+            ) from ex
+        finally:
+            out.close()
+        return arr
+    magic, version, order, ndim, dtype_len = _NDARRAY_HEADER.unpack_from(blob, 0)
+    if version != NDARRAY_CODEC_VERSION:
+        raise ValueError('Unsupported ndarray codec version=%r' % (version,))
+    offset = _NDARRAY_HEADER.size
+    dtype = np.dtype(bytes(blob[offset : offset + dtype_len]).decode('ascii'))
+    offset += dtype_len
+    shape = struct.unpack_from('<%dQ' % (ndim,), blob, offset)
+    offset += 8 * ndim
+    count = int(np.prod(shape, dtype=np.int64))
+    buf = bytearray(memoryview(blob)[offset : offset + count * dtype.itemsize])
+    arr = np.frombuffer(buf, dtype=dtype, count=count)
+    return arr.reshape(shape, order=order.decode('ascii'))
+
+
 class NumPyPicklableType(UserDefinedType):
 
     # Abstract properties
@@ -88,10 +202,7 @@ class NumPyPicklableType(UserDefinedType):
                 return value
             else:
                 if isinstance(value, self.base_py_types):
-                    out = io.BytesIO()
-                    np.save(out, value)
-                    out.seek(0)
-                    return out.read()
+                    return encode_ndarray(value)
                 else:
                     return value
 
@@ -103,11 +214,7 @@ class NumPyPicklableType(UserDefinedType):
                 return value
             else:
                 if not isinstance(value, self.base_py_types):
-                    out = io.BytesIO(value)
-                    out.seek(0)
-                    arr = np.load(out, allow_pickle=True)
-                    out.close()
-                    return arr
+                    return decode_ndarray(value)
                 else:
                     return value
 
@@ -1336,22 +1336,22 @@ def filter_annots_independent(
         # avail_aids = sorted(avail_aids)
 
     if aidcfg.get('is_exemplar') is not None:
-        flags = ibs.get_annot_exemplar_flags(avail_aids)
-        is_valid = [flag == aidcfg['is_exemplar'] for flag in flags]
+        flags = ibs.get_annot_columnar(avail_aids, ('annot_exemplar_flag',))[0]
+        is_valid = (flags == aidcfg['is_exemplar']).filled(False)
         with VerbosityContext('is_exemplar'):
             avail_aids = ut.compress(avail_aids, is_valid)
         # avail_aids = sorted(avail_aids)
 
     if aidcfg.get('reviewed') is not None:
-        flags = ibs.get_annot_reviewed(avail_aids)
-        is_valid = [flag == aidcfg['reviewed'] for flag in flags]
+        flags = ibs.get_annot_columnar(avail_aids, ('annot_toggle_reviewed',))[0]
+        is_valid = (flags == aidcfg['reviewed']).filled(False)
         with VerbosityContext('reviewed'):
             avail_aids = ut.compress(avail_aids, is_valid)
         # avail_aids = sorted(avail_aids)
 
     if aidcfg.get('multiple') is not None:
-        flags = ibs.get_annot_multiple(avail_aids)
-        is_valid = [flag == aidcfg['multiple'] for flag in flags]
+        flags = ibs.get_annot_columnar(avail_aids, ('annot_toggle_multiple',))[0]
+        is_valid = (flags.astype(bool) == aidcfg['multiple']).filled(False)
         with VerbosityContext('multiple'):
             avail_aids = ut.compress(avail_aids, is_valid)
         # avail_aids = sorted(avail_aids)
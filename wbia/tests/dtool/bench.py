@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks for the SQL controller and the dependency cache"""
+import logging
+import timeit
+
+import utool as ut
+
+(print, rrr, profile) = ut.inject2(__name__)
+logger = logging.getLogger('wbia')
+
+
+def _make_bench_ctrlr(num_rows=10000, uri='sqlite:///:memory:', **kwargs):
+    from wbia.dtool.sql_control import SQLDatabaseController
+
+    db = SQLDatabaseController(uri, 'bench', **kwargs)
+    db.add_table(
+        'annotations',
+        [
+            ('annot_rowid', 'INTEGER PRIMARY KEY'),
+            ('annot_uuid', 'UUID NOT NULL'),
+            ('image_rowid', 'INTEGER NOT NULL'),
+            ('annot_xtl', 'INTEGER'),
+            ('annot_ytl', 'INTEGER'),
+            ('annot_width', 'INTEGER'),
+            ('annot_height', 'INTEGER'),
+            ('annot_theta', 'REAL DEFAULT 0.0'),
+        ],
+        superkeys=[('annot_uuid',)],
+        docstr='benchmark table',
+    )
+    import uuid
+
+    insert_stmt = db._reflect_table('annotations').insert()
+    params = [
+        {
+            'annot_uuid': uuid.uuid4(),
+            'image_rowid': i // 3,
+            'annot_xtl': i,
+            'annot_ytl': i,
+            'annot_width': 10,
+            'annot_height': 10,
+            'annot_theta': 0.0,
+        }
+        for i in range(num_rows)
+    ]
+    with db.connect() as conn:
+        conn.execute(insert_stmt, params)
+    return db
+
+
+def benchmark_getter_stmt_cache(num_rows=10000, num_ids=10, number=2000):
+    r"""
+    Compares the latency of small ``db.get`` calls with a cold statement
+    cache (the behavior before statements were cached) against a warm one.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_getter_stmt_cache()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_getter_stmt_cache()
+        >>> print(ut.repr4(result))
+    """
+    db = _make_bench_ctrlr(num_rows)
+    aids = list(range(1, num_ids + 1))
+    colnames = ('annot_xtl', 'annot_ytl', 'annot_width', 'annot_height')
+
+    def cold_get():
+        db._stmt_cache.clear()
+        db._compiled_cache.clear()
+        db.get('annotations', colnames, aids)
+
+    def warm_get():
+        db.get('annotations', colnames, aids)
+
+    def cold_get_gids():
+        db._stmt_cache.clear()
+        db._compiled_cache.clear()
+        db.get('annotations', ('image_rowid',), aids)
+
+    def warm_get_gids():
+        db.get('annotations', ('image_rowid',), aids)
+
+    result = ut.odict()
+    for key, func in [
+        ('bbox_cold', cold_get),
+        ('bbox_warm', warm_get),
+        ('gids_cold', cold_get_gids),
+        ('gids_warm', warm_get_gids),
+    ]:
+        total = timeit.timeit(func, number=number)
+        result[key + '_usec'] = 1e6 * total / number
+    result['speedup_bbox'] = result['bbox_cold_usec'] / result['bbox_warm_usec']
+    result['speedup_gids'] = result['gids_cold_usec'] / result['gids_warm_usec']
+    result['cache_info'] = db.get_stmt_cache_info()
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_columnar_get(num_rows=100000, number=3):
+    r"""
+    Compares reading annotation bboxes, thetas and gids for every row through
+    ``db.get`` against ``db.get_columnar``.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_columnar_get()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_columnar_get()
+        >>> print(ut.repr4(result))
+    """
+    db = _make_bench_ctrlr(num_rows)
+    aids = list(range(1, num_rows + 1))
+    colnames = (
+        'annot_xtl',
+        'annot_ytl',
+        'annot_width',
+        'annot_height',
+        'annot_theta',
+        'image_rowid',
+    )
+
+    def rowwise_get():
+        db.get('annotations', colnames, aids)
+
+    def columnar_get():
+        db.get_columnar('annotations', colnames, aids)
+
+    result = ut.odict()
+    result['rowwise_sec'] = timeit.timeit(rowwise_get, number=number) / number
+    result['columnar_sec'] = timeit.timeit(columnar_get, number=number) / number
+    result['speedup'] = result['rowwise_sec'] / result['columnar_sec']
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_get_strategies(num_rows=1000000, num_ids=500000, number=1):
+    r"""
+    Compares the batched ``IN (...)`` getter strategy against the temporary
+    table join strategy for a large list of ids.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_get_strategies()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_get_strategies(num_rows=200000, num_ids=100000)
+        >>> print(ut.repr4(result))
+    """
+    import numpy as np
+
+    db = _make_bench_ctrlr(num_rows)
+    rng = np.random.RandomState(0)
+    aids = rng.randint(1, num_rows + 1, size=num_ids).tolist()
+    colnames = ('image_rowid', 'annot_theta')
+    superkeys = [
+        (uuid_,) for uuid_ in db.get('annotations', ('annot_uuid',), aids[:num_ids])
+    ]
+
+    def batched_get():
+        return db.get('annotations', colnames, aids, temp_table_threshold=None)
+
+    def joined_get():
+        return db.get('annotations', colnames, aids, temp_table_threshold=1)
+
+    def batched_get_where_eq():
+        return db.get_where_eq(
+            'annotations',
+            colnames,
+            superkeys,
+            ('annot_uuid',),
+            temp_table_threshold=None,
+        )
+
+    def joined_get_where_eq():
+        return db.get_where_eq(
+            'annotations', colnames, superkeys, ('annot_uuid',), temp_table_threshold=1
+        )
+
+    assert batched_get() == joined_get()
+    result = ut.odict()
+    for key, func in [
+        ('get_batched', batched_get),
+        ('get_temp_table', joined_get),
+        ('get_where_eq_batched', batched_get_where_eq),
+        ('get_where_eq_temp_table', joined_get_where_eq),
+    ]:
+        result[key + '_sec'] = timeit.timeit(func, number=number) / number
+    result['speedup_get'] = result['get_batched_sec'] / result['get_temp_table_sec']
+    result['speedup_get_where_eq'] = (
+        result['get_where_eq_batched_sec'] / result['get_where_eq_temp_table_sec']
+    )
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_ndarray_codec(num_rows=2000, num_feats=1000, number=3):
+    r"""
+    Compares loading ``feat``-like rows (kpts and vecs) stored as ``np.save``
+    blobs against rows stored with ``dtool.types.encode_ndarray``.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_ndarray_codec()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_ndarray_codec()
+        >>> print(ut.repr4(result))
+    """
+    import io
+    import numpy as np
+    from wbia.dtool.sql_control import SQLDatabaseController
+    from wbia.dtool.types import encode_ndarray
+
+    def npsave_encode(arr):
+        out = io.BytesIO()
+        np.save(out, arr)
+        return out.getvalue()
+
+    rng = np.random.RandomState(0)
+    kpts_list = [rng.rand(num_feats, 6).astype(np.float32) for _ in range(num_rows)]
+    vecs_list = [
+        rng.randint(0, 255, (num_feats, 128)).astype(np.uint8) for _ in range(num_rows)
+    ]
+
+    db = SQLDatabaseController('sqlite:///:memory:', 'bench')
+    result = ut.odict()
+    for codec, encode in [('npsave', npsave_encode), ('raw', encode_ndarray)]:
+        tablename = 'feat_' + codec
+        db.add_table(
+            tablename,
+            [
+                ('feature_rowid', 'INTEGER PRIMARY KEY'),
+                ('feature_kpts', 'NDARRAY'),
+                ('feature_vecs', 'NDARRAY'),
+            ],
+            docstr='benchmark table',
+        )
+        insert_stmt = db._reflect_table(tablename).insert()
+        # Encoded bytes are passed through the NDArray bind processor as is
+        params = [
+            {'feature_kpts': encode(kpts), 'feature_vecs': encode(vecs)}
+            for kpts, vecs in zip(kpts_list, vecs_list)
+        ]
+        with db.connect() as conn:
+            conn.execute(insert_stmt, params)
+
+        rowids = list(range(1, num_rows + 1))
+        colnames = ('feature_kpts', 'feature_vecs')
+
+        def load():
+            return db.get(tablename, colnames, rowids)
+
+        loaded = load()
+        assert all(np.all(vecs == row[1]) for vecs, row in zip(vecs_list, loaded))
+        result[codec + '_load_sec'] = timeit.timeit(load, number=number) / number
+        encode_all = ut.partial(ut.lmap, encode, vecs_list)
+        result[codec + '_encode_sec'] = timeit.timeit(encode_all, number=number) / number
+    result['speedup_load'] = result['npsave_load_sec'] / result['raw_load_sec']
+    result['speedup_encode'] = result['npsave_encode_sec'] / result['raw_encode_sec']
+    logger.info(ut.repr4(result))
+    return result
+
+
+def benchmark_add_cleanly(num_rows=100000, number=1):
+    r"""
+    Compares ``add_cleanly`` with the getter / insert / getter path against
+    the ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` path, for tables
+    shaped like the ``images`` and ``annotations`` tables used by
+    ``add_images`` and ``add_annots``. Each case adds ``num_rows`` new rows
+    and then re-adds them mixed with as many new ones.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_add_cleanly()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_add_cleanly()
+        >>> print(ut.repr4(result))
+    """
+    import uuid
+    from wbia.dtool.sql_control import SQLDatabaseController
+
+    tables = {
+        'images': [
+            ('image_rowid', 'INTEGER PRIMARY KEY'),
+            ('image_uuid', 'UUID NOT NULL'),
+            ('image_uri', 'TEXT NOT NULL'),
+            ('image_ext', 'TEXT NOT NULL'),
+            ('image_width', 'INTEGER DEFAULT -1'),
+            ('image_height', 'INTEGER DEFAULT -1'),
+        ],
+        'annotations': [
+            ('annot_rowid', 'INTEGER PRIMARY KEY'),
+            ('annot_uuid', 'UUID NOT NULL'),
+            ('image_rowid', 'INTEGER NOT NULL'),
+            ('annot_xtl', 'INTEGER NOT NULL'),
+            ('annot_ytl', 'INTEGER NOT NULL'),
+            ('annot_width', 'INTEGER NOT NULL'),
+            ('annot_height', 'INTEGER NOT NULL'),
+            ('annot_theta', 'REAL DEFAULT 0.0'),
+        ],
+    }
+
+    def make_params(tablename, num):
+        if tablename == 'images':
+            return [
+                (uuid.uuid4(), 'img_%d.jpg' % (i,), '.jpg', 640, 480) for i in range(num)
+            ]
+        return [(uuid.uuid4(), i // 3, i, i, 10, 10, 0.0) for i in range(num)]
+
+    result = ut.odict()
+    for tablename, coldef_list in tables.items():
+        first_params = make_params(tablename, num_rows)
+        second_params = first_params + make_params(tablename, num_rows)
+        for use_upsert in [False, True]:
+            key = '%s_%s' % (tablename, 'upsert' if use_upsert else 'getter')
+            times = {'new_sec': 0.0, 'mixed_sec': 0.0}
+            for _ in range(number):
+                db = SQLDatabaseController('sqlite:///:memory:', 'bench')
+                db.add_table(
+                    tablename,
+                    coldef_list,
+                    superkeys=[(coldef_list[1][0],)],
+                    docstr='benchmark table',
+                )
+                db.use_upsert = use_upsert
+                colnames = [name for name, _ in coldef_list[1:]]
+                superkey_colnames = (colnames[0],)
+
+                def get_rowid_from_superkey(uuids):
+                    return db.get_where_eq(
+                        tablename, (coldef_list[0][0],), zip(uuids), superkey_colnames
+                    )
+
+                for case, params in [
+                    ('new_sec', first_params),
+                    ('mixed_sec', second_params),
+                ]:
+                    start = timeit.default_timer()
+                    rowids = db.add_cleanly(
+                        tablename, colnames, params, get_rowid_from_superkey
+                    )
+                    times[case] += timeit.default_timer() - start
+                assert rowids == list(range(1, 2 * num_rows + 1))
+            for case, total in times.items():
+                result[key + '_' + case] = total / number
+        for case in ['new_sec', 'mixed_sec']:
+            result['%s_speedup_%s' % (tablename, case[:-4])] = (
+                result['%s_getter_%s' % (tablename, case)]
+                / result['%s_upsert_%s' % (tablename, case)]
+            )
+    logger.info(ut.repr4(result))
+    return result
+
+
+def _sql_stress_worker(uri, wal, kind, seed, duration, read_size=50):
+    """Runs reads or writes against ``uri`` for ``duration`` seconds"""
+    import uuid
+    import numpy as np
+    from wbia.dtool.sql_control import SQLDatabaseController
+
+    db = SQLDatabaseController(uri, 'bench', wal=wal)
+    num_rows = db.get_row_count('annotations')
+    colnames = (
+        'annot_uuid',
+        'image_rowid',
+        'annot_xtl',
+        'annot_ytl',
+        'annot_width',
+        'annot_height',
+        'annot_theta',
+    )
+    rng = np.random.RandomState(seed)
+    latencies = []
+    errors = []
+    end_time = timeit.default_timer() + duration
+    while timeit.default_timer() < end_time:
+        start = timeit.default_timer()
+        try:
+            if kind == 'read':
+                ids = rng.randint(1, num_rows + 1, size=read_size).tolist()
+                db.get('annotations', ('image_rowid', 'annot_theta'), ids)
+            else:
+                params = [(uuid.uuid4(), seed, 0, 0, 1, 1, 0.0) for _ in range(10)]
+                db._add('annotations', colnames, params)
+        except Exception as ex:
+            errors.append(repr(ex))
+        latencies.append(timeit.default_timer() - start)
+    return kind, latencies, errors
+
+
+def _run_sql_stress(uri, wal, num_readers, num_writers, duration):
+    """
+    Runs reader processes (``db.get`` of random ids) and writer processes
+    (``db._add`` of a few rows in one transaction) against the same database
+    in parallel and returns their throughput and latency percentiles.
+    """
+    import concurrent.futures
+    import numpy as np
+
+    kinds = ['read'] * num_readers + ['write'] * num_writers
+    with concurrent.futures.ProcessPoolExecutor(len(kinds)) as pool:
+        futures = [
+            pool.submit(_sql_stress_worker, uri, wal, kind, seed, duration)
+            for seed, kind in enumerate(kinds)
+        ]
+        outputs = [future.result() for future in futures]
+
+    result = ut.odict()
+    errors = []
+    for kind in ['read', 'write']:
+        times = [t for kind_, ts, _ in outputs if kind_ == kind for t in ts]
+        errors += [e for kind_, _, es in outputs if kind_ == kind for e in es]
+        times = np.array(times) * 1000
+        result[kind + '_ops_per_sec'] = len(times) / duration
+        if len(times):
+            result[kind + '_p50_ms'] = float(np.percentile(times, 50))
+            result[kind + '_p99_ms'] = float(np.percentile(times, 99))
+    result['num_errors'] = len(errors)
+    if errors:
+        result['first_error'] = errors[0]
+    return result
+
+
+def benchmark_concurrent_access(
+    num_rows=100000, num_readers=8, num_writers=2, duration=5.0
+):
+    r"""
+    Stress test of a file backed SQLite database with parallel reader and
+    writer processes (like the web server and job engine), in the default
+    rollback journal mode and in WAL mode. Reports the throughput and p50/p99
+    latency of reads and writes.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_concurrent_access()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_concurrent_access(duration=2.0)
+        >>> print(ut.repr4(result))
+    """
+    import tempfile
+    from os.path import join
+
+    result = ut.odict()
+    for wal in [False, True]:
+        dpath = tempfile.mkdtemp()
+        uri = 'sqlite:///' + join(dpath, 'bench.sqlite3')
+        db = _make_bench_ctrlr(num_rows, uri=uri, wal=wal)
+        mode = 'wal' if wal else 'default'
+        del db
+        result[mode] = _run_sql_stress(uri, wal, num_readers, num_writers, duration)
+        ut.delete(dpath, verbose=False)
+    logger.info(ut.repr4(result))
+    return result
+
+
+def _make_bench_depc(dpath):
+    import numpy as np
+
+    from wbia import dtool
+    from wbia.dtool.example_depcache import DummyController
+
+    root = 'annotations'
+    depc = dtool.DependencyCache(
+        DummyController(dpath),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+
+    @depc.register_preproc(
+        tablename='chips',
+        parents=[root],
+        colnames=['chip'],
+        coltypes=[np.ndarray],
+        configclass={'dim_size': 700, 'resize_dim': 'width'},
+    )
+    def compute_chip(depc, aids, config=None):
+        for aid in aids:
+            yield (np.full((8, 8), aid % 256, dtype=np.uint8),)
+
+    @depc.register_preproc(
+        tablename='feat',
+        parents=['chips'],
+        colnames=['num_feats', 'kpts', 'vecs'],
+        coltypes=[int, np.ndarray, np.ndarray],
+        configclass={'n_orient': 1, 'scale_max': 40.0},
+    )
+    def compute_feats(depc, cids, config=None):
+        for cid in cids:
+            yield 4, np.zeros((4, 6), np.float32), np.zeros((4, 128), np.uint8)
+
+    @depc.register_preproc(
+        tablename='featweight',
+        parents=['feat'],
+        colnames=['fwg'],
+        coltypes=[np.ndarray],
+        configclass={'fw_detector': 'cnn'},
+    )
+    def compute_fgweights(depc, fids, config=None):
+        for fid in fids:
+            yield (np.ones(4, np.float32),)
+
+    depc.initialize()
+    return depc
+
+
+def benchmark_resolution_plan(num_annots=1000, number=2000):
+    r"""
+    Latency of single rowid gets through the chips -> feat -> featweight
+    chain with and without memoized resolution plans in
+    DependencyCache.get_parent_rowids. All rows are computed up front so only
+    the rowid resolution and the final property read are timed.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_resolution_plan()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_resolution_plan(number=200)
+        >>> print(ut.repr4(result))
+    """
+    import tempfile
+
+    dpath = tempfile.mkdtemp()
+    depc = _make_bench_depc(dpath)
+    aids = list(range(1, num_annots + 1))
+    config = {'fw_detector': 'cnn', 'n_orient': 1}
+    depc.get('featweight', aids, 'fwg', config=config)
+
+    result = ut.odict()
+    for use_plans in [False, True]:
+        depc.use_resolution_plans = use_plans
+        timer_iter = iter(range(number))
+
+        def single_get():
+            aid = aids[next(timer_iter) % num_annots]
+            depc.get('featweight', [aid], 'fwg', config=config)
+
+        latencies = timeit.repeat(single_get, number=1, repeat=number)
+        latencies = sorted(latencies)
+        result['plans' if use_plans else 'no_plans'] = ut.odict(
+            [
+                ('mean_ms', 1e3 * sum(latencies) / number),
+                ('p50_ms', 1e3 * latencies[number // 2]),
+                ('p99_ms', 1e3 * latencies[int(number * 0.99)]),
+            ]
+        )
+    result['speedup'] = result['no_plans']['mean_ms'] / result['plans']['mean_ms']
+    ut.delete(dpath, verbose=False)
+    logger.info(ut.repr4(result))
+    return result
+
+
+def _make_deep_bench_depc(dpath, depth):
+    import string
+
+    from wbia import dtool
+    from wbia.dtool.example_depcache import DummyController
+    from wbia.dtool.example_depcache2 import depc_34_helper
+
+    depc = dtool.DependencyCache(
+        DummyController(dpath),
+        'annot',
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        use_globals=False,
+    )
+    register_dummy_config = depc_34_helper(depc)
+    parent = 'annot'
+    for level in range(depth):
+        # Table names cannot contain numbers
+        tablename = 'level_' + string.ascii_lowercase[level]
+        register_dummy_config(tablename=tablename, parents=[parent])
+        parent = tablename
+    depc.initialize()
+    return depc
+
+
+def benchmark_delete_root(num_annots=2000, num_deleted=1000, depth=8, number=3):
+    r"""
+    Time of DependencyCache.delete_root on a chain of ``depth`` tables built
+    with the ``example_depcache2`` helpers, compared to deleting through the
+    cascading ``delete_rows`` of every table, which revisits the descendants
+    of each deleted row once per ancestor.
+
+    CommandLine:
+        python -c "from wbia.tests.dtool.bench import *; benchmark_delete_root()"
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from wbia.tests.dtool.bench import *  # NOQA
+        >>> result = benchmark_delete_root(num_annots=200, num_deleted=100)
+        >>> print(ut.repr4(result))
+    """
+    import string
+    import tempfile
+
+    aids = list(range(1, num_annots + 1))
+    deleted_aids = aids[:num_deleted]
+    leaf = 'level_' + string.ascii_lowercase[depth - 1]
+
+    def cascading_delete(depc):
+        rowid_dict = depc.get_allconfig_descendant_rowids(deleted_aids)
+        return sum(
+            depc[tablename].delete_rows(rowids)
+            for tablename, rowids in rowid_dict.items()
+            if tablename != depc.root
+        )
+
+    def planned_delete(depc):
+        return depc.delete_root(deleted_aids)
+
+    result = ut.odict()
+    delete_funcs = [('cascading', cascading_delete), ('planned', planned_delete)]
+    for key, delete_func in delete_funcs:
+        times = []
+        for _ in range(number):
+            dpath = tempfile.mkdtemp()
+            depc = _make_deep_bench_depc(dpath, depth)
+            depc.get_rowids(leaf, aids)
+            start = timeit.default_timer()
+            num_rows = delete_func(depc)
+            times.append(timeit.default_timer() - start)
+            assert len(depc[leaf]._get_all_rowids()) == num_annots - num_deleted
+            ut.delete(dpath, verbose=False)
+        result[key] = ut.odict([('num_rows', num_rows), ('best_sec', min(times))])
+    result['speedup'] = result['cascading']['best_sec'] / result['planned']['best_sec']
+    logger.info(ut.repr4(result))
+    return result
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import re
+import struct
+import threading
+import uuid
+
+import numpy as np
+import pytest
+
+from wbia.dtool.copy_sqlite_to_postgres import (
+    PGCOPY_HEADER,
+    PGCOPY_TRAILER,
+    ChecksumMismatchError,
+    copy_sqlite_database,
+    get_sqlite_table_specs,
+    run_in_dependency_order,
+)
+from wbia.dtool.sql_control import SQLDatabaseController
+from wbia.dtool.types import decode_ndarray
+
+
+def _split_tuples(data):
+    """Splits binary COPY tuples into their fields (None for NULL)"""
+    offset = 0
+    while offset < len(data):
+        (num_fields,) = struct.unpack_from('!h', data, offset)
+        offset += 2
+        if num_fields == -1:
+            break
+        fields = []
+        for _ in range(num_fields):
+            (size,) = struct.unpack_from('!i', data, offset)
+            offset += 4
+            if size == -1:
+                fields.append(None)
+            else:
+                fields.append(data[offset : offset + size])
+                offset += size
+        yield fields
+
+
+class PostgresStandIn:
+    """
+    In memory stand-in of the part of a postgres server (and of a psycopg2
+    connection) used by the migration: statements are recorded and binary
+    COPY payloads are kept as raw tuples keyed by table and rowid.
+    """
+
+    def __init__(self, corrupt_rowid=None):
+        self.statements = []
+        self.tables = {}
+        self.corrupt_rowid = corrupt_rowid
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return _StandInConnection(self)
+
+
+class _StandInConnection:
+    def __init__(self, server):
+        self.server = server
+
+    def cursor(self):
+        return _StandInCursor(self.server)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _StandInCursor:
+    def __init__(self, server):
+        self.server = server
+        self._result = None
+
+    def execute(self, sql):
+        with self.server.lock:
+            self.server.statements.append(sql)
+            match = re.match(r'CREATE TABLE ("\w+"\."\w+")', sql)
+            if match:
+                self.server.tables[match.group(1)] = {}
+            match = re.match(r'SELECT count\(\*\) FROM ("\w+"\."\w+")', sql)
+            if match:
+                self._result = (len(self.server.tables[match.group(1)]),)
+
+    def fetchone(self):
+        return self._result
+
+    def copy_expert(self, sql, file, size=8192):
+        table = re.search(r'("\w+"\."\w+")', sql).group(1)
+        rows = self.server.tables[table]
+        if 'FROM STDIN' in sql:
+            parts = []
+            while True:
+                data = file.read(size)
+                if not data:
+                    break
+                parts.append(data)
+            data = b''.join(parts)
+            assert data.startswith(PGCOPY_HEADER)
+            assert data.endswith(PGCOPY_TRAILER)
+            for fields in _split_tuples(data[len(PGCOPY_HEADER) :]):
+                (rowid,) = struct.unpack('!q', fields[0])
+                if rowid == self.server.corrupt_rowid:
+                    fields[-1] = b'?' + fields[-1][1:]
+                rows[rowid] = fields
+        else:
+            first, last = map(int, re.search(r'BETWEEN (\d+) AND (\d+)', sql).groups())
+            file.write(PGCOPY_HEADER[:5])
+            file.write(PGCOPY_HEADER[5:])
+            for rowid in sorted(rows):
+                if first <= rowid <= last:
+                    fields = rows[rowid]
+                    data = [struct.pack('!h', len(fields))]
+                    for field in fields:
+                        if field is None:
+                            data.append(struct.pack('!i', -1))
+                        else:
+                            data.append(struct.pack('!i', len(field)) + field)
+                    # Split the writes to exercise the digest sink
+                    data = b''.join(data)
+                    assert file.write(data[:3]) == 3
+                    assert file.write(data[3:]) == len(data) - 3
+            file.write(PGCOPY_TRAILER)
+
+
+@pytest.fixture
+def sqlite_uri(tmp_path):
+    uri = f'sqlite:///{tmp_path / "_ibeis_database.sqlite3"}'
+    db = SQLDatabaseController(uri, 'testing')
+    db.add_table(
+        'images',
+        [
+            ('image_rowid', 'INTEGER PRIMARY KEY'),
+            ('image_uuid', 'UUID NOT NULL'),
+            ('image_note', 'TEXT'),
+        ],
+        superkeys=[('image_uuid',)],
+    )
+    db.add_table(
+        'annotations',
+        [
+            ('annot_rowid', 'INTEGER PRIMARY KEY'),
+            ('image_rowid', 'INTEGER NOT NULL'),
+            ('annot_theta', 'REAL DEFAULT 0.0'),
+            ('annot_vecs', 'NDARRAY'),
+            ('annot_info', 'DICT'),
+        ],
+        dependsmap={'image_rowid': ('images', ('image_rowid',), ('image_uuid',))},
+    )
+    with db.connect() as conn:
+        conn.execute(
+            db._reflect_table('images').insert(),
+            [
+                {'image_uuid': uuid.UUID(int=i), 'image_note': f'note {i}'}
+                for i in range(1, 31)
+            ],
+        )
+        conn.execute(
+            db._reflect_table('annotations').insert(),
+            [
+                {
+                    'image_rowid': 1 + i // 2,
+                    'annot_theta': i / 3,
+                    'annot_vecs': np.full((2, 3), i, dtype=np.uint8),
+                    'annot_info': {'i': i},
+                }
+                for i in range(50)
+            ],
+        )
+        # sqlite does not enforce column types
+        conn.execute('UPDATE annotations SET image_rowid = 2.7 WHERE rowid = 50')
+    return uri
+
+
+def test_table_specs(sqlite_uri):
+    specs = {spec.name: spec for spec in get_sqlite_table_specs(sqlite_uri)}
+    assert set(specs) == {'metadata', 'images', 'annotations'}
+    annots = specs['annotations']
+    assert annots.dependencies == {'images'}
+    assert annots.primary_key == ['annot_rowid']
+    assert [column.pg_type for column in annots.columns] == [
+        'BIGINT',
+        'BIGINT',
+        'DOUBLE PRECISION',
+        'ndarray',
+        'dict',
+    ]
+    assert specs['images'].unique_constraints == [['image_uuid']]
+    order = [spec.name for spec, _, _ in run_in_dependency_order(str, specs.values())]
+    assert order.index('images') < order.index('annotations')
+
+
+def test_copy_sqlite_database(sqlite_uri):
+    server = PostgresStandIn()
+    table_chunks = copy_sqlite_database(
+        sqlite_uri, server.connect, 'main', chunk_size=7, num_workers=2
+    )
+    assert [chunk.num_rows for chunk in table_chunks['annotations']] == [7] * 7 + [1]
+    assert table_chunks['annotations'][-1].last_rowid == 50
+
+    annots = server.tables['"main"."annotations"']
+    assert sorted(annots) == list(range(1, 51))
+    rowid, annot_rowid, image_rowid, theta, vecs, info = annots[5]
+    assert struct.unpack('!q', image_rowid) == (3,)
+    assert struct.unpack('!d', theta) == (4 / 3,)
+    assert (decode_ndarray(vecs) == 4).all()
+    assert info == b'{"i": 4}'
+    assert struct.unpack('!q', annots[50][2]) == (2,)
+    images = server.tables['"main"."images"']
+    assert images[3][2] == uuid.UUID(int=3).bytes
+
+    statements = '\n'.join(server.statements)
+    assert 'CREATE TABLE "main"."annotations" (rowid BIGINT NOT NULL, ' in statements
+    assert '"annot_theta" DOUBLE PRECISION DEFAULT 0.0' in statements
+    assert 'ADD CONSTRAINT "unique_images_image_uuid" UNIQUE ("image_uuid")' in statements
+    assert 'ALTER TABLE "main"."images" ADD PRIMARY KEY ("image_rowid")' in statements
+
+
+def test_checksum_mismatch(sqlite_uri):
+    server = PostgresStandIn(corrupt_rowid=12)
+    with pytest.raises(ChecksumMismatchError):
+        copy_sqlite_database(sqlite_uri, server.connect, 'main', chunk_size=5)
+    # Without verification the corruption goes unnoticed
+    server = PostgresStandIn(corrupt_rowid=12)
+    copy_sqlite_database(sqlite_uri, server.connect, 'main', verify=False)
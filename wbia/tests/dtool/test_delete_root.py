@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from os.path import exists
+
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool.example_depcache import DummyController
+from wbia.dtool.example_depcache2 import depc_34_helper
+
+
+@pytest.fixture
+def depc(tmp_path):
+    root = 'dummy_annot'
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+
+    @depc.register_preproc(
+        tablename='chip',
+        parents=[root],
+        colnames=['chip'],
+        coltypes=[('extern', np.load, np.save, '.npy')],
+        configclass={'dim': 2},
+    )
+    def compute_chip(depc, rowids, config=None):
+        for rowid in rowids:
+            yield (np.full((rowid, config['dim']), rowid),)
+
+    @depc.register_preproc(
+        tablename='feat', parents=['chip'], colnames=['num'], coltypes=[int]
+    )
+    def compute_feat(depc, chip_rowids, config=None):
+        for chip_rowid in chip_rowids:
+            yield (chip_rowid,)
+
+    @depc.register_preproc(
+        tablename='label', parents=[root], colnames=['label'], coltypes=[str]
+    )
+    def compute_label(depc, rowids, config=None):
+        for rowid in rowids:
+            yield ('label%d' % (rowid,),)
+
+    depc.initialize()
+    return depc
+
+
+def _num_rows(depc, tablename):
+    return depc[tablename].db.get_row_count(depc[tablename].tablename)
+
+
+def test_delete_root_cascades(depc):
+    aids = [1, 2, 3, 4]
+    for dim in [2, 3]:
+        depc.get_rowids('feat', aids, config={'dim': dim})
+    depc.get_rowids('label', aids)
+    fpaths = depc.get('chip', aids, 'chip', config={'dim': 2}, read_extern=False)
+    assert all(exists(fpath) for fpath in fpaths)
+
+    plan = depc.get_delete_plan([1, 2])
+    assert list(plan.keys()).index('chip') < list(plan.keys()).index('feat')
+    assert ut.map_vals(len, plan) == {'chip': 4, 'feat': 4, 'label': 2}
+
+    num_deleted = depc.delete_root([1, 2], delete_extern=True)
+    assert num_deleted == 10
+    assert _num_rows(depc, 'chip') == 4
+    assert _num_rows(depc, 'feat') == 4
+    assert _num_rows(depc, 'label') == 2
+    assert [exists(fpath) for fpath in fpaths] == [False, False, True, True]
+    # The deleted rows are recomputed on demand
+    assert depc.get('feat', aids, 'num', config={'dim': 2}) == depc.get_rowids(
+        'chip', aids, config={'dim': 2}
+    )
+    assert depc.delete_root([]) == 0
+
+
+def test_delete_root_filters(depc):
+    aids = [1, 2, 3]
+    for dim in [2, 3]:
+        depc.get_rowids('feat', aids, config={'dim': dim})
+    depc.get_rowids('label', aids)
+
+    depc.register_delete_table_exclusion('label', 'name')
+    plan = depc.get_delete_plan(aids, table_config_filter={'chip': {'dim': 3}})
+    assert ut.map_vals(len, plan) == {'chip': 3, 'feat': 3, 'label': 3}
+    plan = depc.get_delete_plan(aids, prop='name')
+    assert ut.map_vals(len, plan) == {'chip': 6, 'feat': 6, 'label': 0}
+
+    depc.delete_root(aids, table_config_filter={'chip': {'dim': 3}}, prop='name')
+    assert _num_rows(depc, 'chip') == 3
+    assert _num_rows(depc, 'feat') == 3
+    assert _num_rows(depc, 'label') == 3
+
+
+def test_delete_plan_multiple_parents(tmp_path):
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        'annot',
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        use_globals=False,
+    )
+    register_dummy_config = depc_34_helper(depc)
+    register_dummy_config(tablename='labeler', parents=['annot'])
+    register_dummy_config(tablename='meta_labeler', parents=['labeler'])
+    register_dummy_config(tablename='vsone', parents=['annot', 'annot'])
+    register_dummy_config(tablename='pair', parents=['meta_labeler', 'labeler'])
+    depc.initialize()
+
+    depc.get_rowids('vsone', ([1, 2, 3], [3, 1, 4]))
+    depc.get_rowids('pair', [1, 2, 3])
+
+    plan = depc.get_delete_plan([1])
+    assert ut.map_vals(len, plan) == {
+        'labeler': 1,
+        'meta_labeler': 1,
+        'vsone': 2,
+        'pair': 1,
+    }
+    assert depc.delete_root([1]) == 5
+    assert len(depc['vsone']._get_all_rowids()) == 1
+
+
+def test_sql_delete_in_batches(depc):
+    aids = list(range(1, 26))
+    rowids = depc.get_rowids('label', aids)
+    db = depc['label'].db
+    db.delete('label', rowids[:20] + [None], batch_size=7)
+    assert db.get_all_rowids('label') == rowids[20:]
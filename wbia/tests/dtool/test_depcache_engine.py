@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool.example_depcache import DummyController
+
+
+class EngineConfig(dtool.Config):
+    _param_info_list = [ut.ParamInfo('scale', 2)]
+
+
+def compute_row(depc, rowid, config=None):
+    """A non-vectorized preproc function that can be run in a process pool"""
+    return rowid * config['scale'], np.full(rowid % 4, rowid, dtype=np.int32)
+
+
+def compute_rows(depc, rowids, config=None):
+    for rowid in rowids:
+        yield compute_row(depc, rowid, config)
+
+
+def make_depc(cache_dpath, engine, vectorized):
+    root = 'dummy_annot'
+    depc = dtool.DependencyCache(
+        DummyController(cache_dpath),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+    depc.register_preproc(
+        tablename='spam',
+        parents=[root],
+        colnames=['num', 'arr'],
+        coltypes=[int, np.ndarray],
+        configclass=EngineConfig,
+        chunksize=7,
+        vectorized=vectorized,
+        engine=engine,
+        num_workers=2,
+    )(compute_rows if vectorized else compute_row)
+    depc.initialize()
+    return depc
+
+
+@pytest.mark.parametrize(
+    'engine, vectorized',
+    [(None, True), ('thread', True), ('process', False), ('process', True)],
+)
+def test_compute_engines(tmp_path, engine, vectorized):
+    depc = make_depc(tmp_path, engine, vectorized)
+    rowids = list(range(1, 40))[::-1]
+    props = depc.get('spam', rowids, ('num', 'arr'))
+    # Rows come back in input order regardless of how they were computed
+    assert [num for num, _ in props] == [rowid * 2 for rowid in rowids]
+    for rowid, (_, arr) in zip(rowids, props):
+        assert np.all(arr == np.full(rowid % 4, rowid))
+    # Rows are inserted in input order, so rowids are deterministic
+    assert depc.get_rowids('spam', rowids) == list(range(1, 40))
+
+    stats = depc['spam'].get_compute_stats()
+    assert stats['engine'] == engine
+    assert stats['num_rows'] == len(rowids)
+    assert stats['rows_per_sec'] > 0
+
+
+def test_unknown_engine(tmp_path):
+    with pytest.raises(ValueError):
+        make_depc(tmp_path, 'gpu', True)
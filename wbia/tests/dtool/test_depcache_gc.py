@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from os.path import exists, join
+
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool.depcache_table import CONFIG_TABLE
+from wbia.dtool.example_depcache2 import depc_34_helper
+
+
+@pytest.fixture
+def depc(tmp_path):
+    from wbia.dtool.example_depcache import DummyController
+
+    root = 'dummy_annot'
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+
+    @depc.register_preproc(
+        tablename='chip',
+        parents=[root],
+        colnames=['chip'],
+        coltypes=[('extern', np.load, np.save, '.npy')],
+        configclass={'dim': 2},
+    )
+    def compute_chip(depc, rowids, config=None):
+        for rowid in rowids:
+            yield (np.full((rowid, config['dim']), rowid),)
+
+    @depc.register_preproc(
+        tablename='feat',
+        parents=['chip'],
+        colnames=['num', 'vecs'],
+        coltypes=[int, dtool.ShardType()],
+        configclass={'dim': 2, 'nfeat': 4},
+    )
+    def compute_feat(depc, chip_rowids, config=None):
+        for chip in depc.get_native('chip', chip_rowids, 'chip'):
+            yield len(chip), np.ones((len(chip), config['nfeat']), np.float32)
+
+    depc.initialize()
+    return depc
+
+
+def _make_old(fpath):
+    old = time.time() - 3600
+    os.utime(fpath, (old, old))
+
+
+def _num_configs(db):
+    return len(db.get_all_rowids(CONFIG_TABLE))
+
+
+def test_collects_orphans_and_files(depc):
+    aids = [1, 2, 3, 4, 5]
+    depc.get('feat', aids, 'num')
+    chip_table = depc['chip']
+    chip_fpaths = depc.get('chip', aids, 'chip', read_extern=False)
+    stray_fpath = join(chip_table.extern_dpath, 'stray.npy')
+    np.save(stray_fpath, np.zeros(100))
+    young_fpath = join(chip_table.extern_dpath, 'young.npy')
+    np.save(young_fpath, np.zeros(100))
+    _make_old(stray_fpath)
+
+    report = depc.gc(dry_run=True, valid_root_rowids=[1, 2, 3])
+    assert report['done']
+    # Orphaned chips cascade to their feats in the same pass
+    assert report['rows_deleted'] == 4
+    assert report['files_deleted'] == 3
+    assert report['bytes_freed'] >= os.path.getsize(stray_fpath)
+    assert exists(stray_fpath) and all(exists(fpath) for fpath in chip_fpaths)
+    assert depc['chip'].number_of_rows == 5
+
+    report2 = depc.gc(valid_root_rowids=[1, 2, 3])
+    assert ut.dict_subset(report2, ['rows_deleted', 'files_deleted']) == (
+        ut.dict_subset(report, ['rows_deleted', 'files_deleted'])
+    )
+    assert not exists(stray_fpath) and exists(young_fpath)
+    assert [exists(fpath) for fpath in chip_fpaths] == [True] * 3 + [False] * 2
+    assert depc['chip'].number_of_rows == 3
+    assert depc['feat'].number_of_rows == 3
+    assert depc.get('feat', [1, 2, 3], 'num') == [1, 2, 3]
+
+    # Nothing is left to collect
+    report3 = depc.gc(valid_root_rowids=[1, 2, 3])
+    assert report3['rows_deleted'] == 0 and report3['files_deleted'] == 0
+
+
+def test_counts_only_removed_files(depc):
+    aids = [1, 2, 3]
+    chip_fpaths = depc.get('chip', aids, 'chip', read_extern=False)
+    # The file of an orphaned row is already gone
+    os.remove(chip_fpaths[2])
+    nbytes = os.path.getsize(chip_fpaths[1])
+
+    report = depc.gc(dry_run=True, valid_root_rowids=[1], sweeps=['rows'])
+    assert report['rows_deleted'] == 2
+    assert report['files_deleted'] == 1
+    assert report['bytes_freed'] == nbytes
+
+    report = depc.gc(valid_root_rowids=[1], sweeps=['rows'])
+    assert report['rows_deleted'] == 2
+    assert report['files_deleted'] == 1
+    assert report['bytes_freed'] == nbytes
+    assert not exists(chip_fpaths[1])
+
+
+def test_collects_unused_configs_and_shards(depc):
+    aids = [1, 2]
+    for dim in [3, 4, 2]:
+        depc.get('feat', aids, 'num', config={'dim': dim})
+    chip_table = depc['chip']
+    db = chip_table.db
+    num_configs = _num_configs(db)
+    dim3_chip_rowids = depc.get_rowids('chip', aids, config={'dim': 3})
+    dim3_fpaths = depc.get('chip', aids, 'chip', config={'dim': 3}, read_extern=False)
+    dim3_feat_rowids = depc.get_rowids('feat', aids, config={'dim': 3})
+    chip_table.delete_rows(dim3_chip_rowids)
+    for fpath in dim3_fpaths:
+        _make_old(fpath)
+    feat_table = depc['feat']
+    shard_dnames = sorted(os.listdir(feat_table.shard_dpath))
+    assert len(shard_dnames) == 3
+    for dname in shard_dnames:
+        _make_old(join(feat_table.shard_dpath, dname, 'index.bin'))
+    assert feat_table.get_internal_columns(dim3_feat_rowids, ('num',)) == [None, None]
+
+    report = depc.gc()
+    assert report['done']
+    assert report['files_deleted'] == 2
+    assert report['shard_dirs_deleted'] == 1
+    assert report['configs_deleted'] == 2
+    assert not any(exists(fpath) for fpath in dim3_fpaths)
+    assert len(os.listdir(feat_table.shard_dpath)) == 2
+    assert _num_configs(db) == num_configs - 2
+    # The remaining configs still resolve to the same rows
+    assert depc.get('feat', aids, 'num', config={'dim': 4}) == [1, 2]
+    vecs = depc.get('feat', aids, 'vecs', config={'dim': 2})
+    assert [v.shape for v in vecs] == [(1, 4), (2, 4)]
+    # A collected config is added again when it is used
+    assert depc.get('feat', aids, 'num', config={'dim': 3}) == [1, 2]
+
+
+def test_incremental_and_rate_limited(depc):
+    aids = list(range(1, 21))
+    depc.get('chip', aids, 'chip', read_extern=False)
+    for fpath in depc.get('chip', aids, 'chip', read_extern=False):
+        _make_old(fpath)
+    depc['chip'].delete_rows(depc.get_rowids('chip', aids[10:]))
+
+    num_calls = 0
+    report = {'done': False}
+    while not report['done']:
+        report = depc.gc(max_items=1, max_deletes_per_sec=1000.0, sweeps=['extern'])
+        num_calls += 1
+    assert num_calls > 2
+    assert report['files_deleted'] == 10
+    assert report['rows_scanned'] == 10
+    assert len(os.listdir(depc['chip'].extern_dpath)) == 10
+
+    start = time.time()
+    report = depc.gc(valid_root_rowids=[], max_deletes_per_sec=20.0, sweeps=['rows'])
+    assert report['rows_deleted'] == 10
+    assert time.time() - start >= 0.4
+
+
+def test_roots_from_controller(tmp_path):
+    from wbia.dtool.example_depcache import DummyController
+
+    snapshots = [[1, 2, 5], [1, 2]]
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        'annot',
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        use_globals=False,
+        get_root_rowids=snapshots.pop,
+    )
+    register_dummy_config = depc_34_helper(depc)
+    # Registered out of dependency order, the pass must still visit parents
+    # before their children
+    register_dummy_config(tablename='pair', parents=['meta_labeler', 'labeler'])
+    register_dummy_config(tablename='labeler', parents=['annot'])
+    register_dummy_config(tablename='meta_labeler', parents=['labeler'])
+    register_dummy_config(tablename='triple', parents=['pair', 'meta_labeler'])
+    depc.initialize()
+    # Roots 3 and 4 were deleted by the controller, 5 is added after the
+    # pass took its first snapshot of the roots
+    depc.get_rowids('triple', [1, 2, 3, 4, 5])
+
+    report = depc.gc(sweeps=['rows'])
+    assert report['done'] and not snapshots
+    # A single pass collects every descendant of the deleted roots
+    assert report['rows_deleted'] == 8
+    for tablename in ['labeler', 'meta_labeler', 'pair', 'triple']:
+        assert depc[tablename].number_of_rows == 3
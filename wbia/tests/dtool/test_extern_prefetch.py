@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool.depcache_table import prefetch_imap
+from wbia.dtool.example_depcache import DummyController
+
+
+class ReadLog(object):
+    def __init__(self):
+        self.thread_names = set()
+        self.num_reads = 0
+
+    def read(self, fpath):
+        self.thread_names.add(threading.current_thread().name)
+        self.num_reads += 1
+        # Simulate a network mounted cache directory
+        time.sleep(0.005)
+        return np.load(fpath)
+
+
+@pytest.fixture
+def depc(tmp_path):
+    root = 'dummy_annot'
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+    depc.read_log = ReadLog()
+
+    @depc.register_preproc(
+        tablename='chip',
+        parents=[root],
+        colnames=['size', 'chip'],
+        coltypes=[int, ('extern', depc.read_log.read, np.save, '.npy')],
+    )
+    def compute_chip(depc, rowids, config=None):
+        for rowid in rowids:
+            yield rowid, np.full((rowid, 2), rowid, dtype=np.uint8)
+
+    depc.initialize()
+    depc['chip'].extern_read_workers = 4
+    return depc
+
+
+def test_prefetch_imap_order_and_errors():
+    def func(x):
+        time.sleep(0.001 * ((7 * x) % 5))
+        if x == 6:
+            raise ValueError(x)
+        return x
+
+    gen = prefetch_imap(func, range(10), num_workers=4)
+    assert [next(gen) for _ in range(6)] == list(range(6))
+    with pytest.raises(ValueError):
+        next(gen)
+    assert list(prefetch_imap(func, range(5), num_workers=1)) == list(range(5))
+
+
+def test_eager_prefetch(depc):
+    aids = list(range(1, 21))[::-1]
+    chips = depc.get('chip', aids, 'chip')
+    assert [chip.shape for chip in chips] == [(aid, 2) for aid in aids]
+    assert all(np.all(chip == aid) for aid, chip in zip(aids, chips))
+    assert len(depc.read_log.thread_names) > 1
+
+    # The serial path gives the same results
+    depc['chip'].extern_read_workers = 1
+    chips2 = depc.get('chip', aids, 'chip')
+    assert all(np.all(c1 == c2) for c1, c2 in zip(chips, chips2))
+
+
+def test_streaming_prefetch(depc):
+    aids = list(range(1, 41))
+    depc.get_rowids('chip', aids)
+    depc.read_log.num_reads = 0
+    gen = depc.get('chip', aids, ('size', 'chip'), eager=False)
+    size, chip = next(gen)
+    assert size == 1 and chip.shape == (1, 2)
+    # Only a bounded window is read ahead of the consumer
+    time.sleep(0.05)
+    assert depc.read_log.num_reads <= 2 * 4 + 1
+    rest = list(gen)
+    assert [size for size, _ in rest] == aids[1:]
+    assert depc.read_log.num_reads == len(aids)
+
+
+def test_prefetch_missing_file_is_recomputed(depc):
+    aids = [1, 2, 3, 4]
+    fpaths = depc.get('chip', aids, 'chip', read_extern=False)
+    os.remove(fpaths[2])
+    chips = depc.get('chip', aids, 'chip')
+    assert [chip.shape for chip in chips] == [(aid, 2) for aid in aids]
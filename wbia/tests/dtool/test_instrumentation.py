@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool import instrumentation
+from wbia.dtool.example_depcache import DummyController
+
+
+@pytest.fixture
+def instrumented():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield
+    instrumentation.enable(False)
+    instrumentation.reset()
+
+
+@pytest.fixture
+def depc(tmp_path):
+    root = 'dummy_annot'
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+
+    @depc.register_preproc(
+        tablename='chip',
+        parents=[root],
+        colnames=['size', 'chip'],
+        coltypes=[int, np.ndarray],
+    )
+    def compute_chip(depc, rowids, config=None):
+        for rowid in rowids:
+            yield rowid, np.zeros((rowid, 2))
+
+    depc.initialize()
+    return depc
+
+
+def _ops_by_key(snapshot):
+    return {(op['kind'], op['table'], op['op']): op for op in snapshot['ops']}
+
+
+def test_disabled_records_nothing(depc):
+    instrumentation.reset()
+    depc.get('chip', [1, 2], 'size')
+    assert instrumentation.get_snapshot()['ops'] == []
+
+
+def test_depcache_snapshot(depc, instrumented):
+    aids = [1, 2, 3]
+    depc.get('chip', aids, 'size')
+    depc.get('chip', aids, 'chip')
+    snapshot = depc.get_instrumentation_snapshot()
+    ops = _ops_by_key(snapshot)
+
+    get_row_data = ops[('depc', 'chip', 'get_row_data')]
+    assert get_row_data['count'] == 2
+    assert get_row_data['nrows'] == 6
+    assert sum(get_row_data['bucket_counts']) == 2
+    assert ops[('depc', 'chip', 'compute')]['nrows'] == 3
+    assert ops[('depc', 'chip', 'store')]['nrows'] == 3
+    assert ops[('depc', 'chip', 'ensure_rows')]['count'] == 2
+    assert ops[('sql', 'chip', 'select')]['count'] > 0
+    assert all(op['source'] in (depc.name, 'dummy_annot_cache') for op in snapshot['ops'])
+    totals = [op['total_sec'] for op in snapshot['ops']]
+    assert totals == sorted(totals, reverse=True)
+    assert snapshot['compute_stats']['chip']['num_rows'] == 3
+    assert snapshot['row_cache'] is None
+
+
+def test_executemany_is_recorded_once(depc, instrumented):
+    from sqlalchemy.sql import text
+
+    db = depc['chip'].db
+    db.executemany(
+        text('SELECT size FROM chip WHERE chip_rowid=:rowid'),
+        [
+            {'rowid': 1},
+            {'rowid': 2},
+        ],
+    )
+    ops = _ops_by_key(instrumentation.get_snapshot(kind='sql', source=db.name))
+    assert ops[('sql', 'chip', 'select')]['count'] == 1
+    assert ops[('sql', 'chip', 'select')]['nrows'] == 2
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool.depcache_table import CONFIG_ROWID, CONFIG_TABLE
+from wbia.dtool.example_depcache import DummyController
+
+
+@pytest.fixture
+def depc(tmp_path):
+    root = 'dummy_annot'
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+
+    @depc.register_preproc(
+        tablename='chips',
+        parents=[root],
+        colnames=['size'],
+        coltypes=[int],
+        configclass={'dim_size': 700},
+    )
+    def compute_chip(depc, aids, config=None):
+        for aid in aids:
+            yield (aid * config['dim_size'],)
+
+    @depc.register_preproc(
+        tablename='feat',
+        parents=['chips'],
+        colnames=['vecs'],
+        coltypes=[np.ndarray],
+        configclass={'n_orient': 1},
+    )
+    def compute_feats(depc, cids, config=None):
+        for size in depc.get_native('chips', cids, 'size'):
+            yield (np.full(config['n_orient'], size),)
+
+    @depc.register_preproc(
+        tablename='featweight',
+        parents=['feat'],
+        colnames=['fwg'],
+        coltypes=[np.ndarray],
+    )
+    def compute_fgweights(depc, fids, config=None):
+        for vecs in depc.get_native('feat', fids, 'vecs'):
+            yield (vecs / 2,)
+
+    depc.initialize()
+    return depc
+
+
+def test_plan_is_memoized_per_config(depc):
+    plan = depc.get_resolution_plan('featweight', {'dim_size': 10})
+    assert [step[1].tablename for step in plan.steps] == ['chips', 'feat', 'featweight']
+    assert plan.steps[0][-1]['dim_size'] == 10
+    assert set(plan.configs) == {'chips', 'feat', 'featweight'}
+    assert depc.get_resolution_plan('featweight', {'dim_size': 10}) is plan
+    assert depc.get_resolution_plan('featweight', {'dim_size': 20}) is not plan
+    assert depc.get_resolution_plan('featweight', {}) is not plan
+
+
+def test_plan_results_match(depc):
+    aids = [3, 1, 2, 1]
+    config = {'dim_size': 10, 'n_orient': 2}
+    fwgs = depc.get('featweight', aids, 'fwg', config=config)
+    assert [fwg.tolist() for fwg in fwgs] == [[aid * 5.0] * 2 for aid in aids]
+    for aid in aids:
+        assert depc.get('featweight', [aid], 'fwg', config=config)[0].tolist() == (
+            [aid * 5.0] * 2
+        )
+    depc.use_resolution_plans = False
+    rowids = depc.get_rowids('featweight', aids, config=config)
+    depc.use_resolution_plans = True
+    assert depc.get_rowids('featweight', aids, config=config) == rowids
+    # Different configs still resolve to different rows
+    assert depc.get('featweight', [1], 'fwg')[0].tolist() == [350.0]
+
+
+def test_plan_invalidation(depc):
+    plan = depc.get_resolution_plan('feat', {})
+    assert depc._resolution_plans
+
+    @depc.register_preproc(
+        tablename='probchip',
+        parents=['dummy_annot'],
+        colnames=['mask'],
+        coltypes=[int],
+    )
+    def compute_probchip(depc, aids, config=None):
+        for aid in aids:
+            yield (aid,)
+
+    assert not depc._resolution_plans
+    depc.initialize()
+    assert depc.get_resolution_plan('feat', {}) is not plan
+    assert depc.get('feat', [4], 'vecs')[0].tolist() == [2800]
+
+
+def test_plan_does_not_write(depc):
+    depc.get_resolution_plan('featweight', {'dim_size': 10})
+    for tablename in ['chips', 'feat', 'featweight']:
+        assert depc[tablename].db.get_row_count(CONFIG_TABLE) == 0
+
+
+def test_deleted_config_rowid_is_not_reused(depc):
+    config = {'dim_size': 10}
+    table = depc['chips']
+    rowids = depc.get_rowids('chips', [1], config=config)
+    old_config_rowid = table.get_row_cfgid(rowids)[0]
+    # Another process deletes the rows and the config, this one still has
+    # the config rowid memoized
+    table.db.delete_rowids('chips', rowids)
+    table.db.delete(CONFIG_TABLE, [old_config_rowid], id_colname=CONFIG_ROWID)
+    assert table.get_config_rowid(config) == old_config_rowid
+
+    rowids = depc.get_rowids('chips', [1, 2], config=config)
+    config_rowids = table.get_row_cfgid(rowids)
+    assert config_rowids[0] == config_rowids[1] != old_config_rowid
+    assert table.get_config_from_rowid(config_rowids)[0]['dim_size'] == 10
+    assert depc.get('chips', [1, 2], 'size', config=config) == [10, 20]
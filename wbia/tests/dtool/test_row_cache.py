@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool.example_depcache import DummyController
+from wbia.dtool.row_cache import RowCache
+
+
+def test_byte_bounded_eviction():
+    cache = RowCache(max_nbytes=2500)
+    for rowid in range(5):
+        cache.put(('feat', rowid, 'vecs'), np.zeros(1000, dtype=np.uint8))
+    assert cache.nbytes <= 2500
+    assert len(cache) == 2
+    assert cache.evictions == 3
+    # Reading an entry marks it as recently used
+    assert cache.get(('feat', 3, 'vecs')) is not None
+    cache.put(('feat', 5, 'vecs'), np.zeros(1000, dtype=np.uint8))
+    assert ('feat', 3, 'vecs') in cache
+    assert ('feat', 4, 'vecs') not in cache
+    # Values larger than the whole cache are not stored
+    cache.put(('feat', 6, 'vecs'), np.zeros(4000, dtype=np.uint8))
+    assert ('feat', 6, 'vecs') not in cache
+
+
+def test_values_are_copied():
+    cache = RowCache(max_nbytes=2 ** 20)
+    arr = np.arange(3)
+    value = (arr, [np.arange(2)], {'a': np.arange(2), 'b': [1, 2]}, 'spam')
+    cache.put(('feat', 1, 'x'), value)
+    # The caller keeps a writable array that does not alias the entry
+    assert arr.flags.writeable
+    arr[:] = -1
+    value[1].append(None)
+    value[2]['b'].append(3)
+    hit1 = cache.get(('feat', 1, 'x'))
+    assert hit1[0].tolist() == [0, 1, 2]
+    assert len(hit1[1]) == 1
+    assert hit1[2]['b'] == [1, 2]
+    assert hit1[0].flags.writeable and hit1[2]['a'].flags.writeable
+    # Mutating a hit does not change later hits
+    hit1[0][:] = -1
+    hit1[1].clear()
+    hit1[2]['a'][:] = -1
+    del hit1[2]['b']
+    hit2 = cache.get(('feat', 1, 'x'))
+    assert hit2[0].tolist() == [0, 1, 2]
+    assert hit2[1][0].tolist() == [0, 1]
+    assert hit2[2]['a'].tolist() == [0, 1]
+    assert hit2[2]['b'] == [1, 2]
+    assert hit2[3] == 'spam'
+
+
+def test_invalidate():
+    cache = RowCache(max_nbytes=2 ** 20)
+    for tablename in ['feat', 'chip']:
+        for rowid in [1, 2]:
+            for colname in ['a', 'b']:
+                cache.put((tablename, rowid, colname), rowid)
+    cache.invalidate_rows('feat', [1, 3])
+    assert len(cache) == 6
+    cache.invalidate_table('chip')
+    assert sorted(cache._entries) == [('feat', 2, 'a'), ('feat', 2, 'b')]
+    cache.clear()
+    assert cache.nbytes == 0
+
+
+@pytest.fixture
+def depc(tmp_path):
+    root = 'dummy_annot'
+    depc = dtool.DependencyCache(
+        DummyController(tmp_path),
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+        row_cache_nbytes=2 ** 20,
+    )
+
+    @depc.register_preproc(
+        tablename='spam',
+        parents=[root],
+        colnames=['num', 'arr'],
+        coltypes=[int, np.ndarray],
+        configclass={'scale': 2},
+    )
+    def compute_spam(depc, rowids, config=None):
+        for rowid in rowids:
+            yield rowid * config['scale'], np.full(3, rowid)
+
+    @depc.register_preproc(
+        tablename='eggs',
+        parents=['spam'],
+        colnames=['total'],
+        coltypes=[int],
+    )
+    def compute_eggs(depc, spam_rowids, config=None):
+        for arr in depc.get_native('spam', spam_rowids, 'arr'):
+            yield (int(arr.sum()),)
+
+    depc.initialize()
+    return depc
+
+
+def test_depcache_read_through(depc):
+    rowids = [1, 2, 3, None]
+    props = depc.get('spam', rowids, ('num', 'arr'))
+    info = depc.get_row_cache_info()
+    assert info['misses'] > 0
+    assert info['num_entries'] == 6
+    assert info['nbytes'] > 0
+
+    props2 = depc.get('spam', rowids, ('num', 'arr'))
+    assert props2[-1] is None
+    assert [p[0] for p in props2[:-1]] == [p[0] for p in props[:-1]]
+    # Misses and hits are both writable and do not alias the cached values
+    assert props[0][1].flags.writeable
+    assert props2[0][1].flags.writeable
+    assert props2[0][1] is not props[0][1]
+    props[0][1][:] = -1
+    props2[0][1][:] = -2
+    assert depc.get('spam', [1], 'arr')[0].tolist() == [1, 1, 1]
+    assert depc.get_row_cache_info()['hits'] == 7
+
+    # Single columns are unpacked the same way with and without the cache
+    nums = depc.get('spam', [3, 1], 'num')
+    assert nums == [6, 2]
+    assert nums == depc['spam'].get_row_data(
+        depc.get_rowids('spam', [3, 1]), 'num', use_cache=False
+    )
+
+    # Configs produce different rows and therefore different entries
+    assert depc.get('spam', [1], 'num', config={'scale': 3}) == [3]
+    assert depc.get('spam', [1], 'num') == [2]
+
+
+def test_depcache_invalidation(depc):
+    depc.get('eggs', [1, 2, 3], 'total')
+    depc.get('spam', [1, 2, 3], 'num')
+    cache = depc.row_cache
+    spam_rowids = depc.get_rowids('spam', [1, 2, 3])
+    assert ('spam', spam_rowids[0], 'num') in cache
+    assert any(key[0] == 'eggs' and key[1] == 1 for key in cache._entries)
+
+    depc.notify_root_changed([1], 'bbox')
+    assert ('spam', spam_rowids[0], 'num') not in cache
+    assert ('spam', spam_rowids[1], 'num') in cache
+    assert not any(key[0] == 'eggs' and key[1] == 1 for key in cache._entries)
+
+    depc['spam'].delete_rows([spam_rowids[1]])
+    assert ('spam', spam_rowids[1], 'num') not in cache
+    assert depc.get('spam', [2], 'num') == [4]
+
+    depc['spam'].clear_table()
+    assert not any(key[0] == 'spam' for key in cache._entries)
+    assert depc.get('spam', [3], 'num') == [6]
+
+    depc.enable_row_cache(None)
+    assert depc.get_row_cache_info() is None
+    assert depc.get('spam', [3], 'num') == [6]
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import utool as ut
+
+from wbia import dtool
+from wbia.dtool.example_depcache import DummyController
+from wbia.dtool.shard_store import ShardStore, stack_arrays
+
+
+def test_append_and_take(tmp_path):
+    store = ShardStore(str(tmp_path / 'store'))
+    rng = np.random.RandomState(0)
+    arrs = [rng.randint(0, 255, (n, 8)).astype(np.uint8) for n in [3, 0, 5, 1]]
+    idxs = store.extend(arrs)
+    assert idxs == [0, 1, 2, 3]
+    store.flush()
+
+    # A fresh store reads what was flushed
+    store2 = ShardStore(str(tmp_path / 'store'))
+    loaded = store2.take(idxs[::-1])
+    for arr, arr2 in zip(arrs[::-1], loaded):
+        assert arr2.dtype == np.uint8
+        assert arr2.shape == (len(arr), 8)
+        assert np.all(arr == arr2)
+    assert isinstance(loaded[0], np.memmap)
+    assert store2.take([None]) == [None]
+
+
+def test_append_rejects_other_layouts(tmp_path):
+    store = ShardStore(str(tmp_path / 'store'))
+    store.append(np.zeros((2, 4), dtype=np.float32))
+    with pytest.raises(ValueError):
+        store.append(np.zeros((2, 5), dtype=np.float32))
+    with pytest.raises(ValueError):
+        store.append(np.zeros((2, 4), dtype=np.float64))
+    store.close()
+
+
+def test_shard_rollover(tmp_path):
+    store = ShardStore(str(tmp_path / 'store'), max_shard_nbytes=64)
+    arrs = [np.full((i + 1, 4), i, dtype=np.float32) for i in range(6)]
+    idxs = store.extend(arrs)
+    store.flush()
+    assert len(set(store._index['shard'])) > 1
+    for arr, arr2 in zip(arrs, store.take(idxs)):
+        assert np.all(arr == arr2)
+
+
+def test_stack_arrays_is_zero_copy(tmp_path):
+    store = ShardStore(str(tmp_path / 'store'))
+    arrs = [np.full((n, 2), n, dtype=np.uint8) for n in [2, 3, 0, 4]]
+    idxs = store.extend(arrs)
+    store.flush()
+    loaded = store.take(idxs)
+    stacked = stack_arrays(loaded)
+    assert np.shares_memory(stacked, loaded[0])
+    assert np.all(stacked == np.vstack(arrs))
+    # Out of order reads fall back to a copy
+    stacked = stack_arrays(loaded[::-1])
+    assert not np.shares_memory(stacked, loaded[0])
+    assert np.all(stacked == np.vstack(arrs[::-1]))
+
+
+def test_stack_arrays_empty(tmp_path):
+    store = ShardStore(str(tmp_path / 'store'))
+    idxs = store.extend([np.full((2, 3), 1, dtype=np.uint8)])
+    idxs += store.extend([np.empty((0, 3), dtype=np.uint8)])
+    store.flush()
+    stacked = stack_arrays(store.take(idxs[1:]))
+    assert stacked.shape == (0, 3)
+    assert stacked.dtype == np.uint8
+    template = np.empty((0, 3), dtype=np.float32)
+    stacked = stack_arrays([], template=template)
+    assert stacked.shape == (0, 3)
+    assert stacked.dtype == np.float32
+    with pytest.raises(ValueError):
+        stack_arrays([])
+
+
+@pytest.fixture
+def depc(tmp_path):
+    root = 'dummy_annot'
+    controller = DummyController(tmp_path)
+    depc = dtool.DependencyCache(
+        controller,
+        root,
+        lambda rowids: ut.lmap(ut.hashable_to_uuid, rowids),
+        table_name=root,
+        use_globals=False,
+    )
+
+    @depc.register_preproc(
+        tablename='feat',
+        parents=[root],
+        colnames=['num', 'vecs'],
+        coltypes=[int, dtool.ShardType()],
+        configclass={'dim': 4},
+    )
+    def compute_feat(depc, rowids, config=None):
+        for rowid in rowids:
+            vecs = np.full((rowid % 3, config['dim']), rowid, dtype=np.uint8)
+            yield len(vecs), vecs
+
+    depc.initialize()
+    return depc
+
+
+def test_depcache_shard_column(depc):
+    table = depc['feat']
+    assert 'vecs' + dtool.depcache_table.SHARD_SUFFIX in table.computable_colnames()
+    rowids = [1, 2, 3, 4, 5]
+    vecs_list = depc.get('feat', rowids, 'vecs')
+    for rowid, vecs in zip(rowids, vecs_list):
+        assert isinstance(vecs, np.ndarray)
+        assert vecs.shape == (rowid % 3, 4)
+        assert np.all(vecs == rowid)
+
+    # Each config gets its own store
+    vecs_list2 = depc.get('feat', rowids, 'vecs', config={'dim': 2})
+    assert [vecs.shape for vecs in vecs_list2] == [(r % 3, 2) for r in rowids]
+    assert len(table._shard_stores) == 2
+
+    # Rows computed together are stacked without copying
+    stacked = stack_arrays(vecs_list)
+    assert np.shares_memory(stacked, vecs_list[0])
+
+    # Non-eager getters and mixed columns resolve the shards as well
+    props = depc.get('feat', rowids, ('num', 'vecs'))
+    assert [num for num, _ in props] == [r % 3 for r in rowids]
+    gen = table.get_row_data(depc.get_rowids('feat', rowids), 'vecs', eager=False)
+    assert all(np.all(v1 == v2) for v1, v2 in zip(gen, vecs_list))
+
+    table.clear_table()
+    assert len(table._shard_stores) == 0
+    vecs_list3 = depc.get('feat', rowids, 'vecs')
+    assert all(np.all(v1 == v3) for v1, v3 in zip(vecs_list, vecs_list3))
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import numpy as np
@@ -70,6 +71,92 @@ def test_instantiation_with_table_reflection(tmp_path):
     # which will have been tested by SQLAlchemy.
 
 
+def test_wal_mode_concurrent_access(tmp_path):
+    db_file = (tmp_path / 'testing.db').resolve()
+    ctrlr = SQLDatabaseController(f'sqlite:///{db_file}', 'testing', wal=True)
+    ctrlr.add_table(**make_table_definition('items'))
+    with ctrlr.connect() as conn:
+        assert conn.execute('PRAGMA journal_mode').scalar() == 'wal'
+    colnames = ('meta_labeler_id', 'indexer_id', 'data')
+    ctrlr._add('items', colnames, [(0, i, 'initial') for i in range(10)])
+
+    # Readers see the last committed state while a write is in progress
+    with ctrlr.connect() as conn:
+        with conn.begin():
+            conn.execute("INSERT INTO items (meta_labeler_id, indexer_id) VALUES (1, 1)")
+            with ThreadPoolExecutor(1) as pool:
+                future = pool.submit(ctrlr.get_row_count, 'items')
+                assert future.result(timeout=5) == 10
+    assert ctrlr.get_row_count('items') == 11
+
+    # Parallel writers are serialized and readers don't fail
+    def write(x):
+        ctrlr._add('items', colnames, [(2 + x, i, 'written') for i in range(20)])
+
+    def read(x):
+        return ctrlr.get('items', ('data',), list(range(1, 11)))
+
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(write, x) for x in range(8)]
+        futures += [pool.submit(read, x) for x in range(8)]
+        results = [future.result() for future in futures]
+    assert all(result == ['initial'] * 10 for result in results[8:])
+    assert ctrlr.get_row_count('items') == 11 + 8 * 20
+
+
+def test_wal_mode_executemany_write(tmp_path):
+    db_file = (tmp_path / 'testing.db').resolve()
+    # A short busy timeout makes a write waiting on its own lock fail fast
+    ctrlr = SQLDatabaseController(f'sqlite:///{db_file}', 'testing', wal=True, timeout=1)
+    ctrlr.add_table(**make_table_definition('items'))
+    colnames = ('meta_labeler_id', 'indexer_id', 'data')
+    ctrlr._add('items', colnames, [(0, i, 'initial') for i in range(10)])
+
+    # The statements run in the transaction that holds the write lock
+    stmt = text('UPDATE items SET data = :data WHERE rowid = :rowid')
+    ctrlr.executemany(stmt, [{'data': 'updated', 'rowid': i} for i in range(1, 4)])
+    ctrlr.set('items', ('data',), [('set',)] * 2, [4, 5])
+    assert ctrlr.get('items', ('data',), [1, 3, 4, 6]) == [
+        'updated',
+        'updated',
+        'set',
+        'initial',
+    ]
+
+
+def test_wal_mode_reads_do_not_wait_for_writers(tmp_path):
+    db_file = (tmp_path / 'testing.db').resolve()
+    ctrlr = SQLDatabaseController(f'sqlite:///{db_file}', 'testing', wal=True)
+    ctrlr.add_table(**make_table_definition('items'))
+    colnames = ('meta_labeler_id', 'indexer_id', 'data')
+    ctrlr._add('items', colnames, [(0, i, 'initial') for i in range(10)])
+
+    def read_where():
+        return ctrlr.get_where(
+            'items',
+            ('data',),
+            [{'labeler': 0}, {'labeler': 1}],
+            'meta_labeler_id = :labeler',
+            unpack_scalars=False,
+        )
+
+    def read_temp_table():
+        return ctrlr.get('items', ('data',), list(range(1, 11)), temp_table_threshold=1)
+
+    # Reads run while a write transaction is open in another thread
+    with ThreadPoolExecutor(2) as pool:
+        with ctrlr.connect() as conn:
+            with conn.begin():
+                conn.execute(
+                    "INSERT INTO items (meta_labeler_id, indexer_id) VALUES (1, 1)"
+                )
+                future1 = pool.submit(read_where)
+                future2 = pool.submit(read_temp_table)
+                assert future1.result(timeout=5) == [['initial'] * 10, []]
+                assert future2.result(timeout=5) == ['initial'] * 10
+    assert read_where() == [['initial'] * 10, [None]]
+
+
 class TestSchemaModifiers:
     """Testing the API that creates, modifies or deletes schema elements"""
 
@@ -662,6 +749,109 @@ class TestAdditionAPI(BaseAPITestCase):
         expected = [(i + 1, x, y, z) for i, (x, y, z) in enumerate(parameter_values)]
         assert results.fetchall() == expected
 
+    @pytest.mark.parametrize('use_upsert', [True, False])
+    def test_add_cleanly(self, use_upsert):
+        table_name = 'test_add_cleanly'
+        self.ctrlr.add_table(
+            table_name,
+            [
+                ('item_rowid', 'INTEGER PRIMARY KEY'),
+                ('item_uuid', 'UUID NOT NULL'),
+                ('item_num', 'INTEGER'),
+            ],
+            superkeys=[('item_uuid',)],
+            docstr='',
+        )
+        self.ctrlr.use_upsert = use_upsert
+        num_lookups = []
+
+        def get_rowid_from_superkey(uuids):
+            num_lookups.append(len(uuids))
+            return self.ctrlr.get_where_eq(
+                table_name, ('item_rowid',), zip(uuids), ('item_uuid',)
+            )
+
+        uuids = [uuid.uuid4() for _ in range(6)]
+        colnames = ('item_uuid', 'item_num')
+        params = [(uuid_, i) for i, uuid_ in enumerate(uuids[0:3])]
+        rowids = self.ctrlr.add_cleanly(
+            table_name, colnames, params, get_rowid_from_superkey
+        )
+        assert rowids == [1, 2, 3]
+
+        # Existing rows, duplicates and None inputs
+        params = [
+            (uuids[3], 3),
+            (uuids[1], 10),
+            None,
+            (uuids[4], 4),
+            (uuids[3], 30),
+            (uuids[0], 0),
+        ]
+        rowids = self.ctrlr.add_cleanly(
+            table_name, colnames, params, get_rowid_from_superkey
+        )
+        assert rowids == [4, 2, None, 5, 4, 1]
+        results = self.ctrlr._engine.execute(
+            f'SELECT item_rowid, item_num FROM {table_name}'
+        )
+        assert results.fetchall() == [(1, 0), (2, 1), (3, 2), (4, 3), (5, 4)]
+        if use_upsert:
+            # Only rows that already existed are looked up
+            assert num_lookups == [2]
+        else:
+            assert num_lookups == [3, 3, 6, 6]
+
+    @pytest.mark.parametrize('use_upsert', [True, False])
+    def test_add_cleanly_other_unique_violation(self, use_upsert):
+        # Only superkey conflicts are existing rows, other UNIQUE constraints
+        # still raise
+        table_name = 'test_add_cleanly'
+        self.ctrlr.add_table(
+            table_name,
+            [
+                ('item_rowid', 'INTEGER PRIMARY KEY'),
+                ('item_uuid', 'UUID NOT NULL'),
+                ('item_num', 'INTEGER UNIQUE'),
+            ],
+            superkeys=[('item_uuid',)],
+            docstr='',
+        )
+        self.ctrlr.use_upsert = use_upsert
+
+        def get_rowid_from_superkey(uuids):
+            return self.ctrlr.get_where_eq(
+                table_name, ('item_rowid',), zip(uuids), ('item_uuid',)
+            )
+
+        colnames = ('item_uuid', 'item_num')
+        uuid1 = uuid.uuid4()
+        rowids = self.ctrlr.add_cleanly(
+            table_name, colnames, [(uuid1, 1)], get_rowid_from_superkey
+        )
+        assert rowids == [1]
+        with pytest.raises(sqlalchemy.exc.IntegrityError):
+            self.ctrlr.add_cleanly(
+                table_name, colnames, [(uuid.uuid4(), 1)], get_rowid_from_superkey
+            )
+        results = self.ctrlr._engine.execute(f'SELECT item_rowid FROM {table_name}')
+        assert results.fetchall() == [(1,)]
+
+    def test_add_cleanly_without_unique_superkey(self):
+        # Without a UNIQUE constraint conflicts cannot be detected by the
+        # database, so the getter based path is used
+        table_name = 'test_add_cleanly'
+        self.make_table(table_name)
+
+        def get_rowid_from_superkey(xs):
+            return self.ctrlr.get_where_eq(table_name, ('id',), zip(xs), ('x',))
+
+        for _ in range(2):
+            rowids = self.ctrlr.add_cleanly(
+                table_name, ('x', 'y'), [('a', 1), ('b', 2)], get_rowid_from_superkey
+            )
+            assert rowids == [1, 2]
+
 
 class TestGettingAPI(BaseAPITestCase):
     def test_get_where_without_where_condition(self):
@@ -850,6 +1040,91 @@ class TestGettingAPI(BaseAPITestCase):
         # Verify getting
         assert data == expected
 
+    def test_get_uses_stmt_cache(self):
+        table_name = 'test_getting'
+        self.make_table(table_name)
+        self.populate_table(table_name)
+        self.ctrlr.invalidate_tables_cache()
+        info = self.ctrlr.get_stmt_cache_info()
+        hits, misses = info['hits'], info['misses']
+
+        # Call the testing target
+        data1 = self.ctrlr.get(table_name, ['x', 'y'], [2, 4])
+        data2 = self.ctrlr.get(table_name, ['x', 'y'], [6, 8])
+
+        # Verify the statement is only built once
+        info = self.ctrlr.get_stmt_cache_info()
+        assert info['misses'] == misses + 1
+        assert info['hits'] == hits + 1
+        assert data1 == [('odd', 1), ('odd', 3)]
+        assert data2 == [('odd', 5), ('odd', 7)]
+
+        # Verify invalidation clears the cached statements
+        self.ctrlr.invalidate_tables_cache()
+        assert self.ctrlr.get_stmt_cache_info()['size'] == 0
+        assert self.ctrlr.get(table_name, ['x', 'y'], [2, 4]) == data1
+        assert self.ctrlr.get_stmt_cache_info()['misses'] == misses + 2
+
+    def test_get_by_temp_table(self):
+        table_name = 'test_getting'
+        self.make_table(table_name)
+        self.populate_table(table_name)
+
+        # Call the testing target with both strategies
+        requested_ids = [6, 4, 99, 2, 6, None]
+        batched = self.ctrlr.get(
+            table_name, ['x', 'y'], requested_ids, temp_table_threshold=None
+        )
+        joined = self.ctrlr.get(
+            table_name, ['x', 'y'], requested_ids, temp_table_threshold=1
+        )
+
+        # Verify the join preserves the order of the input ids
+        assert joined == batched
+        assert joined == [('odd', 5), ('odd', 3), None, ('odd', 1), ('odd', 5), None]
+
+        # Verify matching on multiple columns
+        params = (['even', 8], ['odd', 7], ['odd', 8], ['even', 8])
+        batched = self.ctrlr.get_where_eq(
+            table_name, ['id'], params, ('x', 'y'), temp_table_threshold=None
+        )
+        joined = self.ctrlr.get_where_eq(
+            table_name, ['id'], params, ('x', 'y'), temp_table_threshold=1
+        )
+        assert joined == batched
+        assert joined == [9, 8, None, 9]
+
+        # Verify the temporary table is cleaned up
+        with self.ctrlr.connect() as conn:
+            results = conn.execute(
+                "SELECT name FROM sqlite_temp_master WHERE type = 'table'"
+            )
+            assert results.fetchall() == []
+
+    def test_get_columnar(self):
+        table_name = 'test_getting'
+        self.make_table(table_name)
+        self.populate_table(table_name)
+        self.ctrlr._engine.execute(f'UPDATE {table_name} SET z = NULL WHERE id = 4')
+
+        # Call the testing target
+        requested_ids = [6, 4, 99, 2, 6]
+        xs, ys, zs = self.ctrlr.get_columnar(table_name, ['x', 'y', 'z'], requested_ids)
+
+        # Verify the columns align with the requested ids
+        assert ys.dtype == np.int64
+        assert zs.dtype == np.float64
+        assert xs.tolist() == ['odd', 'odd', None, 'odd', 'odd']
+        assert ys.tolist() == [5, 3, None, 1, 5]
+        assert zs.mask.tolist() == [False, True, True, False, False]
+        assert np.allclose(zs.compressed(), [5 * 2.01, 1 * 2.01, 5 * 2.01])
+
+        # Verify the non-unique path produces the same result
+        data = self.ctrlr.get_columnar(
+            table_name, ['x', 'y', 'z'], requested_ids, id_colname='id'
+        )
+        assert [c.tolist() for c in data] == [c.tolist() for c in (xs, ys, zs)]
+
 
 class TestSettingAPI(BaseAPITestCase):
     def test_setting(self):
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import io
 import uuid
 
 import numpy as np
@@ -7,7 +8,16 @@ from sqlalchemy.engine import create_engine
 from sqlalchemy.sql import text, bindparam
 from sqlalchemy.types import Float
 
-from wbia.dtool.types import Dict, Integer, List, NDArray, Number, UUID
+from wbia.dtool.types import (
+    Dict,
+    Integer,
+    List,
+    NDArray,
+    Number,
+    UUID,
+    decode_ndarray,
+    encode_ndarray,
+)
 
 
 @pytest.fixture(autouse=True)
@@ -140,6 +150,77 @@ def test_numpy_ndarray(db):
     assert (selected_value == insert_value).all()
 
 
+ndarray_values = (
+    np.array([[1, 2, 3], [4, 5, 6]], np.int32),
+    np.asfortranarray(np.arange(12, dtype='>f8').reshape(3, 4)),
+    np.arange(20, dtype=np.uint8).reshape(4, 5)[:, ::2],
+    np.empty((0, 128), np.uint8),
+)
+
+
+@pytest.mark.parametrize('insert_value', ndarray_values)
+def test_numpy_ndarray_codec(insert_value):
+    blob = encode_ndarray(insert_value)
+    assert not blob.startswith(b'\x93NUMPY')
+    selected_value = decode_ndarray(blob)
+    assert selected_value.dtype == insert_value.dtype
+    assert selected_value.shape == insert_value.shape
+    assert (selected_value == insert_value).all()
+    # Decoded arrays can be modified in place, as with np.load
+    assert selected_value.flags.writeable
+    selected_value[...] = 0
+    assert blob == encode_ndarray(insert_value)
+
+
+def test_numpy_ndarray_legacy_blob(db):
+    db.execute(text('CREATE TABLE test(x NDARRAY)'))
+
+    # Insert a blob written by np.save, as done before the custom codec
+    insert_value = np.array([[1, 2, 3], [4, 5, 6]], np.int32)
+    out = io.BytesIO()
+    np.save(out, insert_value)
+    db.execute(text('INSERT INTO test(x) VALUES (:x)'), x=out.getvalue())
+
+    stmt = text('SELECT x FROM test').columns(x=NDArray)
+    selected_value = db.execute(stmt).fetchone()[0]
+    assert selected_value.dtype == insert_value.dtype
+    assert (selected_value == insert_value).all()
+
+
+def test_numpy_ndarray_object_dtype():
+    insert_value = np.array([np.arange(3), np.arange(2)], dtype=object)
+    blob = encode_ndarray(insert_value)
+    # Object arrays are pickled and only decoded when explicitly allowed
+    with pytest.raises(ValueError, match='pickled object array'):
+        decode_ndarray(blob)
+    selected_value = decode_ndarray(blob, allow_pickle=True)
+    assert all((a == b).all() for a, b in zip(selected_value, insert_value))
+
+
+def test_numpy_ndarray_pickle_opt_in(db, monkeypatch):
+    from wbia.dtool import types
+
+    db.execute(text('CREATE TABLE test(x NDARRAY)'))
+    insert_value = np.array([{'a': 1}, None], dtype=object)
+    out = io.BytesIO()
+    np.save(out, insert_value)
+    db.execute(text('INSERT INTO test(x) VALUES (:x)'), x=out.getvalue())
+
+    stmt = text('SELECT x FROM test').columns(x=NDArray)
+    with pytest.raises(ValueError, match='pickled object array'):
+        db.execute(stmt).fetchone()[0]
+    monkeypatch.setattr(types, 'ALLOW_PICKLED_NDARRAYS', True)
+    selected_value = db.execute(stmt).fetchone()[0]
+    assert selected_value.tolist() == [{'a': 1}, None]
+
+
+def test_numpy_ndarray_structured_dtype():
+    insert_value = np.array([(1, 2.0)], dtype=[('a', '<i4'), ('b', '<f4')])
+    selected_value = decode_ndarray(encode_ndarray(insert_value))
+    assert selected_value.dtype == insert_value.dtype
+    assert (selected_value == insert_value).all()
+
+
 np_numbers = (
     np.int8(120),
     np.int16(32767),
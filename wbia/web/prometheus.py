@@ -2,6 +2,7 @@
 import logging
 from prometheus_client import Info, Gauge, Counter, Enum, Histogram  # NOQA
 from wbia.control import controller_inject
+from wbia.dtool import instrumentation
 from wbia.web.apis_query import RENDER_STATUS  # NOQA
 import wbia.constants as const
 import utool as ut
@@ -104,6 +105,36 @@ PROMETHEUS_DATA = {
         'Number of web exceptions',
         ['name', 'tag'],
     ),
+    'dtool_calls': Gauge(
+        'wbia_dtool_calls',
+        'Number of instrumented SQL statements and depcache operations',
+        ['name', 'kind', 'source', 'table', 'op'],
+    ),
+    'dtool_rows': Gauge(
+        'wbia_dtool_rows',
+        'Number of rows touched by instrumented operations',
+        ['name', 'kind', 'source', 'table', 'op'],
+    ),
+    'dtool_seconds': Gauge(
+        'wbia_dtool_seconds',
+        'Total wall time of instrumented operations',
+        ['name', 'kind', 'source', 'table', 'op'],
+    ),
+    'dtool_seconds_bucket': Gauge(
+        'wbia_dtool_seconds_bucket',
+        'Cumulative number of instrumented operations faster than le seconds',
+        ['name', 'kind', 'source', 'table', 'op', 'le'],
+    ),
+    'depc_compute': Gauge(
+        'wbia_depc_compute',
+        'Rows computed and seconds spent computing / storing per depcache table',
+        ['name', 'depc', 'table', 'stat'],
+    ),
+    'depc_row_cache': Gauge(
+        'wbia_depc_row_cache',
+        'Depcache row cache statistics',
+        ['name', 'depc', 'stat'],
+    ),
 }
 
 
@@ -149,6 +180,51 @@ def prometheus_increment_exception(ibs, tag):
         pass
 
 
+def _prometheus_update_dtool(ibs, container_name):
+    """
+    Publishes the SQL / depcache instrumentation snapshot (when enabled with
+    --dtool-instrument), the depcache compute stats and the row cache stats
+    """
+    if instrumentation.is_enabled():
+        snapshot = instrumentation.get_snapshot()
+        for op in snapshot['ops']:
+            labels = {
+                'name': container_name,
+                'kind': op['kind'],
+                'source': str(op['source']),
+                'table': op['table'],
+                'op': op['op'],
+            }
+            PROMETHEUS_DATA['dtool_calls'].labels(**labels).set(op['count'])
+            PROMETHEUS_DATA['dtool_rows'].labels(**labels).set(op['nrows'])
+            PROMETHEUS_DATA['dtool_seconds'].labels(**labels).set(op['total_sec'])
+            cumulative = 0
+            for upper, number in zip(snapshot['buckets'], op['bucket_counts']):
+                cumulative += number
+                le = '+Inf' if upper == float('inf') else str(upper)
+                PROMETHEUS_DATA['dtool_seconds_bucket'].labels(le=le, **labels).set(
+                    cumulative
+                )
+
+    for depc in [ibs.depc_image, ibs.depc_annot, ibs.depc_part]:
+        if depc is None:
+            continue
+        for tablename, table in depc.cachetable_dict.items():
+            compute_stats = table.get_compute_stats()
+            if not compute_stats['num_rows']:
+                continue
+            for stat in ['num_rows', 'compute_sec', 'store_sec']:
+                PROMETHEUS_DATA['depc_compute'].labels(
+                    name=container_name, depc=depc.name, table=tablename, stat=stat
+                ).set(compute_stats[stat])
+        row_cache_info = depc.get_row_cache_info()
+        if row_cache_info is not None:
+            for stat in ['hits', 'misses', 'hit_rate', 'evictions', 'nbytes']:
+                PROMETHEUS_DATA['depc_row_cache'].labels(
+                    name=container_name, depc=depc.name, stat=stat
+                ).set(row_cache_info[stat])
+
+
 @register_ibs_method
 @register_api(
     '/api/test/prometheus/',
@@ -393,6 +469,11 @@ def prometheus_update(ibs, *args, **kwargs):
                         ).set(number)
                 except Exception:
                     pass
+
+                try:
+                    _prometheus_update_dtool(ibs, container_name)
+                except Exception:
+                    pass
         try:
             PROMETHEUS_DATA['update'].labels(name=container_name).set(timer.ellapsed)
         except Exception: